@@ -0,0 +1,452 @@
+"""
+End-to-end performance benchmarks on deterministic synthetic data.
+
+Generates (or reuses) a synthetic genome, reads with planted SNVs and SVs and
+a multi-sample VCF for the chosen scale (see benchmarks/synthetic_data.py),
+then times the hot paths of the pipeline against a throwaway test database
+and filesystem, exactly like the test runner sets them up:
+
+    * alignment, with its post-processing steps (sort/rmdup, fillmd, insert
+      metrics, callable loci, ...) reported from their telemetry spans
+    * VCF parsing
+    * materialized view build
+    * filter queries against the melted and cast views
+    * CSV export
+    * genome finishing: assembly steps (from telemetry spans), coverage
+      based deletion detection and graph contig placement
+
+Results are written as json. If a baseline results file is given, the median
+of each benchmark is compared against it and the script exits with status 1
+if any benchmark regressed by more than the tolerance.
+
+Everything runs locally; the tools in settings.TOOLS_DIR and a local
+Postgres are required, but no network access.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--scale small|medium|large]
+            [--seed N] [--repeat N] [--output results.json]
+            [--baseline baseline.json] [--tolerance 0.25]
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+import json
+from optparse import OptionParser
+import os
+import subprocess
+import sys
+import time
+
+# Setup Django environment.
+sys.path.append(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), '../'))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from benchmarks import synthetic_data
+from genome_finish.assembly_runner import single_sample_alignment_assembly
+from genome_finish.detect_deletion import cov_detect_deletion_make_vcf
+from genome_finish.graph_contig_placement import graph_contig_placement
+from main.models import Contig
+from main.models import Dataset
+from main.models import ExperimentSample
+from main.models import ExperimentSampleToAlignment
+from main.models import Project
+from main.telemetry import read_telemetry_spans
+from pipeline.pipeline_runner import run_pipeline
+from utils.data_export_util import export_melted_variant_view
+from utils.import_util import add_dataset_to_entity
+from utils.import_util import import_reference_genome_from_local_file
+from variants.materialized_variant_filter import lookup_variants
+from variants.materialized_view_manager import MeltedVariantMaterializedViewManager
+from variants.vcf_parser import parse_vcf
+
+
+DEFAULT_SCALE = 'small'
+
+DEFAULT_REPEAT = 3
+
+# Relative slowdown of a benchmark's median, compared to the baseline, above
+# which it is reported as a regression.
+DEFAULT_TOLERANCE = 0.25
+
+# Differences smaller than this are treated as noise regardless of tolerance.
+MIN_REGRESSION_SECONDS = 0.05
+
+# Generated data is cached here between runs, keyed by scale and seed.
+BENCHMARK_DATA_ROOT = os.path.join(settings.TEMP_FILE_ROOT, 'benchmark_data')
+
+BENCHMARK_USERNAME = 'benchmarkuser'
+
+FILTER_STRING_LIST = [
+    '',
+    'position > 10000',
+    'GT_TYPE = 2',
+    'INFO_DP > 100',
+    'position > 1000 & GT_TYPE = 2',
+    'EXPERIMENT_SAMPLE_LABEL = vcf_sample_0',
+]
+
+FILTER_QUERY_PAGE_SIZE = 100
+
+
+class BenchmarkContext(object):
+    """The entities shared by the benchmarks of one run.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.params = manifest['params']
+        self.project = None
+        self.ref_genome = None
+        self.alignment_group = None
+        self.sample_alignment_list = []
+        self.vcf_dataset = None
+        self.contig_uid_list = []
+
+
+class Benchmark(object):
+    """A named, timed piece of work.
+
+    Args:
+        name: Name of the benchmark in the results.
+        run_fn: Function of the BenchmarkContext doing the measured work.
+        repeatable: Whether run_fn can be called more than once and be
+            expected to do the same work each time. Benchmarks that create
+            data for later ones, like parsing a VCF, only run once.
+    """
+
+    def __init__(self, name, run_fn, repeatable=True):
+        self.name = name
+        self.run_fn = run_fn
+        self.repeatable = repeatable
+
+
+###############################################################################
+# Setup
+###############################################################################
+
+def setup_environment():
+    """Creates a test database and filesystem the same way the test runner
+    does, so benchmarks never touch real data.
+
+    Returns the runner and database config needed by teardown_environment().
+    """
+    from south.management.commands import patch_for_test_db_setup
+    from test_suite_runner import CustomTestSuiteRunner
+
+    patch_for_test_db_setup()
+    runner = CustomTestSuiteRunner(verbosity=0, interactive=False)
+    runner.setup_test_environment()
+    old_db_config = runner.setup_databases()
+    return (runner, old_db_config)
+
+
+def teardown_environment(runner, old_db_config):
+    runner.teardown_databases(old_db_config)
+    runner.teardown_test_environment()
+
+
+def create_entities(context):
+    """Creates the Project, ReferenceGenome and ExperimentSamples with the
+    synthetic reads.
+    """
+    user = User.objects.create_user(BENCHMARK_USERNAME,
+            password=BENCHMARK_USERNAME, email='benchmark@example.com')
+    context.project = Project.objects.create(
+            owner=user.get_profile(), title='Benchmark Project')
+
+    context.ref_genome = import_reference_genome_from_local_file(
+            context.project, 'synthetic_ref',
+            context.manifest['ref_fasta'], 'fasta', move=False)
+
+    sample_list = []
+    for sample_data in context.manifest['samples']:
+        sample = ExperimentSample.objects.create(
+                project=context.project, label=sample_data['label'])
+        add_dataset_to_entity(sample, Dataset.TYPE.FASTQ1,
+                Dataset.TYPE.FASTQ1,
+                filesystem_location=sample_data['fastq_1'])
+        add_dataset_to_entity(sample, Dataset.TYPE.FASTQ2,
+                Dataset.TYPE.FASTQ2,
+                filesystem_location=sample_data['fastq_2'])
+        sample_list.append(sample)
+    return sample_list
+
+
+def create_vcf_dataset(context, seed):
+    """Writes the multi-sample VCF for ExperimentSamples created for it and
+    adds it to the AlignmentGroup.
+    """
+    vcf_sample_uid_list = []
+    for sample_idx in range(context.params['num_vcf_samples']):
+        vcf_sample_uid_list.append(ExperimentSample.objects.create(
+                project=context.project,
+                label='vcf_sample_%d' % sample_idx).uid)
+
+    vcf_path = os.path.join(context.alignment_group.get_model_data_dir(),
+            'benchmark_multi_sample.vcf')
+    ref_seq = synthetic_data.read_fasta_sequence(
+            context.manifest['ref_fasta'])
+    synthetic_data.write_multi_sample_vcf(synthetic_data.get_vcf_rng(seed),
+            vcf_path, ref_seq, vcf_sample_uid_list,
+            context.params['num_vcf_records'])
+
+    context.vcf_dataset = add_dataset_to_entity(context.alignment_group,
+            Dataset.TYPE.VCF_FREEBAYES, Dataset.TYPE.VCF_FREEBAYES,
+            filesystem_location=vcf_path)
+
+
+###############################################################################
+# Benchmarks
+###############################################################################
+
+def _summarize_spans_since(context, since_time, prefix):
+    """Returns a dictionary from '<prefix>.<span name>' to the total wall
+    time, across samples, of the AlignmentGroup's spans of that name started
+    after since_time.
+    """
+    totals = OrderedDict()
+    for span in read_telemetry_spans(context.alignment_group):
+        if span['start_time'] < since_time:
+            continue
+        key = prefix + '.' + span['name']
+        totals[key] = totals.get(key, 0) + span['wall_time']
+    return totals
+
+
+def run_alignment(context, sample_list):
+    context.alignment_group, _, _ = run_pipeline('benchmark_alignment',
+            context.ref_genome, sample_list,
+            perform_variant_calling=False, alignment_options={})
+    context.sample_alignment_list = list(
+            ExperimentSampleToAlignment.objects.filter(
+                    alignment_group=context.alignment_group))
+
+
+def run_parse_vcf(context):
+    parse_vcf(context.vcf_dataset, context.alignment_group)
+
+
+def run_materialized_view_build(context):
+    MeltedVariantMaterializedViewManager(context.ref_genome).create()
+
+
+def _run_filter_queries(context, is_melted):
+    for filter_string in FILTER_STRING_LIST:
+        query_args = {
+            'filter_string': filter_string,
+            'is_melted': is_melted,
+            'sort_by_column': '',
+            'sort_by_direction': 'asc',
+            'pagination_start': 0,
+            'pagination_len': FILTER_QUERY_PAGE_SIZE,
+            'visible_key_names': [],
+        }
+        lookup_variants(query_args, context.ref_genome)
+
+
+def run_filter_queries_melted(context):
+    _run_filter_queries(context, True)
+
+
+def run_filter_queries_cast(context):
+    _run_filter_queries(context, False)
+
+
+def run_csv_export(context):
+    for _ in export_melted_variant_view(context.alignment_group, ''):
+        pass
+
+
+def run_cov_detect_deletion(context):
+    for sample_alignment in context.sample_alignment_list:
+        cov_detect_deletion_make_vcf(sample_alignment)
+
+
+def run_graph_contig_placement(context):
+    if context.contig_uid_list:
+        graph_contig_placement(context.contig_uid_list, True)
+
+
+def run_assembly(context):
+    for sample_alignment in context.sample_alignment_list:
+        single_sample_alignment_assembly(sample_alignment)
+    context.contig_uid_list = list(Contig.objects.filter(
+            experiment_sample_to_alignment=context.sample_alignment_list[0]
+            ).values_list('uid', flat=True))
+
+
+VARIANT_BENCHMARKS = [
+    Benchmark('parse_vcf', run_parse_vcf, repeatable=False),
+    Benchmark('materialized_view_build', run_materialized_view_build),
+    Benchmark('filter_queries.melted', run_filter_queries_melted),
+    Benchmark('filter_queries.cast', run_filter_queries_cast),
+    Benchmark('csv_export', run_csv_export),
+]
+
+GENOME_FINISH_BENCHMARKS = [
+    Benchmark('cov_detect_deletion', run_cov_detect_deletion),
+    Benchmark('graph_contig_placement', run_graph_contig_placement),
+]
+
+
+###############################################################################
+# Running and reporting
+###############################################################################
+
+def time_call(fn, *args):
+    start = time.time()
+    fn(*args)
+    return time.time() - start
+
+
+def _make_result(run_times):
+    sorted_times = sorted(run_times)
+    return OrderedDict([
+        ('runs', run_times),
+        ('min', sorted_times[0]),
+        ('median', sorted_times[len(sorted_times) / 2]),
+    ])
+
+
+def run_benchmark(benchmark, context, repeat):
+    num_runs = repeat if benchmark.repeatable else 1
+    run_times = [time_call(benchmark.run_fn, context)
+            for _ in range(num_runs)]
+    print '%-45s median %8.3f s over %d run(s)' % (
+            benchmark.name, sorted(run_times)[len(run_times) / 2], num_runs)
+    return _make_result(run_times)
+
+
+def run_all(scale, seed, repeat):
+    """Runs every benchmark for the scale and returns the results
+    dictionary.
+    """
+    manifest = synthetic_data.generate_data(BENCHMARK_DATA_ROOT, scale, seed)
+    context = BenchmarkContext(manifest)
+    results = OrderedDict()
+
+    sample_list = create_entities(context)
+
+    # Alignment only makes sense to run once per AlignmentGroup; its steps
+    # are reported from the telemetry spans it records.
+    phase_start_time = time.time()
+    results['alignment'] = _make_result(
+            [time_call(run_alignment, context, sample_list)])
+    for name, total in _summarize_spans_since(
+            context, phase_start_time, 'alignment').iteritems():
+        results[name] = _make_result([total])
+
+    create_vcf_dataset(context, seed)
+    for benchmark in VARIANT_BENCHMARKS:
+        results[benchmark.name] = run_benchmark(benchmark, context, repeat)
+
+    phase_start_time = time.time()
+    results['genome_finish'] = _make_result(
+            [time_call(run_assembly, context)])
+    for name, total in _summarize_spans_since(
+            context, phase_start_time, 'genome_finish').iteritems():
+        results[name] = _make_result([total])
+
+    if not context.contig_uid_list:
+        print 'WARNING: No contigs were assembled; skipping contig placement.'
+    for benchmark in GENOME_FINISH_BENCHMARKS:
+        results[benchmark.name] = run_benchmark(benchmark, context, repeat)
+
+    return results
+
+
+def _get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                cwd=settings.PWD).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_to_baseline(results, baseline_results, tolerance,
+        min_seconds=MIN_REGRESSION_SECONDS):
+    """Compares the median of each benchmark against the baseline.
+
+    Returns a list of tuples (name, baseline_median, median, is_regression)
+    for the benchmarks present in both.
+    """
+    comparison_list = []
+    for name, result in results.iteritems():
+        if name not in baseline_results:
+            continue
+        baseline_median = baseline_results[name]['median']
+        median = result['median']
+        is_regression = (
+                median - baseline_median > min_seconds and
+                median > baseline_median * (1 + tolerance))
+        comparison_list.append((name, baseline_median, median, is_regression))
+    return comparison_list
+
+
+def print_comparison(comparison_list):
+    print '\n%-45s %10s %10s %8s' % ('benchmark', 'baseline', 'current',
+            'change')
+    for name, baseline_median, median, is_regression in comparison_list:
+        if baseline_median:
+            change = '%+7.1f%%' % (
+                    100.0 * (median - baseline_median) / baseline_median)
+        else:
+            change = 'n/a'
+        print '%-45s %9.3fs %9.3fs %8s%s' % (name, baseline_median, median,
+                change, '  REGRESSION' if is_regression else '')
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--scale', default=DEFAULT_SCALE,
+            choices=sorted(synthetic_data.SCALES.keys()))
+    parser.add_option('--seed', type='int', default=synthetic_data.DEFAULT_SEED)
+    parser.add_option('--repeat', type='int', default=DEFAULT_REPEAT,
+            help='Number of runs of each repeatable benchmark.')
+    parser.add_option('--output', help='Path to write the json results to.')
+    parser.add_option('--baseline',
+            help='Path to a previous json results file to compare against.')
+    parser.add_option('--tolerance', type='float', default=DEFAULT_TOLERANCE,
+            help='Allowed relative slowdown before reporting a regression.')
+    (options, args) = parser.parse_args()
+
+    runner, old_db_config = setup_environment()
+    try:
+        results = run_all(options.scale, options.seed, options.repeat)
+    finally:
+        teardown_environment(runner, old_db_config)
+
+    output = OrderedDict([
+        ('scale', options.scale),
+        ('seed', options.seed),
+        ('repeat', options.repeat),
+        ('params', synthetic_data.SCALES[options.scale]),
+        ('git_revision', _get_git_revision()),
+        ('date', datetime.now().isoformat()),
+        ('results', results),
+    ])
+    if options.output:
+        with open(options.output, 'w') as fh:
+            json.dump(output, fh, indent=2)
+        print 'Results written to %s' % options.output
+
+    if options.baseline:
+        with open(options.baseline) as fh:
+            baseline = json.load(fh)
+        if (baseline['scale'], baseline['seed']) != (
+                options.scale, options.seed):
+            print 'WARNING: Baseline was run with scale %s, seed %d.' % (
+                    baseline['scale'], baseline['seed'])
+        comparison_list = compare_to_baseline(results, baseline['results'],
+                options.tolerance)
+        print_comparison(comparison_list)
+        if any(is_regression for _, _, _, is_regression in comparison_list):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
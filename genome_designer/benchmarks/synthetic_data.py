@@ -0,0 +1,326 @@
+"""
+Deterministic synthetic data for the benchmark suite.
+
+Everything here is generated from a seeded random.Random so that the same
+scale and seed always produce byte-identical files, which makes timings from
+different runs (and different machines) comparable. No network access or
+external data is needed.
+
+The data for a scale consists of:
+    * A reference genome with a single chromosome of random sequence.
+    * For each aligned sample, paired-end reads simulated from a copy of the
+      reference with planted SNVs, one deletion and one novel insertion.
+    * A multi-sample VCF with freebayes-like records at random positions.
+"""
+
+import json
+import os
+import random
+
+
+# Parameters for each benchmark scale.
+SCALES = {
+    'small': {
+        'genome_size': 20000,
+        'num_aligned_samples': 1,
+        'coverage': 30,
+        'read_length': 100,
+        'insert_size_mean': 300,
+        'insert_size_sd': 30,
+        'read_error_rate': 0.002,
+        'num_planted_snvs': 20,
+        'deletion_size': 1000,
+        'insertion_size': 500,
+        'num_vcf_samples': 4,
+        'num_vcf_records': 1000,
+    },
+    'medium': {
+        'genome_size': 200000,
+        'num_aligned_samples': 2,
+        'coverage': 40,
+        'read_length': 100,
+        'insert_size_mean': 300,
+        'insert_size_sd': 30,
+        'read_error_rate': 0.002,
+        'num_planted_snvs': 200,
+        'deletion_size': 2000,
+        'insertion_size': 1000,
+        'num_vcf_samples': 20,
+        'num_vcf_records': 10000,
+    },
+    'large': {
+        'genome_size': 1000000,
+        'num_aligned_samples': 4,
+        'coverage': 40,
+        'read_length': 100,
+        'insert_size_mean': 300,
+        'insert_size_sd': 30,
+        'read_error_rate': 0.002,
+        'num_planted_snvs': 1000,
+        'deletion_size': 5000,
+        'insertion_size': 1000,
+        'num_vcf_samples': 50,
+        'num_vcf_records': 50000,
+    },
+}
+
+DEFAULT_SEED = 1
+
+# Added to the seed for the multi-sample VCF generator.
+VCF_SEED_OFFSET = 1000003
+
+CHROMOSOME_ID = 'synthetic_chrom'
+
+BASES = 'ACGT'
+
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
+
+FASTA_LINE_LENGTH = 70
+
+# Name of the file describing the generated data, written last so that its
+# presence means the data set is complete.
+MANIFEST_FILENAME = 'manifest.json'
+
+VCF_HEADER = '\n'.join([
+    '##fileformat=VCFv4.1',
+    '##source=millstone_benchmarks',
+    '##contig=<ID={chrom},length={length}>',
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total read depth at the locus">',
+    '##INFO=<ID=AF,Number=A,Type=Float,Description="Estimated allele frequency in the range (0,1]">',
+    '##INFO=<ID=TYPE,Number=A,Type=String,Description="The type of allele, either snp, mnp, ins, del, or complex.">',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">',
+    '##FORMAT=<ID=RO,Number=1,Type=Integer,Description="Reference allele observation count">',
+    '##FORMAT=<ID=AO,Number=A,Type=Integer,Description="Alternate allele observation count">',
+])
+
+
+def reverse_complement(seq):
+    return ''.join(COMPLEMENT[base] for base in reversed(seq))
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choice(BASES) for _ in xrange(length))
+
+
+def write_fasta(path, seq_id, seq):
+    with open(path, 'w') as fh:
+        fh.write('>%s\n' % seq_id)
+        for start in xrange(0, len(seq), FASTA_LINE_LENGTH):
+            fh.write(seq[start:start + FASTA_LINE_LENGTH] + '\n')
+
+
+def plant_variants(rng, ref_seq, num_snvs, deletion_size, insertion_size):
+    """Returns a tuple (sample_seq, planted) where sample_seq is a copy of
+    ref_seq with SNVs, one deletion and one insertion planted, and planted is
+    a dictionary describing them in reference coordinates (1-based).
+
+    The deletion and insertion are placed in different halves of the genome,
+    away from the ends, so that they don't overlap each other or the SNVs
+    near them.
+    """
+    genome_size = len(ref_seq)
+    quarter = genome_size / 4
+
+    deletion_start = rng.randint(quarter / 2, quarter)
+    insertion_pos = rng.randint(2 * quarter + quarter / 2, 3 * quarter)
+    insertion_seq = random_sequence(rng, insertion_size)
+
+    # Keep SNVs out of the SV regions so they stay visible in the reads.
+    excluded = set(xrange(deletion_start, deletion_start + deletion_size))
+    excluded.add(insertion_pos)
+    snv_positions = set()
+    while len(snv_positions) < num_snvs:
+        pos = rng.randint(1, genome_size - 1)
+        if pos not in excluded:
+            snv_positions.add(pos)
+
+    seq = list(ref_seq)
+    snv_list = []
+    for pos in sorted(snv_positions):
+        ref_base = seq[pos]
+        alt_base = rng.choice([b for b in BASES if b != ref_base])
+        seq[pos] = alt_base
+        snv_list.append({'position': pos + 1, 'ref': ref_base,
+                'alt': alt_base})
+
+    sample_seq = (''.join(seq[:deletion_start]) +
+            ''.join(seq[deletion_start + deletion_size:insertion_pos]) +
+            insertion_seq +
+            ''.join(seq[insertion_pos:]))
+
+    planted = {
+        'snvs': snv_list,
+        'deletion': {'start': deletion_start + 1, 'size': deletion_size},
+        'insertion': {'position': insertion_pos + 1, 'size': insertion_size},
+    }
+    return (sample_seq, planted)
+
+
+def _mutate_read(rng, read, error_rate):
+    if not error_rate:
+        return read
+    read = list(read)
+    for idx in xrange(len(read)):
+        if rng.random() < error_rate:
+            read[idx] = rng.choice([b for b in BASES if b != read[idx]])
+    return ''.join(read)
+
+
+def simulate_paired_reads(rng, seq, fastq_1_path, fastq_2_path, coverage,
+        read_length, insert_size_mean, insert_size_sd, error_rate,
+        read_name_prefix='read'):
+    """Simulates paired-end Illumina-style reads from seq.
+
+    Fragment lengths are drawn from a normal distribution. The first read is
+    taken from the forward strand and the second from the reverse strand of
+    each fragment. Substitution errors are added at error_rate.
+
+    Returns the number of read pairs written.
+    """
+    num_pairs = int(coverage * len(seq) / (2 * read_length))
+    quality = 'I' * read_length
+    with open(fastq_1_path, 'w') as fh_1, open(fastq_2_path, 'w') as fh_2:
+        for pair_idx in xrange(num_pairs):
+            fragment_length = max(read_length, int(round(
+                    rng.gauss(insert_size_mean, insert_size_sd))))
+            fragment_length = min(fragment_length, len(seq))
+            start = rng.randint(0, len(seq) - fragment_length)
+            fragment = seq[start:start + fragment_length]
+
+            read_1 = _mutate_read(rng, fragment[:read_length], error_rate)
+            read_2 = _mutate_read(rng,
+                    reverse_complement(fragment[-read_length:]), error_rate)
+
+            name = '%s_%d' % (read_name_prefix, pair_idx)
+            fh_1.write('@%s/1\n%s\n+\n%s\n' % (name, read_1, quality))
+            fh_2.write('@%s/2\n%s\n+\n%s\n' % (name, read_2, quality))
+    return num_pairs
+
+
+def write_multi_sample_vcf(rng, path, ref_seq, sample_id_list, num_records):
+    """Writes a VCF with num_records biallelic SNV records at distinct random
+    positions, with a genotype for each of the samples in sample_id_list.
+
+    The sample ids should be ExperimentSample uids so that the VCF can be
+    parsed by variants.vcf_parser.
+    """
+    num_records = min(num_records, len(ref_seq))
+    position_list = sorted(rng.sample(xrange(1, len(ref_seq) + 1),
+            num_records))
+
+    with open(path, 'w') as fh:
+        fh.write(VCF_HEADER.format(chrom=CHROMOSOME_ID, length=len(ref_seq)))
+        fh.write('\n')
+        fh.write('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL',
+                'FILTER', 'INFO', 'FORMAT'] + list(sample_id_list)) + '\n')
+
+        for position in position_list:
+            ref_base = ref_seq[position - 1]
+            alt_base = rng.choice([b for b in BASES if b != ref_base])
+
+            sample_column_list = []
+            total_depth = 0
+            num_alt_alleles = 0
+            for _ in sample_id_list:
+                depth = rng.randint(10, 60)
+                gt = rng.choice(['0/0', '0/1', '1/1', '1/1'])
+                alt_count = {'0/0': 0, '0/1': depth / 2, '1/1': depth}[gt]
+                total_depth += depth
+                num_alt_alleles += gt.count('1')
+                sample_column_list.append('%s:%d:%d:%d' % (
+                        gt, depth, depth - alt_count, alt_count))
+
+            allele_freq = num_alt_alleles / (2.0 * len(sample_id_list))
+            fh.write('\t'.join([
+                CHROMOSOME_ID,
+                str(position),
+                '.',
+                ref_base,
+                alt_base,
+                '%.1f' % rng.uniform(20, 1000),
+                '.',
+                'DP=%d;AF=%.3f;TYPE=snp' % (total_depth, allele_freq),
+                'GT:DP:RO:AO',
+            ] + sample_column_list) + '\n')
+
+
+def get_data_dir(root_dir, scale, seed):
+    return os.path.join(root_dir, '%s_seed%d' % (scale, seed))
+
+
+def generate_data(root_dir, scale, seed=DEFAULT_SEED):
+    """Generates the reference genome and reads for the scale, unless a
+    complete copy already exists under root_dir.
+
+    The multi-sample VCF is not generated here since it must refer to the
+    uids of ExperimentSamples; use write_multi_sample_vcf() with
+    get_vcf_rng().
+
+    Returns the manifest dictionary, which has keys:
+        * scale, seed, params
+        * ref_fasta: Path to the reference genome fasta.
+        * samples: List of dictionaries with keys label, fastq_1, fastq_2
+              and planted (see plant_variants()).
+    """
+    params = SCALES[scale]
+    data_dir = get_data_dir(root_dir, scale, seed)
+    manifest_path = os.path.join(data_dir, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as fh:
+            return json.load(fh)
+
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    rng = random.Random(seed)
+
+    ref_seq = random_sequence(rng, params['genome_size'])
+    ref_fasta = os.path.join(data_dir, 'ref.fa')
+    write_fasta(ref_fasta, CHROMOSOME_ID, ref_seq)
+
+    sample_list = []
+    for sample_idx in range(params['num_aligned_samples']):
+        label = 'sample_%d' % sample_idx
+        sample_seq, planted = plant_variants(rng, ref_seq,
+                params['num_planted_snvs'], params['deletion_size'],
+                params['insertion_size'])
+        fastq_1 = os.path.join(data_dir, label + '.1.fq')
+        fastq_2 = os.path.join(data_dir, label + '.2.fq')
+        simulate_paired_reads(rng, sample_seq, fastq_1, fastq_2,
+                params['coverage'], params['read_length'],
+                params['insert_size_mean'], params['insert_size_sd'],
+                params['read_error_rate'], read_name_prefix=label)
+        sample_list.append({
+            'label': label,
+            'fastq_1': fastq_1,
+            'fastq_2': fastq_2,
+            'planted': planted,
+        })
+
+    manifest = {
+        'scale': scale,
+        'seed': seed,
+        'params': params,
+        'ref_fasta': ref_fasta,
+        'samples': sample_list,
+    }
+    with open(manifest_path, 'w') as fh:
+        json.dump(manifest, fh, indent=2)
+    return manifest
+
+
+def get_vcf_rng(seed):
+    """Returns the random generator for the multi-sample VCF, independent of
+    the one used for the genome and reads so that either can be regenerated
+    on its own.
+    """
+    return random.Random(seed + VCF_SEED_OFFSET)
+
+
+def read_fasta_sequence(path):
+    """Returns the sequence of a single-record fasta file.
+    """
+    with open(path) as fh:
+        return ''.join(line.strip() for line in fh
+                if not line.startswith('>'))
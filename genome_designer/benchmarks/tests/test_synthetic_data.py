@@ -0,0 +1,59 @@
+"""
+Tests for synthetic_data.py.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from benchmarks.synthetic_data import generate_data
+from benchmarks.synthetic_data import plant_variants
+from benchmarks.synthetic_data import random_sequence
+from benchmarks.synthetic_data import read_fasta_sequence
+
+
+class TestSyntheticData(TestCase):
+
+    def setUp(self):
+        self.root_dir_list = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+
+    def tearDown(self):
+        for root_dir in self.root_dir_list:
+            shutil.rmtree(root_dir)
+
+    def test_generate_data_is_deterministic(self):
+        manifest_list = [generate_data(root_dir, 'small', seed=7)
+                for root_dir in self.root_dir_list]
+
+        self.assertEqual(manifest_list[0]['samples'][0]['planted'],
+                manifest_list[1]['samples'][0]['planted'])
+        for key in ['fastq_1', 'fastq_2']:
+            contents = [open(manifest['samples'][0][key]).read()
+                    for manifest in manifest_list]
+            self.assertTrue(contents[0])
+            self.assertEqual(contents[0], contents[1])
+
+        # Existing data is reused.
+        ref_fasta = manifest_list[0]['ref_fasta']
+        mtime = os.path.getmtime(ref_fasta)
+        generate_data(self.root_dir_list[0], 'small', seed=7)
+        self.assertEqual(mtime, os.path.getmtime(ref_fasta))
+        self.assertEqual(20000, len(read_fasta_sequence(ref_fasta)))
+
+    def test_plant_variants(self):
+        rng = random.Random(3)
+        ref_seq = random_sequence(rng, 10000)
+        sample_seq, planted = plant_variants(rng, ref_seq, 10, 500, 200)
+
+        self.assertEqual(len(ref_seq) - 500 + 200, len(sample_seq))
+        self.assertEqual(10, len(planted['snvs']))
+
+        # SNVs before the deletion are at the same position in the sample.
+        deletion_start = planted['deletion']['start']
+        for snv in planted['snvs']:
+            self.assertEqual(snv['ref'], ref_seq[snv['position'] - 1])
+            if snv['position'] < deletion_start:
+                self.assertEqual(snv['alt'], sample_seq[snv['position'] - 1])
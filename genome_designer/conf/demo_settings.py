@@ -36,6 +36,7 @@ DEMO_SAFE_VIEWS = [
     'main.xhr_handlers.get_ref_genomes',
     'main.xhr_handlers.get_samples',
     'main.xhr_handlers.get_single_ref_genome',
+    'main.xhr_handlers.get_status_events',
     'main.xhr_handlers.get_variant_list',
     'main.xhr_handlers.get_variant_set_list',
     'main.xhr_handlers.is_materialized_view_valid',
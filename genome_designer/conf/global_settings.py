@@ -163,6 +163,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'main.middleware.DatasetRegistryMiddleware',
 )
 
 ROOT_URLCONF = 'genome_designer.urls'
@@ -301,7 +302,8 @@ CELERY_IMPORTS = (
         'pipeline.variant_calling',
         'pipeline.variant_calling.freebayes',
         'utils.import_util',
-        'genome_finish.assembly_runner'
+        'genome_finish.assembly_runner',
+        'variants.materialized_view_manager'
 )
 
 # When True, forces synchronous behavior so that it's not necessary
@@ -363,6 +365,45 @@ JBROWSE_MAX_ALIGN_TRACKS = 5
 JBROWSE_MAX_COVERAGE_TRACKS = 10
 
 
+###############################################################################
+# Sample Import
+###############################################################################
+
+# Whether to generate FastQC html reports for imported reads, in a background
+# task. Not needed for alignment since reads are profiled natively as they're
+# copied (see utils/fastq_profile_util.py).
+RUN_FASTQC_ON_IMPORT = True
+
+# Maximum number of FastQC processes a single worker runs at once when doing
+# QC on the forward and reverse reads of a sample. Each is a separate JVM, so
+# lower this on workers with little memory.
+FASTQC_MAX_CONCURRENT_PER_WORKER = 2
+
+
+###############################################################################
+# Read Alignment
+###############################################################################
+
+# Number of properly-paired records, read from the start of each alignment,
+# used to estimate its read length and insert size distribution.
+ALIGNMENT_METRICS_SAMPLE_SIZE = 10000
+
+# Sampled insert sizes more than this many median absolute deviations above
+# the median are dropped before computing the mean and stdev, as done by
+# lumpy's pairend_distro.py.
+ALIGNMENT_METRICS_INSERT_SIZE_MADS = 10
+
+
+###############################################################################
+# Project Export
+###############################################################################
+
+# Number of threads used to compress project files as the export archive is
+# streamed to the user. Files that are already compressed, like bams, are
+# stored without compressing them again.
+PROJECT_EXPORT_COMPRESSION_THREADS = 4
+
+
 ###############################################################################
 # Variant Calling
 ###############################################################################
@@ -395,6 +436,23 @@ FREEBAYES_PARALLEL = True
 # TODO: perhaps this should be determined dynamically based on genome size.
 FREEBAYES_REGION_SIZE = 200000
 
+# Pindel and Lumpy run as one task per sample per region of this size, so
+# that their time and memory depend on the region size rather than the genome
+# size. Each region is extended on both sides by a margin so that evidence for
+# breakpoints near its edges is seen, and only calls with their breakpoint in
+# the region proper are kept.
+SV_CALLER_REGION_SIZE = 500000
+
+# The margin is the sample's mean insert size plus this many standard
+# deviations, and at least SV_CALLER_MIN_REGION_MARGIN.
+SV_CALLER_REGION_MARGIN_STDEVS = 4
+SV_CALLER_MIN_REGION_MARGIN = 1000
+
+# Limit in MB on the address space of each Pindel and Lumpy process, so that a
+# region with unexpectedly deep coverage fails its task instead of the whole
+# worker. None for no limit.
+SV_CALLER_MEMORY_LIMIT_MB = None
+
 # SNPEff can be multithreaded but for simplicity, let's always keep this at 1.
 SNPEFF_THREADS = 1
 
@@ -404,6 +462,60 @@ SNPEFF_BUILD_DEBUG = True
 # Names of SnpEff summary files, which we want to delete after running.
 SNPEFF_SUMMARY_FILES = ['snpEff_genes.txt', 'snpEff_summary.html']
 
+###############################################################################
+# Materialized Variant View
+###############################################################################
+
+# Besides the core columns, the materialized view gets expression indexes on
+# json keys used by saved filters and by recent filter queries. Queries over
+# this many days count as recent.
+MATERIALIZED_VIEW_INDEX_QUERY_WINDOW_DAYS = 14
+
+# Maximum number of json keys indexed per materialized view.
+MATERIALIZED_VIEW_MAX_JSON_KEY_INDEXES = 20
+
+###############################################################################
+# Caching
+###############################################################################
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache alias used for per-ReferenceGenome metadata such as the JBrowse track
+# names. Local memory is only invalidated within a process, so deployments
+# running celery workers should add a shared backend to CACHES, e.g.:
+#     'ref_genome_metadata': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# and point this at it.
+REFERENCE_GENOME_METADATA_CACHE = 'default'
+
+# Seconds before a cached entry expires. Bounds how stale a local memory cache
+# can be after an invalidation made in another process.
+REFERENCE_GENOME_METADATA_CACHE_TIMEOUT = 60
+
+###############################################################################
+# Status Events
+###############################################################################
+
+# Pipeline status transitions are recorded as StatusEvents, which the browser
+# polls for. The latest event id per Project is cached under this alias so
+# that polls with nothing new don't need to query the database. As above, a local
+# memory cache only sees events published in the same process, so this should
+# point at a shared backend when running celery workers.
+STATUS_EVENT_CACHE = 'default'
+
+# Seconds before the cached latest event id expires. Bounds how late a client
+# can hear about an event published in another process.
+STATUS_EVENT_CACHE_TIMEOUT = 10
+
+# Events older than this are deleted as new ones are published.
+STATUS_EVENT_RETENTION_HOURS = 24
+
 ###############################################################################
 # Callable Loci
 ###############################################################################
@@ -452,6 +564,40 @@ COVDEL_LARGE_DEL_MIN_DEL_LEN = 2000
 # (they should be found by SNV tools like Freebayes instead)
 COVDEL_SMOOTHED_SIZE_CUTOFF = 15
 
+# Coarse-to-fine mode: instead of per-base depth over whole chromosomes, one
+# streaming pass over the reads finds the stretches with no coverage and the
+# total depth of each bin of this size, and per-base depth is only computed in
+# windows around those stretches, grown in steps of
+# COVDEL_FINE_WINDOW_MARGIN until they hold whole low coverage regions. Gives
+# the same deletions as the per-base mode.
+COVDEL_COARSE_TO_FINE = True
+COVDEL_COARSE_BIN_SIZE = 1000
+COVDEL_FINE_WINDOW_MARGIN = 1000
+
+###############################################################################
+# De Novo Assembly
+###############################################################################
+
+# Hash lengths to try when assembling SV indicating reads with velvet. Each is
+# assembled in a separate process, at most VELVET_MULTI_K_MAX_CONCURRENT at a
+# time, and the assembly with the highest contig N50, then coverage, is used.
+# Velvet must be compiled with MAXKMERLENGTH of at least the largest. None to
+# only use genome_finish.assembly.VELVET_HASH_LENGTH.
+VELVET_MULTI_K_HASH_LENGTHS = None
+VELVET_MULTI_K_MAX_CONCURRENT = 3
+
+# Assembly inputs and velvet results are cached per sample alignment, keyed by
+# the content of their inputs, so that re-running SV calling with unchanged
+# inputs reuses them. Least recently used entries beyond this many are
+# deleted.
+ASSEMBLY_CACHE_MAX_ENTRIES = 20
+
+# Whether to make a bam of the reads assembled into each contig after
+# assembly, as the contig's BWA_SV_INDICANTS Dataset. The reads are streamed
+# once per CONTIG_READS_MAX_OPEN_FILES contigs.
+CONTIG_READS_DATASETS_ENABLED = True
+CONTIG_READS_MAX_OPEN_FILES = 256
+
 ###############################################################################
 # Feature Flags
 ###############################################################################
@@ -463,6 +609,10 @@ FLAG__GENERATE_NEW_REFERENCE_GENOME_ENABLED = True
 
 FLAG__GENOME_FINISHING_ENABLED = True
 
+# Compute the IN_PARENTS / IN_CHILDREN VariantEvidence keys with set-based
+# SQL rather than by iterating over every VariantCallerCommonData in Python.
+FLAG__PARENT_CHILD_FIELDS_IN_SQL = True
+
 ###############################################################################
 # S3
 ###############################################################################
@@ -503,6 +653,15 @@ S3_TEST_BUCKET = S3_BUCKET
 # Maximum file size for user upload
 S3_FILE_MAX_SIZE = 1024 ** 3  # 1GB
 
+# Number of files, or parts of a large file, transferred at once when syncing
+# project data with S3.
+S3_SYNC_NUM_THREADS = 8
+
+# Files larger than this are uploaded and downloaded in parts of
+# S3_MULTIPART_PART_SIZE, in parallel. S3 requires parts of at least 5MB.
+S3_MULTIPART_THRESHOLD = 64 * 1024 ** 2
+S3_MULTIPART_PART_SIZE = 64 * 1024 ** 2
+
 
 ###############################################################################
 # Testing
@@ -525,3 +684,7 @@ south_logger.setLevel(logging.INFO)
 
 # Directory where profiler logs will be stored. See README.md.
 PROFILE_LOG_BASE = None
+
+# Whether TelemetrySpans count the database queries made during each pipeline
+# stage (see main/telemetry.py). None to count them only when DEBUG is on.
+TELEMETRY_COUNT_DB_QUERIES = None
@@ -0,0 +1,101 @@
+"""
+Per-page latency benchmark for the variant list endpoint.
+
+Times the three stages of main.xhr_handlers.get_variant_list() separately for
+an existing ReferenceGenome: the materialized view query (lookup_variants),
+adapting rows for the frontend (adapt_variant_to_frontend), and the final
+json.dumps of the response. Both melted and cast views are measured.
+
+Usage:
+    python debug/benchmark_variant_list.py <ref_genome_uid> \
+            [page_size] [num_pages] [visible_key,...]
+"""
+
+import json
+import os
+import sys
+import time
+
+# Setup Django environment.
+sys.path.append(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), '../'))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+from main.model_views import adapt_variant_to_frontend
+from main.models import ReferenceGenome
+from variants.common import determine_visible_field_names
+from variants.materialized_variant_filter import lookup_variants
+from variants.materialized_view_manager import MeltedVariantMaterializedViewManager
+
+
+DEFAULT_PAGE_SIZE = 1000
+
+DEFAULT_NUM_PAGES = 5
+
+
+def benchmark_page(ref_genome, is_melted, page_idx, page_size,
+        visible_key_names):
+    """Returns tuple of seconds spent in (query, adapt, serialize) and the
+    number of rows returned.
+    """
+    query_args = {
+        'filter_string': '',
+        'is_melted': is_melted,
+        'sort_by_column': '',
+        'sort_by_direction': 'asc',
+        'pagination_start': page_idx * page_size,
+        'pagination_len': page_size,
+        'visible_key_names': visible_key_names,
+    }
+
+    start = time.time()
+    lookup_variant_result = lookup_variants(query_args, ref_genome)
+    query_time = time.time() - start
+
+    start = time.time()
+    variant_list_json = adapt_variant_to_frontend(
+            lookup_variant_result.result_list, ref_genome,
+            visible_key_names, melted=is_melted)
+    adapt_time = time.time() - start
+
+    start = time.time()
+    json.dumps({'variant_list_json': variant_list_json})
+    serialize_time = time.time() - start
+
+    return ((query_time, adapt_time, serialize_time),
+            len(lookup_variant_result.result_list))
+
+
+def main(ref_genome_uid, page_size, num_pages, visible_keys):
+    ref_genome = ReferenceGenome.objects.get(uid=ref_genome_uid)
+
+    # Build the view up front so the first page isn't charged for it.
+    MeltedVariantMaterializedViewManager(
+            ref_genome).create_if_not_exists_or_invalid()
+
+    visible_key_names = determine_visible_field_names(
+            visible_keys, '', ref_genome)
+
+    for is_melted in [True, False]:
+        print '%s view, page size %d:' % (
+                'Melted' if is_melted else 'Cast', page_size)
+        for page_idx in range(num_pages):
+            times, num_rows = benchmark_page(ref_genome, is_melted, page_idx,
+                    page_size, visible_key_names)
+            print ('  page %d (%d rows): query %.3f s, adapt %.3f s, '
+                    'json %.3f s, total %.3f s') % (
+                            page_idx, num_rows, times[0], times[1], times[2],
+                            sum(times))
+            if num_rows < page_size:
+                break
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    ref_genome_uid = sys.argv[1]
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PAGE_SIZE
+    num_pages = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_NUM_PAGES
+    visible_keys = sys.argv[4].split(',') if len(sys.argv) > 4 else []
+    main(ref_genome_uid, page_size, num_pages, visible_keys)
@@ -0,0 +1,115 @@
+"""
+Benchmark for adding and removing large numbers of Variants to and from a
+VariantSet.
+
+Creates a throwaway Project with NUM_VARIANTS Variants, then times
+update_variant_in_set_memberships() for add with and without sample
+association, and for remove. The Project is deleted at the end. Query
+counts are only reported when settings.DEBUG is True.
+
+Usage:
+    python debug/benchmark_variant_set_membership.py [num_variants]
+"""
+
+import os
+import sys
+import time
+
+# Setup Django environment.
+sys.path.append(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), '../'))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from main.models import Chromosome
+from main.models import ExperimentSample
+from main.models import Project
+from main.models import ReferenceGenome
+from main.models import Variant
+from main.models import VariantSet
+from variants.variant_sets import MODIFY_VARIANT_SET_MEMBERSHIP__ADD
+from variants.variant_sets import MODIFY_VARIANT_SET_MEMBERSHIP__REMOVE
+from variants.variant_sets import update_variant_in_set_memberships
+
+
+DEFAULT_NUM_VARIANTS = 100000
+
+BENCHMARK_USERNAME = 'variant_set_benchmark'
+
+
+def _timed(label, fn, *args):
+    start = time.time()
+    num_queries_before = len(connection.queries)
+    result = fn(*args)
+    print '%s: %.2f s, %d queries' % (label, time.time() - start,
+            len(connection.queries) - num_queries_before)
+    return result
+
+
+def main(num_variants):
+    user, _ = User.objects.get_or_create(username=BENCHMARK_USERNAME)
+    project = Project.objects.create(
+            title='variant_set_benchmark', owner=user.get_profile())
+    try:
+        ref_genome = ReferenceGenome.objects.create(
+                project=project, label='benchmark_ref')
+        chromosome = Chromosome.objects.create(
+                reference_genome=ref_genome, label='Chromosome',
+                num_bases=num_variants + 1)
+        sample = ExperimentSample.objects.create(
+                project=project, label='benchmark_sample')
+
+        # Deterministic uids avoid the clash retries of short_uuid() at this
+        # scale.
+        Variant.objects.bulk_create([
+                Variant(
+                        uid='b%07d' % position,
+                        type=Variant.TYPE.TRANSITION,
+                        reference_genome=ref_genome,
+                        chromosome=chromosome,
+                        position=position,
+                        ref_value='A')
+                for position in xrange(1, num_variants + 1)],
+                batch_size=5000)
+        variant_uid_list = list(Variant.objects.filter(
+                reference_genome=ref_genome).values_list('uid', flat=True))
+        variant_set = VariantSet.objects.create(
+                reference_genome=ref_genome, label='benchmark_set')
+        print 'Created %d variants.' % len(variant_uid_list)
+
+        _timed('add (no sample)', update_variant_in_set_memberships,
+                ref_genome, variant_uid_list,
+                MODIFY_VARIANT_SET_MEMBERSHIP__ADD, variant_set.uid)
+
+        _timed('add (already members)', update_variant_in_set_memberships,
+                ref_genome, variant_uid_list,
+                MODIFY_VARIANT_SET_MEMBERSHIP__ADD, variant_set.uid)
+
+        with_sample_list = [uid + ',' + sample.uid
+                for uid in variant_uid_list]
+        _timed('add (with sample)', update_variant_in_set_memberships,
+                ref_genome, with_sample_list,
+                MODIFY_VARIANT_SET_MEMBERSHIP__ADD, variant_set.uid)
+
+        _timed('remove (sample association)',
+                update_variant_in_set_memberships,
+                ref_genome, with_sample_list,
+                MODIFY_VARIANT_SET_MEMBERSHIP__REMOVE, variant_set.uid)
+
+        _timed('remove (no sample)', update_variant_in_set_memberships,
+                ref_genome, variant_uid_list,
+                MODIFY_VARIANT_SET_MEMBERSHIP__REMOVE, variant_set.uid)
+
+        assert variant_set.variants.count() == 0
+    finally:
+        project.delete()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        num_variants = int(sys.argv[1])
+    else:
+        num_variants = DEFAULT_NUM_VARIANTS
+    main(num_variants)
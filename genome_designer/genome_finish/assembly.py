@@ -1,4 +1,6 @@
+import copy
 import datetime
+from multiprocessing.pool import ThreadPool
 import os
 import pickle
 import pyinter
@@ -9,11 +11,17 @@ import subprocess
 from Bio import SeqIO
 from django.conf import settings
 
+from genome_finish.assembly_cache import get_assembly_cache_dir
+from genome_finish.assembly_cache import get_or_create_cache_entry
+from genome_finish.assembly_cache import prune_assembly_cache
 from genome_finish.celery_task_decorator import get_failure_report_path
 from genome_finish.celery_task_decorator import set_assembly_status
 from genome_finish.constants import CUSTOM_SV_METHODS
 from genome_finish.graph_contig_placement import graph_contig_placement
+from genome_finish.insertion_placement_read_trkg import CONTIG_READS_FILENAME
+from genome_finish.insertion_placement_read_trkg import make_contig_reads_datasets
 from genome_finish.insertion_placement_read_trkg import make_contig_reads_to_ref_alignments
+from genome_finish.insertion_placement_read_trkg import write_contig_reads_file
 from genome_finish.millstone_de_novo_fns import add_paired_mates
 from genome_finish.millstone_de_novo_fns import filter_low_qual_read_pairs
 from genome_finish.millstone_de_novo_fns import filter_out_unpaired_reads
@@ -27,9 +35,11 @@ from main.models import Contig
 from main.models import Dataset
 from main.models import ExperimentSampleToAlignment
 from main.models import VariantCallerCommonData
-from pipeline.read_alignment import get_insert_size_mean_and_stdev
+from main.telemetry import TelemetrySpan
+from pipeline.read_alignment import get_alignment_metrics
 from pipeline.read_alignment_util import extract_discordant_read_pairs
 from pipeline.read_alignment_util import extract_split_reads
+from utils import calc_file_md5
 from utils.bam_utils import concatenate_bams
 from utils.bam_utils import index_bam
 from utils.bam_utils import rmdup
@@ -38,6 +48,7 @@ from utils.bam_utils import sort_bam_by_name
 from utils.data_export_util import export_contig_list_as_vcf
 from utils.data_export_util import export_var_dict_list_as_vcf
 from utils.import_util import add_dataset_to_entity
+from utils.jbrowse_util import remove_indiv_tracks
 from variants.filter_key_map_constants import MAP_KEY__COMMON_DATA
 from variants.vcf_parser import parse_vcf
 
@@ -64,6 +75,9 @@ DEFAULT_VELVET_OPTS = {
     }
 }
 
+# Files generated by velveth that velvetg reads.
+VELVETH_OUTPUT_FILES = ['Sequences', 'Roadmaps']
+
 # A list of files generated by velvet that we do not need to keep
 # and may want to delete to save space.
 VELVET_OUTPUT_FILES = {
@@ -114,6 +128,36 @@ def kmer_coverage(C, L, k):
     return C * (L - k + 1) / float(L)
 
 
+def _make_velvet_opts(hash_length, ins_length, ins_length_sd,
+        avg_read_coverage, input_velvet_opts):
+    """Returns velvet options for assembling with the given hash length,
+    with input_velvet_opts overriding the computed ones.
+    """
+    velvet_opts = copy.deepcopy(DEFAULT_VELVET_OPTS)
+    velvet_opts['velveth']['hash_length'] = hash_length
+    velvet_opts['velvetg']['ins_length'] = ins_length
+    velvet_opts['velvetg']['ins_length_sd'] = ins_length_sd
+
+    # Calculate expected coverage in kmers
+    genome_kmer_coverage = kmer_coverage(avg_read_coverage, ins_length,
+            hash_length)
+    exp_cov = genome_kmer_coverage * VELVET_CONTIG_COVERAGE_EXPECTED
+    velvet_opts['velvetg']['exp_cov'] = exp_cov
+
+    # # Set cov cutoff
+    cov_cutoff = genome_kmer_coverage * VELVET_CONTIG_COVERAGE_CUTOFF
+    velvet_opts['velvetg']['cov_cutoff'] = cov_cutoff
+
+    # Update velvet_opts with input_velvet_opts
+    for shallow_key in ['velveth', 'velvetg']:
+        if shallow_key in input_velvet_opts:
+            for deep_key in input_velvet_opts[shallow_key]:
+                velvet_opts[shallow_key][deep_key] = (
+                        input_velvet_opts[shallow_key][deep_key])
+
+    return velvet_opts
+
+
 def generate_contigs(sample_alignment,
         sv_read_classes={}, input_velvet_opts={},
         overwrite=True):
@@ -153,8 +197,10 @@ def generate_contigs(sample_alignment,
 
 
     # Get a bam of sorted SV indicants with pairs
-    sv_indicants_bam = get_sv_indicating_reads(sample_alignment,
-            sv_read_classes, overwrite=overwrite)
+    with TelemetrySpan('get_sv_indicating_reads',
+            sample_alignment=sample_alignment):
+        sv_indicants_bam = get_sv_indicating_reads(sample_alignment,
+                sv_read_classes, overwrite=overwrite)
 
     prev_dataset = get_dataset_with_type(
             sample_alignment,
@@ -168,11 +214,13 @@ def generate_contigs(sample_alignment,
         sv_indicants_sorted_bam = (os.path.splitext(sv_indicants_bam)[0] +
                 '.coordinate_sorted.bam')
 
-        # Bam needs to be coordinated sorted to index
-        sort_bam_by_coordinate(sv_indicants_bam, sv_indicants_sorted_bam)
+        with TelemetrySpan('sort_and_index_sv_indicating_reads',
+                sample_alignment=sample_alignment):
+            # Bam needs to be coordinated sorted to index
+            sort_bam_by_coordinate(sv_indicants_bam, sv_indicants_sorted_bam)
 
-        # Bam needs to be indexed for jbrowse
-        index_bam(sv_indicants_sorted_bam)
+            # Bam needs to be indexed for jbrowse
+            index_bam(sv_indicants_sorted_bam)
 
         for_assembly_dataset = add_dataset_to_entity(
                 sample_alignment,
@@ -187,42 +235,39 @@ def generate_contigs(sample_alignment,
         # add_bam_file_track(reference_genome,
         #         sample_alignment, Dataset.TYPE.BWA_FOR_DE_NOVO_ASSEMBLY)
 
-    velvet_opts = dict(DEFAULT_VELVET_OPTS)
-
     # Find insertion metrics
-    ins_length, ins_length_sd = get_insert_size_mean_and_stdev(
-            sample_alignment)
-    velvet_opts['velvetg']['ins_length'] = ins_length
-    velvet_opts['velvetg']['ins_length_sd'] = ins_length_sd
+    alignment_metrics = get_alignment_metrics(sample_alignment)
+    ins_length = alignment_metrics['insert_size_mean']
+    ins_length_sd = alignment_metrics['insert_size_stdev']
 
     # Find expected coverage
     avg_read_coverage = get_avg_genome_coverage(
             sample_alignment)
 
-    # Calculate expected coverage in kmers
-    genome_kmer_coverage = kmer_coverage(avg_read_coverage, ins_length,
-            velvet_opts['velveth']['hash_length'])
-    exp_cov = genome_kmer_coverage * VELVET_CONTIG_COVERAGE_EXPECTED
-    velvet_opts['velvetg']['exp_cov'] = exp_cov
+    # Try each of the multi-k hash lengths, if any, unless the hash length
+    # was given.
+    hash_length_list = [VELVET_HASH_LENGTH]
+    if (settings.VELVET_MULTI_K_HASH_LENGTHS and
+            'hash_length' not in input_velvet_opts.get('velveth', {})):
+        hash_length_list = settings.VELVET_MULTI_K_HASH_LENGTHS
 
-    # # Set cov cutoff
-    cov_cutoff = genome_kmer_coverage * VELVET_CONTIG_COVERAGE_CUTOFF
-    velvet_opts['velvetg']['cov_cutoff'] = cov_cutoff
-
-    # Update velvet_opts with input_velvet_opts
-    for shallow_key in ['velveth', 'velvetg']:
-        if shallow_key in input_velvet_opts:
-            for deep_key in input_velvet_opts[shallow_key]:
-                velvet_opts[shallow_key][deep_key] = (
-                        input_velvet_opts[shallow_key][deep_key])
+    velvet_opts_list = [
+            _make_velvet_opts(hash_length, ins_length, ins_length_sd,
+                    avg_read_coverage, input_velvet_opts)
+            for hash_length in hash_length_list]
 
     # Perform velvet assembly and generate contig objects.
-    contig_uid_list = assemble_with_velvet(
-            assembly_dir, velvet_opts, sv_indicants_bam,
-            sample_alignment, overwrite=overwrite)
+    with TelemetrySpan('assemble_with_velvet',
+            sample_alignment=sample_alignment,
+            hash_length_count=len(velvet_opts_list)):
+        contig_uid_list = assemble_with_velvet(
+                assembly_dir, velvet_opts_list, sv_indicants_bam,
+                sample_alignment, overwrite=overwrite)
 
     # Evaluate contigs for mapping.
-    evaluate_contigs(contig_uid_list)
+    with TelemetrySpan('evaluate_contigs', sample_alignment=sample_alignment,
+            contig_count=len(contig_uid_list)):
+        evaluate_contigs(contig_uid_list)
 
     # Update status again if not FAILED.
     sample_alignment = ExperimentSampleToAlignment.objects.get(
@@ -391,8 +436,14 @@ def get_sv_indicating_reads(sample_alignment, input_sv_indicant_classes={},
     return SV_indicants_filtered
 
 
-def assemble_with_velvet(assembly_dir, velvet_opts, sv_indicants_bam,
+def assemble_with_velvet(assembly_dir, velvet_opts_list, sv_indicants_bam,
         sample_alignment, overwrite=True, reassemble_contig_from_reads=False):
+    """Assembles the reads with velvet using each of velvet_opts_list, and
+    creates Contigs from the best assembly.
+
+    Velvet results are cached by the content of sv_indicants_bam and the
+    options (see assembly_cache.py).
+    """
     # NOTE: Unused. If enabled, will call make_contig_reads_to_ref_alignments()
     # which is not used anywhere currently due to performance issues which
     # which are particularly bad when many unused reads.
@@ -406,11 +457,22 @@ def assemble_with_velvet(assembly_dir, velvet_opts, sv_indicants_bam,
     contig_files = []
     contig_uid_list = []
 
-    _run_velvet(assembly_dir, velvet_opts, sv_indicants_bam)
+    cache_dir = get_assembly_cache_dir(sample_alignment)
+    velvet_opts, cached_contigs_fasta = _run_velvet_cached(
+            cache_dir, velvet_opts_list, sv_indicants_bam)
+
+    _write_assembly_metadata(assembly_dir, velvet_opts, sv_indicants_bam)
 
     # Collect resulting contigs fasta
     contigs_fasta = os.path.join(assembly_dir, 'contigs.fa')
+    shutil.copyfile(cached_contigs_fasta, contigs_fasta)
     contig_files.append(contigs_fasta)
+    shutil.copyfile(
+            os.path.join(os.path.dirname(cached_contigs_fasta),
+                    CONTIG_READS_FILENAME),
+            os.path.join(assembly_dir, CONTIG_READS_FILENAME))
+
+    prune_assembly_cache(cache_dir)
 
     records = list(SeqIO.parse(contigs_fasta, 'fasta'))
     digits = len(str(len(records))) + 1
@@ -463,8 +525,10 @@ def assemble_with_velvet(assembly_dir, velvet_opts, sv_indicants_bam,
         #     # this generates longer contigs because the graph will trim the
         #     # edges if there is a branchpoint. With only one node it should
         #     # be very fast.
-        #     _run_velvet(contig.get_model_data_dir(), velvet_opts,
-        #             contig_reads_bam)
+        #     _, reassembled_contigs_fasta = _run_velvet_cached(cache_dir,
+        #             [velvet_opts], contig_reads_bam)
+        #     shutil.copyfile(reassembled_contigs_fasta, os.path.join(
+        #             contig.get_model_data_dir(), 'contigs.fa'))
         #     reassembled_seqrecord = _extract_node_from_contig_reassembly(
         #             contig)
         #     if reassembled_seqrecord:
@@ -486,17 +550,20 @@ def assemble_with_velvet(assembly_dir, velvet_opts, sv_indicants_bam,
 
         contig.save()
 
-        # NOTE: Disabled for now. Severe performance issues.
-        # Make a bam track on the reference for each contig that shows only the
-        # reads that assembled the contig and their mates
-        # make_contig_reads_to_ref_alignments(contig.uid)
-
         # append the uid to the contig_uid_list
         contig_uid_list.append(contig.uid)
 
-    # once contigs are extracted, remove velvet data
-    _cleanup_velvet_dir(assembly_dir)
-
+    # Make a bam for each contig of the reads that assembled it, in a single
+    # pass over the reads.
+    if settings.CONTIG_READS_DATASETS_ENABLED:
+        with TelemetrySpan('make_contig_reads_datasets',
+                sample_alignment=sample_alignment,
+                contig_count=len(contig_uid_list)):
+            make_contig_reads_datasets(list(
+                    Contig.objects.filter(uid__in=contig_uid_list)))
+
+    # The velvet output lives in the cache entries, which are cleaned up as
+    # they're built by _run_velvetg_from_velveth_dir().
     return contig_uid_list
 
 
@@ -655,22 +722,14 @@ def clean_up_previous_runs_of_sv_calling_pipeline(sample_alignment):
 
     # Delete all jbrowse tracks associated with contigs.
     ref_genome = sample_alignment.alignment_group.reference_genome
-    jbrowse_parent_path = os.path.join(
-            ref_genome.get_jbrowse_directory_path(),
-            'indiv_tracks')
-
+    track_id_list = []
     for contig_uid in contig_uids:
-        reads_subdir = os.path.join(
-                jbrowse_parent_path, '_'.join([
-                        contig_uid,
-                        'BWA_STRUCTURAL_VARIANT_INDICATING_READS']))
-        coverage_subdir = '_'.join([
-                        reads_subdir,
-                        'COVERAGE'])
-        if os.path.exists(reads_subdir):
-            shutil.rmtree(reads_subdir)
-        if os.path.exists(coverage_subdir):
-            shutil.rmtree(coverage_subdir)
+        reads_track_id = '_'.join([
+                contig_uid,
+                'BWA_STRUCTURAL_VARIANT_INDICATING_READS'])
+        track_id_list.append(reads_track_id)
+        track_id_list.append('_'.join([reads_track_id, 'COVERAGE']))
+    remove_indiv_tracks(ref_genome, track_id_list)
 
     # Delete Variants associated with SVs called by this pipeline.
     var_list = get_de_novo_variants(sample_alignment)
@@ -694,7 +753,8 @@ def clean_up_previous_runs_of_sv_calling_pipeline(sample_alignment):
             sample_alignment.ASSEMBLY_STATUS.NOT_STARTED,
             force=True)
 
-    # Delete all assembly data.
+    # Delete all assembly data. The assembly cache is kept so that velvet
+    # results are reused if the inputs are unchanged.
     assembly_dir = os.path.join(
             sample_alignment.get_model_data_dir(),
             'assembly')
@@ -732,8 +792,88 @@ def get_de_novo_variants(sample_alignment, sv_methods=CUSTOM_SV_METHODS):
     return filtered_variant_list
 
 
-def _run_velvet(assembly_dir, velvet_opts, sv_indicants_bam):
+def _calc_n50(length_list):
+    """Returns the N50 of the sequence lengths, or 0 if there are none.
+    """
+    half_total = sum(length_list) / 2.0
+    running_total = 0
+    for length in sorted(length_list, reverse=True):
+        running_total += length
+        if running_total >= half_total:
+            return length
+    return 0
+
+
+def _get_assembly_score(contigs_fasta):
+    """Returns (N50, length weighted coverage) of the contigs in the velvet
+    contigs fasta, by which assemblies of the same reads are compared.
+    """
+    length_list = []
+    weighted_coverage = 0
+    for seq_record in SeqIO.parse(contigs_fasta, 'fasta'):
+        length = len(seq_record.seq)
+        coverage = float(seq_record.description.rsplit('_', 1)[1])
+        length_list.append(length)
+        weighted_coverage += length * coverage
+
+    if not length_list:
+        return (0, 0)
+    return (_calc_n50(length_list), weighted_coverage / sum(length_list))
+
+
+def _run_velvet_cached(cache_dir, velvet_opts_list, sv_indicants_bam):
+    """Runs velvet with each of velvet_opts_list, at most
+    settings.VELVET_MULTI_K_MAX_CONCURRENT at a time, reusing results cached
+    for the same reads and options.
+
+    velveth output is cached separately from velvetg output, so that changing
+    only velvetg options reuses the velveth hash.
+
+    Returns (velvet_opts, contigs fasta path) for the assembly with the best
+    _get_assembly_score().
+    """
+    sv_indicants_md5 = calc_file_md5(sv_indicants_bam)
+
+    def _assemble(velvet_opts):
+        velveth_dir = get_or_create_cache_entry(cache_dir, 'velveth',
+                [sv_indicants_md5, velvet_opts['velveth']],
+                lambda entry_dir: _run_velveth(
+                        entry_dir, velvet_opts, sv_indicants_bam))
+        velvetg_dir = get_or_create_cache_entry(cache_dir, 'velvetg',
+                [sv_indicants_md5, velvet_opts],
+                lambda entry_dir: _run_velvetg_from_velveth_dir(
+                        velveth_dir, entry_dir, velvet_opts))
+        return os.path.join(velvetg_dir, 'contigs.fa')
+
+    # velvet runs as a subprocess, so threads are enough to run in parallel.
+    num_threads = min(settings.VELVET_MULTI_K_MAX_CONCURRENT,
+            len(velvet_opts_list))
+    if num_threads <= 1:
+        contigs_fasta_list = map(_assemble, velvet_opts_list)
+    else:
+        pool = ThreadPool(num_threads)
+        try:
+            contigs_fasta_list = pool.map(_assemble, velvet_opts_list)
+        finally:
+            pool.close()
+            pool.join()
+
+    return max(zip(velvet_opts_list, contigs_fasta_list),
+            key=lambda opts_and_fasta: _get_assembly_score(opts_and_fasta[1]))
+
+
+def _run_velvetg_from_velveth_dir(velveth_dir, velvetg_dir, velvet_opts):
+    """Runs velvetg in velvetg_dir on the output of velveth in velveth_dir,
+    leaving only the contigs, the reads assembled into each and the log.
+    """
+    for fn in VELVETH_OUTPUT_FILES:
+        os.symlink(os.path.join(velveth_dir, fn), os.path.join(velvetg_dir, fn))
+    _run_velvetg(velvetg_dir, velvet_opts)
+    write_contig_reads_file(velvetg_dir)
+    _cleanup_velvet_dir(velvetg_dir)
+
 
+def _write_assembly_metadata(assembly_dir, velvet_opts, sv_indicants_bam):
     # Write sv_indicants filename and velvet options to file
     assembly_metadata_fn = os.path.join(assembly_dir, 'metadata.txt')
     with open(assembly_metadata_fn, 'w') as fh:
@@ -743,6 +883,8 @@ def _run_velvet(assembly_dir, velvet_opts, sv_indicants_bam):
         }
         pickle.dump(assembly_metadata, fh)
 
+
+def _run_velveth(assembly_dir, velvet_opts, sv_indicants_bam):
     velveth_opts = [str(velvet_opts['velveth']['hash_length'])]
     velveth_opts.extend(['-' + key + ' ' + str(velvet_opts['velveth'][key])
             for key in velvet_opts['velveth'] if key not in ['hash_length']])
@@ -758,6 +900,8 @@ def _run_velvet(assembly_dir, velvet_opts, sv_indicants_bam):
         subprocess.check_call(cmd, shell=True, executable=settings.BASH_PATH,
                 stderr=error_output_fh)
 
+
+def _run_velvetg(assembly_dir, velvet_opts):
     ins_length = velvet_opts['velvetg'].get('ins_length', None)
     exp_cov = velvet_opts['velvetg'].get('exp_cov', None)
     ins_length_sd = velvet_opts['velvetg'].get('ins_length_sd', None)
@@ -780,7 +924,7 @@ def _run_velvet(assembly_dir, velvet_opts, sv_indicants_bam):
     cmd = ' '.join(arg_list)
     print 'velvetg cmd:', cmd
 
-    velvetg_error_output = os.path.join(assembly_dir, 'velveth_error_log.txt')
+    velvetg_error_output = os.path.join(assembly_dir, 'velvetg_error_log.txt')
     with open(velvetg_error_output, 'w') as error_output_fh:
         subprocess.check_call(cmd, shell=True, executable=settings.BASH_PATH,
                 stderr=error_output_fh)
@@ -0,0 +1,97 @@
+"""
+Content-addressed cache of de novo assembly intermediates.
+
+Each entry is a directory in the sample alignment's assembly cache dir, named
+by the kind of entry and an md5 of everything its contents depend on, e.g.
+the md5 of the SV indicating reads bam and the velvet options. Entries are
+built in a temporary directory and renamed into place, so a partially built
+entry is never reused, and are touched on reuse so that the least recently
+used ones are pruned first.
+
+The cache dir is kept by clean_up_previous_runs_of_sv_calling_pipeline() so
+that re-running SV calling with unchanged inputs reuses prior results.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+# Bump to invalidate all existing entries, e.g. when changing how they are
+# built.
+ASSEMBLY_CACHE_VERSION = 2
+
+ASSEMBLY_CACHE_DIRNAME = 'assembly_cache'
+
+TEMP_ENTRY_PREFIX = '.tmp_'
+
+
+def get_assembly_cache_dir(sample_alignment):
+    """Returns the assembly cache dir for the sample alignment, creating it
+    if it doesn't exist.
+    """
+    cache_dir = os.path.join(sample_alignment.get_model_data_dir(),
+            ASSEMBLY_CACHE_DIRNAME)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
+def make_cache_key(key_parts):
+    """Returns the md5 hex digest of the json serializable key_parts.
+    """
+    serialized = json.dumps([ASSEMBLY_CACHE_VERSION, key_parts],
+            sort_keys=True)
+    return hashlib.md5(serialized).hexdigest()
+
+
+def get_or_create_cache_entry(cache_dir, kind, key_parts, create_fn):
+    """Returns the path to the cache entry for key_parts, first calling
+    create_fn(entry_dir) to fill it in if it doesn't exist.
+
+    Safe to call concurrently from threads, as long as create_fn is.
+    """
+    entry_dir = os.path.join(cache_dir,
+            '%s_%s' % (kind, make_cache_key(key_parts)))
+    if os.path.exists(entry_dir):
+        os.utime(entry_dir, None)
+        return entry_dir
+
+    temp_dir = tempfile.mkdtemp(prefix=TEMP_ENTRY_PREFIX, dir=cache_dir)
+    try:
+        create_fn(temp_dir)
+        try:
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another thread finished the same entry first.
+            if not os.path.exists(entry_dir):
+                raise
+            shutil.rmtree(temp_dir)
+    except:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        raise
+    return entry_dir
+
+
+def prune_assembly_cache(cache_dir,
+        max_entries=settings.ASSEMBLY_CACHE_MAX_ENTRIES):
+    """Deletes the least recently used entries beyond max_entries.
+
+    Not safe to call while entries are being created.
+    """
+    entry_list = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(TEMP_ENTRY_PREFIX):
+            # Left behind by an interrupted run.
+            shutil.rmtree(path)
+        else:
+            entry_list.append((os.path.getmtime(path), path))
+
+    entry_list.sort(reverse=True)
+    for _, path in entry_list[max_entries:]:
+        shutil.rmtree(path)
@@ -19,6 +19,7 @@ from genome_finish.celery_task_decorator import set_assembly_status
 from genome_finish.detect_deletion import cov_detect_deletion_make_vcf
 from main.models import Dataset
 from main.models import ExperimentSampleToAlignment
+from main.telemetry import TelemetrySpan
 from pipeline.read_alignment_util import ensure_bwa_index
 from utils.jbrowse_util import compile_tracklist_json
 from utils.jbrowse_util import prepare_jbrowse_ref_sequence
@@ -163,7 +164,9 @@ def cov_detect_deletion_make_vcf_async(sample_alignment):
     """
     Async wrapper for deletion coverage function.
     """
-    cov_detect_deletion_make_vcf(sample_alignment)
+    with TelemetrySpan('cov_detect_deletion_make_vcf',
+            sample_alignment=sample_alignment):
+        cov_detect_deletion_make_vcf(sample_alignment)
 
 
 @task(ignore_result=False)
@@ -178,4 +181,6 @@ def parse_variants_for_sa_list_async(sample_alignment_list):
 
 @report_failure_stats(FAILURE_REPORT__PARSE_VARIANTS)
 def parse_variants_for_single_sa(sample_alignment):
-    parse_variants_from_vcf(sample_alignment)
+    with TelemetrySpan('parse_sv_variants_from_vcf',
+            sample_alignment=sample_alignment):
+        parse_variants_from_vcf(sample_alignment)
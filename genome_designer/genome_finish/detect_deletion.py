@@ -17,6 +17,10 @@ from utils.data_export_util import export_var_dict_list_as_vcf
 from utils.import_util import add_dataset_to_entity
 
 
+# Reads skipped by pileup() by default, so not counted in depth.
+PILEUP_SKIPPED_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+
 def cov_detect_deletion_make_vcf(sample_alignment):
     """Uses coverage data to call large deletions and
     creates a VCF_COV_DETECT_DELETIONS dataset for the sample alignment
@@ -99,29 +103,42 @@ def make_var_dict_list(chrom_regions, ref_fasta):
 
 def get_deleted_regions(
         sample_alignment,
-        cov_cutoff=settings.COVDEL_CUTOFF):
-
-    chrom_to_cov_list = per_base_cov_stats_opt(sample_alignment)
+        cov_cutoff=settings.COVDEL_CUTOFF,
+        coarse_to_fine=settings.COVDEL_COARSE_TO_FINE):
+    """Returns a dictionary from chromosome to the list of (start, end)
+    regions deleted according to coverage.
+
+    If coarse_to_fine, per-base depth is only computed around the stretches
+    with no coverage (see coarse_to_fine_cov_stats()) rather than over whole
+    chromosomes. The regions are the same either way.
+    """
+    if coarse_to_fine:
+        chrom_to_cov_list = coarse_to_fine_cov_stats(sample_alignment)
+    else:
+        chrom_to_cov_list = {}
+        for chrom, cov_dict in per_base_cov_stats_opt(
+                sample_alignment).items():
+            depths = cov_dict['depths']
+            chrom_to_cov_list[chrom] = {
+                'windows': [(0, depths)],
+                'unique': depths - cov_dict['altaligns'],
+                'mean_depth': np.mean(depths)
+            }
 
     chrom_regions = {}
     for chrom, cov_dict in chrom_to_cov_list.items():
-        depths = cov_dict['depths']
-        altaligns = cov_dict['altaligns']
-        unique = depths - altaligns
-
-        # Use COVDEL_CUTOFF_PCT of mean unique coverage, or COVDEL_CUTOFF,
-        # whichever is lower.
-        cov_cutoff = min(
-                settings.COVDEL_CUTOFF,
-                max(1, int(settings.COVDEL_CUTOFF_PCT * np.mean(unique))))
+        unique = cov_dict['unique']
 
-        # identify regions with coverage lower than cov_cutoff
-        low_cov_regions = get_low_cov_regions(
-                depths, cov_cutoff)
+        cov_cutoff = _get_cov_cutoff(np.mean(unique))
 
-        # throw away regions that contain no bases with 0 coverage
-        low_cov_regions = [(i,j) for i,j in low_cov_regions if
-                min(depths[i:j]) == 0]
+        low_cov_regions = []
+        for window_start, depths in cov_dict['windows']:
+            # identify regions with coverage lower than cov_cutoff, and throw
+            # away regions that contain no bases with 0 coverage
+            low_cov_regions.extend(
+                    (window_start + i, window_start + j) for i, j in
+                    get_low_cov_regions(depths, cov_cutoff) if
+                    min(depths[i:j]) == 0)
 
         # throw away unsmoothed low coverage regions below an
         # empirically determinted size cutoff, based on the clones
@@ -129,7 +146,7 @@ def get_deleted_regions(
         # and minimum coverage-based-deletion size measureable is
         # approximately:
         # 5 ** ( 5 - (mean_coverage / 3) ** 0.5)
-        cov_size_cutoff = 5 ** ( 5 - (np.mean(depths) / 3) ** 0.5)
+        cov_size_cutoff = 5 ** ( 5 - (cov_dict['mean_depth'] / 3) ** 0.5)
         low_cov_regions = [(i,j) for i,j in low_cov_regions if
                 (j-i) > cov_size_cutoff]
 
@@ -147,6 +164,15 @@ def get_deleted_regions(
     return chrom_regions
 
 
+def _get_cov_cutoff(mean_unique_cov):
+    """Use COVDEL_CUTOFF_PCT of mean unique coverage, or COVDEL_CUTOFF,
+    whichever is lower.
+    """
+    return min(
+            settings.COVDEL_CUTOFF,
+            max(1, int(settings.COVDEL_CUTOFF_PCT * mean_unique_cov)))
+
+
 def get_low_cov_regions(cov_arr, min_cov):
     split_indices = np.where(np.diff(cov_arr < min_cov) != 0)[0] + 1
     split_indices = list(split_indices)
@@ -238,6 +264,39 @@ def make_altalign_dataset(sample_alignment):
                 filesystem_location=altalign_bam)
 
 
+def _get_altalign_bam_path(sample_alignment):
+    """Returns the path to the indexed bam of alternative alignment reads,
+    creating it if needed.
+    """
+    altalign_dataset_query = sample_alignment.dataset_set.filter(
+            type=Dataset.TYPE.BWA_ALTALIGN)
+
+    if altalign_dataset_query.count():
+        assert altalign_dataset_query.count() == 1
+        altalign_dataset = altalign_dataset_query[0]
+    else:
+        print "Writing bam dataset of alternative alignment reads\n"
+        altalign_dataset = make_altalign_dataset(sample_alignment)
+
+    altalign_bam_path = altalign_dataset.get_absolute_location()
+    index_bam(altalign_bam_path)
+    return altalign_bam_path
+
+
+def _get_depths(bamfile, chrom, start, end):
+    """Returns an array of per-base depth over [start, end) of the chrom.
+    """
+    depth_arr = np.zeros(end - start)
+    for pileup_col in bamfile.pileup(chrom,
+            start=start, end=end, truncate=True):
+
+        # number of segments aligned to this position
+        depth = pileup_col.nsegments
+        depth_arr[pileup_col.reference_pos - start] = depth
+
+    return depth_arr
+
+
 def per_base_cov_stats_opt(sample_alignment):
 
     sample_alignment_bam = sample_alignment.dataset_set.get(
@@ -246,59 +305,202 @@ def per_base_cov_stats_opt(sample_alignment):
 
     chrom_list = bamfile.references
     chrom_lens = bamfile.lengths
-    c_starts = [0] * len(chrom_list)
-    c_ends = chrom_lens
 
     chrom_to_cov_list = {}
 
-    for chrom, c_start, c_end in zip(chrom_list, c_starts, c_ends):
+    for chrom, c_end in zip(chrom_list, chrom_lens):
+        chrom_to_cov_list[chrom] = {
+                'depths': _get_depths(bamfile, chrom, 0, c_end)
+        }
+
+    # Do altaligns
+    bamfile = pysam.AlignmentFile(
+            _get_altalign_bam_path(sample_alignment), 'rb')
+
+    chrom_list = bamfile.references
+    chrom_lens = bamfile.lengths
+
+    for chrom, c_end in zip(chrom_list, chrom_lens):
+        chrom_to_cov_list[chrom]['altaligns'] = _get_depths(
+                bamfile, chrom, 0, c_end)
+
+    return chrom_to_cov_list
 
-        depth_arr = np.zeros(c_end)
-        for pileup_col in bamfile.pileup(chrom,
-                start=c_start, end=c_end, truncate=True):
 
-            # number of segments aligned to this position
-            depth = pileup_col.nsegments
-            depth_arr[pileup_col.reference_pos] = depth
+def coarse_to_fine_cov_stats(sample_alignment):
+    """Returns the coverage stats get_deleted_regions() needs for each
+    chromosome, without computing per-base depth over whole chromosomes.
+
+    One streaming pass over the reads of each bam gives the total depth per
+    COVDEL_COARSE_BIN_SIZE bin, from which mean coverages are computed, and
+    the stretches with no coverage, which every deletion contains. Per-base
+    depth is then only computed in windows around those stretches.
+
+    Returns:
+        Dictionary from chromosome to a dictionary with keys:
+            * windows: List of (start, per-base depth array) of windows
+                holding every low coverage region that could be a deletion.
+            * unique: Stands in for the per-base unique coverage array, of
+                which only means are taken.
+            * mean_depth: Mean depth over the chromosome.
+    """
+    sample_alignment_bam = sample_alignment.dataset_set.get(
+            type=Dataset.TYPE.BWA_ALIGN).get_absolute_location()
+    bamfile = pysam.AlignmentFile(sample_alignment_bam, 'rb')
+    altalign_bamfile = pysam.AlignmentFile(
+            _get_altalign_bam_path(sample_alignment), 'rb')
+
+    chrom_to_cov_list = {}
+    for chrom, chrom_len in zip(bamfile.references, bamfile.lengths):
+        depth_cov = _BinnedCoverage(bamfile, chrom, chrom_len)
+        altalign_cov = _BinnedCoverage(altalign_bamfile, chrom, chrom_len)
+        unique = _UniqueCoverageTrack(depth_cov, altalign_cov)
+
+        windows = _get_fine_windows(bamfile, chrom, chrom_len,
+                depth_cov.zero_cov_regions, _get_cov_cutoff(unique.mean()))
 
         chrom_to_cov_list[chrom] = {
-                'depths': depth_arr
+            'windows': [(start, _get_depths(bamfile, chrom, start, end))
+                    for start, end in windows],
+            'unique': unique,
+            'mean_depth': (float(depth_cov.get_sum(0, chrom_len)) /
+                    chrom_len)
         }
 
+    return chrom_to_cov_list
 
-    # Do altaligns
-    altalign_dataset_query = sample_alignment.dataset_set.filter(
-            type=Dataset.TYPE.BWA_ALTALIGN)
 
-    if altalign_dataset_query.count():
-        assert altalign_dataset_query.count() == 1
-        altalign_dataset = altalign_dataset_query[0]
-    else:
-        print "Writing bam dataset of alternative alignment reads\n"
-        altalign_dataset = make_altalign_dataset(sample_alignment)
+def _get_fine_windows(bamfile, chrom, chrom_len, zero_cov_regions,
+        cov_cutoff, margin=settings.COVDEL_FINE_WINDOW_MARGIN):
+    """Returns sorted, disjoint (start, end) windows holding every region
+    with coverage below cov_cutoff that has bases with no coverage.
 
-    altalign_bam_path = altalign_dataset.get_absolute_location()
-    index_bam(altalign_bam_path)
-
-    bamfile = pysam.AlignmentFile(
-            altalign_dataset.get_absolute_location(), 'rb')
+    Each window starts as a stretch with no coverage plus the margin, and is
+    grown until the bases at its edges have coverage of at least cov_cutoff,
+    so that no low coverage region is cut off by its edges.
+    """
+    windows = []
+    for start, end in zero_cov_regions:
+        start = max(start - margin, 0)
+        end = min(end + margin, chrom_len)
+        while (start > 0 and
+                _get_depths(bamfile, chrom, start, start + 1)[0] <
+                        cov_cutoff):
+            start = max(start - margin, 0)
+        while (end < chrom_len and
+                _get_depths(bamfile, chrom, end - 1, end)[0] < cov_cutoff):
+            end = min(end + margin, chrom_len)
+        windows.append((start, end))
+
+    merged_windows = []
+    for start, end in sorted(windows):
+        if merged_windows and start <= merged_windows[-1][1]:
+            merged_windows[-1] = (merged_windows[-1][0],
+                    max(end, merged_windows[-1][1]))
+        else:
+            merged_windows.append((start, end))
+    return merged_windows
 
-    chrom_list = bamfile.references
-    chrom_lens = bamfile.lengths
-    c_starts = [0] * len(chrom_list)
-    c_ends = chrom_lens
 
+def _fetch_pileup_reads(bamfile, chrom, start, end):
+    """Yields the reads overlapping [start, end) that pileup() counts.
+    """
+    for read in bamfile.fetch(chrom, start, end):
+        if read.flag & PILEUP_SKIPPED_FLAGS or read.reference_end is None:
+            continue
+        yield read
 
-    for chrom, c_start, c_end in zip(chrom_list, c_starts, c_ends):
-        depth_arr = np.zeros(c_end)
 
-        for pileup_col in bamfile.pileup(chrom,
-                start=c_start, end=c_end, truncate=True):
+class _BinnedCoverage(object):
+    """Depth of coverage of a chromosome by a bam, as the total depth in each
+    bin, along with the stretches with no coverage.
 
-            # number of segments aligned to this position
-            depth = pileup_col.nsegments
-            depth_arr[pileup_col.reference_pos] = depth
+    Built from one streaming pass over the reads. A read covers every base
+    from its start to its end, as in pileup(), so sums of depth match those
+    of per-base depth arrays.
+    """
 
-        chrom_to_cov_list[chrom]['altaligns'] = depth_arr
+    def __init__(self, bamfile, chrom, chrom_len,
+            bin_size=settings.COVDEL_COARSE_BIN_SIZE):
+        self.bamfile = bamfile
+        self.chrom = chrom
+        self.chrom_len = chrom_len
+        self.bin_size = bin_size
+        self.bin_sums = [0] * (chrom_len / bin_size + 1)
+        self.zero_cov_regions = []
+        self._sum_cache = {}
+
+        covered_until = 0
+        for read in _fetch_pileup_reads(bamfile, chrom, 0, chrom_len):
+            start = read.reference_start
+            end = min(read.reference_end, chrom_len)
+            if start > covered_until:
+                self.zero_cov_regions.append((covered_until, start))
+            covered_until = max(covered_until, end)
+
+            for bin_index in range(start / bin_size,
+                    (end - 1) / bin_size + 1):
+                bin_start = bin_index * bin_size
+                self.bin_sums[bin_index] += (
+                        min(end, bin_start + bin_size) - max(start, bin_start))
+
+        if covered_until < chrom_len:
+            self.zero_cov_regions.append((covered_until, chrom_len))
+
+    def _get_read_sum(self, start, end):
+        total = 0
+        for read in _fetch_pileup_reads(self.bamfile, self.chrom, start, end):
+            total += max(0,
+                    min(read.reference_end, end) -
+                            max(read.reference_start, start))
+        return total
+
+    def get_sum(self, start, end):
+        """Returns the sum of per-base depth over [start, end), reading the
+        reads only for bins partially in it.
+        """
+        key = (start, end)
+        if key not in self._sum_cache:
+            first_bin = -(-start / self.bin_size)
+            end_bin = end / self.bin_size
+            if first_bin >= end_bin:
+                total = self._get_read_sum(start, end)
+            else:
+                total = sum(self.bin_sums[first_bin:end_bin])
+                total += self._get_read_sum(start, first_bin * self.bin_size)
+                total += self._get_read_sum(end_bin * self.bin_size, end)
+            self._sum_cache[key] = total
+        return self._sum_cache[key]
+
+
+class _UniqueCoverageTrack(object):
+    """Stands in for the per-base unique coverage array of a chromosome, or
+    a slice of it, in smoothed_deletions(), which only takes means of it and
+    of its slices.
+    """
 
-    return chrom_to_cov_list
+    def __init__(self, depth_cov, altalign_cov, start=0, end=None):
+        self.depth_cov = depth_cov
+        self.altalign_cov = altalign_cov
+        self.start = start
+        if end is None:
+            end = depth_cov.chrom_len
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, key):
+        start, end, step = key.indices(len(self))
+        assert step == 1
+        return _UniqueCoverageTrack(self.depth_cov, self.altalign_cov,
+                self.start + start, self.start + max(start, end))
+
+    def mean(self, *args, **kwargs):
+        """Called by np.mean().
+        """
+        if not len(self):
+            return np.nan
+        unique_sum = (self.depth_cov.get_sum(self.start, self.end) -
+                self.altalign_cov.get_sum(self.start, self.end))
+        return float(unique_sum) / len(self)
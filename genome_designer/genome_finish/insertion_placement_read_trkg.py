@@ -14,6 +14,11 @@ from utils.bam_utils import index_bam
 from utils.bam_utils import sort_bam_by_coordinate
 from utils.import_util import add_dataset_to_entity
 
+# Written next to velvet's contigs.fa by write_contig_reads_file().
+CONTIG_READS_FILENAME = 'contig_reads.txt'
+
+VELVET_READ_NAME_PATTERN = re.compile('(\S+)/(\d)$')
+
 
 def mapped_mates_of_unmapped_reads(contig):
     unmapped_contig_reads = extract_contig_reads(
@@ -34,6 +39,114 @@ def mapped_mates_of_unmapped_reads(contig):
     return found_mates
 
 
+def write_contig_reads_file(velvet_dir):
+    """Writes CONTIG_READS_FILENAME in velvet_dir, listing the reads velvet
+    assembled into each contig in its contigs.fa, as tab separated lines of
+    node number, read name and read number (1 or 2).
+
+    Reads velvet's LastGraph, which velvetg writes the read tracking to when
+    run with -read_trkg yes, and Sequences once each, rather than running
+    extractContigReads.pl once per contig. Must be called before the velvet
+    files are cleaned up.
+    """
+    contig_node_pattern = re.compile('^>NODE_(\d+)_')
+    contig_nodes = set()
+    with open(os.path.join(velvet_dir, 'contigs.fa')) as fh:
+        for line in fh:
+            match = contig_node_pattern.match(line)
+            if match:
+                contig_nodes.add(int(match.group(1)))
+
+    # Reads are listed after an NR line for each node they're in, and again
+    # for the node's twin, as lines of read id, offset and start.
+    read_id_to_nodes = defaultdict(set)
+    node = None
+    with open(os.path.join(velvet_dir, 'LastGraph')) as fh:
+        for line in fh:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == 'NR':
+                node = abs(int(fields[1]))
+                if node not in contig_nodes:
+                    node = None
+            elif node is not None and fields[0].isdigit():
+                read_id_to_nodes[int(fields[0])].add(node)
+            else:
+                node = None
+
+    # Sequences headers are read name, read id and category.
+    with open(os.path.join(velvet_dir, 'Sequences')) as fh, open(
+            os.path.join(velvet_dir, CONTIG_READS_FILENAME), 'w') as out_fh:
+        for line in fh:
+            if not line.startswith('>'):
+                continue
+            fields = line[1:].rstrip('\n').split('\t')
+            nodes = read_id_to_nodes.get(int(fields[1]))
+            if not nodes:
+                continue
+            match = VELVET_READ_NAME_PATTERN.match(fields[0])
+            if not match:
+                continue
+            for node in sorted(nodes):
+                out_fh.write('%d\t%s\t%s\n' % (
+                        node, match.group(1), match.group(2)))
+
+
+def _get_read_key_to_nodes(assembly_dir, node_numbers):
+    """Returns a dict from (read name, read number) to the list of nodes
+    among node_numbers that velvet assembled the read into, as written by
+    write_contig_reads_file().
+    """
+    read_key_to_nodes = defaultdict(list)
+    with open(os.path.join(assembly_dir, CONTIG_READS_FILENAME)) as fh:
+        for line in fh:
+            node, read_name, read_number = line.rstrip('\n').split('\t')
+            node = int(node)
+            if node in node_numbers:
+                read_key_to_nodes[(read_name, int(read_number))].append(node)
+    return read_key_to_nodes
+
+
+def _get_assembly_sv_indicants_bam(assembly_dir):
+    """Returns the path to the bam of reads velvet assembled.
+    """
+    assembly_metadata_file = os.path.join(assembly_dir, 'metadata.txt')
+    with open(assembly_metadata_file) as fh:
+        assembly_metadata_obj = pickle.load(fh)
+    return assembly_metadata_obj['sv_indicants_bam']
+
+
+def _get_read_number(read):
+    if read.is_read1:
+        return 1
+    elif read.is_read2:
+        return 2
+    raise Exception('Read is neither read1 nor read2')
+
+
+def _set_contig_chromosome(contig, ref_id_to_count, sam_file):
+    """Sets the contig's chromosome to the one most of its mapped reads are
+    on, if more than 80% are.
+    """
+    mapped_count = sum(ref_id_to_count.values())
+    if not mapped_count:
+        return
+
+    tid_count_sorted = sorted(
+            ref_id_to_count.items(), key=lambda x: x[1], reverse=True)
+
+    mode_chrom_tid = tid_count_sorted[0][0]
+    mode_chrom_percentage = (tid_count_sorted[0][1] /
+            float(mapped_count))
+
+    # Set field
+    if mode_chrom_percentage > 0.8:
+        contig_seqrecord_id = sam_file.getrname(mode_chrom_tid)
+        contig.metadata['chromosome'] = contig_seqrecord_id
+        contig.save()
+
+
 def extract_contig_reads(contig, read_category='all'):
     '''
     Use velvet tools to extract reads from the contig, and then
@@ -53,13 +166,8 @@ def extract_contig_reads(contig, read_category='all'):
         if read_category in READ_CATEGORY_TO_FILENAME_DICT:
             return READ_CATEGORY_TO_FILENAME_DICT[read_category]
         elif read_category == 'all':
-
-            assembly_metadata_file = os.path.join(
-                    contig.metadata['assembly_dir'],
-                    'metadata.txt')
-            with open(assembly_metadata_file) as fh:
-                assembly_metadata_obj = pickle.load(fh)
-            return assembly_metadata_obj['sv_indicants_bam']
+            return _get_assembly_sv_indicants_bam(
+                    contig.metadata['assembly_dir'])
         elif read_category == 'mates_of_unmapped':
             return mapped_mates_of_unmapped_reads(contig)
         else:
@@ -72,26 +180,31 @@ def extract_contig_reads(contig, read_category='all'):
     assembly_dir = contig.metadata['assembly_dir']
 
     contig_node_number = contig.metadata['node_number']
-    cmd = [extract_contig_reads_executable, str(contig_node_number),
-           assembly_dir]
-    cmd = ' '.join(cmd)
-
-    contig_reads_fasta = os.path.join(
-            contig.get_model_data_dir(),
-            'extracted_reads.fa')
-    if not os.path.exists(contig_reads_fasta):
-        with open(contig_reads_fasta, 'w') as fh:
-            subprocess.call(cmd, shell=True, stdout=fh)
-
-    p1 = re.compile('>(\S+)/(\d)')
     contig_reads = defaultdict(list)
-    with open(contig_reads_fasta) as fh:
-        for line in fh:
-            m1 = p1.match(line)
-            if m1:
-                read_id = m1.group(1)
-                read_number = int(m1.group(2))
-                contig_reads[read_id].append(read_number)
+    if os.path.exists(os.path.join(assembly_dir, CONTIG_READS_FILENAME)):
+        for read_id, read_number in _get_read_key_to_nodes(
+                assembly_dir, set([contig_node_number])):
+            contig_reads[read_id].append(read_number)
+    else:
+        cmd = [extract_contig_reads_executable, str(contig_node_number),
+               assembly_dir]
+        cmd = ' '.join(cmd)
+
+        contig_reads_fasta = os.path.join(
+                contig.get_model_data_dir(),
+                'extracted_reads.fa')
+        if not os.path.exists(contig_reads_fasta):
+            with open(contig_reads_fasta, 'w') as fh:
+                subprocess.call(cmd, shell=True, stdout=fh)
+
+        p1 = re.compile('>(\S+)/(\d)')
+        with open(contig_reads_fasta) as fh:
+            for line in fh:
+                m1 = p1.match(line)
+                if m1:
+                    read_id = m1.group(1)
+                    read_number = int(m1.group(2))
+                    contig_reads[read_id].append(read_number)
 
     sv_indicant_reads_path = os.path.join(
             contig.experiment_sample_to_alignment.get_model_data_dir(),
@@ -100,12 +213,7 @@ def extract_contig_reads(contig, read_category='all'):
     sam_file = pysam.AlignmentFile(sv_indicant_reads_path)
     sv_indicant_reads_in_contig = []
     for read in sam_file:
-        if read.is_read1:
-            read_number = 1
-        elif read.is_read2:
-            read_number = 2
-        else:
-            raise Exception('Read is neither read1 nor read2')
+        read_number = _get_read_number(read)
 
         contig_read_numbers = contig_reads.get(read.query_name, [])
         if read_number in contig_read_numbers:
@@ -113,29 +221,11 @@ def extract_contig_reads(contig, read_category='all'):
 
     # HACK: Set chromosome here while sam file is open
     # so AlignmentFile.getrname(tid) can be called
-    ref_id_to_count = {}
-    mapped_count = 0
+    ref_id_to_count = defaultdict(int)
     for read in sv_indicant_reads_in_contig:
         if not read.is_unmapped:
-            mapped_count += 1
-            if read.reference_id not in ref_id_to_count:
-                ref_id_to_count[read.reference_id] = 1
-            else:
-                ref_id_to_count[read.reference_id] += 1
-
-    if mapped_count:
-        tid_count_sorted = sorted(
-                ref_id_to_count.items(), key=lambda x: x[1], reverse=True)
-
-        mode_chrom_tid = tid_count_sorted[0][0]
-        mode_chrom_percentage = (tid_count_sorted[0][1] /
-                float(mapped_count))
-
-        # Set field
-        if mode_chrom_percentage > 0.8:
-            contig_seqrecord_id = sam_file.getrname(mode_chrom_tid)
-            contig.metadata['chromosome'] = contig_seqrecord_id
-            contig.save()
+            ref_id_to_count[read.reference_id] += 1
+    _set_contig_chromosome(contig, ref_id_to_count, sam_file)
 
     sam_file.close()
     return sv_indicant_reads_in_contig
@@ -165,6 +255,13 @@ def make_contig_reads_dataset(contig, sv_indicant_reads_in_contig):
 
     extracted_reads_alignment_file.close()
 
+    _add_contig_reads_dataset(contig, extracted_reads_bam_file)
+
+
+def _add_contig_reads_dataset(contig, extracted_reads_bam_file):
+    """Sorts and indexes the bam of the contig's reads and adds it to the
+    contig as its BWA_SV_INDICANTS dataset.
+    """
     coordinate_sorted_bam = (os.path.splitext(extracted_reads_bam_file)[0] +
             '.coordinate_sorted.bam')
     sort_bam_by_coordinate(extracted_reads_bam_file, coordinate_sorted_bam)
@@ -183,6 +280,79 @@ def make_contig_reads_dataset(contig, sv_indicant_reads_in_contig):
             filesystem_location=coordinate_sorted_bam)
 
 
+def make_contig_reads_datasets(contig_list,
+        max_open_files=settings.CONTIG_READS_MAX_OPEN_FILES):
+    """Makes the BWA_SV_INDICANTS dataset of each contig, the bam of the reads
+    velvet assembled into it, and sets its chromosome as
+    extract_contig_reads() does.
+
+    The contigs must be from the same assembly, and its assembly dir must
+    have the CONTIG_READS_FILENAME written by write_contig_reads_file().
+    Rather than reading all the assembled reads per contig, the reads are
+    streamed once and each is written to the bams of the contigs it's in,
+    with at most max_open_files bams open at once. Contigs without reads
+    get no dataset.
+    """
+    if not contig_list:
+        return
+
+    assembly_dir = contig_list[0].metadata['assembly_dir']
+    assert all(c.metadata['assembly_dir'] == assembly_dir
+            for c in contig_list)
+    sv_indicants_bam = _get_assembly_sv_indicants_bam(assembly_dir)
+
+    for batch_start in range(0, len(contig_list), max_open_files):
+        contig_batch = contig_list[batch_start:batch_start + max_open_files]
+        node_to_contig = dict(
+                (c.metadata['node_number'], c) for c in contig_batch)
+        read_key_to_nodes = _get_read_key_to_nodes(
+                assembly_dir, set(node_to_contig.keys()))
+
+        node_to_bam_path = dict(
+                (node, os.path.join(contig.get_model_data_dir(),
+                        'sv_indicants.bam'))
+                for node, contig in node_to_contig.iteritems())
+        node_to_ref_id_to_count = defaultdict(lambda: defaultdict(int))
+
+        sam_file = pysam.AlignmentFile(sv_indicants_bam)
+        try:
+            node_to_output = {}
+            try:
+                for node, bam_path in node_to_bam_path.iteritems():
+                    node_to_output[node] = pysam.AlignmentFile(
+                            bam_path, 'wb', template=sam_file)
+
+                for read in sam_file:
+                    nodes = read_key_to_nodes.get(
+                            (read.query_name, _get_read_number(read)))
+                    if not nodes:
+                        continue
+                    for node in nodes:
+                        node_to_output[node].write(read)
+                        if not read.is_unmapped:
+                            node_to_ref_id_to_count[node][
+                                    read.reference_id] += 1
+            finally:
+                for output in node_to_output.itervalues():
+                    output.close()
+
+            for node, contig in node_to_contig.iteritems():
+                _set_contig_chromosome(contig, node_to_ref_id_to_count[node],
+                        sam_file)
+        finally:
+            sam_file.close()
+
+        read_nodes = set()
+        for nodes in read_key_to_nodes.itervalues():
+            read_nodes.update(nodes)
+        for node, contig in node_to_contig.iteritems():
+            extracted_reads_bam_file = node_to_bam_path[node]
+            if node in read_nodes:
+                _add_contig_reads_dataset(contig, extracted_reads_bam_file)
+            else:
+                os.remove(extracted_reads_bam_file)
+
+
 def extract_left_and_right_clipped_read_dicts(sv_indicant_reads_in_contig,
         clipping_threshold=0):
 
@@ -255,6 +425,15 @@ def make_contig_reads_to_ref_alignments(
             type=Dataset.TYPE.BWA_SV_INDICANTS)
 
     if overwrite or not dataset_query.count():
+        if os.path.exists(os.path.join(contig.metadata['assembly_dir'],
+                CONTIG_READS_FILENAME)):
+            make_contig_reads_datasets([contig])
+            if not contig.dataset_set.filter(
+                    type=Dataset.TYPE.BWA_SV_INDICANTS).exists():
+                raise Exception(
+                        'No reads were extracted from contig ' + contig.label)
+            return
+
         # Get the reads aligned to ref that assembled the contig
         contig_reads = extract_contig_reads(contig, 'all')
 
@@ -0,0 +1,74 @@
+"""
+Tests for assembly_cache.py.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase
+
+from genome_finish.assembly import _calc_n50
+from genome_finish.assembly_cache import get_or_create_cache_entry
+from genome_finish.assembly_cache import make_cache_key
+from genome_finish.assembly_cache import prune_assembly_cache
+
+
+class TestAssemblyCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_make_cache_key(self):
+        self.assertEqual(
+                make_cache_key(['abc', {'hash_length': 21, 'b': 1}]),
+                make_cache_key(['abc', {'b': 1, 'hash_length': 21}]))
+        self.assertNotEqual(
+                make_cache_key(['abc', {'hash_length': 21}]),
+                make_cache_key(['abc', {'hash_length': 31}]))
+
+    def test_get_or_create_cache_entry(self):
+        created = []
+
+        def _create(entry_dir):
+            created.append(entry_dir)
+            with open(os.path.join(entry_dir, 'contigs.fa'), 'w') as fh:
+                fh.write('>NODE_1_length_10_cov_5.0\nACGT\n')
+
+        entry_dir = get_or_create_cache_entry(self.cache_dir, 'velvetg',
+                ['abc'], _create)
+        self.assertTrue(os.path.exists(os.path.join(entry_dir, 'contigs.fa')))
+        self.assertEqual(entry_dir, get_or_create_cache_entry(
+                self.cache_dir, 'velvetg', ['abc'], _create))
+        self.assertEqual(1, len(created))
+
+        # A failed create leaves nothing behind.
+        def _fail(entry_dir):
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            get_or_create_cache_entry(self.cache_dir, 'velvetg', ['def'],
+                    _fail)
+        self.assertEqual([os.path.basename(entry_dir)],
+                os.listdir(self.cache_dir))
+
+    def test_prune_assembly_cache(self):
+        entry_dir_list = []
+        for i in range(3):
+            entry_dir_list.append(get_or_create_cache_entry(self.cache_dir,
+                    'velveth', [i], lambda entry_dir: None))
+            now = time.time()
+            os.utime(entry_dir_list[-1], (now + i, now + i))
+
+        prune_assembly_cache(self.cache_dir, max_entries=2)
+        self.assertEqual(
+                sorted(os.path.basename(d) for d in entry_dir_list[1:]),
+                sorted(os.listdir(self.cache_dir)))
+
+    def test_calc_n50(self):
+        self.assertEqual(0, _calc_n50([]))
+        self.assertEqual(80, _calc_n50([80, 10, 10]))
+        self.assertEqual(30, _calc_n50([10, 20, 30, 40]))
@@ -0,0 +1,76 @@
+"""
+Tests for detect_deletion.py.
+"""
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from genome_finish.detect_deletion import get_deleted_regions
+from main.models import Dataset
+from main.models import ExperimentSample
+from main.models import ExperimentSampleToAlignment
+from main.models import Project
+from pipeline.pipeline_runner import run_pipeline
+from utils.import_util import add_dataset_to_entity
+from utils.import_util import import_reference_genome_from_local_file
+
+TEST_USERNAME = 'testuser'
+TEST_PASSWORD = 'password'
+TEST_EMAIL = 'test@example.com'
+
+GF_TEST_DIR = os.path.join(
+        settings.PWD,
+        'test_data/genome_finish_test')
+
+
+class TestDetectDeletion(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(
+            TEST_USERNAME, password=TEST_PASSWORD, email=TEST_EMAIL)
+        self.project = Project.objects.create(
+            owner=user.get_profile(), title='Test Project')
+
+    def _align(self, data_dir):
+        ref_genome = import_reference_genome_from_local_file(
+                self.project, 'test_ref',
+                os.path.join(data_dir, 'ref.fa'), 'fasta', move=False)
+
+        sample = ExperimentSample.objects.create(
+                project=self.project,
+                label='test_sample')
+        add_dataset_to_entity(
+                sample,
+                Dataset.TYPE.FASTQ1,
+                Dataset.TYPE.FASTQ1,
+                filesystem_location=os.path.join(data_dir, 'reads.1.fq'))
+        add_dataset_to_entity(
+                sample,
+                Dataset.TYPE.FASTQ2,
+                Dataset.TYPE.FASTQ2,
+                filesystem_location=os.path.join(data_dir, 'reads.2.fq'))
+
+        alignment_group, _, _ = run_pipeline(
+                'test_alignment', ref_genome, [sample],
+                perform_variant_calling=False, alignment_options={})
+
+        return ExperimentSampleToAlignment.objects.get(
+                alignment_group=alignment_group,
+                experiment_sample=sample)
+
+    def test_coarse_to_fine_matches_per_base(self):
+        for fixture in ['1kb_ins_del_30', '1kb_ins_del_1000']:
+            sample_alignment = self._align(os.path.join(
+                    GF_TEST_DIR, 'small_mg1655_data', fixture))
+
+            per_base_regions = get_deleted_regions(
+                    sample_alignment, coarse_to_fine=False)
+            coarse_to_fine_regions = get_deleted_regions(
+                    sample_alignment, coarse_to_fine=True)
+
+            if fixture == '1kb_ins_del_1000':
+                self.assertTrue(any(per_base_regions.values()))
+            self.assertEqual(per_base_regions, coarse_to_fine_regions,
+                    fixture)
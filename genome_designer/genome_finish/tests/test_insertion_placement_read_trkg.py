@@ -0,0 +1,178 @@
+"""
+Tests for insertion_placement_read_trkg.py.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+
+from django.test import TestCase
+import pysam
+
+from genome_finish import insertion_placement_read_trkg
+from genome_finish.insertion_placement_read_trkg import CONTIG_READS_FILENAME
+from genome_finish.insertion_placement_read_trkg import make_contig_reads_datasets
+from genome_finish.insertion_placement_read_trkg import write_contig_reads_file
+from main.model_utils import get_dataset_with_type
+from main.models import Contig
+from main.models import Dataset
+from main.models import ExperimentSampleToAlignment
+from main.testing_util import create_common_entities
+
+
+class TestWriteContigReadsFile(TestCase):
+
+    def setUp(self):
+        self.velvet_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.velvet_dir)
+
+    def _write(self, filename, lines):
+        with open(os.path.join(self.velvet_dir, filename), 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+    def test_write_contig_reads_file(self):
+        self._write('contigs.fa', [
+            '>NODE_3_length_50_cov_10.000000',
+            'ACGT',
+            '>NODE_5_length_60_cov_8.000000',
+            'ACGT'
+        ])
+        self._write('LastGraph', [
+            '6\t4\t21',
+            'NODE\t3\t10\t10',
+            'ACGTACGT',
+            'TTTT',
+            'ARC\t3\t5\t1',
+            'NR\t3\t2',
+            '1\t0\t0',
+            '2\t5\t0',
+            'NR\t-3\t1',
+            '2\t3\t0',
+            # Node 4 isn't a contig.
+            'NR\t4\t1',
+            '3\t0\t0',
+            'NR\t-5\t1',
+            '4\t0\t0'
+        ])
+        self._write('Sequences', [
+            '>r1/1\t1\t0',
+            'ACGT',
+            '>r1/2\t2\t0',
+            'ACGT',
+            '>r2/1\t3\t0',
+            'AC',
+            '>r2/2\t4\t0',
+            'GT'
+        ])
+
+        write_contig_reads_file(self.velvet_dir)
+
+        with open(os.path.join(self.velvet_dir, CONTIG_READS_FILENAME)) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(['3\tr1\t1', '3\tr1\t2', '5\tr2\t2'], lines)
+
+
+class TestMakeContigReadsDatasets(TestCase):
+
+    def setUp(self):
+        common_entities = create_common_entities()
+        self.sample_alignment = ExperimentSampleToAlignment.objects.create(
+                alignment_group=common_entities['alignment_group_1'],
+                experiment_sample=common_entities['sample_1'])
+        self.sample_alignment.ensure_model_data_dir_exists()
+        self.assembly_dir = os.path.join(
+                self.sample_alignment.get_model_data_dir(), 'assembly')
+        os.mkdir(self.assembly_dir)
+
+        # Pairs r1 to r3 are on chr1 and r4 is on chr2.
+        sv_indicants_bam = os.path.join(
+                self.sample_alignment.get_model_data_dir(),
+                'sv_indicants.bam')
+        header = {
+            'HD': {'VN': '1.0'},
+            'SQ': [{'SN': 'chr1', 'LN': 10000}, {'SN': 'chr2', 'LN': 10000}]
+        }
+        output_bam = pysam.AlignmentFile(sv_indicants_bam, 'wb',
+                header=header)
+        for i, read_name in enumerate(['r1', 'r2', 'r3', 'r4']):
+            for read_number in [1, 2]:
+                read = pysam.AlignedSegment()
+                read.query_name = read_name
+                read.query_sequence = 'ACGTACGTAC'
+                read.query_qualities = [30] * 10
+                read.flag = 0x1 | (0x40 if read_number == 1 else 0x80)
+                read.reference_id = 1 if read_name == 'r4' else 0
+                read.reference_start = 100 * i + 50 * read_number
+                read.cigarstring = '10M'
+                read.mapping_quality = 60
+                output_bam.write(read)
+        output_bam.close()
+
+        with open(os.path.join(self.assembly_dir, 'metadata.txt'), 'w') as fh:
+            pickle.dump({'sv_indicants_bam': sv_indicants_bam}, fh)
+
+        # r2/1 is in nodes 1 and 2, node 3 has no reads and r4 isn't in any.
+        with open(os.path.join(self.assembly_dir, CONTIG_READS_FILENAME),
+                'w') as fh:
+            for node, read_name, read_number in [
+                    (1, 'r1', 1), (1, 'r1', 2), (1, 'r2', 1),
+                    (2, 'r2', 1), (2, 'r3', 1), (2, 'r3', 2)]:
+                fh.write('%d\t%s\t%d\n' % (node, read_name, read_number))
+
+        self.contig_list = []
+        for node in [1, 2, 3]:
+            contig = Contig.objects.create(
+                    label='contig_%d' % node,
+                    parent_reference_genome=(
+                            common_entities['reference_genome']),
+                    experiment_sample_to_alignment=self.sample_alignment)
+            contig.metadata['assembly_dir'] = self.assembly_dir
+            contig.metadata['node_number'] = node
+            contig.save()
+            contig.ensure_model_data_dir_exists()
+            self.contig_list.append(contig)
+
+    def _get_contig_read_keys(self, contig):
+        dataset = get_dataset_with_type(contig, Dataset.TYPE.BWA_SV_INDICANTS)
+        sam_file = pysam.AlignmentFile(dataset.get_absolute_location())
+        read_keys = set((read.query_name, 1 if read.is_read1 else 2)
+                for read in sam_file)
+        sam_file.close()
+        return read_keys
+
+    def test_make_contig_reads_datasets(self):
+        # Record the nodes of each pass over the reads.
+        batch_node_list = []
+        get_read_key_to_nodes = (
+                insertion_placement_read_trkg._get_read_key_to_nodes)
+
+        def _get_read_key_to_nodes(assembly_dir, node_numbers):
+            batch_node_list.append(sorted(node_numbers))
+            return get_read_key_to_nodes(assembly_dir, node_numbers)
+
+        insertion_placement_read_trkg._get_read_key_to_nodes = (
+                _get_read_key_to_nodes)
+        try:
+            make_contig_reads_datasets(self.contig_list, max_open_files=2)
+        finally:
+            insertion_placement_read_trkg._get_read_key_to_nodes = (
+                    get_read_key_to_nodes)
+
+        self.assertEqual([[1, 2], [3]], batch_node_list)
+
+        contig_1, contig_2, contig_3 = [Contig.objects.get(id=c.id)
+                for c in self.contig_list]
+        self.assertEqual(set([('r1', 1), ('r1', 2), ('r2', 1)]),
+                self._get_contig_read_keys(contig_1))
+        self.assertEqual(set([('r2', 1), ('r3', 1), ('r3', 2)]),
+                self._get_contig_read_keys(contig_2))
+        self.assertEqual('chr1', contig_1.metadata['chromosome'])
+
+        # No reads, so no dataset and no bam left behind.
+        self.assertEqual(None, get_dataset_with_type(contig_3,
+                Dataset.TYPE.BWA_SV_INDICANTS))
+        self.assertFalse(os.path.exists(os.path.join(
+                contig_3.get_model_data_dir(), 'sv_indicants.bam')))
@@ -13,8 +13,11 @@ from django.db.models import Model
 from django.db.models.query import QuerySet
 
 from main.constants import UNDEFINED_STRING
+from main.models import AlignmentGroup
 from main.models import ExperimentSample
 from main.models import ExperimentSampleToAlignment
+from main.models import ReferenceGenome
+from main.models import VariantSet
 
 OBJ_LIST = 'obj_list'
 
@@ -26,6 +29,51 @@ HIDDEN_PAIR_FIELDS = [
     'uid',
 ]
 
+# Related objects to fetch along with querysets of each model, so that the
+# fields displayed for each object, including those of nested objects, don't
+# each query the database. The model properties behind those fields read
+# related Datasets and Chromosomes with all() so that prefetched ones are
+# used.
+FRONTEND_PREFETCH_PLANS = {
+    AlignmentGroup: {
+        'select_related': ['reference_genome__project'],
+        'prefetch_related': ['reference_genome__chromosome_set'],
+    },
+    ExperimentSample: {
+        'select_related': ['project'],
+        'prefetch_related': ['dataset_set'],
+    },
+    ExperimentSampleToAlignment: {
+        'select_related': [
+            'experiment_sample__project',
+            'alignment_group__reference_genome__project',
+        ],
+        'prefetch_related': ['dataset_set', 'experiment_sample__dataset_set'],
+    },
+    ReferenceGenome: {
+        'select_related': ['project'],
+        'prefetch_related': ['chromosome_set'],
+    },
+    VariantSet: {
+        'select_related': ['reference_genome__project'],
+        'prefetch_related': ['reference_genome__chromosome_set'],
+    },
+}
+
+
+def apply_frontend_prefetch_plan(model, obj_list):
+    """Returns obj_list set to fetch the related objects in the model's
+    FRONTEND_PREFETCH_PLANS entry.
+
+    Lists that are already evaluated are returned unchanged.
+    """
+    prefetch_plan = FRONTEND_PREFETCH_PLANS.get(model)
+    if prefetch_plan is None or not isinstance(obj_list, QuerySet):
+        return obj_list
+    return obj_list.select_related(
+            *prefetch_plan['select_related']).prefetch_related(
+                    *prefetch_plan['prefetch_related'])
+
 
 def adapt_model_to_frontend(model, filters={}, obj_list=None, **kwargs):
     """Converts django models to frontend format.
@@ -53,11 +101,14 @@ def adapt_model_to_frontend(model, filters={}, obj_list=None, **kwargs):
     # Get all objects that pass the filter.
     if obj_list is None:
         obj_list = model.objects.filter(**filters)
+    obj_list = apply_frontend_prefetch_plan(model, obj_list)
 
     # A list of dicts with object data, where each dict is one object
     # and all the fields required for front-end display.
+    field_order_cache = {}
     fe_obj_list = [
-            adapt_model_instance_to_frontend(obj, **kwargs)
+            adapt_model_instance_to_frontend(obj,
+                    field_order_cache=field_order_cache, **kwargs)
             for obj in obj_list]
 
     # Get a list of fields required for displaying the objects, in the order
@@ -91,6 +142,7 @@ def adapt_experiment_samples_to_frontend(filters={}, obj_list=None, **kwargs):
     # Get all objects that pass the filter.
     if obj_list is None:
         obj_list = ExperimentSample.objects.filter(**filters).order_by('label')
+    obj_list = apply_frontend_prefetch_plan(ExperimentSample, obj_list)
 
     json_fields = {}
     for obj in obj_list:
@@ -100,6 +152,7 @@ def adapt_experiment_samples_to_frontend(filters={}, obj_list=None, **kwargs):
 
     # A list of dicts with object data, where each dict is one object
     # and all the fields required for front-end display.
+    field_order_cache = {}
     fe_obj_list = []
     for obj in obj_list:
         # default to empty string
@@ -107,6 +160,7 @@ def adapt_experiment_samples_to_frontend(filters={}, obj_list=None, **kwargs):
         obj_json_fields.update(obj.data)
         fe_obj_list.append(adapt_model_instance_to_frontend(obj,
                 field_info= obj_json_fields,
+                field_order_cache=field_order_cache,
                 **kwargs))
 
 
@@ -145,8 +199,9 @@ def adapt_experiment_samples_to_frontend(filters={}, obj_list=None, **kwargs):
 def adapt_sample_alignments_to_frontend_for_assembly(filters={}):
     """ The sample metadata fields require their own custom adapter. """
     # Get all objects that pass the filter.
-    obj_list = ExperimentSampleToAlignment.objects.filter(
-            **filters).order_by('experiment_sample__label')
+    obj_list = apply_frontend_prefetch_plan(ExperimentSampleToAlignment,
+            ExperimentSampleToAlignment.objects.filter(
+                    **filters).order_by('experiment_sample__label'))
 
     json_fields = {}
     for obj in obj_list:
@@ -156,13 +211,15 @@ def adapt_sample_alignments_to_frontend_for_assembly(filters={}):
 
     # A list of dicts with object data, where each dict is one object
     # and all the fields required for front-end display.
+    field_order_cache = {}
     fe_obj_list = []
     for obj in obj_list:
         # default to empty string
         obj_json_fields = dict((field, '') for field in json_fields)
         obj_json_fields.update(obj.data)
         fe_obj_list.append(adapt_model_instance_to_frontend(obj,
-                field_info=obj_json_fields))
+                field_info=obj_json_fields,
+                field_order_cache=field_order_cache))
 
     # Get a list of fields required for displaying the objects, in the order
     # in which they should be displayed.
@@ -204,7 +261,19 @@ def adapt_sample_alignments_to_frontend_for_assembly(filters={}):
     })
 
 
-def adapt_model_instance_to_frontend(model_instance, field_info={}, **kwargs):
+def _get_field_order(model_type, field_order_cache, **kwargs):
+    """Returns model_type.get_field_order(), looking it up only once per
+    class in field_order_cache.
+    """
+    if field_order_cache is None:
+        return model_type.get_field_order(**kwargs)
+    if model_type not in field_order_cache:
+        field_order_cache[model_type] = model_type.get_field_order(**kwargs)
+    return field_order_cache[model_type]
+
+
+def adapt_model_instance_to_frontend(model_instance, field_info={},
+        field_order_cache=None, **kwargs):
     """Adapts a single model instance to the frontend representation.
 
     Args:
@@ -216,6 +285,8 @@ def adapt_model_instance_to_frontend(model_instance, field_info={}, **kwargs):
             can decorate the serialized model with information like CSS class,
             state, instructions on how to render in datatable_component.js,
             etc.
+        field_order_cache: Optional dictionary from model class to its field
+            order, shared when adapting many instances.
 
     Returns:
         A dictionary representation of the model. May contained nested
@@ -225,16 +296,16 @@ def adapt_model_instance_to_frontend(model_instance, field_info={}, **kwargs):
     model_type = type(model_instance)
 
     # The visible fields of the model.
-    visible_field_names = [f['field']
-            for f in model_type.get_field_order(**kwargs)]
-    visible_field_dict = {f['field']: f
-            for f in model_type.get_field_order(**kwargs)}
+    field_dict_list = _get_field_order(model_type, field_order_cache,
+            **kwargs)
+    visible_field_names = [f['field'] for f in field_dict_list]
+    visible_field_dict = {f['field']: f for f in field_dict_list}
 
     # Get (key, value) pairs for visible fields.
     visible_field_pairs = [
             (field, get_model_field_fe_representation(
                     model_instance, field, visible_field_dict[field],
-                    **kwargs))
+                    field_order_cache=field_order_cache, **kwargs))
             for field in visible_field_names]
 
     # Other values.
@@ -259,7 +330,7 @@ def adapt_model_instance_to_frontend(model_instance, field_info={}, **kwargs):
 
 
 def get_model_field_fe_representation(model_obj, field, field_info={},
-        **kwargs):
+        field_order_cache=None, **kwargs):
     """Returns the best frontend representation for a model field that is
     implemented.
 
@@ -272,12 +343,15 @@ def get_model_field_fe_representation(model_obj, field, field_info={},
 
     # Maybe special handling if ModelField is of special type.
     if isinstance(model_field, Model):
-        return adapt_model_instance_to_frontend(model_field, field_info)
+        return adapt_model_instance_to_frontend(model_field, field_info,
+                field_order_cache=field_order_cache)
     elif model_field.__class__.__name__ == 'ManyRelatedManager':
-        return [adapt_model_instance_to_frontend(m, field_info)
+        return [adapt_model_instance_to_frontend(m, field_info,
+                        field_order_cache=field_order_cache)
                 for m in model_field.all()]
     elif isinstance(model_field, QuerySet):
-        return [adapt_model_instance_to_frontend(m, field_info)
+        return [adapt_model_instance_to_frontend(m, field_info,
+                        field_order_cache=field_order_cache)
                 for m in model_field]
     elif isinstance(model_field, datetime.datetime):
         return model_field.strftime("%Y-%m-%d %H:%M:%S")
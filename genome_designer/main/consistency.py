@@ -5,23 +5,48 @@
 def ensure_variant_set_consistency(variant_set):
     """For all Variants in a VariantSet, makes an association to samples
     having GT_TYPE = 2.
+
+    Returns:
+        True if any association was added or removed.
     """
+    changed = False
     for variant in variant_set.variants.all():
         vtvs = variant.varianttovariantset_set.get(variant_set=variant_set)
+        associated_sample_ids = set(
+                vtvs.sample_variant_set_association.values_list(
+                        'id', flat=True))
         for vccd in variant.variantcallercommondata_set.all():
             for ve in vccd.variantevidence_set.all():
+                is_associated = (
+                        ve.experiment_sample_id in associated_sample_ids)
                 if 'GT_TYPE' in ve.data and ve.data['GT_TYPE'] == 2:
-                    vtvs.sample_variant_set_association.add(
-                            ve.experiment_sample)
-                else:
+                    if not is_associated:
+                        vtvs.sample_variant_set_association.add(
+                                ve.experiment_sample)
+                        associated_sample_ids.add(ve.experiment_sample_id)
+                        changed = True
+                elif is_associated:
                     vtvs.sample_variant_set_association.remove(
                             ve.experiment_sample)
+                    associated_sample_ids.remove(ve.experiment_sample_id)
+                    changed = True
+    return changed
 
 
 def ensure_all_ref_genome_variant_set_consistency(reference_genome):
     """Ensures VariantSet consistency for all VariantSets belonging to a
     ReferenceGenome.
+
+    The sample associations show up in every partition of the materialized
+    view, so if any changed, the whole view is invalidated.
+
+    Returns:
+        True if any association was added or removed.
     """
+    changed = False
     for vs in reference_genome.variantset_set.all():
-        ensure_variant_set_consistency(vs)
-    reference_genome.invalidate_materialized_view()
+        if ensure_variant_set_consistency(vs):
+            changed = True
+    if changed:
+        reference_genome.invalidate_materialized_view()
+    return changed
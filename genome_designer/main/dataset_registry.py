@@ -0,0 +1,139 @@
+"""
+Per-request and per-task registry of the Datasets belonging to each entity.
+
+get_dataset_with_type() is called for nearly every file a pipeline stage
+touches, and each call used to query the entity's dataset_set. Inside a
+registry scope, the first lookup for an entity loads all of its Datasets in
+one query and later lookups are answered from memory. A scope is opened
+around each web request (see main.middleware.DatasetRegistryMiddleware) and
+each celery task (see main/signals.py). Outside a scope nothing is cached.
+
+Entries are invalidated by the signal handlers in main/signals.py when a
+Dataset is added to or removed from an entity (e.g. by
+add_dataset_to_entity()), and when a Dataset is saved through an instance
+other than the registered one, e.g. a status change made by a task that
+re-fetched the Dataset. Changes made in other processes are not seen until
+the next scope, so a long-running task that waits on Datasets created
+elsewhere should re-fetch them itself.
+
+The registry is thread-local. Scopes nest, e.g. when celery runs tasks
+eagerly inside a request, in which case the outermost scope owns the
+registry.
+"""
+
+from contextlib import contextmanager
+import threading
+
+
+_local = threading.local()
+
+
+def _get_registry():
+    return getattr(_local, 'registry', None)
+
+
+def open_dataset_registry():
+    """Opens a registry scope. Must be matched by close_dataset_registry().
+    """
+    depth = getattr(_local, 'depth', 0)
+    if depth == 0:
+        _local.registry = {}
+    _local.depth = depth + 1
+
+
+def close_dataset_registry():
+    _local.depth -= 1
+    if _local.depth == 0:
+        _local.registry = None
+
+
+@contextmanager
+def dataset_registry_scope():
+    """Context manager that caches Dataset lookups made inside of it.
+    """
+    open_dataset_registry()
+    try:
+        yield
+    finally:
+        close_dataset_registry()
+
+
+def _get_entity_key(model, pk):
+    # The db table, rather than the class, so that deferred instances share
+    # entries with regular ones.
+    return (model._meta.db_table, pk)
+
+
+def get_registered_datasets(entity):
+    """Returns the list of Datasets belonging to the entity, loading them if
+    necessary, or None if there's no open registry scope.
+    """
+    registry = _get_registry()
+    if registry is None or entity.pk is None:
+        return None
+    key = _get_entity_key(type(entity), entity.pk)
+    if key not in registry:
+        registry[key] = list(entity.dataset_set.all())
+    return registry[key]
+
+
+def preload_entity_datasets(entity_list):
+    """Loads the Datasets of all the entities, which must be of the same
+    model, into the registry in one query.
+
+    A no-op outside a registry scope.
+    """
+    registry = _get_registry()
+    entity_list = [entity for entity in entity_list if entity.pk is not None]
+    if registry is None or not entity_list:
+        return
+
+    model = type(entity_list[0])
+    dataset_set_field = model._meta.get_field('dataset_set')
+    entity_field_name = dataset_set_field.m2m_field_name()
+    dataset_field_name = dataset_set_field.m2m_reverse_field_name()
+
+    entity_pk_to_datasets = dict((entity.pk, []) for entity in entity_list)
+    through_list = dataset_set_field.rel.through.objects.filter(**{
+            entity_field_name + '__in': entity_pk_to_datasets.keys()
+    }).select_related(dataset_field_name)
+    for through in through_list:
+        entity_pk = getattr(through, entity_field_name + '_id')
+        entity_pk_to_datasets[entity_pk].append(
+                getattr(through, dataset_field_name))
+
+    for entity_pk, dataset_list in entity_pk_to_datasets.iteritems():
+        registry[_get_entity_key(model, entity_pk)] = dataset_list
+
+
+def invalidate_entity_datasets(model, pk_list=None):
+    """Drops the registered Datasets of the entities of the model with the
+    given pks, or of all entities of the model if pk_list is None.
+    """
+    registry = _get_registry()
+    if not registry:
+        return
+    db_table = model._meta.db_table
+    for key in registry.keys():
+        if key[0] == db_table and (pk_list is None or key[1] in pk_list):
+            del registry[key]
+
+
+def invalidate_dataset(dataset, keep_if_registered=False):
+    """Drops the entries of all entities holding the Dataset.
+
+    Args:
+        dataset: The Dataset.
+        keep_if_registered: If True, entries holding this very instance are
+            kept, since they already reflect any changes made to it.
+    """
+    registry = _get_registry()
+    if not registry:
+        return
+    for key, dataset_list in registry.items():
+        for registered_dataset in dataset_list:
+            if registered_dataset.id != dataset.id:
+                continue
+            if not (keep_if_registered and registered_dataset is dataset):
+                del registry[key]
+            break
@@ -11,6 +11,8 @@ from django.conf import settings
 from django.http import HttpResponseForbidden
 
 from conf import demo_settings
+from main.dataset_registry import close_dataset_registry
+from main.dataset_registry import open_dataset_registry
 
 
 class DisabledInDemoModeMiddleware(object):
@@ -48,3 +50,21 @@ class DisabledInDemoModeMiddleware(object):
         if view_func in self.safe_views:
             return None # continue handling request
         return HttpResponseForbidden()
+
+
+class DatasetRegistryMiddleware(object):
+    """Caches the Datasets looked up while handling each request.
+
+    See main/dataset_registry.py.
+    """
+
+    def process_request(self, request):
+        open_dataset_registry()
+        request.dataset_registry_open = True
+
+    def process_response(self, request, response):
+        # process_request() is skipped if an earlier middleware responded.
+        if getattr(request, 'dataset_registry_open', False):
+            close_dataset_registry()
+            request.dataset_registry_open = False
+        return response
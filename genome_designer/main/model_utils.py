@@ -2,10 +2,13 @@
 Utility objects and functions for interacting with models.
 """
 
+from contextlib import contextmanager
 import hashlib
 from uuid import uuid4
+import zlib
 
 from django.conf import settings
+from django.db import connection
 from django.db import IntegrityError
 from django.db import models
 from django.db import transaction
@@ -14,6 +17,8 @@ import os
 import re
 import stat
 
+from dataset_registry import get_registered_datasets
+
 
 # Size of unique UIDs.
 UUID_SIZE = 8
@@ -21,6 +26,13 @@ UUID_SIZE = 8
 # Size of hash id for filenames that store long alt.
 LONG_ALT_HASH_SIZE = 8
 
+# Namespaces for advisory_lock(), so that keys for different kinds of lock
+# don't collide.
+ADVISORY_LOCK_NAMESPACE__VARIANT = 1
+ADVISORY_LOCK_NAMESPACE__VARIANT_KEY_MAP = 2
+ADVISORY_LOCK_NAMESPACE__PARENT_CHILD_FIELDS = 3
+ADVISORY_LOCK_NAMESPACE__S3_MANIFEST = 4
+
 
 ###############################################################################
 # Mixins
@@ -199,9 +211,15 @@ def get_dataset_with_type(entity, type, compressed=False):
 
     If there are both compressed and uncompressed versions, return the 
     uncompressed unless the compressed is asked for.
+
+    Inside a dataset registry scope, the entity's Datasets are looked up in
+    the registry rather than queried each time. See main/dataset_registry.py.
     """
-    results = [r for r in entity.dataset_set.filter(type=type) 
-            if r.is_compressed() == compressed]
+    dataset_list = get_registered_datasets(entity)
+    if dataset_list is None:
+        dataset_list = entity.dataset_set.filter(type=type)
+    results = [r for r in dataset_list
+            if r.type == type and r.is_compressed() == compressed]
 
     assert len(results) < 2, ("More than one Datasets of type %s for entity %s."
             % (type, str(entity)))
@@ -243,3 +261,47 @@ def get_long_alt_path(ref_genome, hash_part):
     ensure_exists_0775_dir(long_alts_dir)
 
     return os.path.join(long_alts_dir, hash_part + '.txt')
+
+
+@contextmanager
+def advisory_lock(namespace, key):
+    """Context manager that holds a Postgres advisory lock on
+    (namespace, key), for serializing read-modify-write sequences across
+    processes, e.g. celery tasks parsing VCFs for the same ReferenceGenome.
+
+    The lock is session-level so it is held across any commits made inside
+    the block.
+
+    Args:
+        namespace: One of the ADVISORY_LOCK_NAMESPACE__* constants.
+        key: A 32-bit int, or a string that is hashed to one.
+    """
+    if isinstance(key, basestring):
+        key = zlib.crc32(key)
+    cursor = connection.cursor()
+    cursor.execute('SELECT pg_advisory_lock(%s, %s)', (namespace, key))
+    try:
+        yield
+    finally:
+        cursor.execute('SELECT pg_advisory_unlock(%s, %s)', (namespace, key))
+
+
+def iter_query_rows(sql, params=None, fetch_size=2000):
+    """Generator over the rows of a read-only query that fetches them in
+    batches through a Postgres server-side cursor, so that a large result is
+    never held in memory at once.
+
+    Must be consumed within a single transaction, i.e. without committing
+    in between rows.
+    """
+    # Make sure Django has opened the underlying connection.
+    connection.cursor()
+    cursor = connection.connection.cursor(
+            name='iter_query_rows_' + uuid4().hex)
+    cursor.itersize = fetch_size
+    try:
+        cursor.execute(sql, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
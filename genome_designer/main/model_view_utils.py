@@ -55,28 +55,75 @@ def get_jbrowse_track_names(reference_genome):
 
 # HELPER FXNS FOR GENERATING MODEL VIEW LINKS ============================
 
-def create_single_variant_page_link_for_variant_object(variant_as_dict,
-        reference_genome, alignment_group=None):
-    """Constructs the label as an anchor that links to the single variant view.
+DEFAULT_VARIANT_SPECIFIC_TRACKS = {'alignment': [], 'coverage': []}
+
+
+def get_analyze_view_root_href(reference_genome, alignment_group=None):
+    """Returns the href to the Analyze view that variant links append a
+    filter to.
     """
     reverse_args = [reference_genome.project.uid]
     if alignment_group is not None:
         reverse_args += [alignment_group.uid, 'variants']
-    root_href = reverse('main.views.tab_root_analyze', args=reverse_args)
+    return reverse('main.views.tab_root_analyze', args=reverse_args)
+
+
+class VariantLinksContext(object):
+    """Values shared by the links field of every variant row in a single
+    request, so they are computed once rather than once per row.
+
+    Attributes:
+        jbrowse_track_names: Output of get_jbrowse_track_names().
+        ref_genome_jbrowse_link: JBrowse link for the ReferenceGenome.
+        analyze_view_root_href: See get_analyze_view_root_href().
+        variant_uid_to_specific_tracks: Map from Variant uid to its
+            variant_specific_tracks, fetched in a single query.
+    """
+
+    def __init__(self, reference_genome, jbrowse_track_names,
+            alignment_group=None, variant_uid_list=[]):
+        self.jbrowse_track_names = jbrowse_track_names
+        self.ref_genome_jbrowse_link = (
+                reference_genome.get_client_jbrowse_link())
+        self.analyze_view_root_href = get_analyze_view_root_href(
+                reference_genome, alignment_group)
+
+        self.variant_uid_to_specific_tracks = {}
+        unique_variant_uids = set(variant_uid_list)
+        if unique_variant_uids:
+            for variant in Variant.objects.filter(
+                    reference_genome=reference_genome,
+                    uid__in=unique_variant_uids).only('uid', 'data'):
+                self.variant_uid_to_specific_tracks[variant.uid] = (
+                        variant.variant_specific_tracks)
+
+    def get_variant_specific_tracks(self, variant_uid):
+        return self.variant_uid_to_specific_tracks.get(
+                variant_uid, DEFAULT_VARIANT_SPECIFIC_TRACKS)
+
+
+def create_single_variant_page_link_for_variant_object(variant_as_dict,
+        reference_genome, alignment_group=None, root_href=None):
+    """Constructs the label as an anchor that links to the single variant view.
+    """
+    if root_href is None:
+        root_href = get_analyze_view_root_href(
+                reference_genome, alignment_group)
     filter_part = '?filter=UID=%s&melt=1' % (variant_as_dict['UID'],)
     full_href = root_href + filter_part
     return full_href
 
 
 def create_jbrowse_link_for_variant_object(variant_as_dict, reference_genome,
-        track_strings):
+        track_strings, ref_genome_jbrowse_link=None):
     """
     Constructs a JBrowse link for the Variant. Adds tracks passed in;
     DNA and genbank annotation tracks are in by default.
     """
     assert MELTED_SCHEMA_KEY__POSITION in variant_as_dict
     position = variant_as_dict[MELTED_SCHEMA_KEY__POSITION]
-    ref_genome_jbrowse_link = reference_genome.get_client_jbrowse_link()
+    if ref_genome_jbrowse_link is None:
+        ref_genome_jbrowse_link = reference_genome.get_client_jbrowse_link()
 
     # HACK(gleb): JBrowse parses the reference .fasta file to use the first
     # word as the name of the reference genome, while we store the entire
@@ -110,10 +157,19 @@ def create_jbrowse_link_for_variant_object(variant_as_dict, reference_genome,
 
 
 def create_variant_links_field(variant_as_dict, reference_genome,
-        jbrowse_track_names, alignment_group=None):
+        jbrowse_track_names, alignment_group=None, links_context=None):
     """
     Create a list of icon links for the variant datatable view.
+
+    Clients adapting many rows should pass a VariantLinksContext built once
+    for all of them. Otherwise one is built for this row alone.
     """
+    if links_context is None:
+        links_context = VariantLinksContext(reference_genome,
+                jbrowse_track_names, alignment_group,
+                [variant_as_dict['UID']])
+    jbrowse_track_names = links_context.jbrowse_track_names
+    ref_genome_jbrowse_link = links_context.ref_genome_jbrowse_link
 
     # list of all experiment samples for this variant row
     es_list = []
@@ -132,8 +188,8 @@ def create_variant_links_field(variant_as_dict, reference_genome,
         else:
             es_list = [es for es in es_field if es is not None]
 
-    variant = Variant.objects.get(uid=variant_as_dict['UID'])
-    variant_specific_tracks = variant.variant_specific_tracks
+    variant_specific_tracks = links_context.get_variant_specific_tracks(
+            variant_as_dict['UID'])
 
     # BAM JBROWSE
     jbrowse_bam_tracks = list(chain.from_iterable([
@@ -144,7 +200,8 @@ def create_variant_links_field(variant_as_dict, reference_genome,
                     for es in es_list]))
 
     jbrowse_bam_href = create_jbrowse_link_for_variant_object(
-            variant_as_dict, reference_genome, jbrowse_bam_tracks)
+            variant_as_dict, reference_genome, jbrowse_bam_tracks,
+            ref_genome_jbrowse_link)
 
     # BAM COVERAGE JBROWSE
     jbrowse_bam_coverage_tracks = list(chain.from_iterable([
@@ -155,12 +212,14 @@ def create_variant_links_field(variant_as_dict, reference_genome,
                     for es in es_list]))
 
     jbrowse_bam_coverage_href = create_jbrowse_link_for_variant_object(
-            variant_as_dict, reference_genome, jbrowse_bam_coverage_tracks)
+            variant_as_dict, reference_genome, jbrowse_bam_coverage_tracks,
+            ref_genome_jbrowse_link)
 
     single_variant_view_href = \
             create_single_variant_page_link_for_variant_object(
                     variant_as_dict, reference_genome,
-                    alignment_group)
+                    alignment_group,
+                    root_href=links_context.analyze_view_root_href)
 
     buttons = [{
             'href': single_variant_view_href,
@@ -190,7 +249,8 @@ def create_variant_links_field(variant_as_dict, reference_genome,
             button['href'] = create_jbrowse_link_for_variant_object(
                     variant_as_dict,
                     reference_genome,
-                    jbrowse_track_names['vcf'])
+                    jbrowse_track_names['vcf'],
+                    ref_genome_jbrowse_link)
             button['title'] += ' (too many samples)'
             button['glyph'] += ' disabled'
 
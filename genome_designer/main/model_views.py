@@ -10,8 +10,13 @@ from django.core.urlresolvers import reverse
 
 from main.models import AlignmentGroup
 from main.model_view_utils import create_variant_links_field
+from main.model_view_utils import get_analyze_view_root_href
 from main.model_view_utils import get_jbrowse_track_names
 from main.model_view_utils import create_alt_flag_field
+from main.model_view_utils import VariantLinksContext
+from main.reference_genome_metadata_cache import get_cached_reference_genome_metadata
+from main.reference_genome_metadata_cache import METADATA_KEY__ALIGNMENT_GROUPS
+from main.reference_genome_metadata_cache import METADATA_KEY__JBROWSE_TRACK_NAMES
 from utils import titlecase_spaces
 from variants.common import generate_key_to_materialized_view_parent_col
 from variants.common import validate_key_against_map
@@ -42,21 +47,28 @@ def adapt_non_recursive(obj_list, field_dict_list, reference_genome, melted):
     # We want a list of all VCF tracks for jbrowse. Makes sense to do it
     # once and then pass the strings to each variant object for the frontend.
     # This is a little hacky, but whatever.
-    jbrowse_track_names = get_jbrowse_track_names(reference_genome)
+    jbrowse_track_names = get_cached_reference_genome_metadata(
+            reference_genome, METADATA_KEY__JBROWSE_TRACK_NAMES,
+            get_jbrowse_track_names)
 
     # HACK: Only one AlignmentGroup right now.
-    associated_alignment_groups = AlignmentGroup.objects.filter(
-            reference_genome=reference_genome)
+    associated_alignment_groups = get_cached_reference_genome_metadata(
+            reference_genome, METADATA_KEY__ALIGNMENT_GROUPS,
+            _get_alignment_group_list)
     if len(associated_alignment_groups) > 0:
         hack_single_alignment_group = associated_alignment_groups[0]
     else:
         hack_single_alignment_group = None
 
+    # Resolve the per-field handling once, rather than re-checking the
+    # field type for every row.
+    field_adapter_list = _compile_field_adapters(field_dict_list,
+            reference_genome, melted, jbrowse_track_names,
+            hack_single_alignment_group, obj_list)
+
     # Aggregate list of objects that are ready for display by the frontend.
     fe_obj_list = []
     for melted_variant_obj in obj_list:
-        visible_field_pairs = []
-
         # If there is an empty row (no ExperimentSample associated),
         # then all the counts will be off by one, so we need to decrement
         # them.
@@ -69,92 +81,19 @@ def adapt_non_recursive(obj_list, field_dict_list, reference_genome, melted):
         else:
             maybe_dec = 0
 
-        for fdict in field_dict_list:
-            value = None
-            field = fdict['field']
-
-            # HACK: Special handling for certain fields.
-            if field == 'links':
-                value = create_variant_links_field(
-                        melted_variant_obj, reference_genome,
-                        jbrowse_track_names, hack_single_alignment_group)
-            elif field == MELTED_SCHEMA_KEY__CHROMOSOME:
-                value = melted_variant_obj.get(field, '')
-                # Truncate chromosme names and add a trailing '...' if longer
-                # than 15 characters
-                if len(value) > 15:
-                    value = value[:15] + '...'
-            elif field == MELTED_SCHEMA_KEY__VS_LABEL:
-                value = _adapt_variant_set_label_field(
-                        melted_variant_obj, reference_genome.project.uid,
-                        melted, reference_genome, hack_single_alignment_group)
-            elif field == MELTED_SCHEMA_KEY__REF and not melted:
-                value = (melted_variant_obj[MELTED_SCHEMA_KEY__REF] + ' (%d)' %
-                        melted_variant_obj[MELTED_SCHEMA_KEY__ALT].count(None))
-            elif field == MELTED_SCHEMA_KEY__ALT:
-                value = create_alt_flag_field(melted_variant_obj, melted, maybe_dec)
-            elif field == CAST_SCHEMA_KEY__TOTAL_SAMPLE_COUNT:
-                value = (melted_variant_obj[
-                        CAST_SCHEMA_KEY__TOTAL_SAMPLE_COUNT] - maybe_dec)
-            elif fdict.get('is_subkey', False):
-                assert 'parent_col' in fdict
-                parent_dict_or_list = melted_variant_obj.get(fdict['parent_col'].upper(), {})
-                if isinstance(parent_dict_or_list, dict):
-                    # melted
-                    parent_dict = parent_dict_or_list
-                    value = adapt_melted_object_field(
-                            parent_dict.get(field, ''), fdict)
-
-                elif isinstance(parent_dict_or_list, list):
-                    # cast
-                    value = adapt_cast_object_list_field(
-                            parent_dict_or_list, fdict)
-            else:
-                value = melted_variant_obj.get(field, '')
+        fe_obj = {}
+        for field, adapter in field_adapter_list:
+            value = adapter(melted_variant_obj, maybe_dec)
+
             # Pass empty string when no value present.
             if value is None:
                 value = ''
+            fe_obj[field] = value
 
-            # Append (key, value) to list so we can create dict at the end.
-            # Order doesn't matter here since it's determined in the
-            # field config object constructed separately below.
-            visible_field_pairs.append((field, value))
         # Append catch all INFO column field
-        # TODO use variables instead of magic strings
-        va_data = melted_variant_obj['VA_DATA']
+        fe_obj['INFO'] = _adapt_info_field(melted_variant_obj)
 
-        # MAJOR HACK ALERT: We need to rethink the whole thing.
-        if isinstance(va_data, list):
-            # Default.
-            representative_va = va_data[0]
-
-            # Try to do better. First one might not have data.
-            for va in va_data:
-                if not va:
-                    continue
-                if va.get('INFO_EFF_AA', '') or va.get('INFO_SVTYPE', ''):
-                    representative_va = va
-                    break
-
-            # Use this as va_data from here on.
-            va_data = representative_va
-
-        if va_data:
-            if 'INFO_SVTYPE' in va_data:
-                # is SV: make info of the form "SV [type] [length]"
-                key = 'INFO'
-                value = 'SV {svtype} {svlen}'.format(
-                        svtype=va_data['INFO_SVTYPE'],
-                        svlen=va_data.get('INFO_SVLEN', ''))
-                visible_field_pairs.append((key, value))
-            else:
-                # is SNP: make info equal to the AA field
-                visible_field_pairs.append(('INFO', va_data.get('INFO_EFF_AA', '')))
-        else:
-            # unknown: just leave info field blank
-            visible_field_pairs.append(('INFO', ''))
-
-        fe_obj_list.append(dict(visible_field_pairs))
+        fe_obj_list.append(fe_obj)
 
     # Create the config dict that tells DataTables js how to display each col.
     obj_field_config = []
@@ -198,6 +137,155 @@ def adapt_non_recursive(obj_list, field_dict_list, reference_genome, melted):
         'field_config': obj_field_config
     })
 
+
+def _get_alignment_group_list(reference_genome):
+    return list(AlignmentGroup.objects.filter(
+            reference_genome=reference_genome))
+
+
+def _compile_field_adapters(field_dict_list, reference_genome, melted,
+        jbrowse_track_names, alignment_group, obj_list):
+    """Returns a list of (field, adapter) pairs, one per field in
+    field_dict_list, where adapter is a function taking
+    (melted_variant_obj, maybe_dec) and returning the value to display.
+
+    Values that are the same for every row (link roots, JBrowse track names,
+    per-Variant track data) are computed here once.
+    """
+    field_adapter_list = []
+    links_context = None
+    variant_set_root_href = None
+    for fdict in field_dict_list:
+        field = fdict['field']
+
+        # HACK: Special handling for certain fields.
+        if field == 'links':
+            if links_context is None:
+                links_context = VariantLinksContext(reference_genome,
+                        jbrowse_track_names, alignment_group,
+                        [obj[MELTED_SCHEMA_KEY__UID] for obj in obj_list])
+            adapter = _make_links_adapter(
+                    reference_genome, alignment_group, links_context)
+        elif field == MELTED_SCHEMA_KEY__CHROMOSOME:
+            adapter = _adapt_chromosome_field
+        elif field == MELTED_SCHEMA_KEY__VS_LABEL:
+            if variant_set_root_href is None:
+                variant_set_root_href = get_analyze_view_root_href(
+                        reference_genome, alignment_group)
+            adapter = _make_variant_set_label_adapter(
+                    melted, variant_set_root_href)
+        elif field == MELTED_SCHEMA_KEY__REF and not melted:
+            adapter = _adapt_cast_ref_field
+        elif field == MELTED_SCHEMA_KEY__ALT:
+            adapter = _make_alt_adapter(melted)
+        elif field == CAST_SCHEMA_KEY__TOTAL_SAMPLE_COUNT:
+            adapter = _adapt_total_sample_count_field
+        elif fdict.get('is_subkey', False):
+            assert 'parent_col' in fdict
+            adapter = _make_subkey_adapter(fdict)
+        else:
+            adapter = _make_plain_adapter(field)
+        field_adapter_list.append((field, adapter))
+    return field_adapter_list
+
+
+def _make_links_adapter(reference_genome, alignment_group, links_context):
+    def _adapt(obj, maybe_dec):
+        return create_variant_links_field(obj, reference_genome,
+                links_context.jbrowse_track_names, alignment_group,
+                links_context=links_context)
+    return _adapt
+
+
+def _adapt_chromosome_field(obj, maybe_dec):
+    value = obj.get(MELTED_SCHEMA_KEY__CHROMOSOME, '')
+    # Truncate chromosme names and add a trailing '...' if longer
+    # than 15 characters
+    if len(value) > 15:
+        value = value[:15] + '...'
+    return value
+
+
+def _make_variant_set_label_adapter(melted, root_href):
+    def _adapt(obj, maybe_dec):
+        return _adapt_variant_set_label_field(obj, melted, root_href)
+    return _adapt
+
+
+def _adapt_cast_ref_field(obj, maybe_dec):
+    return (obj[MELTED_SCHEMA_KEY__REF] + ' (%d)' %
+            obj[MELTED_SCHEMA_KEY__ALT].count(None))
+
+
+def _make_alt_adapter(melted):
+    def _adapt(obj, maybe_dec):
+        return create_alt_flag_field(obj, melted, maybe_dec)
+    return _adapt
+
+
+def _adapt_total_sample_count_field(obj, maybe_dec):
+    return obj[CAST_SCHEMA_KEY__TOTAL_SAMPLE_COUNT] - maybe_dec
+
+
+def _make_subkey_adapter(fdict):
+    field = fdict['field']
+    parent_key = fdict['parent_col'].upper()
+
+    def _adapt(obj, maybe_dec):
+        parent_dict_or_list = obj.get(parent_key, {})
+        if isinstance(parent_dict_or_list, dict):
+            # melted
+            return adapt_melted_object_field(
+                    parent_dict_or_list.get(field, ''), fdict)
+        elif isinstance(parent_dict_or_list, list):
+            # cast
+            return adapt_cast_object_list_field(parent_dict_or_list, fdict)
+        return None
+    return _adapt
+
+
+def _make_plain_adapter(field):
+    def _adapt(obj, maybe_dec):
+        return obj.get(field, '')
+    return _adapt
+
+
+def _adapt_info_field(melted_variant_obj):
+    """Returns the value of the catch-all INFO column.
+    """
+    # TODO use variables instead of magic strings
+    va_data = melted_variant_obj['VA_DATA']
+
+    # MAJOR HACK ALERT: We need to rethink the whole thing.
+    if isinstance(va_data, list):
+        # Default.
+        representative_va = va_data[0]
+
+        # Try to do better. First one might not have data.
+        for va in va_data:
+            if not va:
+                continue
+            if va.get('INFO_EFF_AA', '') or va.get('INFO_SVTYPE', ''):
+                representative_va = va
+                break
+
+        # Use this as va_data from here on.
+        va_data = representative_va
+
+    if va_data:
+        if 'INFO_SVTYPE' in va_data:
+            # is SV: make info of the form "SV [type] [length]"
+            return 'SV {svtype} {svlen}'.format(
+                    svtype=va_data['INFO_SVTYPE'],
+                    svlen=va_data.get('INFO_SVLEN', ''))
+        else:
+            # is SNP: make info equal to the AA field
+            return va_data.get('INFO_EFF_AA', '')
+    else:
+        # unknown: just leave info field blank
+        return ''
+
+
 def _create_label_for_variant_object(variant_as_dict):
     # Generate label from variant data.
     # Using ordered dicts with None as an ordered set
@@ -272,22 +360,21 @@ def _create_label_for_variant_object(variant_as_dict):
     return label
 
 
-def _adapt_variant_set_label_field(variant_as_dict, project_uid, melted,
-        reference_genome, alignment_group):
+def _adapt_variant_set_label_field(variant_as_dict, melted, root_href):
     """Constructs the labels as anchors that link to the single variant view.
+
+    Args:
+        root_href: Analyze view href, see get_analyze_view_root_href().
     """
     if melted:
         return _adapt_variant_set_label_field__melted(
-                variant_as_dict, project_uid, reference_genome,
-                alignment_group)
+                variant_as_dict, root_href)
     else:
         return _adapt_variant_set_label_field__cast(
-                variant_as_dict, project_uid, reference_genome,
-                alignment_group)
+                variant_as_dict, root_href)
 
 
-def _adapt_variant_set_label_field__melted(variant_as_dict, project_uid,
-        reference_genome, alignment_group=None):
+def _adapt_variant_set_label_field__melted(variant_as_dict, root_href):
     # Build a dictionary of individual HTML string anchors mapped by label,
     # so we can sort it at the very end.
     variant_set_anchor_map = {}
@@ -302,7 +389,7 @@ def _adapt_variant_set_label_field__melted(variant_as_dict, project_uid,
 
         # This is the link to the variant set view.
         variant_set_href = _create_variant_set_analyze_view_link(
-                project_uid, uid, reference_genome, alignment_group)
+                root_href, uid)
 
         # If the variant set is for this sample, then it will be filled,
         # Otherwise, it will be outlined. Cast view always uses outline.
@@ -325,8 +412,7 @@ def _adapt_variant_set_label_field__melted(variant_as_dict, project_uid,
             [variant_set_anchor_map[i] for i in sorted_set_labels])
 
 
-def _adapt_variant_set_label_field__cast(variant_as_dict, project_uid,
-        reference_genome, alignment_group=None):
+def _adapt_variant_set_label_field__cast(variant_as_dict, root_href):
     # If there is an empty row (no ExperimentSample associated),
     # then all the counts will be off by one, so we need to decrement
     # them.
@@ -360,7 +446,7 @@ def _adapt_variant_set_label_field__cast(variant_as_dict, project_uid,
 
         # This is the link to the variant set view.
         variant_set_href = _create_variant_set_analyze_view_link(
-                project_uid, uid, reference_genome, alignment_group)
+                root_href, uid)
 
         # If the variant set is for this sample, then it will be filled,
         # Otherwise, it will be outlined. Cast view always uses outline.
@@ -387,14 +473,9 @@ def _adapt_variant_set_label_field__cast(variant_as_dict, project_uid,
             [variant_set_anchor_map[i] for i in sorted_set_labels])
 
 
-def _create_variant_set_analyze_view_link(project_uid, variant_set_uid,
-        reference_genome, alignment_group=None):
+def _create_variant_set_analyze_view_link(root_href, variant_set_uid):
     """Create link to Analyze view filtered by this variant set.
     """
-    reverse_args = [reference_genome.project.uid]
-    if alignment_group is not None:
-        reverse_args += [alignment_group.uid, 'variants']
-    root_href = reverse('main.views.tab_root_analyze', args=reverse_args)
     filter_part = '?filter=VARIANT_SET_UID=%s&melt=0' % (variant_set_uid,)
     return root_href + filter_part
 
@@ -688,8 +769,8 @@ def adapt_cast_object_list_field(cast_object_dict_list, fdict):
     # If bucketing, count each.
     elif fdict.get('format','bucket') is 'bucket':
         # Create string.
-        return (' | '.join(['%s (%d)' % (key, count)
-                for key, count in buckets.iteritems()]))
+        return (' | '.join(['%s (%d)' % (bucket_key, bucket_count)
+                for bucket_key, bucket_count in buckets.iteritems()]))
 
 
 def adapt_gene_list_to_frontend(obj_list, alignment_group):
@@ -31,6 +31,7 @@ Implementation Notes:
 
 from contextlib import contextmanager
 from datetime import datetime
+import glob
 import json
 import os
 import re
@@ -54,8 +55,10 @@ from model_utils import get_normalized_alt_representation
 from model_utils import make_choices_tuple
 from model_utils import JSONDataSubfieldsMixin
 from model_utils import UniqueUidModelMixin
+from model_utils import UUID_SIZE
 from model_utils import VisibleFieldMixin
 from utils import uppercase_underscore
+from utils.compressed_stream_util import open_decompressed
 from utils.genbank_util import generate_genbank_mobile_element_multifasta
 from variants.filter_key_map_constants import MAP_KEY__ALTERNATE
 from variants.filter_key_map_constants import MAP_KEY__COMMON_DATA
@@ -136,6 +139,8 @@ class Dataset(UniqueUidModelMixin):
         LUMPY_INSERT_METRICS_MEAN_STDEV = 'Lumpy Insert Metrics Mean Stdev'
         FASTQC1_HTML = 'FASTQC Forward HTML Output'
         FASTQC2_HTML = 'FASTQC Reverse HTML Output'
+        FASTQ1_PROFILE = 'FASTQ Forward Profile JSON'
+        FASTQ2_PROFILE = 'FASTQ Reverse Profile JSON'
         SEQUENCE_GRAPH_PICKLE = 'Pickled NetworkX Sequence Graph'
         MOBILE_ELEMENT_FASTA = 'Mobile Element Fasta'
         FEATURE_INDEX = 'Genbank Feature Index'
@@ -173,6 +178,8 @@ class Dataset(UniqueUidModelMixin):
                 'experimentsampletoalignment_set'),
         TYPE.FASTQC1_HTML: 'experimentsample_set',
         TYPE.FASTQC2_HTML: 'experimentsample_set',
+        TYPE.FASTQ1_PROFILE: 'experimentsample_set',
+        TYPE.FASTQ2_PROFILE: 'experimentsample_set',
     }
 
     # Human-readable identifier. Also used for JBrowse.
@@ -296,35 +303,28 @@ class Dataset(UniqueUidModelMixin):
 
 
     @contextmanager
-    def stream(self):
-        """
-        If dataset is compressed, return a named pipe that decompressed the
-        file, else just return the absolute location.
-        """
-
-        raise NotImplementedError
-        # Currently the below isn't working; the mkfifo blocks itself so I can't
-        # seem to read and write to it at the same time. For now, we've decided
-        # to go for process substitution in Bash (see wrap_if_compressed(),
-        # although this requires the use of Shell=True.
-
-        # dirname = tempfile.mkdtemp()
-        # p = None
-
-        # try:
-        #     if not self.is_compressed():
-        #         return self.get_absolute_location()
-
-        #     path = os.path.join(dirname, 'named_pipe')
-        #     os.mkfifo(path)
-        #     extension = os.path.splitext(self.filesystem_location)[1]
-        #     program = self.COMPRESSION_TYPES[extension]
-        #     with open(path, 'w') as wpipe:
-        #         p = Popen(program.append(path)) # write to path
-        #         return path
-        # finally:
-        #     shutil.rmtree(dirname)
-        #     if p: p.close()
+    def stream(self, num_threads=1, region=None):
+        """Yields a read-only file-like object over the decompressed contents
+        of the dataset, so that compressed datasets can be read directly
+        without decompressing them to a temporary file first.
+
+        gzip and bgzip files are decompressed in process. bgzip files can
+        also be decompressed with num_threads threads, seeked with
+        seek_virtual_offset(), or read for just a region if indexed with
+        tabix (see utils.compressed_stream_util.open_decompressed()). Other
+        formats are decompressed by their COMPRESSION_TYPES 'cat' program.
+        """
+        decompress_command = None
+        if self.is_compressed():
+            extension = os.path.splitext(self.filesystem_location)[1]
+            decompress_command = self.COMPRESSION_TYPES[extension]['cat']
+        stream = open_decompressed(self.get_absolute_location(),
+                num_threads=num_threads, region=region,
+                decompress_command=decompress_command)
+        try:
+            yield stream
+        finally:
+            stream.close()
 
     def get_related_model_set(self):
         return getattr(self, Dataset.TYPE_TO_RELATED_MODEL[self.type])
@@ -539,7 +539,9 @@ class ReferenceGenome(UniqueUidModelMixin):
     # Bit that indicates whether the materialized view is up to date.
     # This design decision puts a lot on the developer to remember to set this
     # false whenever any data changes that would require a refresh of the
-    # materialized view.
+    # materialized view. The view is partitioned per AlignmentGroup, each of
+    # which has its own bit, and this one covers the partition of Variants
+    # that are only in VariantSets.
     is_materialized_variant_view_valid = models.BooleanField(default=False)
 
     def __unicode__(self):
@@ -549,14 +551,14 @@ class ReferenceGenome(UniqueUidModelMixin):
     def num_chromosomes(self):
         """Number of Chromosomes belonging to the ReferenceGenome
         """
-        return len(Chromosome.objects.filter(reference_genome = self))
+        return len(self.chromosome_set.all())
 
     @property
     def num_bases(self):
         """Total number of bases of all Chromosomes belonging to
         the ReferenceGenome
         """
-        return sum([chrom.num_bases for chrom in Chromosome.objects.filter(reference_genome = self)])
+        return sum([chrom.num_bases for chrom in self.chromosome_set.all()])
 
     @property
     def href(self):
@@ -738,8 +740,13 @@ class ReferenceGenome(UniqueUidModelMixin):
         ]
 
     def invalidate_materialized_view(self):
+        """Marks every partition of the materialized view as needing a
+        rebuild. Use AlignmentGroup.invalidate_materialized_view() when only
+        the data of one AlignmentGroup changed.
+        """
         self.is_materialized_variant_view_valid = False
         self.save(update_fields=['is_materialized_variant_view_valid'])
+        self.alignmentgroup_set.update(is_materialized_variant_view_valid=False)
 
     def drop_materialized_view(self):
         """Deletes associated materialized view.
@@ -981,20 +988,24 @@ class ExperimentSample(UniqueUidModelMixin, JSONDataSubfieldsMixin):
         """The status of the data underlying this data.
         """
         status_string = 'NO_DATA'
-        fastq1_dataset_queryset = self.dataset_set.filter(
-                type=Dataset.TYPE.FASTQ1)
-        if len(fastq1_dataset_queryset) > 1:
+
+        # Filtered here rather than in the query, so that Datasets
+        # prefetched by the frontend adapter are used.
+        dataset_list = self.dataset_set.all()
+        fastq1_dataset_list = [dataset for dataset in dataset_list
+                if dataset.type == Dataset.TYPE.FASTQ1]
+        if len(fastq1_dataset_list) > 1:
             return 'ERROR: More than one forward reads source'
-        if len(fastq1_dataset_queryset) == 1:
-            status_string = 'FASTQ1: %s' % fastq1_dataset_queryset[0].status
+        if len(fastq1_dataset_list) == 1:
+            status_string = 'FASTQ1: %s' % fastq1_dataset_list[0].status
             # Maybe add reverse reads.
-            fastq2_dataset_queryset = self.dataset_set.filter(
-                    type=Dataset.TYPE.FASTQ2)
-            if len(fastq2_dataset_queryset) > 1:
+            fastq2_dataset_list = [dataset for dataset in dataset_list
+                    if dataset.type == Dataset.TYPE.FASTQ2]
+            if len(fastq2_dataset_list) > 1:
                 return 'ERROR: More than one reverse reads source'
-            if len(fastq2_dataset_queryset) == 1:
+            if len(fastq2_dataset_list) == 1:
                 status_string += (
-                        ' | FASTQ2:  %s' % fastq2_dataset_queryset[0].status)
+                        ' | FASTQ2:  %s' % fastq2_dataset_list[0].status)
         return status_string
 
     def __unicode__(self):
@@ -1013,11 +1024,17 @@ class ExperimentSample(UniqueUidModelMixin, JSONDataSubfieldsMixin):
                 Dataset.TYPE.FASTQC1_HTML,
                 Dataset.TYPE.FASTQC2_HTML], start=1)
 
+        # Uses Datasets prefetched by the frontend adapter, if any.
+        dataset_list = self.dataset_set.all()
+
         for read_num, fqc_dataset_type in fqc_dataset_types:
 
-            fastqc_dataset = get_dataset_with_type(self, fqc_dataset_type)
+            has_fastqc_dataset = any(
+                    dataset.type == fqc_dataset_type and
+                            not dataset.is_compressed()
+                    for dataset in dataset_list)
 
-            if not fastqc_dataset:
+            if not has_fastqc_dataset:
                 continue
 
             links.append(
@@ -1154,6 +1171,10 @@ class AlignmentGroup(UniqueUidModelMixin):
     status = models.CharField('Alignment Status',
             max_length=40, choices=STATUS_CHOICES, default=STATUS.NOT_STARTED)
 
+    # Bit that indicates whether this AlignmentGroup's partition of the
+    # ReferenceGenome's materialized variant view is up to date.
+    is_materialized_variant_view_valid = models.BooleanField(default=False)
+
     # Statuses that indicate the alignment pipeline is running.
     PIPELINE_IS_RUNNING_STATUSES = [
         STATUS.ALIGNING,
@@ -1163,6 +1184,20 @@ class AlignmentGroup(UniqueUidModelMixin):
     def __unicode__(self):
         return self.label
 
+    def invalidate_materialized_view(self):
+        """Marks only this AlignmentGroup's partition of the materialized
+        variant view as needing a rebuild.
+        """
+        self.is_materialized_variant_view_valid = False
+        self.save(update_fields=['is_materialized_variant_view_valid'])
+
+    def drop_materialized_view(self):
+        """Deletes this AlignmentGroup's partition of the materialized
+        variant view.
+        """
+        mvm = MeltedVariantMaterializedViewManager(self.reference_genome)
+        mvm.drop_partition(self)
+
     def get_model_data_root(self):
         """Get the root location for all data of this type in the project.
         """
@@ -1269,11 +1304,15 @@ class AlignmentGroup(UniqueUidModelMixin):
         vcf_dir = self.get_or_create_vcf_output_dir()
 
         # TODO(gleb): Support other error files.
-        error_file = os.path.join(vcf_dir, 'merge_variant_data.error')
-
-        if os.path.exists(error_file):
-            with open(error_file) as fh:
-                raw_data = fh.read()
+        # Each variant caller's merge writes its own error file.
+        error_file_list = sorted(glob.glob(
+                os.path.join(vcf_dir, 'merge_variant_data*.error')))
+
+        if error_file_list:
+            raw_data = ''
+            for error_file in error_file_list:
+                with open(error_file) as fh:
+                    raw_data += fh.read()
         else:
             raw_data = 'None'
         return raw_data
@@ -1292,6 +1331,16 @@ class ExperimentSampleToAlignment(UniqueUidModelMixin, JSONDataSubfieldsMixin):
 
     data = PostgresJsonField()
 
+    # Alignment metrics sampled from the alignment. Null until computed, and
+    # -1 if they couldn't be computed. Use
+    # pipeline.read_alignment.get_alignment_metrics() rather than reading
+    # these directly.
+    read_length = models.IntegerField(null=True, blank=True)
+
+    insert_size_mean = models.IntegerField(null=True, blank=True)
+
+    insert_size_stdev = models.IntegerField(null=True, blank=True)
+
     class ASSEMBLY_STATUS:
         """
         The status of an Assembly
@@ -1311,8 +1360,9 @@ class ExperimentSampleToAlignment(UniqueUidModelMixin, JSONDataSubfieldsMixin):
     def status(self):
         """The status of a running alignment job.
         """
-        alignment_datasets = self.dataset_set.filter(
-                type=Dataset.TYPE.BWA_ALIGN)
+        # Uses Datasets prefetched by the frontend adapter, if any.
+        alignment_datasets = [dataset for dataset in self.dataset_set.all()
+                if dataset.type == Dataset.TYPE.BWA_ALIGN]
         assert len(alignment_datasets) <= 1, (
                 "Expected only one alignment dataset.")
         if len(alignment_datasets) == 1:
@@ -1628,17 +1678,27 @@ class VariantAlternate(UniqueUidModelMixin, VisibleFieldMixin):
 
         Clients should use this rather than alt_value directly for reading.
         """
-        maybe_long_alt_regex_match = VariantAlternate.LONG_ALT_REGEX.match(
-                self.alt_value)
-        if maybe_long_alt_regex_match:
-            ref_genome = self.variant.reference_genome
-            hash_part = maybe_long_alt_regex_match.group('hash')
-            long_alt_path = get_long_alt_path(ref_genome, hash_part)
-            assert os.path.exists(long_alt_path)
-            with open(long_alt_path) as fh:
-                return fh.read().strip()
-        else:
-            return self.alt_value
+        if VariantAlternate.LONG_ALT_REGEX.match(self.alt_value):
+            return VariantAlternate.resolve_alt_value(
+                    self.variant.reference_genome, self.alt_value)
+        return self.alt_value
+
+    @classmethod
+    def resolve_alt_value(cls, ref_genome, alt_value):
+        """Returns the actual alt for a stored alt_value, reading the full
+        alt from disk for a long value.
+
+        For clients that read alt_value without loading the VariantAlternate,
+        e.g. with a raw query.
+        """
+        maybe_long_alt_regex_match = cls.LONG_ALT_REGEX.match(alt_value)
+        if not maybe_long_alt_regex_match:
+            return alt_value
+        hash_part = maybe_long_alt_regex_match.group('hash')
+        long_alt_path = get_long_alt_path(ref_genome, hash_part)
+        assert os.path.exists(long_alt_path)
+        with open(long_alt_path) as fh:
+            return fh.read().strip()
 
     def __unicode__(self):
         actual_alt_value = self.actual_alt
@@ -1913,6 +1973,40 @@ class S3File(Model):
         return unicode(self.url())
 
 
+class StatusEvent(Model):
+    """A status transition of a pipeline entity, e.g. an AlignmentGroup
+    finishing or a Dataset starting to compute.
+
+    Browsers showing the Project poll for the events after the last one
+    they've seen, so the ids act as the cursor. See main/status_events.py.
+    """
+    project = models.ForeignKey('Project')
+
+    # Class name and uid of the entity whose status changed.
+    model_name = models.CharField(max_length=40)
+    uid = models.CharField(max_length=UUID_SIZE)
+
+    # For Datasets, the uid of the entity the Dataset belongs to, e.g. the
+    # ExperimentSample for a FASTQ1 Dataset.
+    parent_uid = models.CharField(max_length=UUID_SIZE, blank=True)
+
+    # Name of the status field, and its new value.
+    field = models.CharField(max_length=40)
+    value = models.CharField(max_length=40)
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'modelName': self.model_name,
+            'uid': self.uid,
+            'parentUid': self.parent_uid,
+            'field': self.field,
+            'value': self.value
+        }
+
+
 def get_or_create_derived_bam_dataset(sample_alignment, dataset_type,
         derivation_fn, force_rerun=False):
     """Gets or creates a new bam Dataset derived according to a provided function.
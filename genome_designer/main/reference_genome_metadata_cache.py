@@ -0,0 +1,88 @@
+"""
+Versioned cache of per-ReferenceGenome metadata.
+
+Every request for the Variants table needs a handful of things derived from
+the ReferenceGenome (e.g. the JBrowse track names and the AlignmentGroup
+used for links) that only change when new data is added to the
+ReferenceGenome. Rather than recomputing these on every request, we cache
+them keyed by a per-ReferenceGenome version string.
+
+Any change to the underlying metadata (a new VCF updating the variant key
+map, a new JBrowse track, a new AlignmentGroup) should call
+invalidate_reference_genome_metadata(), which replaces the version so that all
+previously cached entries are ignored from then on. The version is also sent
+to the frontend so that it only needs to be sent the variant key map again
+when it has changed.
+
+The cache backend is the one configured under the
+settings.REFERENCE_GENOME_METADATA_CACHE alias. The default is local memory,
+which means invalidations made in another process (e.g. a celery worker)
+are only observed once the entries time out. Deployments with more than one
+process should point the alias at a shared Memcached or Redis backend.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+CACHE_KEY_PREFIX = 'ref_genome_metadata'
+
+# Names of the cached metadata entries.
+METADATA_KEY__JBROWSE_TRACK_NAMES = 'jbrowse_track_names'
+METADATA_KEY__ALIGNMENT_GROUPS = 'alignment_groups'
+
+
+def _get_cache():
+    return get_cache(settings.REFERENCE_GENOME_METADATA_CACHE)
+
+
+def _get_version_cache_key(reference_genome_uid):
+    return '%s:%s:version' % (CACHE_KEY_PREFIX, reference_genome_uid)
+
+
+def _get_entry_cache_key(reference_genome_uid, version, name):
+    return '%s:%s:%s:%s' % (CACHE_KEY_PREFIX, reference_genome_uid, version,
+            name)
+
+
+def get_reference_genome_metadata_version(reference_genome):
+    """Returns the current metadata version string for the ReferenceGenome,
+    creating one if none exists.
+    """
+    cache = _get_cache()
+    version_key = _get_version_cache_key(reference_genome.uid)
+    version = cache.get(version_key)
+    if version is None:
+        # add() is a no-op if another request beat us to it, in which case
+        # we want to use their version.
+        cache.add(version_key, uuid.uuid4().hex,
+                settings.REFERENCE_GENOME_METADATA_CACHE_TIMEOUT)
+        version = cache.get(version_key)
+    return version
+
+
+def invalidate_reference_genome_metadata(reference_genome):
+    """Invalidates all cached metadata for the ReferenceGenome.
+
+    The version is replaced rather than the entries deleted, so stale entries
+    are never read again and simply expire.
+    """
+    _get_cache().set(_get_version_cache_key(reference_genome.uid),
+            uuid.uuid4().hex, settings.REFERENCE_GENOME_METADATA_CACHE_TIMEOUT)
+
+
+def get_cached_reference_genome_metadata(reference_genome, name, compute_fn):
+    """Returns the named metadata entry for the ReferenceGenome, calling
+    compute_fn(reference_genome) to populate the cache if necessary.
+    """
+    cache = _get_cache()
+    version = get_reference_genome_metadata_version(reference_genome)
+    entry_key = _get_entry_cache_key(reference_genome.uid, version, name)
+    value = cache.get(entry_key)
+    if value is None:
+        value = compute_fn(reference_genome)
+        cache.set(entry_key, value,
+                settings.REFERENCE_GENOME_METADATA_CACHE_TIMEOUT)
+    return value
@@ -1,31 +1,39 @@
 from django.conf import settings
 import logging
-import hashlib
 import os
 from models import Project
 from functools import wraps
 from contextlib import contextmanager
 import tempfile
+from s3_sync import sync_down
+from s3_sync import sync_up
+from s3_sync import BotoBucketStore
 
 logger = logging.getLogger('s3')
 
 if not settings.S3_ENABLED:
     logger.debug("Set settings.S3_ENABLED to True to enable S3 persistance")
 
-def calc_file_md5(filepath):
-    md5 = hashlib.md5()
-    with open(filepath,'rb') as f: 
-        for chunk in iter(lambda: f.read(128*md5.block_size), b''): 
-            md5.update(chunk)
-    return md5.hexdigest()
-
-def project_files_needed(func):
+def project_files_needed(func=None, paths=None):
     """A decorator function to wrap function to make sure the availability and
     persistance of project files for the period of function execution.
 
+    By default all the project files are fetched. To fetch only the files the
+    function needs, pass paths, a function called with the same arguments as
+    the decorated function that returns the list of files and directories
+    needed, either absolute or relative to the project data dir:
+
+        @project_files_needed(paths=lambda alignment_group: [
+                alignment_group.reference_genome.get_model_data_dir()])
+        def f(alignment_group):
+            ...
+
     NOTE: Either 1st argument or kwargs['project'] of function 
           must be models.Project instance
     """
+    if func is None:
+        return lambda func: project_files_needed(func, paths=paths)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         try:
@@ -39,12 +47,30 @@ def project_files_needed(func):
             del kwargs['project']
 
         assert isinstance(project, Project)
-        with project_s3_persisted(project):
+        relpath_list = None
+        if paths is not None:
+            relpath_list = [
+                    os.path.relpath(path, project.get_model_data_dir())
+                    if os.path.isabs(path) else path
+                    for path in paths(*args, **kwargs)]
+        with project_s3_persisted(project, relpath_list=relpath_list):
             return func(*args, **kwargs)
     return wrapper
 
+def no_project_files(*args, **kwargs):
+    """For use as the paths of project_files_needed() by functions that only
+    create project files.
+    """
+    return []
+
 @contextmanager
-def project_s3_persisted(project):
+def project_s3_persisted(project, relpath_list=None):
+    """Syncs the project data dir from S3 on entry and back to S3 on exit.
+
+    Only files that changed are transferred. If relpath_list is given, only
+    those files and directories, relative to the project data dir, are
+    fetched.
+    """
     project = project
     assert isinstance(project, Project)
     call_s3_put = False
@@ -52,7 +78,8 @@ def project_s3_persisted(project):
     if project.is_s3_backed():
         if settings.S3_ENABLED:
             call_s3_put = True
-            s3_get_directory(project.get_s3_model_data_dir(), project.get_model_data_dir())
+            s3_get_directory(project.get_s3_model_data_dir(),
+                    project.get_model_data_dir(), relpath_list=relpath_list)
         else:
             logger.warning("%r.is_s3_backed() is True but S3 is disabled globally." % project)
 
@@ -85,24 +112,15 @@ if settings.S3_ENABLED:
     S3 = S3Connection(settings.AWS_SERVER_PUBLIC_KEY, settings.AWS_SERVER_SECRET_KEY)
     aws_bucket = S3.get_bucket(settings.S3_BUCKET)
 
-    def s3_get_directory(s3_dir, local_dir):
+    def s3_get_directory(s3_dir, local_dir, relpath_list=None):
         logger.info("Getting s3://%s/%s to file://%s" % (
             aws_bucket.name, s3_dir, os.path.abspath(local_dir)) +
                 " (DRY RUN)" if settings.S3_DRY_RUN else "")
-        rs = aws_bucket.list(s3_dir)
 
         if not settings.S3_DRY_RUN:
-            for key in rs:
-                relpath = os.path.relpath(key.name, s3_dir)
-                filepath = os.path.join(local_dir, relpath)
-                directory = os.path.dirname(filepath)
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-
-                if os.path.isfile(filepath):
-                    if key.etag.strip("\"") == calc_file_md5(filepath):
-                        continue  # already fetched.
-                key.get_contents_to_filename(filepath)
+            fetched = sync_down(BotoBucketStore(aws_bucket), s3_dir,
+                    local_dir, relpath_list=relpath_list)
+            logger.info("Fetched %d changed files" % len(fetched))
 
     def s3_put_directory(s3_dir, local_dir):
         logger.info("Putting file://%s to s3://%s/%s" % (
@@ -110,22 +128,9 @@ if settings.S3_ENABLED:
                 " (DRY RUN)" if settings.S3_DRY_RUN else "")
 
         if not settings.S3_DRY_RUN:
-            for dirname, dirnames, filenames in os.walk(local_dir):
-                for filename in filenames:
-                    if filename == ".DS_Store":
-                        continue
-                    filepath = os.path.join(dirname, filename)
-                    relpath = os.path.relpath(filepath, local_dir)
-                    key = os.path.join(s3_dir, relpath)
-                    aws_key = aws_bucket.get_key(key)
-                    if aws_key:
-                        # assume the content of file did not change if md5 hashes are consistent.
-                        if aws_key.etag.strip("\"") == calc_file_md5(filepath):
-                            continue
-                    else:
-                        aws_key = Key(aws_bucket, key)
-                    aws_key.set_contents_from_filename(filepath)
-                    aws_key.set_acl('public-read')
+            put = sync_up(BotoBucketStore(aws_bucket, acl='public-read'),
+                    s3_dir, local_dir)
+            logger.info("Put %d changed files" % len(put))
 
     def s3_delete(key):
         logging.info("Deleting s3://%s/%s" % (aws_bucket.name, key.name))
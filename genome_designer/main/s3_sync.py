@@ -0,0 +1,424 @@
+"""
+Incremental, manifest-based sync of a local directory with a remote store.
+
+Each synced directory has a manifest, a json file mapping the path of every
+file, relative to the directory, to its size, mtime and md5. A copy of the
+manifest is kept on each side:
+
+    * The local manifest lets us skip re-computing the md5 of files whose
+      size and mtime haven't changed since they were last synced, so that a
+      task that touched one file doesn't hash every BAM in the project.
+    * The remote manifest lets us decide what to transfer without a request
+      per key. It also holds the md5 of files uploaded in multiple parts,
+      whose S3 ETag isn't an md5.
+
+Only files whose md5 differs are transferred. Files are transferred in
+parallel, and large files are uploaded in parts in parallel and downloaded
+with parallel ranged requests.
+
+The remote side is a store object with a small interface, implemented for a
+boto bucket (BotoBucketStore) and a local directory (LocalDirectoryStore).
+The latter is used in tests and can stand in for S3.
+"""
+
+import json
+import logging
+import math
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+from main.model_utils import ADVISORY_LOCK_NAMESPACE__S3_MANIFEST
+from main.model_utils import advisory_lock
+from utils import calc_file_md5
+
+
+logger = logging.getLogger('s3')
+
+MANIFEST_FILENAME = '.s3_manifest.json'
+
+# Files never synced.
+IGNORED_FILENAMES = set([MANIFEST_FILENAME, '.DS_Store'])
+
+
+def _run_in_parallel(fn, arg_list, num_threads=None):
+    """Calls fn on each of arg_list with a pool of threads. Exceptions raised
+    by fn are re-raised.
+    """
+    if num_threads is None:
+        num_threads = settings.S3_SYNC_NUM_THREADS
+    num_threads = min(num_threads, len(arg_list))
+    if num_threads <= 1:
+        return map(fn, arg_list)
+    pool = ThreadPool(num_threads)
+    try:
+        return pool.map(fn, arg_list)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _matches_relpath_list(relpath, relpath_list):
+    """Returns True if relpath is one of relpath_list or in a directory in
+    relpath_list. A relpath_list of None matches everything.
+    """
+    if relpath_list is None:
+        return True
+    for path in relpath_list:
+        path = path.rstrip('/')
+        if path in ('', '.') or relpath == path or relpath.startswith(
+                path + '/'):
+            return True
+    return False
+
+
+###############################################################################
+# Manifests
+###############################################################################
+
+def read_manifest_file(manifest_path):
+    """Returns the manifest stored at manifest_path, or an empty manifest if
+    there isn't one.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path) as fh:
+            return json.load(fh)
+    except ValueError:
+        logger.warning("Ignoring corrupt manifest %s" % manifest_path)
+        return {}
+
+
+def write_manifest_file(manifest_path, manifest):
+    """Writes the manifest atomically, so that concurrent readers never see
+    a partial file.
+    """
+    manifest_dir = os.path.dirname(manifest_path)
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    fd, temp_path = tempfile.mkstemp(dir=manifest_dir,
+            prefix=MANIFEST_FILENAME)
+    with os.fdopen(fd, 'w') as fh:
+        json.dump(manifest, fh)
+    os.rename(temp_path, manifest_path)
+
+
+def build_local_manifest(local_dir, previous_manifest=None,
+        relpath_list=None):
+    """Returns the manifest of the files in local_dir.
+
+    The md5 of a file is re-used from previous_manifest when its size and
+    mtime are unchanged.
+
+    If relpath_list is given, only those files and directories are visited,
+    and the entries of previous_manifest for the rest are kept as they are.
+    """
+    if previous_manifest is None:
+        previous_manifest = {}
+
+    manifest = {}
+    if relpath_list is not None:
+        manifest.update(dict((relpath, entry) for relpath, entry
+                in previous_manifest.iteritems()
+                if not _matches_relpath_list(relpath, relpath_list)))
+
+    for dirname, dirnames, filenames in os.walk(local_dir):
+        for filename in filenames:
+            if (filename in IGNORED_FILENAMES or
+                    filename.startswith(MANIFEST_FILENAME)):
+                continue
+            filepath = os.path.join(dirname, filename)
+            relpath = os.path.relpath(filepath, local_dir)
+            if not _matches_relpath_list(relpath, relpath_list):
+                continue
+
+            stat = os.stat(filepath)
+            previous_entry = previous_manifest.get(relpath)
+            if (previous_entry is not None and
+                    previous_entry['size'] == stat.st_size and
+                    previous_entry.get('mtime') == stat.st_mtime):
+                md5 = previous_entry['md5']
+            else:
+                md5 = calc_file_md5(filepath)
+            manifest[relpath] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'md5': md5,
+            }
+    return manifest
+
+
+def _get_remote_manifest_key(remote_dir):
+    return os.path.join(remote_dir, MANIFEST_FILENAME)
+
+
+def get_remote_manifest(store, remote_dir):
+    """Returns the manifest of remote_dir in the store.
+
+    Directories synced before manifests existed have none, in which case one
+    is built from a listing of the store.
+    """
+    manifest_string = store.get_string(_get_remote_manifest_key(remote_dir))
+    if manifest_string is not None:
+        return json.loads(manifest_string)
+
+    manifest = {}
+    for key_name, entry in store.list_files(remote_dir).iteritems():
+        relpath = os.path.relpath(key_name, remote_dir)
+        if os.path.basename(relpath) in IGNORED_FILENAMES:
+            continue
+        manifest[relpath] = entry
+    return manifest
+
+
+###############################################################################
+# Sync
+###############################################################################
+
+def sync_down(store, remote_dir, local_dir, relpath_list=None):
+    """Fetches the files in remote_dir that are missing or different in
+    local_dir.
+
+    Args:
+        store: Store holding remote_dir.
+        remote_dir: Key prefix of the directory in the store.
+        local_dir: Local directory to sync to.
+        relpath_list: If given, only these files and directories, relative to
+            local_dir, are fetched.
+
+    Returns:
+        List of the relative paths of the files fetched.
+    """
+    remote_manifest = get_remote_manifest(store, remote_dir)
+    local_manifest_path = os.path.join(local_dir, MANIFEST_FILENAME)
+    local_manifest = build_local_manifest(local_dir,
+            read_manifest_file(local_manifest_path),
+            relpath_list=relpath_list)
+
+    fetch_relpath_list = [relpath for relpath, entry
+            in remote_manifest.iteritems()
+            if _matches_relpath_list(relpath, relpath_list) and
+                    local_manifest.get(relpath, {}).get('md5') !=
+                            entry.get('md5')]
+
+    def _fetch(relpath):
+        filepath = os.path.join(local_dir, relpath)
+        directory = os.path.dirname(filepath)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another thread.
+                pass
+        store.get_file(os.path.join(remote_dir, relpath), filepath)
+
+    _run_in_parallel(_fetch, fetch_relpath_list)
+
+    for relpath in fetch_relpath_list:
+        stat = os.stat(os.path.join(local_dir, relpath))
+        md5 = remote_manifest[relpath].get('md5')
+        if md5 is None:
+            md5 = calc_file_md5(os.path.join(local_dir, relpath))
+        local_manifest[relpath] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'md5': md5,
+        }
+    write_manifest_file(local_manifest_path, local_manifest)
+
+    return fetch_relpath_list
+
+
+def sync_up(store, remote_dir, local_dir):
+    """Puts the files in local_dir that changed since they were last synced
+    and are missing or different in remote_dir, and updates the remote
+    manifest.
+
+    Remote files that don't exist locally are left alone, since the local
+    directory may only have the files a task needed. Local files that are
+    unchanged since the last sync are left alone too, since they may be stale
+    copies of files other tasks have since updated remotely.
+
+    Tasks for the same project may sync up concurrently, so the remote
+    manifest is updated under an advisory lock on remote_dir.
+
+    Returns:
+        List of the relative paths of the files put.
+    """
+    local_manifest_path = os.path.join(local_dir, MANIFEST_FILENAME)
+    previous_local_manifest = read_manifest_file(local_manifest_path)
+    local_manifest = build_local_manifest(local_dir, previous_local_manifest)
+    remote_manifest = get_remote_manifest(store, remote_dir)
+
+    put_relpath_list = [relpath for relpath, entry
+            in local_manifest.iteritems()
+            if previous_local_manifest.get(relpath, {}).get('md5') !=
+                    entry['md5'] and
+                    remote_manifest.get(relpath, {}).get('md5') !=
+                            entry['md5']]
+
+    def _put(relpath):
+        store.put_file(os.path.join(local_dir, relpath),
+                os.path.join(remote_dir, relpath))
+
+    _run_in_parallel(_put, put_relpath_list)
+
+    if put_relpath_list:
+        # Re-read the remote manifest under the lock so that concurrent
+        # tasks' entries aren't lost.
+        with advisory_lock(ADVISORY_LOCK_NAMESPACE__S3_MANIFEST, remote_dir):
+            remote_manifest = get_remote_manifest(store, remote_dir)
+            for relpath in put_relpath_list:
+                remote_manifest[relpath] = {
+                    'size': local_manifest[relpath]['size'],
+                    'md5': local_manifest[relpath]['md5'],
+                }
+            store.put_string(_get_remote_manifest_key(remote_dir),
+                    json.dumps(remote_manifest))
+    write_manifest_file(local_manifest_path, local_manifest)
+
+    return put_relpath_list
+
+
+###############################################################################
+# Stores
+###############################################################################
+
+class LocalDirectoryStore(object):
+    """Store backed by a local directory, with key names as paths relative to
+    it.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def _get_path(self, key_name):
+        return os.path.join(self.root_dir, key_name)
+
+    def _ensure_parent_dir_exists(self, path):
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another thread.
+                pass
+
+    def get_string(self, key_name):
+        path = self._get_path(key_name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as fh:
+            return fh.read()
+
+    def put_string(self, key_name, content):
+        path = self._get_path(key_name)
+        self._ensure_parent_dir_exists(path)
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+    def list_files(self, prefix):
+        files = {}
+        for dirname, dirnames, filenames in os.walk(self._get_path(prefix)):
+            for filename in filenames:
+                path = os.path.join(dirname, filename)
+                files[os.path.relpath(path, self.root_dir)] = {
+                    'size': os.path.getsize(path),
+                    'md5': calc_file_md5(path),
+                }
+        return files
+
+    def get_file(self, key_name, path):
+        shutil.copyfile(self._get_path(key_name), path)
+
+    def put_file(self, path, key_name):
+        dest = self._get_path(key_name)
+        self._ensure_parent_dir_exists(dest)
+        shutil.copyfile(path, dest)
+
+
+class BotoBucketStore(object):
+    """Store backed by a boto S3 bucket.
+
+    Files larger than settings.S3_MULTIPART_THRESHOLD are uploaded in parts
+    and downloaded in ranges, settings.S3_MULTIPART_PART_SIZE bytes each, in
+    parallel.
+    """
+
+    def __init__(self, bucket, acl=None):
+        self.bucket = bucket
+        self.acl = acl
+
+    def get_string(self, key_name):
+        key = self.bucket.get_key(key_name)
+        if key is None:
+            return None
+        return key.get_contents_as_string()
+
+    def put_string(self, key_name, content):
+        from boto.s3.key import Key
+        Key(self.bucket, key_name).set_contents_from_string(content)
+
+    def list_files(self, prefix):
+        files = {}
+        for key in self.bucket.list(prefix):
+            etag = key.etag.strip('"')
+            files[key.name] = {
+                'size': key.size,
+                # The ETag of a multipart upload isn't an md5.
+                'md5': etag if '-' not in etag else None,
+            }
+        return files
+
+    def get_file(self, key_name, path):
+        key = self.bucket.get_key(key_name)
+        if key.size <= settings.S3_MULTIPART_THRESHOLD:
+            key.get_contents_to_filename(path)
+            return
+
+        part_size = settings.S3_MULTIPART_PART_SIZE
+        with open(path, 'wb') as fh:
+            fh.truncate(key.size)
+
+        def _get_range(range_start):
+            range_end = min(range_start + part_size, key.size) - 1
+            range_key = self.bucket.get_key(key_name)
+            with open(path, 'r+b') as fh:
+                fh.seek(range_start)
+                range_key.get_contents_to_file(fh, headers={
+                    'Range': 'bytes=%d-%d' % (range_start, range_end)})
+
+        _run_in_parallel(_get_range, range(0, key.size, part_size))
+
+    def put_file(self, path, key_name):
+        from boto.s3.key import Key
+        size = os.path.getsize(path)
+        if size <= settings.S3_MULTIPART_THRESHOLD:
+            Key(self.bucket, key_name).set_contents_from_filename(path)
+        else:
+            self._put_file_multipart(path, key_name, size)
+        if self.acl is not None:
+            self.bucket.set_acl(self.acl, key_name)
+
+    def _put_file_multipart(self, path, key_name, size):
+        part_size = settings.S3_MULTIPART_PART_SIZE
+        num_parts = int(math.ceil(float(size) / part_size))
+        multipart_upload = self.bucket.initiate_multipart_upload(key_name)
+
+        def _put_part(part_idx):
+            offset = part_idx * part_size
+            with open(path, 'rb') as fh:
+                fh.seek(offset)
+                multipart_upload.upload_part_from_file(fh, part_idx + 1,
+                        size=min(part_size, size - offset))
+
+        try:
+            _run_in_parallel(_put_part, range(num_parts))
+            multipart_upload.complete_upload()
+        except Exception:
+            multipart_upload.cancel_upload()
+            raise
@@ -8,13 +8,20 @@ import os
 import shutil
 
 from Bio import SeqIO
+from celery.signals import task_postrun
+from celery.signals import task_prerun
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
 from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_init
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_delete
 from django.db.models.signals import post_delete
 
+from dataset_registry import close_dataset_registry
+from dataset_registry import invalidate_dataset
+from dataset_registry import invalidate_entity_datasets
+from dataset_registry import open_dataset_registry
 from models import AlignmentGroup
 from models import Contig
 from models import Dataset
@@ -26,6 +33,9 @@ from models import UserProfile
 from models import VariantEvidence
 from models import VariantSet
 from models import VariantToVariantSet
+from reference_genome_metadata_cache import invalidate_reference_genome_metadata
+from status_events import get_dataset_parent
+from status_events import publish_status_event
 from utils.import_util import prepare_ref_genome_related_datasets
 from utils.import_util import add_chromosomes
 from utils.import_util import sanitize_sequence_dataset
@@ -91,8 +101,9 @@ def post_contig_delete(sender, instance, **kwargs):
         return
 
     # If this is last VariantCallerCommonData for Variant, delete the whole
-    # Variant.
-    vccd.variant.reference_genome.invalidate_materialized_view()
+    # Variant. Deleting the Variant's VariantToVariantSets invalidates the
+    # rest of the materialized view if needed.
+    vccd.alignment_group.invalidate_materialized_view()
     if vccd.variant.variantcallercommondata_set.count() == 1:
         vccd.variant.delete()
     else:
@@ -126,6 +137,55 @@ pre_delete.connect(pre_ref_genome_delete, sender=ReferenceGenome,
         dispatch_uid='ref_genome_delete')
 
 
+# Keep the dataset registry (see dataset_registry.py) in sync. These are
+# connected before the handlers below that look up Datasets on an entity that
+# a Dataset was just added to.
+DATASET_ENTITY_MODELS = [AlignmentGroup, Contig, ExperimentSample,
+        ExperimentSampleToAlignment, ReferenceGenome, VariantSet]
+
+
+def entity_datasets_changed(sender, instance, action, reverse, model, pk_set,
+        **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_entity_datasets(type(instance), [instance.pk])
+    elif pk_set is not None:
+        # Entities added to or removed from the Dataset's side.
+        invalidate_entity_datasets(model, pk_set)
+    else:
+        invalidate_dataset(instance)
+
+for entity_model in DATASET_ENTITY_MODELS:
+    m2m_changed.connect(entity_datasets_changed,
+            sender=entity_model.dataset_set.through,
+            dispatch_uid='dataset_registry_' + entity_model.__name__)
+
+
+def post_dataset_save(sender, instance, **kwargs):
+    invalidate_dataset(instance, keep_if_registered=True)
+post_save.connect(post_dataset_save, sender=Dataset,
+        dispatch_uid='dataset_registry_dataset_save')
+
+
+def post_dataset_delete(sender, instance, **kwargs):
+    invalidate_dataset(instance)
+post_delete.connect(post_dataset_delete, sender=Dataset,
+        dispatch_uid='dataset_registry_dataset_delete')
+
+
+# Each celery task gets its own dataset registry.
+def pre_task_run(**kwargs):
+    open_dataset_registry()
+task_prerun.connect(pre_task_run, dispatch_uid='dataset_registry_task_prerun')
+
+
+def post_task_run(**kwargs):
+    close_dataset_registry()
+task_postrun.connect(post_task_run,
+        dispatch_uid='dataset_registry_task_postrun')
+
+
 def post_add_seq_to_ref_genome(sender, instance, **kwargs):
     """When a dataset gets added to a ref_genome, we need generate some
     additional data via prepare_ref_genome_related_datasets().
@@ -247,13 +307,15 @@ def post_alignment_group_create(sender, instance, created, **kwargs):
     '''
     if created:
         instance.ensure_model_data_dir_exists()
+        invalidate_reference_genome_metadata(instance.reference_genome)
 post_save.connect(post_alignment_group_create, sender=AlignmentGroup,
         dispatch_uid='alignment_group_create')
 
 
 def pre_alignment_group_delete(sender, instance, **kwargs):
     instance.delete_model_data_dir()
-    instance.reference_genome.drop_materialized_view()
+    instance.drop_materialized_view()
+    invalidate_reference_genome_metadata(instance.reference_genome)
 pre_delete.connect(pre_alignment_group_delete, sender=AlignmentGroup,
         dispatch_uid='alignment_group_delete')
 
@@ -288,3 +350,46 @@ def pre_dataset_delete(sender, instance, **kwargs):
     instance.delete_underlying_data()
 pre_delete.connect(pre_dataset_delete, sender=Dataset,
         dispatch_uid='user_profile_create')
+
+
+# Status fields whose transitions are published as StatusEvents.
+STATUS_EVENT_FIELDS = {
+    Dataset: 'status',
+    AlignmentGroup: 'status',
+    ExperimentSampleToAlignment: 'assembly_status',
+}
+
+
+def _get_status_event_value(instance):
+    """Returns the published status of the instance, or None if it isn't
+    loaded.
+    """
+    # Read from __dict__ so that deferred fields aren't fetched.
+    if isinstance(instance, ExperimentSampleToAlignment):
+        return (instance.__dict__.get('data') or {}).get('assembly_status')
+    return instance.__dict__.get('status')
+
+
+def post_status_model_init(sender, instance, **kwargs):
+    instance._status_event_value = _get_status_event_value(instance)
+
+
+def post_status_model_save(sender, instance, created, **kwargs):
+    value = _get_status_event_value(instance)
+    if value is None or value == instance._status_event_value:
+        return
+    instance._status_event_value = value
+
+    parent = None
+    if isinstance(instance, Dataset):
+        parent = get_dataset_parent(instance)
+        if parent is None:
+            return
+    publish_status_event(instance, STATUS_EVENT_FIELDS[sender], value,
+            parent=parent)
+
+for status_model in STATUS_EVENT_FIELDS:
+    post_init.connect(post_status_model_init, sender=status_model,
+            dispatch_uid='status_event_init_' + status_model.__name__)
+    post_save.connect(post_status_model_save, sender=status_model,
+            dispatch_uid='status_event_save_' + status_model.__name__)
@@ -8,6 +8,11 @@ gd.AlignmentListView = Backbone.View.extend({
 
   initialize: function() {
     this.render();
+
+    // Redraw when an alignment changes status, e.g. finishes.
+    this.statusEventStream = new gd.StatusEventStream(this.model.get('uid'));
+    this.listenTo(this.statusEventStream, 'STATUS_EVENTS',
+        _.bind(this.handleStatusEvents, this));
   },
 
   render: function() {
@@ -39,10 +44,11 @@ gd.AlignmentListView = Backbone.View.extend({
 
     this.listenTo(this.controlsComponent, 'MODELS_UPDATED',
         _.bind(this.redrawDatatable, this));
+  },
 
-    // Decide whether to set timeout on redraw.
-    if (this.datatableComponent.clientShouldRefresh) {
-      window.setTimeout(_.bind(this.redrawDatatable, this), 5000);
+  handleStatusEvents: function(events) {
+    if (_.findWhere(events, {modelName: 'AlignmentGroup'})) {
+      this.redrawDatatable();
     }
   }
 });
@@ -87,6 +87,13 @@ gd.AlignmentView = Backbone.View.extend({
         '</span>');
     }
 
+    // Draw 'Timings' link to the per-stage pipeline telemetry.
+    var telemetryUrl = window.location.href + '/telemetry';
+    $('#gd-ag-controls-toolbar').append(
+      '<span class="gd-ag-error-log-text">' +
+        '<a href="' + telemetryUrl + '">Timings</a>' +
+      '</span>');
+
     /** Dropdown options. */
     this.controlsComponent = new gd.AlignmentViewControlsComponent({
       // el: '#gd-sample-list-view-datatable-hook-control',
@@ -8,7 +8,9 @@ gd.ProjectView = Backbone.View.extend({
 
   events: {
     'click #gd-projects-delete-btn': 'handleDeleteClick',
-    'click #gd-projects-export-btn': 'handleExportClick'
+    'click #gd-projects-export-btn': 'handleExportClick',
+    'click #gd-projects-export-without-indexes-btn':
+        'handleExportWithoutIndexesClick'
   },
 
   handleDeleteClick: function() {
@@ -27,28 +29,22 @@ gd.ProjectView = Backbone.View.extend({
   },
 
   handleExportClick: function() {
-    var data = {
-      'project_uid': this.model.get('uid')
-    };
-
-    // UI affordance.
-    $('#gd-projects-export-btn').addClass('disabled');
-    this.setUIStartLoadingState();
-
-    $.get('/_/projects/export', data, _.bind(function(responseData) {
-      this.setUIDoneLoadingState();
-      window.location.href = responseData.downloadUrl;
-    }, this));
+    this.exportProject(false);
   },
 
-  /** Show loading feedback while loading. */
-  setUIStartLoadingState: function() {
-    this.loadingSpinner = new gd.Spinner();
-    this.loadingSpinner.spin()
+  handleExportWithoutIndexesClick: function() {
+    this.exportProject(true);
   },
 
-  /** Reset UI changes after loading complete.. */
-  setUIDoneLoadingState: function() {
-    gd.Spinner.globalClear();
+  /**
+   * Downloads the project as a zip, which the server streams as it's
+   * generated.
+   */
+  exportProject: function(excludeRegenerable) {
+    var data = {
+      'project_uid': this.model.get('uid'),
+      'exclude_regenerable': excludeRegenerable ? 1 : 0
+    };
+    window.location.href = '/_/projects/export?' + $.param(data);
   }
 });
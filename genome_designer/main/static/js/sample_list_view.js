@@ -12,6 +12,12 @@ gd.SampleListView = Backbone.View.extend({
     this.samplesControlComponent = null;
 
     this.render();
+
+    // Redraw when a sample's files change status, e.g. finish uploading or
+    // being profiled.
+    this.statusEventStream = new gd.StatusEventStream(this.model.get('uid'));
+    this.listenTo(this.statusEventStream, 'STATUS_EVENTS',
+        _.bind(this.handleStatusEvents, this));
   },
 
   render: function() {
@@ -50,5 +56,11 @@ gd.SampleListView = Backbone.View.extend({
 
     this.listenTo(this.samplesControlComponent, 'MODELS_UPDATED',
         _.bind(this.redrawDatatable, this));
+  },
+
+  handleStatusEvents: function(events) {
+    if (_.findWhere(events, {modelName: 'Dataset'})) {
+      this.redrawDatatable();
+    }
   }
 });
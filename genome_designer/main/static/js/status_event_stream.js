@@ -0,0 +1,60 @@
+/**
+ * @fileoverview Polls the server for pipeline status transitions in a
+ *     Project (e.g. an alignment finishing), so that views can redraw when
+ *     something changes rather than re-fetching their tables on a timer.
+ *     Polls are cheap and return straight away.
+ *
+ *     Triggers 'STATUS_EVENTS' with the list of new events, each with keys
+ *     modelName, uid, parentUid, field and value.
+ */
+
+
+gd.StatusEventStream = function(projectUid) {
+  this.projectUid = projectUid;
+
+  // Id of the last event seen. Null until the first response, which returns
+  // the current cursor straight away.
+  this.cursor = null;
+
+  this.stopped = false;
+
+  this.poll();
+};
+
+
+_.extend(gd.StatusEventStream.prototype, Backbone.Events, {
+  /** Milliseconds to wait between polls. */
+  POLL_INTERVAL_MS: 3000,
+
+  /** Milliseconds to wait before retrying after a failed request. */
+  RETRY_DELAY_MS: 5000,
+
+  poll: function() {
+    if (this.stopped) {
+      return;
+    }
+
+    var requestData = {projectUid: this.projectUid};
+    if (this.cursor !== null) {
+      requestData.cursor = this.cursor;
+    }
+
+    var jqxhr = $.get('/_/status_events', requestData,
+        _.bind(function(response) {
+          this.cursor = response.cursor;
+          if (response.events.length && !this.stopped) {
+            this.trigger('STATUS_EVENTS', response.events);
+          }
+          window.setTimeout(_.bind(this.poll, this), this.POLL_INTERVAL_MS);
+        }, this));
+
+    jqxhr.fail(_.bind(function() {
+      window.setTimeout(_.bind(this.poll, this), this.RETRY_DELAY_MS);
+    }, this));
+  },
+
+  stop: function() {
+    this.stopped = true;
+    this.stopListening();
+  }
+});
@@ -236,8 +236,15 @@ gd.VariantsTableComponent = Backbone.View.extend({
     // Parse VariantSet data.
     this.variantSetList = JSON.parse(response.variant_set_list_json).obj_list;
 
-    // Grab the field key map data.
-    this.variantKeyMap = JSON.parse(response.variant_key_filter_map_json);
+    // Grab the field key map data. The server only sends it when the version
+    // we have is stale, otherwise we update the visible keys ourselves.
+    if ('variant_key_filter_map_json' in response) {
+      this.variantKeyMap = JSON.parse(response.variant_key_filter_map_json);
+      this.variantKeyMapVersion = response.variant_key_map_version;
+    } else {
+      this.markVisibleKeysInVariantKeyMap(
+          JSON.parse(response.visible_key_names_json));
+    }
 
     this.datatableComponent.update(this.variantList, this.fieldConfig,
         numTotalVariants, timeForLastResult);
@@ -249,6 +256,24 @@ gd.VariantsTableComponent = Backbone.View.extend({
     this.setUIDoneLoadingState();
   },
 
+  /**
+   * Updates the 'checked' state of fields in the cached key map so that the
+   * field select shows the fields currently visible.
+   */
+  markVisibleKeysInVariantKeyMap: function(visibleKeyNames) {
+    var submapNames = [
+        'snp_caller_common_data', 'snp_alternate_data', 'snp_evidence_data'];
+    _.each(submapNames, function(submapName) {
+      _.each(this.variantKeyMap[submapName], function(value, key) {
+        if (_.contains(visibleKeyNames, key)) {
+          value['checked'] = true;
+        } else {
+          delete value['checked'];
+        }
+      });
+    }, this);
+  },
+
   handleGetVariantListError: function(errorMsg) {
     this.setUIDoneLoadingState();
     $('#gd-snp-filter-error-msg').text(errorMsg);
@@ -269,6 +294,10 @@ gd.VariantsTableComponent = Backbone.View.extend({
       requestData['visibleKeyNames'] = JSON.stringify(this.visibleKeyNames);
     }
 
+    if (this.variantKeyMapVersion) {
+      requestData['variantKeyMapVersion'] = this.variantKeyMapVersion;
+    }
+
     return requestData;
   },
 
@@ -0,0 +1,166 @@
+"""
+Push-style status updates for the frontend.
+
+Pipeline tasks change the status of Datasets, AlignmentGroups and
+ExperimentSampleToAlignments (assembly_status) as they run. Rather than
+having pages re-fetch their tables on a timer while anything is running,
+each transition is published as a StatusEvent for the Project (see the
+signal handlers in main/signals.py), and the browser polls
+get_status_events_since() for the events after the last one it has seen.
+
+The StatusEvent table is the channel since it's visible to both the web
+tier and the celery workers. Polls return straight away rather than holding
+a web worker while waiting for events, and the client waits between them. So
+that polls with nothing new don't query the table, the latest event id for
+each Project is cached under the settings.STATUS_EVENT_CACHE alias.
+"""
+
+from datetime import datetime
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db.models import Max
+
+from main.models import AlignmentGroup
+from main.models import Contig
+from main.models import Dataset
+from main.models import ExperimentSample
+from main.models import ExperimentSampleToAlignment
+from main.models import ReferenceGenome
+from main.models import StatusEvent
+from main.models import VariantSet
+
+
+CACHE_KEY_PREFIX = 'status_events'
+
+
+def _get_cache():
+    return get_cache(settings.STATUS_EVENT_CACHE)
+
+
+def _get_latest_id_cache_key(project_id):
+    return '%s:%s:latest_id' % (CACHE_KEY_PREFIX, project_id)
+
+
+def get_project_id_for_entity(entity):
+    """Returns the id of the Project the entity belongs to, or None if it's
+    not one of the models that report status.
+    """
+    if isinstance(entity, (ExperimentSample, ReferenceGenome, VariantSet)):
+        return entity.project_id
+    elif isinstance(entity, AlignmentGroup):
+        return entity.reference_genome.project_id
+    elif isinstance(entity, ExperimentSampleToAlignment):
+        return entity.alignment_group.reference_genome.project_id
+    elif isinstance(entity, Contig):
+        return entity.parent_reference_genome.project_id
+    return None
+
+
+def get_dataset_parent(dataset):
+    """Returns the entity the Dataset belongs to, or None if it isn't
+    attached to one yet.
+    """
+    related_model_set_name = Dataset.TYPE_TO_RELATED_MODEL.get(dataset.type)
+    if related_model_set_name is None:
+        return None
+    parent_list = getattr(dataset, related_model_set_name).all()[:1]
+    if not len(parent_list):
+        return None
+    return parent_list[0]
+
+
+def publish_status_event(entity, field, value, parent=None):
+    """Records a status transition of the entity, to be picked up by browsers
+    showing its Project.
+
+    Args:
+        entity: Model instance whose status changed.
+        field: Name of the status field.
+        value: The new status.
+        parent: For Datasets, the entity the Dataset belongs to. Its Project
+            is the one the event is published to.
+
+    Returns:
+        The new StatusEvent, or None if the entity doesn't belong to a
+        Project.
+    """
+    project_id = get_project_id_for_entity(
+            parent if parent is not None else entity)
+    if project_id is None:
+        return None
+
+    status_event = StatusEvent.objects.create(
+            project_id=project_id,
+            model_name=type(entity).__name__,
+            uid=entity.uid,
+            parent_uid=parent.uid if parent is not None else '',
+            field=field,
+            value=value)
+
+    _get_cache().set(_get_latest_id_cache_key(project_id), status_event.id,
+            settings.STATUS_EVENT_CACHE_TIMEOUT)
+
+    # Transitions are infrequent, so pruning here is cheap enough.
+    StatusEvent.objects.filter(created__lt=datetime.now() - timedelta(
+            hours=settings.STATUS_EVENT_RETENTION_HOURS)).delete()
+
+    return status_event
+
+
+def get_latest_status_event_id(project):
+    """Returns the id of the latest StatusEvent for the Project, or 0 if
+    there are none.
+    """
+    cache = _get_cache()
+    latest_id_key = _get_latest_id_cache_key(project.id)
+    latest_id = cache.get(latest_id_key)
+    if latest_id is None:
+        latest_id = StatusEvent.objects.filter(project=project).aggregate(
+                Max('id'))['id__max'] or 0
+        # add() so that we don't clobber a newer id set by publish.
+        cache.add(latest_id_key, latest_id,
+                settings.STATUS_EVENT_CACHE_TIMEOUT)
+    return latest_id
+
+
+def get_status_events(project, cursor):
+    """Returns the StatusEvents for the Project after the cursor.
+
+    Returns:
+        Tuple (list of StatusEvent, new cursor).
+    """
+    if get_latest_status_event_id(project) <= cursor:
+        return [], cursor
+    status_event_list = list(StatusEvent.objects.filter(
+            project=project, id__gt=cursor).order_by('id'))
+    if not status_event_list:
+        return [], cursor
+    return status_event_list, status_event_list[-1].id
+
+
+def get_status_events_since(project, cursor=None):
+    """Returns the StatusEvents for the Project after the cursor, without
+    waiting for new ones.
+
+    A client without a cursor gets the current one straight away, with no
+    events, as the page it's about to render is already up to date.
+
+    Returns:
+        Dictionary with keys:
+            * events: List of StatusEvent dicts, oldest first.
+            * cursor: Id to pass as the cursor in the next request.
+    """
+    if cursor is None:
+        return {
+            'events': [],
+            'cursor': get_latest_status_event_id(project)
+        }
+
+    status_event_list, cursor = get_status_events(project, cursor)
+    return {
+        'events': [status_event.to_dict()
+                for status_event in status_event_list],
+        'cursor': cursor
+    }
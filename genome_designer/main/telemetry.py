@@ -0,0 +1,333 @@
+"""
+Stage timing and resource telemetry for the alignment, variant calling and
+genome finishing pipelines.
+
+Each pipeline stage is wrapped in a TelemetrySpan which records its wall
+time, the CPU time used by the worker and by the child processes it ran
+(bwa, samtools, freebayes, ...), the peak RSS of those child processes, the
+bytes read and written, and the number of database queries made. Finished
+spans are appended as json lines to a file in the data dir of the owning
+model (the AlignmentGroup for alignment and variant calling stages, the
+ReferenceGenome for the materialized view build) so that spans from
+concurrent celery workers end up in one place.
+
+Queries are counted by wrapping the cursors of the default database
+connection while any span is open, rather than with Django's debug cursor,
+whose connection.queries grows without bound in a long-running worker and
+may be reset by the code being measured. Only queries made by the worker
+itself are counted, and only if settings.TELEMETRY_COUNT_DB_QUERIES (or
+DEBUG, if it's None) is on.
+
+Resource usage is measured as the difference between the worker process'
+counters before and after the span. Celery runs one task per worker process
+at a time, so these differences are attributable to the span, except that
+spans nested inside one another (e.g. parse_vcf inside a merge) each count
+the inner span's usage.
+
+The spans can be exported as a list of dictionaries or in the Chrome trace
+event format (load it in chrome://tracing) to see how stages overlap.
+"""
+
+from collections import OrderedDict
+import fcntl
+import json
+import os
+import resource
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
+
+
+TELEMETRY_SPANS_FILENAME = 'telemetry_spans.jsonl'
+
+SPAN_STATUS__OK = 'OK'
+SPAN_STATUS__FAILED = 'FAILED'
+
+# Provided by the kernel. Includes the I/O of reaped child processes.
+PROC_SELF_IO_PATH = '/proc/self/io'
+
+
+def _read_proc_self_io():
+    """Returns a tuple (bytes_read, bytes_written) as counted by the kernel
+    for this process and its reaped children, or (None, None) if the
+    counters aren't available on this platform.
+
+    These are the rchar and wchar counters, so include reads and writes
+    that were satisfied by the page cache and data sent through pipes.
+    """
+    try:
+        with open(PROC_SELF_IO_PATH) as fh:
+            counters = dict(line.split(':', 1) for line in fh if ':' in line)
+        return (int(counters['rchar']), int(counters['wchar']))
+    except (IOError, KeyError, ValueError):
+        return (None, None)
+
+
+def _take_resource_snapshot():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    bytes_read, bytes_written = _read_proc_self_io()
+    return {
+        'wall_time': time.time(),
+        'cpu_user': self_usage.ru_utime,
+        'cpu_system': self_usage.ru_stime,
+        'child_cpu_user': children_usage.ru_utime,
+        'child_cpu_system': children_usage.ru_stime,
+        'child_max_rss_kb': children_usage.ru_maxrss,
+        'bytes_read': bytes_read,
+        'bytes_written': bytes_written,
+    }
+
+
+def _is_counting_queries_enabled():
+    if settings.TELEMETRY_COUNT_DB_QUERIES is None:
+        return settings.DEBUG
+    return settings.TELEMETRY_COUNT_DB_QUERIES
+
+
+# The TelemetrySpans currently counting queries, and the connection whose
+# cursor() was wrapped for them.
+_query_counting_span_list = []
+_query_counting_connection = None
+
+
+class _QueryCountingCursorWrapper(object):
+    """Database cursor that counts each query executed against the spans in
+    _query_counting_span_list.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def _count_query(self):
+        for span in _query_counting_span_list:
+            span._num_queries += 1
+
+    def execute(self, *args, **kwargs):
+        self._count_query()
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._count_query()
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def _add_query_counting_span(span):
+    global _query_counting_connection
+    if not _query_counting_span_list:
+        _query_counting_connection = connections[DEFAULT_DB_ALIAS]
+        make_cursor = _query_counting_connection.cursor
+        _query_counting_connection.cursor = (
+                lambda: _QueryCountingCursorWrapper(make_cursor()))
+    span._num_queries = 0
+    _query_counting_span_list.append(span)
+
+
+def _remove_query_counting_span(span):
+    """Returns the number of queries made while the span was counting.
+    """
+    global _query_counting_connection
+    _query_counting_span_list.remove(span)
+    if not _query_counting_span_list:
+        # Restore the class' cursor().
+        del _query_counting_connection.cursor
+        _query_counting_connection = None
+    return span._num_queries
+
+
+def _diff_or_none(end_value, start_value):
+    if end_value is None or start_value is None:
+        return None
+    return end_value - start_value
+
+
+class TelemetrySpan(object):
+    """Measures a single pipeline stage.
+
+    Use as a context manager:
+
+        with TelemetrySpan('sort_bam', sample_alignment=sample_alignment):
+            ...
+
+    or call start() and finish() explicitly when the stage doesn't fit in a
+    single block.
+
+    Exactly one of alignment_group, sample_alignment or reference_genome
+    determines where the span is stored. Spans for a sample_alignment are
+    stored with its AlignmentGroup and tagged with the sample.
+    """
+
+    def __init__(self, name, alignment_group=None, sample_alignment=None,
+            reference_genome=None, **extra):
+        self.name = name
+        self.extra = extra
+
+        self.sample_alignment_uid = None
+        self.sample_label = None
+        if sample_alignment is not None:
+            self.sample_alignment_uid = sample_alignment.uid
+            self.sample_label = sample_alignment.experiment_sample.label
+            alignment_group = sample_alignment.alignment_group
+
+        if alignment_group is not None:
+            self.owner = alignment_group
+        else:
+            assert reference_genome is not None, (
+                    "One of alignment_group, sample_alignment or "
+                    "reference_genome is required.")
+            self.owner = reference_genome
+
+        self._start_snapshot = None
+        self._counting_queries = False
+        self._num_queries = 0
+        self.record = None
+
+    def start(self):
+        if _is_counting_queries_enabled():
+            _add_query_counting_span(self)
+            self._counting_queries = True
+        self._start_snapshot = _take_resource_snapshot()
+        return self
+
+    def _stop_counting_queries(self):
+        """Returns the number of queries made since start(), or None if they
+        weren't counted.
+        """
+        if not self._counting_queries:
+            return None
+        self._counting_queries = False
+        return _remove_query_counting_span(self)
+
+    def finish(self, status=SPAN_STATUS__OK):
+        """Records the resources used since start() and persists the span.
+
+        Returns the span record.
+        """
+        assert self._start_snapshot is not None, "Span was never started."
+        start = self._start_snapshot
+        end = _take_resource_snapshot()
+        db_queries = self._stop_counting_queries()
+
+        self.record = OrderedDict([
+            ('name', self.name),
+            ('status', status),
+            ('start_time', start['wall_time']),
+            ('wall_time', end['wall_time'] - start['wall_time']),
+            ('cpu_user', end['cpu_user'] - start['cpu_user']),
+            ('cpu_system', end['cpu_system'] - start['cpu_system']),
+            ('child_cpu_user',
+                    end['child_cpu_user'] - start['child_cpu_user']),
+            ('child_cpu_system',
+                    end['child_cpu_system'] - start['child_cpu_system']),
+            # ru_maxrss for children is the largest RSS of any child reaped
+            # so far by this process, so it is a high-water mark rather than
+            # the peak of this span alone.
+            ('child_max_rss_kb', end['child_max_rss_kb']),
+            ('bytes_read',
+                    _diff_or_none(end['bytes_read'], start['bytes_read'])),
+            ('bytes_written',
+                    _diff_or_none(end['bytes_written'],
+                            start['bytes_written'])),
+            ('db_queries', db_queries),
+            ('pid', os.getpid()),
+            ('sample_alignment_uid', self.sample_alignment_uid),
+            ('sample_label', self.sample_label),
+        ])
+        if self.extra:
+            self.record['extra'] = self.extra
+
+        _append_span_record(self.owner, self.record)
+        return self.record
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.finish(SPAN_STATUS__FAILED if exc_type is not None
+                else SPAN_STATUS__OK)
+        # Never swallow the exception.
+        return False
+
+
+def get_telemetry_spans_path(owner):
+    """Returns the path to the file holding the spans recorded for the
+    AlignmentGroup or ReferenceGenome.
+    """
+    return os.path.join(owner.get_model_data_dir(), TELEMETRY_SPANS_FILENAME)
+
+
+def _append_span_record(owner, record):
+    """Appends the span record to the owner's spans file.
+
+    Telemetry is best effort, so failing to write it is logged rather than
+    failing the stage it measured.
+    """
+    try:
+        owner.ensure_model_data_dir_exists()
+        with open(get_telemetry_spans_path(owner), 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.write(json.dumps(record) + '\n')
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+    except (IOError, OSError) as e:
+        print 'WARNING: Could not record telemetry span %s: %s' % (
+                record['name'], str(e))
+
+
+def read_telemetry_spans(owner):
+    """Returns the list of span records stored for the AlignmentGroup or
+    ReferenceGenome, ordered by start time.
+    """
+    spans_path = get_telemetry_spans_path(owner)
+    if not os.path.exists(spans_path):
+        return []
+
+    span_list = []
+    with open(spans_path) as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                span_list.append(json.loads(line, object_pairs_hook=OrderedDict))
+            except ValueError:
+                # A worker killed mid-write may leave a partial line.
+                continue
+    return sorted(span_list, key=lambda span: span['start_time'])
+
+
+def convert_spans_to_chrome_trace(span_list):
+    """Converts span records to the Chrome trace event format.
+
+    Each span becomes a complete ('X') event. Spans are grouped into one
+    track per worker process so that stages that ran concurrently are shown
+    side by side.
+    """
+    trace_event_list = []
+    for span in span_list:
+        args = dict((key, value) for key, value in span.iteritems()
+                if key not in ('name', 'start_time', 'wall_time', 'pid'))
+        trace_event_list.append({
+            'name': span['name'],
+            'cat': span['sample_label'] or 'pipeline',
+            'ph': 'X',
+            # Chrome trace timestamps are in microseconds.
+            'ts': int(span['start_time'] * 1e6),
+            'dur': int(span['wall_time'] * 1e6),
+            'pid': 1,
+            'tid': span['pid'],
+            'args': args,
+        })
+    return {
+        'traceEvents': trace_event_list,
+        'displayTimeUnit': 'ms',
+    }
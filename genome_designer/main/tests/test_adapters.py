@@ -7,12 +7,17 @@ import json
 from django.contrib.auth.models import User
 from django.test import TestCase
 
+from main.adapters import adapt_experiment_samples_to_frontend
 from main.adapters import adapt_model_to_frontend
+from main.models import AlignmentGroup
 from main.models import Chromosome
+from main.models import Dataset
+from main.models import ExperimentSampleToAlignment
 from main.models import Project
 from main.models import ReferenceGenome
 from main.models import Variant
 from main.models import VariantAlternate
+from main.testing_util import create_common_entities
 
 class TestAdapters(TestCase):
 
@@ -52,3 +57,79 @@ class TestAdapters(TestCase):
         for field in ReferenceGenome.get_field_order():
             self.assertTrue(field['field'] in ref_genome_1_fe)
         self.assertTrue('href' in ref_genome_1_fe)
+
+    def test_adapt_experiment_samples__query_count(self):
+        """The samples page doesn't query per sample.
+        """
+        common_entities = create_common_entities()
+        for sample in [common_entities['sample_1'],
+                common_entities['sample_2']]:
+            for dataset_type in [Dataset.TYPE.FASTQ1, Dataset.TYPE.FASTQ2,
+                    Dataset.TYPE.FASTQC1_HTML]:
+                sample.dataset_set.add(Dataset.objects.create(
+                        type=dataset_type, label=dataset_type))
+
+        # The samples with their Project, then their Datasets.
+        with self.assertNumQueries(2):
+            fe_samples = json.loads(adapt_experiment_samples_to_frontend(
+                    {'project': common_entities['project']}))
+
+        self.assertEqual(2, len(fe_samples['obj_list']))
+        for fe_sample in fe_samples['obj_list']:
+            self.assertTrue(fe_sample['status'].startswith('FASTQ1: '))
+            self.assertTrue('Read 1' in fe_sample['fastqc_links'])
+            self.assertFalse('Read 2' in fe_sample['fastqc_links'])
+
+    def test_adapt_sample_alignments__query_count(self):
+        """The alignment page doesn't query per sample alignment.
+        """
+        common_entities = create_common_entities()
+        alignment_group = common_entities['alignment_group_1']
+        for sample in [common_entities['sample_1'],
+                common_entities['sample_2']]:
+            sample.dataset_set.add(Dataset.objects.create(
+                    type=Dataset.TYPE.FASTQ1, label='fastq1'))
+            sample_alignment = ExperimentSampleToAlignment.objects.create(
+                    alignment_group=alignment_group,
+                    experiment_sample=sample)
+            sample_alignment.dataset_set.add(Dataset.objects.create(
+                    type=Dataset.TYPE.BWA_ALIGN, label='bwa_align',
+                    status=Dataset.STATUS.READY))
+
+        # The sample alignments with their samples and AlignmentGroup, then
+        # the Datasets of the sample alignments and of the samples.
+        with self.assertNumQueries(3):
+            fe_sample_alignments = json.loads(adapt_model_to_frontend(
+                    ExperimentSampleToAlignment,
+                    {'alignment_group': alignment_group}))
+
+        self.assertEqual(2, len(fe_sample_alignments['obj_list']))
+        for fe_sample_alignment in fe_sample_alignments['obj_list']:
+            self.assertEqual(Dataset.STATUS.READY,
+                    fe_sample_alignment['status'])
+            self.assertTrue(fe_sample_alignment['experiment_sample'][
+                    'status'].startswith('FASTQ1: '))
+
+    def test_adapt_alignment_groups__query_count(self):
+        """The alignments page doesn't query per AlignmentGroup.
+        """
+        common_entities = create_common_entities()
+        AlignmentGroup.objects.create(
+                label='Alignment 2',
+                reference_genome=common_entities['reference_genome'],
+                aligner=AlignmentGroup.ALIGNER.BWA)
+
+        # The AlignmentGroups with their ReferenceGenome and Project, then
+        # the Chromosomes.
+        with self.assertNumQueries(2):
+            fe_alignment_groups = json.loads(adapt_model_to_frontend(
+                    AlignmentGroup,
+                    obj_list=AlignmentGroup.objects.filter(
+                            reference_genome__project=(
+                                    common_entities['project']))))
+
+        self.assertEqual(2, len(fe_alignment_groups['obj_list']))
+        for fe_alignment_group in fe_alignment_groups['obj_list']:
+            self.assertTrue('href' in fe_alignment_group)
+            self.assertEqual('1',
+                    fe_alignment_group['reference_genome']['num_chromosomes'])
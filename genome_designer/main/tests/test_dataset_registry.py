@@ -0,0 +1,69 @@
+"""
+Tests for dataset_registry.py.
+"""
+
+from django.test import TestCase
+
+from main.dataset_registry import dataset_registry_scope
+from main.dataset_registry import preload_entity_datasets
+from main.models import Dataset
+from main.models import ExperimentSample
+from main.model_utils import get_dataset_with_type
+from main.testing_util import create_common_entities
+from utils.import_util import add_dataset_to_entity
+
+
+class TestDatasetRegistry(TestCase):
+
+    def setUp(self):
+        self.common_entities = create_common_entities()
+        self.sample_1 = self.common_entities['sample_1']
+        self.sample_2 = self.common_entities['sample_2']
+        for sample in [self.sample_1, self.sample_2]:
+            add_dataset_to_entity(sample, 'fastq1', Dataset.TYPE.FASTQ1,
+                    filesystem_location='reads_1.fq')
+
+    def test_lookups_cached_in_scope(self):
+        with dataset_registry_scope():
+            with self.assertNumQueries(1):
+                fastq1 = get_dataset_with_type(self.sample_1,
+                        Dataset.TYPE.FASTQ1)
+                self.assertEqual(None, get_dataset_with_type(self.sample_1,
+                        Dataset.TYPE.FASTQ2))
+                self.assertEqual(fastq1, get_dataset_with_type(self.sample_1,
+                        Dataset.TYPE.FASTQ1))
+
+            # Adding a Dataset invalidates the entry.
+            fastq2 = add_dataset_to_entity(self.sample_1, 'fastq2',
+                    Dataset.TYPE.FASTQ2, filesystem_location='reads_2.fq')
+            self.assertEqual(fastq2, get_dataset_with_type(self.sample_1,
+                    Dataset.TYPE.FASTQ2))
+
+            # Saving the registered instance keeps the entry.
+            fastq1.status = Dataset.STATUS.COMPUTING
+            fastq1.save()
+            with self.assertNumQueries(0):
+                get_dataset_with_type(self.sample_1, Dataset.TYPE.FASTQ1)
+
+            # Saving another instance of it drops the entry.
+            other_fastq1 = Dataset.objects.get(id=fastq1.id)
+            other_fastq1.status = Dataset.STATUS.READY
+            other_fastq1.save()
+            self.assertEqual(Dataset.STATUS.READY, get_dataset_with_type(
+                    self.sample_1, Dataset.TYPE.FASTQ1).status)
+
+        # Nothing cached outside the scope.
+        with self.assertNumQueries(2):
+            get_dataset_with_type(self.sample_1, Dataset.TYPE.FASTQ1)
+            get_dataset_with_type(self.sample_1, Dataset.TYPE.FASTQ1)
+
+    def test_preload_entity_datasets(self):
+        with dataset_registry_scope():
+            sample_list = list(ExperimentSample.objects.filter(
+                    id__in=[self.sample_1.id, self.sample_2.id]))
+            with self.assertNumQueries(1):
+                preload_entity_datasets(sample_list)
+            with self.assertNumQueries(0):
+                for sample in sample_list:
+                    self.assertEqual('reads_1.fq', get_dataset_with_type(
+                            sample, Dataset.TYPE.FASTQ1).filesystem_location)
@@ -2,6 +2,7 @@
 Tests for models.py.
 """
 
+import gzip
 import json
 import os
 
@@ -144,6 +145,24 @@ class TestDataset(TestCase):
         assert int(wc_output) == 10, (
                 "Compression failed: %s" % (errmsg))
 
+    def test_dataset_stream(self):
+        """Make sure that streaming a compressed dataset yields its
+        decompressed contents.
+        """
+        GZIPPED_FASTQ_FILEPATH = os.path.join(settings.PWD, 'test_data',
+                'compressed_fastq', 'sample0.simLibrary.1.fq.gz')
+        dataset = Dataset.objects.create(
+                label='test_dataset',
+                type=Dataset.TYPE.FASTQ1,
+                filesystem_location=clean_filesystem_location(
+                        GZIPPED_FASTQ_FILEPATH))
+
+        with gzip.open(GZIPPED_FASTQ_FILEPATH) as fh:
+            expected_line_list = fh.readlines()
+
+        with dataset.stream() as fh:
+            self.assertEqual(expected_line_list, list(fh))
+
     def test_compress_dataset(self):
         """
         Make sure that compressing a dataset and putting a new dataset
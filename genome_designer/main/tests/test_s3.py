@@ -10,6 +10,7 @@ import tempfile
 import glob
 import os
 from main.s3 import *
+from utils import calc_file_md5
 
 class TestS3(TestCase):
     def setUp(self):
@@ -0,0 +1,115 @@
+"""
+Tests for s3_sync.py.
+"""
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from main.s3_sync import get_remote_manifest
+from main.s3_sync import LocalDirectoryStore
+from main.s3_sync import sync_down
+from main.s3_sync import sync_up
+from utils import calc_file_md5
+
+
+REMOTE_DIR = 'projects/test_project'
+
+
+class TestS3Sync(TestCase):
+
+    def setUp(self):
+        self.store_root = tempfile.mkdtemp()
+        self.store = LocalDirectoryStore(self.store_root)
+        self.local_dir = tempfile.mkdtemp()
+        self.other_local_dir = tempfile.mkdtemp()
+
+        self._write_file(self.local_dir, 'samples/s1/reads.fq', 'ACGT' * 100)
+        self._write_file(self.local_dir, 'samples/s2/reads.fq', 'TTTT' * 100)
+        self._write_file(self.local_dir, 'ref_genomes/r1/ref.fa', '>r1\nACGT')
+
+    def tearDown(self):
+        for directory in [self.store_root, self.local_dir,
+                self.other_local_dir]:
+            shutil.rmtree(directory)
+
+    def _write_file(self, root, relpath, content):
+        path = os.path.join(root, relpath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+    def test_sync_up_only_changed_files(self):
+        self.assertEqual(
+                set(['samples/s1/reads.fq', 'samples/s2/reads.fq',
+                        'ref_genomes/r1/ref.fa']),
+                set(sync_up(self.store, REMOTE_DIR, self.local_dir)))
+        self.assertEqual([], sync_up(self.store, REMOTE_DIR, self.local_dir))
+
+        self._write_file(self.local_dir, 'samples/s1/reads.fq', 'GGGG')
+        self.assertEqual(['samples/s1/reads.fq'],
+                sync_up(self.store, REMOTE_DIR, self.local_dir))
+
+        remote_manifest = get_remote_manifest(self.store, REMOTE_DIR)
+        self.assertEqual(
+                calc_file_md5(os.path.join(self.local_dir,
+                        'samples/s1/reads.fq')),
+                remote_manifest['samples/s1/reads.fq']['md5'])
+
+    def test_sync_down_declared_paths(self):
+        sync_up(self.store, REMOTE_DIR, self.local_dir)
+
+        self.assertEqual(['samples/s1/reads.fq'],
+                sync_down(self.store, REMOTE_DIR, self.other_local_dir,
+                        relpath_list=['samples/s1']))
+        self.assertFalse(os.path.exists(os.path.join(self.other_local_dir,
+                'samples/s2/reads.fq')))
+
+        # Nothing to fetch the second time.
+        self.assertEqual([], sync_down(self.store, REMOTE_DIR,
+                self.other_local_dir, relpath_list=['samples/s1']))
+
+        # Files that weren't fetched aren't deleted remotely on put.
+        self._write_file(self.other_local_dir, 'samples/s3/reads.fq', 'CCCC')
+        self.assertEqual(['samples/s3/reads.fq'],
+                sync_up(self.store, REMOTE_DIR, self.other_local_dir))
+        self.assertEqual(4, len(get_remote_manifest(self.store, REMOTE_DIR)))
+
+        self.assertEqual(
+                set(['samples/s2/reads.fq', 'ref_genomes/r1/ref.fa']),
+                set(sync_down(self.store, REMOTE_DIR, self.other_local_dir)))
+
+    def test_sync_up_skips_stale_files(self):
+        sync_up(self.store, REMOTE_DIR, self.local_dir)
+        sync_down(self.store, REMOTE_DIR, self.other_local_dir)
+
+        # Another task updates s1 remotely.
+        self._write_file(self.local_dir, 'samples/s1/reads.fq', 'GGGG')
+        sync_up(self.store, REMOTE_DIR, self.local_dir)
+
+        # A task that only fetched s2 must not put its stale copy of s1.
+        sync_down(self.store, REMOTE_DIR, self.other_local_dir,
+                relpath_list=['samples/s2'])
+        self._write_file(self.other_local_dir, 'samples/s2/reads.fq', 'CCCC')
+        self.assertEqual(['samples/s2/reads.fq'],
+                sync_up(self.store, REMOTE_DIR, self.other_local_dir))
+
+        remote_manifest = get_remote_manifest(self.store, REMOTE_DIR)
+        self.assertEqual(
+                calc_file_md5(os.path.join(self.local_dir,
+                        'samples/s1/reads.fq')),
+                remote_manifest['samples/s1/reads.fq']['md5'])
+        with open(os.path.join(self.store_root, REMOTE_DIR,
+                'samples/s1/reads.fq')) as fh:
+            self.assertEqual('GGGG', fh.read())
+
+    def test_sync_down_without_remote_manifest(self):
+        # Directories uploaded before manifests existed.
+        self._write_file(self.store_root,
+                os.path.join(REMOTE_DIR, 'samples/s1/reads.fq'), 'ACGT')
+
+        self.assertEqual(['samples/s1/reads.fq'],
+                sync_down(self.store, REMOTE_DIR, self.other_local_dir))
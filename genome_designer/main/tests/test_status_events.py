@@ -0,0 +1,76 @@
+"""
+Tests for status_events.py.
+"""
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.test import TestCase
+
+from main.models import AlignmentGroup
+from main.models import Dataset
+from main.models import ExperimentSampleToAlignment
+from main.status_events import get_status_events_since
+from main.testing_util import create_common_entities
+
+
+class TestStatusEvents(TestCase):
+
+    def setUp(self):
+        get_cache(settings.STATUS_EVENT_CACHE).clear()
+        self.common_entities = create_common_entities()
+        self.project = self.common_entities['project']
+        self.cursor = get_status_events_since(self.project)['cursor']
+
+    def _poll(self):
+        result = get_status_events_since(self.project, self.cursor)
+        self.cursor = result['cursor']
+        return result['events']
+
+    def test_alignment_group_status(self):
+        alignment_group = self.common_entities['alignment_group_1']
+        alignment_group.status = AlignmentGroup.STATUS.ALIGNING
+        alignment_group.save()
+
+        events = self._poll()
+        self.assertEqual(1, len(events))
+        self.assertEqual('AlignmentGroup', events[0]['modelName'])
+        self.assertEqual(alignment_group.uid, events[0]['uid'])
+        self.assertEqual(AlignmentGroup.STATUS.ALIGNING, events[0]['value'])
+
+        # Saving without a transition publishes nothing.
+        alignment_group.save()
+        AlignmentGroup.objects.get(id=alignment_group.id).save()
+        self.assertEqual([], self._poll())
+
+    def test_dataset_status(self):
+        sample = self.common_entities['sample_1']
+        dataset = Dataset.objects.create(label='fastq1',
+                type=Dataset.TYPE.FASTQ1, status=Dataset.STATUS.QUEUED_TO_COPY)
+        sample.dataset_set.add(dataset)
+
+        dataset.status = Dataset.STATUS.READY
+        dataset.save(update_fields=['status'])
+
+        events = self._poll()
+        self.assertEqual(1, len(events))
+        self.assertEqual('Dataset', events[0]['modelName'])
+        self.assertEqual(sample.uid, events[0]['parentUid'])
+        self.assertEqual(Dataset.STATUS.READY, events[0]['value'])
+
+    def test_assembly_status(self):
+        sample_alignment = ExperimentSampleToAlignment.objects.create(
+                alignment_group=self.common_entities['alignment_group_1'],
+                experiment_sample=self.common_entities['sample_1'])
+        self.assertEqual([], self._poll())
+
+        sample_alignment = ExperimentSampleToAlignment.objects.get(
+                id=sample_alignment.id)
+        sample_alignment.data['assembly_status'] = (
+                ExperimentSampleToAlignment.ASSEMBLY_STATUS.QUEUED)
+        sample_alignment.save()
+
+        events = self._poll()
+        self.assertEqual(1, len(events))
+        self.assertEqual('assembly_status', events[0]['field'])
+        self.assertEqual(ExperimentSampleToAlignment.ASSEMBLY_STATUS.QUEUED,
+                events[0]['value'])
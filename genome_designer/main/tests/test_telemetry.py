@@ -0,0 +1,98 @@
+"""
+Tests for telemetry.py.
+"""
+
+import subprocess
+
+from django.db import connection
+from django.db import reset_queries
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from main.models import ExperimentSampleToAlignment
+from main.telemetry import convert_spans_to_chrome_trace
+from main.telemetry import read_telemetry_spans
+from main.telemetry import SPAN_STATUS__FAILED
+from main.telemetry import SPAN_STATUS__OK
+from main.telemetry import TelemetrySpan
+from main.testing_util import create_common_entities
+
+
+class TestTelemetrySpan(TestCase):
+
+    def setUp(self):
+        self.common_entities = create_common_entities()
+        self.alignment_group = self.common_entities['alignment_group_1']
+        self.sample_alignment = ExperimentSampleToAlignment.objects.create(
+                alignment_group=self.alignment_group,
+                experiment_sample=self.common_entities['sample_1'])
+
+    def test_spans_recorded_for_alignment_group(self):
+        with TelemetrySpan('child_process',
+                sample_alignment=self.sample_alignment):
+            subprocess.check_call(['true'])
+
+        with self.assertRaises(ValueError):
+            with TelemetrySpan('failing_stage',
+                    alignment_group=self.alignment_group, tool='test'):
+                raise ValueError()
+
+        span_list = read_telemetry_spans(self.alignment_group)
+        self.assertEqual(2, len(span_list))
+
+        child_span = span_list[0]
+        self.assertEqual('child_process', child_span['name'])
+        self.assertEqual(SPAN_STATUS__OK, child_span['status'])
+        self.assertEqual(self.sample_alignment.uid,
+                child_span['sample_alignment_uid'])
+        self.assertEqual('es1', child_span['sample_label'])
+        self.assertTrue(child_span['wall_time'] >= 0)
+        self.assertTrue(child_span['child_max_rss_kb'] > 0)
+
+        failed_span = span_list[1]
+        self.assertEqual(SPAN_STATUS__FAILED, failed_span['status'])
+        self.assertEqual({'tool': 'test'}, failed_span['extra'])
+
+        # Nothing recorded against the ReferenceGenome.
+        self.assertEqual([], read_telemetry_spans(
+                self.common_entities['reference_genome']))
+
+    @override_settings(TELEMETRY_COUNT_DB_QUERIES=True)
+    def test_db_queries_counted(self):
+        with TelemetrySpan('queries', alignment_group=self.alignment_group):
+            list(ExperimentSampleToAlignment.objects.all())
+            with TelemetrySpan('nested_query',
+                    alignment_group=self.alignment_group):
+                # Code being measured may reset the debug query log.
+                reset_queries()
+                list(ExperimentSampleToAlignment.objects.all())
+
+        span_list = read_telemetry_spans(self.alignment_group)
+        self.assertEqual(2, len(span_list))
+        self.assertEqual(2, span_list[0]['db_queries'])
+        self.assertEqual(1, span_list[1]['db_queries'])
+
+        # The debug cursor wasn't turned on.
+        self.assertEqual([], connection.queries)
+
+    @override_settings(TELEMETRY_COUNT_DB_QUERIES=False)
+    def test_db_queries_not_counted(self):
+        with TelemetrySpan('queries', alignment_group=self.alignment_group):
+            list(ExperimentSampleToAlignment.objects.all())
+
+        span_list = read_telemetry_spans(self.alignment_group)
+        self.assertEqual(None, span_list[0]['db_queries'])
+
+    def test_convert_spans_to_chrome_trace(self):
+        span = TelemetrySpan('stage', alignment_group=self.alignment_group)
+        span.start()
+        record = span.finish()
+
+        trace = convert_spans_to_chrome_trace([record])
+        self.assertEqual(1, len(trace['traceEvents']))
+        event = trace['traceEvents'][0]
+        self.assertEqual('stage', event['name'])
+        self.assertEqual('X', event['ph'])
+        self.assertEqual(int(record['start_time'] * 1e6), event['ts'])
+        self.assertEqual(record['pid'], event['tid'])
+        self.assertEqual(SPAN_STATUS__OK, event['args']['status'])
@@ -36,12 +36,15 @@ from main.xhr_handlers import ref_genomes_concatenate
 from main.xhr_handlers import samples_upload_through_browser_sample_data
 from main.xhr_handlers import upload_single_sample
 from main.xhr_handlers import VARIANT_LIST_REQUEST_KEY__FILTER_STRING
+from main.xhr_handlers import VARIANT_LIST_REQUEST_KEY__KEY_MAP_VERSION
 from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__ERROR
 from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__LIST
 from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__TOTAL
 from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__TIME
 from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__SET_LIST
 from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__KEY_MAP
+from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION
+from main.xhr_handlers import VARIANT_LIST_RESPONSE_KEY__VISIBLE_KEYS
 from pipeline.pipeline_runner import run_pipeline
 from variants.dynamic_snp_filter_key_map import update_filter_key_map
 from utils.import_util import _create_sample_and_placeholder_dataset
@@ -199,6 +202,8 @@ class TestGetVariantList(TestCase):
             VARIANT_LIST_RESPONSE_KEY__SET_LIST,
             VARIANT_LIST_RESPONSE_KEY__TIME,
             VARIANT_LIST_RESPONSE_KEY__KEY_MAP,
+            VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION,
+            VARIANT_LIST_RESPONSE_KEY__VISIBLE_KEYS,
         ])
         self.assertEqual(EXPECTED_RESPONSE_KEYS, set(response_data.keys()),
                 "Missing keys %s\nGot keys %s" % (
@@ -278,6 +283,8 @@ class TestGetVariantList(TestCase):
             VARIANT_LIST_RESPONSE_KEY__SET_LIST,
             VARIANT_LIST_RESPONSE_KEY__TIME,
             VARIANT_LIST_RESPONSE_KEY__KEY_MAP,
+            VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION,
+            VARIANT_LIST_RESPONSE_KEY__VISIBLE_KEYS,
         ])
         self.assertEqual(EXPECTED_RESPONSE_KEYS, set(response_data.keys()),
                 "Missing keys %s\nGot keys %s" % (
@@ -302,6 +309,37 @@ class TestGetVariantList(TestCase):
                 for obj in variant_obj_list])
         self.assertEqual(set(range(TOTAL_NUM_VARIANTS)), variant_position_set)
 
+    def test_key_map_only_sent_when_stale(self):
+        """The variant key map should only be included when the client's
+        version is missing or out of date.
+        """
+        request_data = {
+            'refGenomeUid': self.ref_genome.uid,
+            'projectUid': self.project.uid
+        }
+        response_data = json.loads(
+                self.client.get(self.url, request_data).content)
+        self.assertTrue(VARIANT_LIST_RESPONSE_KEY__KEY_MAP in response_data)
+        key_map_version = response_data[
+                VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION]
+
+        # Current version, so no key map.
+        request_data[VARIANT_LIST_REQUEST_KEY__KEY_MAP_VERSION] = (
+                key_map_version)
+        response_data = json.loads(
+                self.client.get(self.url, request_data).content)
+        self.assertFalse(VARIANT_LIST_RESPONSE_KEY__KEY_MAP in response_data)
+        self.assertEqual(key_map_version,
+                response_data[VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION])
+
+        # Adding fields from a VCF makes the client's version stale.
+        update_filter_key_map(self.ref_genome, TEST_ANNOTATED_VCF)
+        response_data = json.loads(
+                self.client.get(self.url, request_data).content)
+        self.assertTrue(VARIANT_LIST_RESPONSE_KEY__KEY_MAP in response_data)
+        self.assertNotEqual(key_map_version,
+                response_data[VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION])
+
     def test_does_not_throw_500_on_server_error(self):
         """For user input errors, get_variant_list should not throw a 500 error.
 
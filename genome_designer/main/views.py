@@ -35,6 +35,8 @@ from main.models import ExperimentSample
 from main.models import ExperimentSampleToAlignment
 from main.models import VariantSet
 from main.model_utils import get_dataset_with_type
+from main.telemetry import convert_spans_to_chrome_trace
+from main.telemetry import read_telemetry_spans
 from pipeline.pipeline_runner import run_pipeline
 from utils.import_util import import_variant_set_from_vcf
 from utils.jbrowse_util import compile_tracklist_json
@@ -362,6 +364,50 @@ def alignment_error_log(request, project_uid, alignment_group_uid):
     return render(request, 'alignment_error_log.html', context)
 
 
+@login_required
+def alignment_telemetry_view(request, project_uid, alignment_group_uid):
+    """Shows the time and resources used by each stage of the alignment and
+    variant calling pipeline.
+
+    Pass format=json for the raw spans or format=chrome to download them in
+    the Chrome trace event format.
+    """
+    project = get_object_or_404(Project, owner=request.user.get_profile(),
+            uid=project_uid)
+    alignment_group = get_object_or_404(AlignmentGroup,
+            reference_genome__project=project, uid=alignment_group_uid)
+
+    # Include materialized view builds for the ReferenceGenome, which are
+    # part of getting the variants in front of the user.
+    span_list = sorted(
+            read_telemetry_spans(alignment_group) +
+                    read_telemetry_spans(alignment_group.reference_genome),
+            key=lambda span: span['start_time'])
+
+    output_format = request.GET.get('format')
+    if output_format == 'json':
+        return HttpResponse(json.dumps(span_list),
+                content_type='application/json')
+    elif output_format == 'chrome':
+        response = HttpResponse(
+                json.dumps(convert_spans_to_chrome_trace(span_list)),
+                content_type='application/json')
+        response['Content-Disposition'] = (
+                'attachment; filename="{0}.trace.json"'.format(
+                        alignment_group.uid))
+        return response
+    elif output_format is not None:
+        return HttpResponseBadRequest('Unknown format: ' + output_format)
+
+    context = {
+        'project': project,
+        'tab_root': TAB_ROOT__DATA,
+        'alignment_group': alignment_group,
+        'span_list': span_list,
+    }
+    return render(request, 'alignment_telemetry.html', context)
+
+
 @login_required
 def alignment_create_view(request, project_uid):
     """Displays the view for creating a new alignment.
@@ -49,6 +49,8 @@ from main.models import VariantEvidence
 from main.models import VariantSet
 from main.models import S3File
 from main.model_utils import get_long_alt_path
+from main.reference_genome_metadata_cache import get_reference_genome_metadata_version
+from main.status_events import get_status_events_since
 from pipeline.pipeline_runner import run_pipeline
 from genome_finish.assembly_runner import run_de_novo_assembly_pipeline
 from genome_finish.jbrowse_genome_finish import maybe_create_reads_to_contig_bam
@@ -57,6 +59,8 @@ from utils.combine_reference_genomes import combine_list_allformats
 from utils.data_export_util import export_contigs_as_csv
 from utils.data_export_util import export_melted_variant_view
 from utils.data_export_util import export_project_as_zip
+from utils.data_export_util import get_project_export_filename
+from utils.fastq_profile_util import FastqStats
 from utils.import_util import create_samples_from_row_data
 from utils.import_util import create_sample_models_for_eventual_upload
 from utils.import_util import import_reference_genome_from_local_file
@@ -64,6 +68,7 @@ from utils.import_util import import_reference_genome_from_ncbi
 from utils.import_util import import_samples_from_targets_file
 from utils.import_util import import_variant_set_from_vcf
 from utils.import_util import run_fastqc_on_sample_fastq
+from utils.import_util import update_experiment_sample_fastq_stats
 from utils.optmage_util import ReplicationOriginParams
 from utils.optmage_util import print_mage_oligos
 from utils.reference_genome_maker_util import generate_new_reference_genome
@@ -634,10 +639,12 @@ def samples_upload_through_browser_sample_data(request):
     dataset = datasets_matching_project_and_filename[0]
     copy_dest = dataset.get_absolute_location()
 
-    # Copy the file in chunks.
+    # Copy the file in chunks, computing its stats along the way.
     # TODO: Understand this better. Probably need error handling.
+    fastq_stats = FastqStats(copy_dest)
     with open(copy_dest, 'w') as dest_fh:
         for chunk in uploaded_file.chunks():
+            fastq_stats.update(chunk)
             dest_fh.write(chunk)
 
     # Determine which of the fastq files this is.
@@ -647,13 +654,15 @@ def samples_upload_through_browser_sample_data(request):
     # Obtain experiment sample. Should only be one.
     assert 1 == dataset.experimentsample_set.count()
     experiment_sample = dataset.experimentsample_set.all()[0]
+    update_experiment_sample_fastq_stats(experiment_sample, dataset.type,
+            fastq_stats.get_stats())
 
-    # Start async fastq.
-    dataset.status = Dataset.STATUS.QC
+    # The reads were profiled while copying, so they're ready for alignment.
+    # FastQC html reports are optional and generated in the background.
+    dataset.status = Dataset.STATUS.READY
     dataset.save(update_fields=['status'])
-    run_fastqc_on_sample_fastq.delay(
-            experiment_sample, dataset, rev=rev,
-            source_dataset_status_on_success=Dataset.STATUS.READY)
+    if settings.RUN_FASTQC_ON_IMPORT:
+        run_fastqc_on_sample_fastq.delay(experiment_sample, dataset, rev=rev)
 
     return HttpResponse(json.dumps({}), content_type='application/json')
 
@@ -705,11 +714,17 @@ VARIANT_LIST_REQUEST_KEY__FILTER_STRING = 'variantFilterString'
 VARIANT_LIST_REQUEST_KEY__PROJECT_UID = 'projectUid'
 VARIANT_LIST_REQUEST_KEY__REF_GENOME_UID = 'refGenomeUid'
 
+# Version of the variant key map the client already has, if any. The key map
+# is only included in the response if this is missing or stale.
+VARIANT_LIST_REQUEST_KEY__KEY_MAP_VERSION = 'variantKeyMapVersion'
+
 VARIANT_LIST_RESPONSE_KEY__LIST = 'variant_list_json'
 VARIANT_LIST_RESPONSE_KEY__TOTAL = 'num_total_variants'
 VARIANT_LIST_RESPONSE_KEY__TIME = 'time_for_last_result'
 VARIANT_LIST_RESPONSE_KEY__SET_LIST = 'variant_set_list_json'
 VARIANT_LIST_RESPONSE_KEY__KEY_MAP = 'variant_key_filter_map_json'
+VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION = 'variant_key_map_version'
+VARIANT_LIST_RESPONSE_KEY__VISIBLE_KEYS = 'visible_key_names_json'
 VARIANT_LIST_RESPONSE_KEY__ERROR = 'error'
 
 
@@ -805,27 +820,36 @@ def get_variant_list(request):
         variant_set_list = VariantSet.objects.filter(
                 reference_genome=reference_genome)
 
-        # Query the keys valid for ReferenceGenome, and mark the ones that
-        # will be displayed so that the checkmarks in the visible field select
-        # are pre-filled in case the user wishes to change these.
-        variant_key_map_with_active_fields_marked = copy.deepcopy(
-                reference_genome.variant_key_map)
-        _mark_active_keys_in_variant_key_map(
-                variant_key_map_with_active_fields_marked,
-                query_args['visible_key_names'])
-
         time_for_last_result = (datetime.now() - query_start_time).total_seconds()
 
         # Package up the response.
+        key_map_version = get_reference_genome_metadata_version(
+                reference_genome)
         response_data = {
             VARIANT_LIST_RESPONSE_KEY__LIST: variant_list_json,
             VARIANT_LIST_RESPONSE_KEY__TOTAL: num_total_variants,
             VARIANT_LIST_RESPONSE_KEY__TIME: time_for_last_result,
             VARIANT_LIST_RESPONSE_KEY__SET_LIST: adapt_model_to_frontend(VariantSet,
                     obj_list=variant_set_list),
-            VARIANT_LIST_RESPONSE_KEY__KEY_MAP: json.dumps(
-                    variant_key_map_with_active_fields_marked)
+            VARIANT_LIST_RESPONSE_KEY__KEY_MAP_VERSION: key_map_version,
+            VARIANT_LIST_RESPONSE_KEY__VISIBLE_KEYS: json.dumps(
+                    query_args['visible_key_names'])
         }
+
+        # Only send the key map if the client doesn't have the current one.
+        # The client marks the visible keys itself when reusing its copy.
+        if (request.GET.get(VARIANT_LIST_REQUEST_KEY__KEY_MAP_VERSION) !=
+                key_map_version):
+            # Query the keys valid for ReferenceGenome, and mark the ones that
+            # will be displayed so that the checkmarks in the visible field
+            # select are pre-filled in case the user wishes to change these.
+            variant_key_map_with_active_fields_marked = copy.deepcopy(
+                    reference_genome.variant_key_map)
+            _mark_active_keys_in_variant_key_map(
+                    variant_key_map_with_active_fields_marked,
+                    query_args['visible_key_names'])
+            response_data[VARIANT_LIST_RESPONSE_KEY__KEY_MAP] = json.dumps(
+                    variant_key_map_with_active_fields_marked)
     # Toggle which of the following exceptions is commented for debugging.
     # except FakeException as e:
     except Exception as e:
@@ -1069,15 +1093,21 @@ def export_variants_as_csv(request):
 @login_required
 def export_project(request):
     """Handles a request to export project.
+
+    The zip archive is streamed as it's generated. Pass
+    exclude_regenerable=1 to leave out indexes and JBrowse data.
     """
-    print request.GET
     p_uid = request.GET.get('project_uid')
     project = get_object_or_404(
             Project, owner=request.user.get_profile(), uid=p_uid)
-    download_url = export_project_as_zip(project)
-    response_data = {'downloadUrl': download_url}
-    return HttpResponse(json.dumps(response_data),
-            content_type='application/json')
+    exclude_regenerable = request.GET.get('exclude_regenerable', 0) == '1'
+    response = StreamingHttpResponse(
+            export_project_as_zip(project,
+                    exclude_regenerable=exclude_regenerable),
+            content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+            get_project_export_filename(project))
+    return response
 
 
 @login_required
@@ -1130,28 +1160,33 @@ def get_alignment_groups(request):
         response_data = adapt_model_to_frontend(AlignmentGroup,
                 obj_list=alignment_group_list)
 
-        # Add bit to indicate whether any AlignmentGroups are running.
-        # NOTE: We do this wonky json.loads(), modify, json.dumps() becaause
-        # adapt_model_to_frontend() has the suboptimal interface of returning
-        # a json packaged object. It would be better to change this, but would
-        # require making this change safely everywhere else, but since we are
-        # lacking test coverage I'm not going to do that right now.
-        response_data_dict = json.loads(response_data)
-        response_data_dict['clientShouldRefresh'] = _are_any_alignments_running(
-                alignment_group_list)
-        response_data = json.dumps(response_data_dict)
-
         return HttpResponse(response_data,
                 content_type='application/json')
 
 
-def _are_any_alignments_running(alignment_group_list):
-    """Determines whether any alignments in the list are running.
+@login_required
+@require_GET
+def get_status_events(request):
+    """Returns pipeline status transitions in a Project.
+
+    Clients pass back the cursor from the previous response and get the
+    events after it, possibly none. Without a cursor, the current cursor is
+    returned. Responses are immediate; the client waits between polls.
     """
-    for ag in alignment_group_list:
-        if ag.status in AlignmentGroup.PIPELINE_IS_RUNNING_STATUSES:
-            return True
-    return False
+    project = get_object_or_404(Project,
+            owner=request.user.get_profile(),
+            uid=request.GET.get('projectUid'))
+
+    cursor = request.GET.get('cursor')
+    if cursor is not None:
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor.')
+
+    response_data = get_status_events_since(project, cursor)
+    return HttpResponse(json.dumps(response_data),
+            content_type='application/json')
 
 
 @login_required
@@ -1188,7 +1223,8 @@ def is_materialized_view_valid(request):
                 project__owner=request.user.get_profile(),
                 uid=ref_genome_uid)
     response_data = json.dumps({
-        'isValid': reference_genome.is_materialized_variant_view_valid
+        'isValid': MeltedVariantMaterializedViewManager(
+                reference_genome).is_valid()
     })
     return HttpResponse(response_data, content_type='application/json')
 
@@ -1311,19 +1347,6 @@ def get_contigs(request):
             content_type='application/json')
 
 
-def _are_any_assemblies_running(sample_alignment_query):
-    """Determines whether any assemblies in the list are running.
-    """
-    ASSEMBLY_RUNNING_STATUSES = [
-            ExperimentSampleToAlignment.ASSEMBLY_STATUS.ASSEMBLING]
-
-    for sample_alignment in sample_alignment_query:
-        status = sample_alignment.data.get('assembly_status', False)
-        if status and status in ASSEMBLY_RUNNING_STATUSES:
-            return True
-    return False
-
-
 @login_required
 @require_GET
 def contigs_has_insertion_location(request):
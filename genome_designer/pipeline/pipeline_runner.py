@@ -10,15 +10,22 @@ from datetime import datetime
 import os
 import time
 
+from celery import chord
 from celery import group
+from celery import states
 from celery import task
+from celery.result import EagerResult
+from celery.utils import uuid
 from django.conf import settings
+from django.db.models import Count
 
 from main.celery_util import assert_celery_running
 from main.models import AlignmentGroup
 from main.models import ReferenceGenome
 from main.models import Dataset
 from main.models import ExperimentSampleToAlignment
+from main.status_events import publish_status_event
+from main.telemetry import TelemetrySpan
 from pipeline.read_alignment import align_with_bwa_mem
 from pipeline.variant_calling import find_variants_with_tool
 from pipeline.variant_calling import VARIANT_TOOL_PARAMS_MAP
@@ -30,12 +37,18 @@ from pipeline.variant_calling.freebayes import merge_freebayes_parallel
 from pipeline.variant_calling.freebayes import freebayes_regions
 from pipeline.variant_calling.lumpy import merge_lumpy_vcf
 from pipeline.variant_calling.pindel import merge_pindel_vcf
+from pipeline.variant_calling.sv_regions import sv_caller_regions
 
 
 # List of variant callers to use. At time of writing, this was not hooked
 # up to the ui and only used internally.
 VARIANT_CALLING_OPTION__CALLER_OVERRIDE = 'enabled_variant_callers_override'
 
+# Set by run_pipeline() so that the variant calling pipeline can be put
+# together once alignments are done.
+VARIANT_CALLING_OPTION__PERFORM = 'perform_variant_calling'
+VARIANT_CALLING_OPTION__COMPLETION_TASK_ID = 'completion_task_id'
+
 
 def run_pipeline(alignment_group_label, ref_genome, sample_list,
         skip_alignment=False, perform_variant_calling=True, alignment_options={},
@@ -83,9 +96,9 @@ def run_pipeline(alignment_group_label, ref_genome, sample_list,
 
     # NOTE: Nested chords in celery don't work so we need to break up the
     # pipeline into # two separate pipelines: 1) alignment and 2) variant
-    # calling. This task is the first task in the variant calling pipeline which
-    # polls the database until all alignments are complete before kicking off
-    # parallel variant calling tasks.
+    # calling. Each alignment task is linked to alignment_finished_task(),
+    # which kicks off the variant calling pipeline once the last alignment
+    # for the AlignmentGroup is done, so no worker waits on alignments.
 
     # NOTE: Since we don't want results to be passed as arguments in the
     # chain, use .si(...) and not .s(...)
@@ -102,55 +115,65 @@ def run_pipeline(alignment_group_label, ref_genome, sample_list,
     # TODO: Revisit such calls and see if we can clean them up.
     ref_genome = ReferenceGenome.objects.get(uid=ref_genome.uid)
 
+    # TODO(gleb): We had this to deal with race conditions. Do we still need it?
+    ref_genome.save()
+
+    # HACK(gleb): Force ALIGNING so that UI starts refreshing. This should be
+    # right, but I'm open to removing if it's not right for some case I
+    # didn't think of.
+    # NOTE: This must happen before alignments are started, since the last
+    # alignment to finish moves the AlignmentGroup on from ALIGNING.
+    alignment_group.status = AlignmentGroup.STATUS.ALIGNING
+    alignment_group.start_time = datetime.now()
+    alignment_group.end_time = None
+    alignment_group.save(update_fields=['status', 'start_time', 'end_time'])
+
+    # The variant calling pipeline is only put together once alignments are
+    # done. We fix the id of its final task now so that callers can wait on
+    # its result.
+    variant_calling_options = dict(variant_calling_options)
+    variant_calling_options[VARIANT_CALLING_OPTION__PERFORM] = (
+            perform_variant_calling)
+    variant_calling_options[VARIANT_CALLING_OPTION__COMPLETION_TASK_ID] = (
+            uuid())
+
     # Now we aggregate the alignments that need to be run, collecting their
     # signatures in a Celery group so that these alignments can be run in
     # parallel.
     alignment_task_signatures = []
     for sample_alignment in sample_alignments_to_run:
+        alignment_finished_signature = alignment_finished_task.si(
+                alignment_group, variant_calling_options)
         alignment_task_signatures.append(
                 align_with_bwa_mem.si(
                         alignment_group, sample_alignment,
-                        project=ref_genome.project))
+                        project=ref_genome.project).set(
+                                link=alignment_finished_signature,
+                                link_error=alignment_failed_task.si(
+                                        alignment_group, sample_alignment,
+                                        variant_calling_options)))
 
+    # Run the pipeline. This is a non-blocking call when celery is running so
+    # the rest of code proceeds immediately.
     if len(alignment_task_signatures) > 0:
         alignment_task_group = group(alignment_task_signatures)
         alignment_task_group_async_result = alignment_task_group.apply_async()
     else:
+        # Nothing to align, so go straight to variant calling.
         alignment_task_group_async_result = None
-
-    # HACK(gleb): Force ALIGNING so that UI starts refreshing. This should be
-    # right, but I'm open to removing if it's not right for some case I
-    # didn't think of.
-    alignment_group.status = AlignmentGroup.STATUS.ALIGNING
-    alignment_group.start_time = datetime.now()
-    alignment_group.end_time = None
-    alignment_group.save(update_fields=['status', 'start_time', 'end_time'])
-
-    # Aggregate variant callers, which run in parallel once all alignments
-    # are done.
-    if perform_variant_calling:
-        variant_caller_group = _construct_variant_caller_group(
-                alignment_group, variant_calling_options)
+        alignment_finished_task.si(
+                alignment_group, variant_calling_options).apply_async()
+
+    completion_task_id = variant_calling_options[
+            VARIANT_CALLING_OPTION__COMPLETION_TASK_ID]
+    if settings.CELERY_ALWAYS_EAGER:
+        # Everything has already run synchronously, and any failure would
+        # have raised above.
+        variant_calling_async_result = EagerResult(
+                completion_task_id, None, states.SUCCESS)
     else:
-        variant_caller_group = None
-
-    # Put together the whole pipeline.
-    variant_calling_pipeline = start_variant_calling_pipeline_task.si(
-            alignment_group)
-    if variant_caller_group is not None:
-        variant_calling_pipeline = (variant_calling_pipeline |
-                variant_caller_group)
-
-    # Add a final task which runs only after all previous tasks are complete.
-    pipeline_completion = pipeline_completion_tasks.si(alignment_group)
-    variant_calling_pipeline = variant_calling_pipeline | pipeline_completion
-
-    # TODO(gleb): We had this to deal with race conditions. Do we still need it?
-    ref_genome.save()
-
-    # Run the pipeline. This is a non-blocking call when celery is running so
-    # the rest of code proceeds immediately.
-    variant_calling_async_result = variant_calling_pipeline.apply_async()
+        variant_calling_async_result = pipeline_completion_tasks.AsyncResult(
+                completion_task_id)
 
     return (
             alignment_group,
@@ -217,9 +240,10 @@ def _get_or_create_sample_alignment_datasets(alignment_group, sample_list):
     return sample_alignments_to_run
 
 
-def _construct_variant_caller_group(alignment_group, variant_calling_options):
+def _construct_variant_caller_group(alignment_group, variant_calling_options,
+        variant_calling_start_time):
     """Returns celery Group of variant calling tasks that can be run
-    in parallel.
+    in parallel, followed by merging their results.
     """
     # Get fresh copy of ReferenceGenome to avoid potential issues with
     # race conditions.
@@ -275,110 +299,235 @@ def _construct_variant_caller_group(alignment_group, variant_calling_options):
 
             # TODO: What if some alignments failed?
             for sa in sample_alignment_list:
-                # Create separate lumpy task for each sample.
-                per_sample_params = dict(tool_params)
-                per_sample_params['tool_kwargs'] = {
-                    'region_num': sa.uid,
-                    'sample_alignments': [sa]
-                }
-                parallel_tasks.append(find_variants_with_tool.si(
-                        alignment_group, per_sample_params,
-                        project=ref_genome.project))
+                # Create separate task for each sample and region. Calls are
+                # kept by the region whose core holds them, and the partial
+                # vcfs are merged by merge_variant_caller_data.
+                for region_num, sv_region in enumerate(
+                        sv_caller_regions(ref_genome, sa)):
+                    region_params = dict(tool_params)
+                    region_params['tool_kwargs'] = {
+                        'region_num': '%s_%d' % (sa.uid, region_num),
+                        'sample_alignments': [sa],
+                        'sv_region': sv_region
+                    }
+                    parallel_tasks.append(find_variants_with_tool.si(
+                            alignment_group, region_params,
+                            project=ref_genome.project))
         else:
             parallel_tasks.append(find_variants_with_tool.si(
                     alignment_group, tool_params, project=ref_genome.project))
 
     variant_calling_pipeline = (group(parallel_tasks) |
-            merge_variant_data.si(alignment_group))
+            merge_variant_data.si(alignment_group, variant_calling_options,
+                    variant_calling_start_time))
     return variant_calling_pipeline
 
 
+def _count_unfinished_alignments(alignment_group):
+    """Returns a tuple pair (num_not_ready, num_failed) of BWA Datasets for
+    the AlignmentGroup, counted in a single query.
+    """
+    bwa_datasets = Dataset.objects.filter(
+            experimentsampletoalignment__alignment_group=alignment_group,
+            type=Dataset.TYPE.BWA_ALIGN)
+    status_counts = dict(bwa_datasets.values_list('status').annotate(
+            Count('id')))
+    num_failed = status_counts.get(Dataset.STATUS.FAILED, 0)
+    num_not_ready = sum(status_counts.values()) - status_counts.get(
+            Dataset.STATUS.READY, 0)
+    return (num_not_ready, num_failed)
+
+
+def _claim_alignment_group_status(alignment_group, new_status):
+    """Atomically moves the AlignmentGroup from ALIGNING to new_status.
+
+    Several alignments may finish at the same time, so this ensures that only
+    one of them hands off to variant calling.
+
+    QuerySet.update() doesn't send post_save, so the StatusEvent is
+    published here.
+
+    Returns:
+        True if this call made the transition.
+    """
+    update_kwargs = {'status': new_status}
+    if new_status == AlignmentGroup.STATUS.FAILED:
+        update_kwargs['end_time'] = datetime.now()
+    num_updated = AlignmentGroup.objects.filter(
+            id=alignment_group.id,
+            status=AlignmentGroup.STATUS.ALIGNING).update(**update_kwargs)
+    if num_updated != 1:
+        return False
+    publish_status_event(alignment_group, 'status', new_status)
+    return True
+
+
 @task
-def start_variant_calling_pipeline_task(alignment_group):
-    """First task in variant calling pipeline which waits for all alignments
-    to be complete.
-
-    Nested chords in celery don't work so we need to break up the pipeline into
-    two separate pipelines: 1) alignment and 2) variant calling. This task is
-    the first task in the variant calling pipeline which polls the database
-    until all alignments are complete.
+def alignment_finished_task(alignment_group, variant_calling_options):
+    """Runs after each alignment in the AlignmentGroup finishes, whether or
+    not it succeeded, and starts variant calling once all are done.
+
+    This replaces a task that held a worker while polling the database until
+    all alignments were complete. Here, each call counts the alignments that
+    are still outstanding. When none remain, the variant calling pipeline is
+    started. If any alignment failed, the AlignmentGroup fails right away
+    without waiting for the others.
+    """
+    alignments_done_time = time.time()
+
+    num_not_ready, num_failed = _count_unfinished_alignments(alignment_group)
+
+    if num_failed:
+        if _claim_alignment_group_status(
+                alignment_group, AlignmentGroup.STATUS.FAILED):
+            # Let anyone waiting on the pipeline know it isn't coming.
+            exc = Exception("Alignment failed.")
+            pipeline_completion_tasks.backend.mark_as_failure(
+                    variant_calling_options[
+                            VARIANT_CALLING_OPTION__COMPLETION_TASK_ID],
+                    exc)
+            raise exc
+        return
+
+    if num_not_ready:
+        return
+
+    if not _claim_alignment_group_status(
+            alignment_group, AlignmentGroup.STATUS.VARIANT_CALLING):
+        # Another alignment already handed off.
+        return
+
+    # Put together the variant calling pipeline. When calling variants,
+    # merge_variant_data() adds the final pipeline_completion_tasks().
+    variant_calling_pipeline = start_variant_calling_pipeline_task.si(
+            alignment_group, alignments_done_time)
+    if variant_calling_options[VARIANT_CALLING_OPTION__PERFORM]:
+        variant_calling_pipeline = (variant_calling_pipeline |
+                _construct_variant_caller_group(
+                        alignment_group, variant_calling_options,
+                        alignments_done_time))
+    else:
+        variant_calling_pipeline = (variant_calling_pipeline |
+                _get_pipeline_completion_signature(
+                        alignment_group, variant_calling_options))
+
+    variant_calling_pipeline.apply_async()
+
+
+def _get_pipeline_completion_signature(alignment_group, variant_calling_options,
+        variant_calling_start_time=None):
+    """Returns the signature of the final pipeline_completion_tasks(), using
+    the task id assigned in run_pipeline().
     """
-    print 'START VARIANT CALLING PIPELINE. WAITING FOR ALIGNMENTS TO COMPLETE.'
-
-    POLL_INTERVAL_SEC = 5
-
-    sample_alignment_list = ExperimentSampleToAlignment.objects.filter(
-            alignment_group=alignment_group)
-
-    all_samples_ready = False
-    failed = False
-    while not all_samples_ready:
-        all_samples_ready = True
-        for sa in sample_alignment_list:
-            sa_fresh = ExperimentSampleToAlignment.objects.get(id=sa.id)
-            bwa_dataset = sa_fresh.dataset_set.get(label=Dataset.TYPE.BWA_ALIGN)
-            if bwa_dataset.status == Dataset.STATUS.FAILED:
-                failed = True
-                # # DEBUG: Uncomment to see alignment error output
-                # print '---------------ALIGNMENT ERROR OUTPUT---------------\n'
-                # error_dataset = sa_fresh.dataset_set.get(
-                #         label=Dataset.TYPE.BWA_ALIGN_ERROR)
-                # with open(error_dataset.get_absolute_location(),'r') as fh:
-                #     for line in fh:
-                #         print line
-                break
-
-            if not bwa_dataset.status == Dataset.STATUS.READY:
-                all_samples_ready = False
-                break
-
-        if failed:
-            alignment_group = AlignmentGroup.objects.get(id=alignment_group.id)
-            alignment_group.status = AlignmentGroup.STATUS.FAILED
-            alignment_group.save(update_fields=['status'])
-            raise Exception("Alignment failed.")
-
-        if not all_samples_ready:
-            time.sleep(POLL_INTERVAL_SEC)
-
-    # All ready. Set VARIANT_CALLING.
-    alignment_group.status = AlignmentGroup.STATUS.VARIANT_CALLING
-    alignment_group.save(update_fields=['status'])
+    return pipeline_completion_tasks.si(alignment_group,
+            variant_calling_start_time=variant_calling_start_time).set(
+                    task_id=variant_calling_options[
+                            VARIANT_CALLING_OPTION__COMPLETION_TASK_ID])
 
 
 @task
-def merge_variant_data(alignment_group):
-    """Merges results of variant caller data after pipeline is complete.
+def alignment_failed_task(alignment_group, sample_alignment,
+        variant_calling_options):
+    """Error callback for alignment tasks that raised before recording their
+    status, so that the AlignmentGroup doesn't wait on them forever.
     """
+    # Saved one at a time, rather than with QuerySet.update(), so that the
+    # StatusEvent is published.
+    for bwa_dataset in Dataset.objects.filter(
+            experimentsampletoalignment=sample_alignment,
+            type=Dataset.TYPE.BWA_ALIGN).exclude(
+                    status=Dataset.STATUS.READY):
+        bwa_dataset.status = Dataset.STATUS.FAILED
+        bwa_dataset.save(update_fields=['status'])
+    alignment_finished_task(alignment_group, variant_calling_options)
+
+
+@task
+def start_variant_calling_pipeline_task(alignment_group, alignments_done_time):
+    """First task in variant calling pipeline, started by the last alignment
+    to finish.
+
+    Reports how long the variant calling pipeline waited in the queue after
+    alignments were done.
+    """
+    print 'START VARIANT CALLING PIPELINE. %.2f s AFTER ALIGNMENTS DONE.' % (
+            time.time() - alignments_done_time)
+
+
+@task
+def merge_variant_data(alignment_group, variant_calling_options,
+        variant_calling_start_time):
+    """Merges results of variant caller data after all variant callers are
+    done.
+
+    The merge, annotation and parsing for each variant caller are independent,
+    so each runs as its own task. These are joined by a chord into the final
+    pipeline_completion_tasks().
+    """
+    merge_tasks = [merge_variant_caller_data.si(alignment_group, tool)
+            for tool in MERGE_VARIANT_CALLER_DATA_FUNCTIONS]
+    chord(merge_tasks)(_get_pipeline_completion_signature(
+            alignment_group, variant_calling_options,
+            variant_calling_start_time))
+
+
+# Functions that merge, annotate and parse the partial vcfs of each variant
+# caller. Each returns None if the caller didn't run.
+MERGE_VARIANT_CALLER_DATA_FUNCTIONS = {
+    TOOL_FREEBAYES: merge_freebayes_parallel,
+    TOOL_LUMPY: merge_lumpy_vcf,
+    TOOL_PINDEL: merge_pindel_vcf,
+}
+
+
+@task
+def merge_variant_caller_data(alignment_group, tool):
+    """Merges results of a single variant caller.
+    """
+    start_time = time.time()
     try:
-        merge_freebayes_parallel(alignment_group)
-        merge_lumpy_vcf(alignment_group)
-        merge_pindel_vcf(alignment_group)
+        with TelemetrySpan('merge_variant_caller_data.' + tool,
+                alignment_group=alignment_group):
+            MERGE_VARIANT_CALLER_DATA_FUNCTIONS[tool](alignment_group)
     except:
         # Log error.
         vcf_output_root = get_or_create_vcf_output_dir(alignment_group)
         merge_variant_data_error_path = os.path.join(
-                vcf_output_root, 'merge_variant_data.error')
+                vcf_output_root, 'merge_variant_data.%s.error' % tool)
         with open(merge_variant_data_error_path, 'w') as error_output_fh:
             import traceback
             error_output_fh.write(traceback.format_exc())
 
         # Set AlignmentGroup status to failed.
-        alignment_group.status = AlignmentGroup.STATUS.FAILED
-        alignment_group.end_time = datetime.now()
-        alignment_group.save(update_fields=['end_time', 'status'])
-
+        num_updated = AlignmentGroup.objects.filter(
+                id=alignment_group.id).exclude(
+                        status=AlignmentGroup.STATUS.FAILED).update(
+                                status=AlignmentGroup.STATUS.FAILED,
+                                end_time=datetime.now())
+        if num_updated:
+            publish_status_event(alignment_group, 'status',
+                    AlignmentGroup.STATUS.FAILED)
+    print 'MERGE %s DONE IN %.2f s.' % (tool, time.time() - start_time)
 
 
 @task
-def pipeline_completion_tasks(alignment_group):
+def pipeline_completion_tasks(alignment_group, variant_calling_start_time=None):
     """Final set of synchronous steps after all alignments and variant callers
     are finished.
 
     Sets end_time and status on alignment_group.
+
+    Args:
+        alignment_group: The AlignmentGroup.
+        variant_calling_start_time: Optional time.time() at which alignments
+            were done, for reporting the wall time of variant calling.
     """
     print 'START PIPELINE COMPLETION...'
 
+    if variant_calling_start_time is not None:
+        print 'VARIANT CALLING PHASE TOOK %.2f s.' % (
+                time.time() - variant_calling_start_time)
+
     # Get fresh copy of alignment_group.
     alignment_group = AlignmentGroup.objects.get(id=alignment_group.id)
 
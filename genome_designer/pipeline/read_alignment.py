@@ -4,13 +4,13 @@ Methods for aligning raw fastq reads to a reference genome.
 
 import copy
 from datetime import datetime
+import math
 import os
 import subprocess
-from subprocess import PIPE
-from subprocess import Popen
 
 from celery import task
 from django.conf import settings
+import pysam
 
 from main.models import AlignmentGroup
 from main.models import Dataset
@@ -18,19 +18,22 @@ from main.models import ExperimentSampleToAlignment
 from main.model_utils import clean_filesystem_location
 from main.model_utils import get_dataset_with_type
 from main.s3 import project_files_needed
+from main.telemetry import SPAN_STATUS__FAILED
+from main.telemetry import TelemetrySpan
 from pipeline.read_alignment_util import ensure_bwa_index
 from pipeline.callable_loci import get_callable_loci
 from pipeline.read_alignment_util import index_bam_file
 from pipeline.read_alignment_util import extract_split_reads
 from pipeline.read_alignment_util import extract_discordant_read_pairs
-from utils.import_util import add_dataset_to_entity
 from utils.jbrowse_util import add_bam_file_track
 from utils.jbrowse_util import add_bed_file_track
 from utils import titlecase_spaces
 
 
 @task
-@project_files_needed
+@project_files_needed(paths=lambda alignment_group, sample_alignment: [
+        sample_alignment.experiment_sample.get_model_data_dir(),
+        alignment_group.reference_genome.get_model_data_dir()])
 def align_with_bwa_mem(alignment_group, sample_alignment):
     """
     REPLACES OLD BWA PIPELINE USING ALN AND SAMPE/SAMSE
@@ -77,6 +80,10 @@ def align_with_bwa_mem(alignment_group, sample_alignment):
                     sample_alignment.experiment_sample.label,
                     sample_alignment.uid))
 
+    # Measures the whole alignment. Finished in the finally block below.
+    alignment_span = TelemetrySpan('align_with_bwa_mem',
+            sample_alignment=sample_alignment).start()
+
     # We wrap the alignment logic in a try-except so that if an error occurs,
     # we record it and update the status of the Dataset to FAILED if anything
     # should fail.
@@ -139,10 +146,11 @@ def align_with_bwa_mem(alignment_group, sample_alignment):
         # Flush the output here so it gets written before the alignments.
         error_output.flush()
 
-        with open(output_bam, 'w') as fh:
-            subprocess.check_call(align_input_args,
-                    stdout=fh, stderr=error_output,
-                    shell=True, executable=settings.BASH_PATH)
+        with TelemetrySpan('bwa_mem', sample_alignment=sample_alignment):
+            with open(output_bam, 'w') as fh:
+                subprocess.check_call(align_input_args,
+                        stdout=fh, stderr=error_output,
+                        shell=True, executable=settings.BASH_PATH)
 
         # Set processing mask to not compute insert metrics if reads are
         # not paired end, as the lumpy script only works on paired end reads
@@ -161,12 +169,16 @@ def align_with_bwa_mem(alignment_group, sample_alignment):
         bwa_dataset.save()
 
         # Isolate split and discordant reads for SV calling.
-        get_discordant_read_pairs(sample_alignment)
-        get_split_reads(sample_alignment)
+        with TelemetrySpan('extract_sv_indicating_reads',
+                sample_alignment=sample_alignment):
+            get_discordant_read_pairs(sample_alignment)
+            get_split_reads(sample_alignment)
 
         # Add track to JBrowse.
-        add_bam_file_track(alignment_group.reference_genome, sample_alignment,
-                Dataset.TYPE.BWA_ALIGN)
+        with TelemetrySpan('add_jbrowse_bam_track',
+                sample_alignment=sample_alignment):
+            add_bam_file_track(alignment_group.reference_genome,
+                    sample_alignment, Dataset.TYPE.BWA_ALIGN)
 
         bwa_dataset.status = Dataset.STATUS.READY
         bwa_dataset.save()
@@ -192,6 +204,11 @@ def align_with_bwa_mem(alignment_group, sample_alignment):
         sample_alignment.dataset_set.add(error_dataset)
         sample_alignment.save()
 
+        if bwa_dataset.status == Dataset.STATUS.FAILED:
+            alignment_span.finish(SPAN_STATUS__FAILED)
+        else:
+            alignment_span.finish()
+
         return sample_alignment
 
 
@@ -236,13 +253,14 @@ def process_sam_bam_file(sample_alignment, reference_genome,
         bam_file_location = os.path.splitext(sam_file_location)[0] + '.bam'
 
         if effective_mask['make_bam']:
-            with open(bam_file_location, 'w') as fh:
-                subprocess.check_call([
-                    settings.SAMTOOLS_BINARY,
-                    'view',
-                    '-bS',
-                    sam_file_location
-                ], stdout=fh, stderr=error_output)
+            with TelemetrySpan('make_bam', sample_alignment=sample_alignment):
+                with open(bam_file_location, 'w') as fh:
+                    subprocess.check_call([
+                        settings.SAMTOOLS_BINARY,
+                        'view',
+                        '-bS',
+                        sam_file_location
+                    ], stdout=fh, stderr=error_output)
     else:
         bam_file_location = sam_bam_file_location
 
@@ -275,29 +293,38 @@ def process_sam_bam_file(sample_alignment, reference_genome,
                         '-',
                         sorted_bam_file_location])])
 
-        subprocess.check_call(sort_rmdup_cmd, shell=True, stderr=error_output)
+        with TelemetrySpan('sort_rmdup', sample_alignment=sample_alignment):
+            subprocess.check_call(sort_rmdup_cmd, shell=True,
+                    stderr=error_output)
 
         # 2b. Index the sorted result.
-        index_bam_file(sorted_bam_file_location, error_output)
+        with TelemetrySpan('index_sorted_bam',
+                sample_alignment=sample_alignment):
+            index_bam_file(sorted_bam_file_location, error_output)
 
     elif effective_mask['sort']:
         # 2a. Perform the actual sorting.
-        subprocess.check_call([
-            settings.SAMTOOLS_BINARY,
-            'sort',
-            bam_file_location,
-            sorted_output_name
-        ], stderr=error_output)
+        with TelemetrySpan('sort', sample_alignment=sample_alignment):
+            subprocess.check_call([
+                settings.SAMTOOLS_BINARY,
+                'sort',
+                bam_file_location,
+                sorted_output_name
+            ], stderr=error_output)
 
         # 2b. Index the sorted result.
-        index_bam_file(sorted_bam_file_location, error_output)
+        with TelemetrySpan('index_sorted_bam',
+                sample_alignment=sample_alignment):
+            index_bam_file(sorted_bam_file_location, error_output)
 
     # 3. Compute insert size metrics
     # Subsequent steps screw up pairing info so this has to
     # be done here.
     if effective_mask['compute_insert_metrics']:
-        compute_insert_metrics(sorted_bam_file_location,
-                sample_alignment, error_output)
+        with TelemetrySpan('compute_insert_metrics',
+                sample_alignment=sample_alignment):
+            compute_alignment_metrics(sorted_bam_file_location,
+                    sample_alignment)
 
     # 4. Add back MD tags for visualization of mismatches by Jbrowse
     if effective_mask['withmd']:
@@ -310,29 +337,36 @@ def process_sam_bam_file(sample_alignment, reference_genome,
                 reference_genome,
                 Dataset.TYPE.REFERENCE_GENOME_FASTA).get_absolute_location()
 
-        with open(final_bam_location, 'w') as fh:
-            # Add MD tags for Jbrowse visualization
-            subprocess.check_call([
-                settings.SAMTOOLS_BINARY,
-                'fillmd', '-b',
-                sorted_bam_file_location,
-                ref_genome_fasta_location
-            ], stderr=error_output, stdout=fh)
+        with TelemetrySpan('fillmd', sample_alignment=sample_alignment):
+            with open(final_bam_location, 'w') as fh:
+                # Add MD tags for Jbrowse visualization
+                subprocess.check_call([
+                    settings.SAMTOOLS_BINARY,
+                    'fillmd', '-b',
+                    sorted_bam_file_location,
+                    ref_genome_fasta_location
+                ], stderr=error_output, stdout=fh)
 
         # Re-index this new bam file.
-        index_bam_file(final_bam_location, error_output)
+        with TelemetrySpan('index_withmd_bam',
+                sample_alignment=sample_alignment):
+            index_bam_file(final_bam_location, error_output)
 
     else:
         final_bam_location = sorted_bam_file_location
 
     # 5. Compute callable loci
     if effective_mask['compute_callable_loci']:
-        compute_callable_loci(reference_genome, sample_alignment,
-                final_bam_location, error_output)
+        with TelemetrySpan('compute_callable_loci',
+                sample_alignment=sample_alignment):
+            compute_callable_loci(reference_genome, sample_alignment,
+                    final_bam_location, error_output)
 
     # 6. Create index.
     if effective_mask['index']:
-        index_bam_file(final_bam_location, error_output)
+        with TelemetrySpan('index_final_bam',
+                sample_alignment=sample_alignment):
+            index_bam_file(final_bam_location, error_output)
 
     return final_bam_location
 
@@ -353,70 +387,90 @@ def read_group_string(experiment_sample):
     return('\\t'.join(read_group_fields))
 
 
-def compute_insert_metrics(bam_file, sample_alignment, stderr=None):
-    """Computes read fragment insert size distribution.
+# Fields of ExperimentSampleToAlignment set by compute_alignment_metrics().
+ALIGNMENT_METRICS_FIELDS = ['read_length', 'insert_size_mean',
+        'insert_size_stdev']
+
+
+def compute_alignment_metrics(bam_file, sample_alignment):
+    """Computes the read length and insert size distribution of the alignment
+    and stores them on the ExperimentSampleToAlignment.
 
-    Creates a Dataset for each of:
-        * histogram file
-        * file with mean and stdev comma-separated
+    Samples the first settings.ALIGNMENT_METRICS_SAMPLE_SIZE properly-paired
+    records, rather than streaming the whole bam.
+
+    Metrics that can't be computed are stored as -1, so that they aren't
+    computed again.
 
     Raises:
-        ValueError if calculating paired-end distribution failed.
+        ValueError if there are no properly-paired reads to compute the insert
+        size distribution from. The other metrics are stored regardless.
     """
-    histo_file = os.path.splitext(bam_file)[0] + '.insert_size_histogram.txt'
-    mean_stdev_file = (os.path.splitext(bam_file)[0] +
-            '.insert_size_mean_stdev.txt')
-
-    # First, we analyze the bam distribution.
-    read_bam_cmd = [
-            settings.SAMTOOLS_BINARY,
-            'view',
-            bam_file
-    ]
-    p1 = Popen(read_bam_cmd, stdout=PIPE, stderr=stderr)
-
-    read_length = get_read_length(bam_file)
-
-    pairend_distro_cmd = [
-        settings.LUMPY_PAIREND_DISTRO_BIN,
-        '-r', str(read_length),
-        '-X', '4', # num stdevs from end to extend
-        '-N', '10000', # number to sample
-        '-o', histo_file
-    ]
-    p2 = Popen(pairend_distro_cmd, stdin=p1.stdout, stdout=PIPE, stderr=stderr)
-
-    # Allow p1 to receive a SIGPIPE if p2 exits.
-    p1.stdout.close()
-
-    # Run the command and get mean, stdev
-    mean_and_stdev_str = p2.communicate()[0]
-    mean_and_stdev_parts = mean_and_stdev_str.split('\t')
-    if len(mean_and_stdev_parts) != 2:
+    sample_size = settings.ALIGNMENT_METRICS_SAMPLE_SIZE
+    read_lengths = []
+    insert_sizes = []
+    any_paired = False
+
+    bam = pysam.AlignmentFile(bam_file, 'rb')
+    try:
+        for read in bam.fetch(until_eof=True):
+            if read.is_unmapped or read.is_secondary or read.is_supplementary:
+                continue
+
+            if len(read_lengths) < sample_size:
+                read_lengths.append(read.query_length)
+            any_paired = any_paired or read.is_paired
+
+            # Count each pair once, from its leftmost read.
+            if read.is_proper_pair and read.template_length > 0:
+                insert_sizes.append(read.template_length)
+
+            if len(insert_sizes) >= sample_size:
+                break
+            if len(read_lengths) >= sample_size and not any_paired:
+                break
+    finally:
+        bam.close()
+
+    if read_lengths:
+        sample_alignment.read_length = _median(sorted(read_lengths))
+    else:
+        sample_alignment.read_length = -1
+    if insert_sizes:
+        mean, stdev = _get_insert_size_mean_and_stdev(insert_sizes)
+    else:
+        mean, stdev = (-1, -1)
+    sample_alignment.insert_size_mean = mean
+    sample_alignment.insert_size_stdev = stdev
+    sample_alignment.save(update_fields=ALIGNMENT_METRICS_FIELDS)
+
+    if not insert_sizes:
         raise ValueError(
             "Poor alignment. Perhaps you tried aligning to the wrong reference "
             "genome?")
-    raw_mean, raw_stdev = mean_and_stdev_parts
-    mean = int(float(raw_mean.split(':')[1].strip()))
-    stdev = int(float(raw_stdev.split(':')[1].strip()))
 
-    # Lumpy doesn't like stdev of 0.
-    if stdev < 1:
-        stdev = 1
 
-    # Save the histogram file as a Dataset.
-    add_dataset_to_entity(sample_alignment,
-            Dataset.TYPE.LUMPY_INSERT_METRICS_HISTOGRAM,
-            Dataset.TYPE.LUMPY_INSERT_METRICS_HISTOGRAM,
-            filesystem_location=histo_file)
+def _median(sorted_values):
+    return sorted_values[len(sorted_values) / 2]
+
+
+def _get_insert_size_mean_and_stdev(insert_sizes):
+    """Returns (mean, stdev) of the insert sizes as ints, after dropping high
+    outliers the way lumpy's pairend_distro.py does.
+    """
+    insert_sizes = sorted(insert_sizes)
+    median = _median(insert_sizes)
+    upper_mad = _median(sorted(
+            size - median for size in insert_sizes if size >= median))
+    cutoff = median + settings.ALIGNMENT_METRICS_INSERT_SIZE_MADS * upper_mad
+    insert_sizes = [size for size in insert_sizes if size <= cutoff]
+
+    mean = float(sum(insert_sizes)) / len(insert_sizes)
+    stdev = math.sqrt(sum((size - mean) ** 2 for size in insert_sizes) /
+            len(insert_sizes))
 
-    # Write mean, stdev to another file and create another Dataset.
-    with open(mean_stdev_file, 'w') as fh:
-        fh.write("%d,%d" % (mean, stdev))
-    add_dataset_to_entity(sample_alignment,
-            Dataset.TYPE.LUMPY_INSERT_METRICS_MEAN_STDEV,
-            Dataset.TYPE.LUMPY_INSERT_METRICS_MEAN_STDEV,
-            filesystem_location=mean_stdev_file)
+    # Lumpy doesn't like stdev of 0.
+    return (int(mean), max(int(stdev), 1))
 
 
 def compute_callable_loci(reference_genome, sample_alignment,
@@ -517,78 +571,45 @@ def _get_callable_loci_output_filename(bam_file_location):
     return os.path.splitext(bam_file_location)[0] + '.callable_loci.bed'
 
 
-def get_read_length(bam_file):
-    """Returns the median read length for this sample alignment by looking
-    at the, at most, first 1000 reads.
-    """
-    assert len(os.path.splitext(bam_file)[1]), "Invalid bam: %s" % bam_file
-
-    p = subprocess.Popen([settings.SAMTOOLS_BINARY, 'view', bam_file],
-        stdout=subprocess.PIPE)
-
-    lines = 0
-    base_sum = 0
+def get_alignment_metrics(sample_alignment):
+    """Returns the alignment metrics of the sample alignment, computing them
+    if they haven't been yet.
 
-    for line in p.stdout:
-        try:
-            base_sum += len(line.split('\t')[9])
-        except:
-            break
-        lines += 1
-        if lines > 1000:
-            break
-
-    p.stdout.close()
-
-    return int(base_sum / lines)
-
-
-def get_insert_size_mean_and_stdev(sample_alignment, stderr=None, _iteration=0):
-    """Returns a tuple (mean, stdev) for insert sizes from the alignment.
-
-    Calls the compute functoin if metrics don't exist.
-
-    If the insert size can't be calculated, perhaps because of a bad alignment,
-    returns (-1, -1).
+    If the insert size can't be calculated, perhaps because of a bad alignment
+    or unpaired reads, its mean and stdev are -1. Likewise the read length is
+    -1 if there are no mapped reads.
 
     Args:
         sample_alignment: ExperimentSampleToAlignment we want metrics for.
-        iteration: Used internally to avoid getting stuck in case where
-            computation repeatedly fails.
 
     Returns:
-        Tuple of ints (mean, stdev).
+        Dictionary with int values for keys:
+            * read_length
+            * insert_size_mean
+            * insert_size_stdev
     """
-    # Prevent getting stuck in case computation keeps failing.
-    if _iteration >= 3:
-        return (-1, -1)
-
-    def _compute():
-        """Calls compute function then recursively calls
-        get_insert_size_mean_and_stdev().
-        """
+    def _is_missing():
+        return any(getattr(sample_alignment, field) is None
+                for field in ALIGNMENT_METRICS_FIELDS)
+
+    # The instance may have been fetched before the metrics were computed,
+    # e.g. if it was passed to a task.
+    if _is_missing():
+        stored_metrics = ExperimentSampleToAlignment.objects.filter(
+                id=sample_alignment.id).values(*ALIGNMENT_METRICS_FIELDS)[0]
+        for field, value in stored_metrics.iteritems():
+            setattr(sample_alignment, field, value)
+
+    if _is_missing():
         bam_file = get_dataset_with_type(sample_alignment,
                 Dataset.TYPE.BWA_ALIGN).get_absolute_location()
-        compute_insert_metrics(bam_file, sample_alignment, stderr=stderr)
-        return get_insert_size_mean_and_stdev(sample_alignment, stderr,
-                _iteration=_iteration + 1)
-
-    mean_stdev_dataset = get_dataset_with_type(sample_alignment,
-            Dataset.TYPE.LUMPY_INSERT_METRICS_MEAN_STDEV)
-    if not mean_stdev_dataset:
-        return _compute()
-
-    file_location = mean_stdev_dataset.get_absolute_location()
-    if not os.path.exists(file_location):
-        return _compute()
-
-    with open(file_location) as fh:
-        combined_str = fh.read().strip()
-        parts = combined_str.split(',')
-        if not len(parts) == 2:
-            return _compute()
-        else:
-            return tuple([int(p) for p in parts])
+        try:
+            compute_alignment_metrics(bam_file, sample_alignment)
+        except ValueError:
+            pass
+
+    return dict((field, getattr(sample_alignment, field))
+            for field in ALIGNMENT_METRICS_FIELDS)
 
 
 def get_discordant_read_pairs(sample_alignment):
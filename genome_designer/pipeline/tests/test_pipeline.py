@@ -12,9 +12,15 @@ from main.models import AlignmentGroup
 from main.models import Dataset
 from main.models import ExperimentSample
 from main.models import Project
+from main.models import StatusEvent
 from main.models import Variant
 from main.testing_util import FullVCFTestSet
+from pipeline.pipeline_runner import _get_or_create_sample_alignment_datasets
+from pipeline.pipeline_runner import alignment_failed_task
+from pipeline.pipeline_runner import alignment_finished_task
 from pipeline.pipeline_runner import run_pipeline
+from pipeline.pipeline_runner import VARIANT_CALLING_OPTION__COMPLETION_TASK_ID
+from pipeline.pipeline_runner import VARIANT_CALLING_OPTION__PERFORM
 from utils.import_util import copy_and_add_dataset_source
 from utils.import_util import import_reference_genome_from_local_file
 
@@ -279,3 +285,77 @@ class TestAlignmentPipeline(TransactionTestCase):
         # for a failed alignment to the user.
         with self.assertRaises(Exception):
             run_pipeline('name_placeholder', ref_genome, sample_list)
+
+
+class TestAlignmentFinishedTask(TransactionTestCase):
+    """Tests for the handoff from alignment to variant calling.
+    """
+
+    def setUp(self):
+        user = User.objects.create_user(TEST_USERNAME, password=TEST_PASSWORD,
+                email=TEST_EMAIL)
+        self.project = Project.objects.create(owner=user.get_profile(),
+                title='Test Project')
+        self.reference_genome = import_reference_genome_from_local_file(
+                self.project, 'ref_genome', TEST_FASTA, 'fasta')
+        self.alignment_group = AlignmentGroup.objects.create(
+                label='Alignment 1',
+                reference_genome=self.reference_genome,
+                aligner=AlignmentGroup.ALIGNER.BWA,
+                status=AlignmentGroup.STATUS.ALIGNING)
+        sample_list = [
+                ExperimentSample.objects.create(
+                        project=self.project, label='sample%d' % i)
+                for i in range(2)]
+        self.sample_alignments = _get_or_create_sample_alignment_datasets(
+                self.alignment_group, sample_list)
+        self.bwa_datasets = [
+                sa.dataset_set.get(type=Dataset.TYPE.BWA_ALIGN)
+                for sa in self.sample_alignments]
+        self.variant_calling_options = {
+            VARIANT_CALLING_OPTION__PERFORM: False,
+            VARIANT_CALLING_OPTION__COMPLETION_TASK_ID: 'completion_task',
+        }
+
+    def _set_bwa_dataset_status(self, bwa_dataset, status):
+        bwa_dataset.status = status
+        bwa_dataset.save(update_fields=['status'])
+
+    def _get_alignment_group_status(self):
+        return AlignmentGroup.objects.get(id=self.alignment_group.id).status
+
+    def test_waits_for_all_alignments(self):
+        self._set_bwa_dataset_status(self.bwa_datasets[0], Dataset.STATUS.READY)
+        alignment_finished_task(self.alignment_group,
+                self.variant_calling_options)
+        self.assertEqual(AlignmentGroup.STATUS.ALIGNING,
+                self._get_alignment_group_status())
+
+        self._set_bwa_dataset_status(self.bwa_datasets[1], Dataset.STATUS.READY)
+        alignment_finished_task(self.alignment_group,
+                self.variant_calling_options)
+        self.assertEqual(AlignmentGroup.STATUS.COMPLETED,
+                self._get_alignment_group_status())
+
+    def test_fails_without_waiting(self):
+        self._set_bwa_dataset_status(self.bwa_datasets[0],
+                Dataset.STATUS.FAILED)
+        with self.assertRaises(Exception):
+            alignment_finished_task(self.alignment_group,
+                    self.variant_calling_options)
+        self.assertEqual(AlignmentGroup.STATUS.FAILED,
+                self._get_alignment_group_status())
+
+    def test_failed_alignment_publishes_status_events(self):
+        with self.assertRaises(Exception):
+            alignment_failed_task(self.alignment_group,
+                    self.sample_alignments[0], self.variant_calling_options)
+        self.assertEqual(AlignmentGroup.STATUS.FAILED,
+                self._get_alignment_group_status())
+
+        self.assertTrue(StatusEvent.objects.filter(
+                model_name='AlignmentGroup', uid=self.alignment_group.uid,
+                value=AlignmentGroup.STATUS.FAILED).exists())
+        self.assertTrue(StatusEvent.objects.filter(
+                model_name='Dataset', uid=self.bwa_datasets[0].uid,
+                value=Dataset.STATUS.FAILED).exists())
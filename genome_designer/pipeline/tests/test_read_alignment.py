@@ -5,10 +5,12 @@ Tests for read_alignment.py
 import json
 import os
 import subprocess
+import tempfile
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.test import TestCase
+import pysam
 
 from main.models import AlignmentGroup
 from main.models import Dataset
@@ -22,8 +24,7 @@ from pipeline.read_alignment import align_with_bwa_mem
 from pipeline.read_alignment import compute_callable_loci
 from pipeline.read_alignment import get_discordant_read_pairs
 from pipeline.read_alignment import get_split_reads
-from pipeline.read_alignment import get_read_length
-from pipeline.read_alignment import get_insert_size_mean_and_stdev
+from pipeline.read_alignment import get_alignment_metrics
 from pipeline.read_alignment_util import index_bam_file
 from settings import TOOLS_DIR
 from utils.import_util import copy_and_add_dataset_source
@@ -334,15 +335,56 @@ class TestAlignmentPieces(TestCase):
                 stdout=subprocess.PIPE)
         self.assertEqual(3, sum([1 for line in p.stdout]))
 
-    def test_get_read_length(self):
-        bam_file = get_dataset_with_type(self.sample_alignment,
-                Dataset.TYPE.BWA_ALIGN).get_absolute_location()
-        self.assertEqual(70, get_read_length(bam_file))
+    def test_get_alignment_metrics(self):
+        metrics = get_alignment_metrics(self.sample_alignment)
+        self.assertEqual(70, metrics['read_length'])
+        self.assertAlmostEqual(metrics['insert_size_mean'], 498, delta=2)
+        self.assertAlmostEqual(metrics['insert_size_stdev'], 50, delta=1)
+
+        # Stored on the model, so not computed again.
+        with self.assertNumQueries(0):
+            self.assertEqual(metrics,
+                    get_alignment_metrics(self.sample_alignment))
+        sample_alignment = ExperimentSampleToAlignment.objects.get(
+                id=self.sample_alignment.id)
+        self.assertEqual(metrics['insert_size_mean'],
+                sample_alignment.insert_size_mean)
+
+    def test_get_alignment_metrics__unmapped_reads(self):
+        _, unmapped_bam = tempfile.mkstemp(suffix='.bam')
+        header = {'HD': {'VN': '1.0'}, 'SQ': [{'SN': 'chr1', 'LN': 1000}]}
+        output_bam = pysam.AlignmentFile(unmapped_bam, 'wb', header=header)
+        for i in range(10):
+            read = pysam.AlignedSegment()
+            read.query_name = 'r%d' % i
+            read.query_sequence = 'ACGTACGTAC'
+            read.query_qualities = [30] * 10
+            read.flag = 0x4
+            read.reference_id = -1
+            read.reference_start = -1
+            output_bam.write(read)
+        output_bam.close()
 
-    def test_get_insert_size(self):
-        mean, stdev = get_insert_size_mean_and_stdev(self.sample_alignment)
-        self.assertAlmostEqual(mean, 498, delta=2)
-        self.assertAlmostEqual(stdev, 50, delta=1)
+        alignment_group = AlignmentGroup.objects.create(
+                label='unmapped alignment',
+                reference_genome=self.reference_genome)
+        sample_alignment = create_sample_and_alignment(self.project,
+                alignment_group, 'unmapped', unmapped_bam)['sample_alignment']
+        os.remove(unmapped_bam)
+
+        metrics = get_alignment_metrics(sample_alignment)
+        self.assertEqual({
+            'read_length': -1,
+            'insert_size_mean': -1,
+            'insert_size_stdev': -1
+        }, metrics)
+
+        # Stored, so the bam isn't scanned again.
+        sample_alignment = ExperimentSampleToAlignment.objects.get(
+                id=sample_alignment.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(metrics,
+                    get_alignment_metrics(sample_alignment))
 
     def test_get_insert_size__generated_data(self):
         INVERSION_TEST_DATA_DIR = os.path.join(
@@ -366,6 +408,8 @@ class TestAlignmentPieces(TestCase):
                 INVERSION_SAMPLE_BAM)
         sample_alignment = r['sample_alignment']
 
-        mean, stdev = get_insert_size_mean_and_stdev(sample_alignment)
+        metrics = get_alignment_metrics(sample_alignment)
+        mean = metrics['insert_size_mean']
+        stdev = metrics['insert_size_stdev']
         self.assertAlmostEqual(mean, 498, delta=2)
         self.assertAlmostEqual(stdev, 1, delta=1)
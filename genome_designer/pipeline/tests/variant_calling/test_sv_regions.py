@@ -0,0 +1,140 @@
+"""
+Tests for sv_regions.py.
+"""
+
+import os
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+import pysam
+
+from main.models import ExperimentSampleToAlignment
+from main.testing_util import create_common_entities
+from pipeline.variant_calling.sv_regions import extract_region_evidence_bam
+from pipeline.variant_calling.sv_regions import filter_vcf_to_region_core
+from pipeline.variant_calling.sv_regions import get_samtools_region_string
+from pipeline.variant_calling.sv_regions import is_in_region_core
+from pipeline.variant_calling.sv_regions import sv_caller_regions
+from utils.import_util import import_reference_genome_from_local_file
+
+
+REGION = {
+    'chrom': 'chr1',
+    'start': 900,
+    'end': 2100,
+    'core_start': 1000,
+    'core_end': 2000
+}
+
+
+class TestSVRegions(TestCase):
+
+    def test_get_samtools_region_string(self):
+        self.assertEqual('chr1:901-2100', get_samtools_region_string(REGION))
+
+    def test_is_in_region_core(self):
+        self.assertFalse(is_in_region_core(REGION, 'chr1', 1000))
+        self.assertTrue(is_in_region_core(REGION, 'chr1', 1001))
+        self.assertTrue(is_in_region_core(REGION, 'chr1', 2000))
+        self.assertFalse(is_in_region_core(REGION, 'chr1', 2001))
+        self.assertFalse(is_in_region_core(REGION, 'chr2', 1500))
+
+    def test_filter_vcf_to_region_core(self):
+        _, vcf_path = tempfile.mkstemp(suffix='.vcf')
+        try:
+            with open(vcf_path, 'w') as fh:
+                fh.write('##fileformat=VCFv4.1\n')
+                fh.write('#CHROM\tPOS\tID\tREF\tALT\n')
+                for pos in [950, 1500, 2050]:
+                    fh.write('chr1\t%d\t.\tN\t<DEL>\n' % pos)
+
+            filter_vcf_to_region_core(vcf_path, REGION)
+
+            with open(vcf_path) as fh:
+                lines = fh.readlines()
+            self.assertEqual(3, len(lines))
+            self.assertTrue(lines[1].startswith('#CHROM'))
+            self.assertEqual('1500', lines[2].split('\t')[1])
+        finally:
+            os.remove(vcf_path)
+
+    @override_settings(SV_CALLER_REGION_SIZE=1000,
+            SV_CALLER_MIN_REGION_MARGIN=100, SV_CALLER_REGION_MARGIN_STDEVS=4)
+    def test_sv_caller_regions(self):
+        common_entities = create_common_entities()
+
+        _, fasta_path = tempfile.mkstemp(suffix='.fa')
+        try:
+            with open(fasta_path, 'w') as fh:
+                fh.write('>chr1\n%s\n>chr2\n%s\n' % ('A' * 2500, 'C' * 700))
+            ref_genome = import_reference_genome_from_local_file(
+                    common_entities['project'], 'ref_genome', fasta_path,
+                    'fasta')
+        finally:
+            os.remove(fasta_path)
+
+        # Margin of 300 + 4 * 50 bases.
+        sample_alignment = ExperimentSampleToAlignment.objects.create(
+                alignment_group=common_entities['alignment_group_1'],
+                experiment_sample=common_entities['sample_1'],
+                read_length=100, insert_size_mean=300, insert_size_stdev=50)
+
+        regions = sv_caller_regions(ref_genome, sample_alignment)
+        self.assertEqual([
+            ('chr1', 0, 1500, 0, 1000),
+            ('chr1', 500, 2500, 1000, 2000),
+            ('chr1', 1500, 2500, 2000, 2500),
+            ('chr2', 0, 700, 0, 700)
+        ], [(r['chrom'], r['start'], r['end'], r['core_start'],
+                r['core_end']) for r in regions])
+
+    def test_extract_region_evidence_bam(self):
+        _, bam_path = tempfile.mkstemp(suffix='.bam')
+        _, output_bam_path = tempfile.mkstemp(suffix='.bam')
+        try:
+            header = {
+                'HD': {'VN': '1.0'},
+                'SQ': [{'SN': 'chr1', 'LN': 3000}, {'SN': 'chr2', 'LN': 3000}]
+            }
+            input_bam = pysam.AlignmentFile(bam_path, 'wb', header=header)
+            for (name, flag, reference_id, reference_start,
+                    next_reference_id, next_reference_start, sa_tag) in [
+                    ('in_region', 0x0, 0, 1000, -1, -1, None),
+                    ('at_region_end', 0x0, 0, 2100, -1, -1, None),
+                    ('mate_in_region', 0x1, 1, 100, 0, 1200, None),
+                    ('mate_unmapped', 0x1 | 0x8, 1, 100, 0, 1200, None),
+                    ('split_in_region', 0x0, 1, 500, -1, -1,
+                            'chr1,1501,+,10M,60,0;'),
+                    ('split_elsewhere', 0x0, 1, 500, -1, -1,
+                            'chr2,1501,+,10M,60,0;')]:
+                read = pysam.AlignedSegment()
+                read.query_name = name
+                read.query_sequence = 'ACGTACGTAC'
+                read.query_qualities = [30] * 10
+                read.flag = flag
+                read.reference_id = reference_id
+                read.reference_start = reference_start
+                read.next_reference_id = next_reference_id
+                read.next_reference_start = next_reference_start
+                read.cigarstring = '10M'
+                read.mapping_quality = 60
+                if sa_tag is not None:
+                    read.set_tag('SA', sa_tag)
+                input_bam.write(read)
+            input_bam.close()
+
+            extract_region_evidence_bam(bam_path, REGION, output_bam_path)
+
+            output_bam = pysam.AlignmentFile(output_bam_path, 'rb')
+            try:
+                read_names = [read.query_name for read in
+                        output_bam.fetch(until_eof=True)]
+            finally:
+                output_bam.close()
+            self.assertEqual(
+                    ['in_region', 'mate_in_region', 'split_in_region'],
+                    read_names)
+        finally:
+            os.remove(bam_path)
+            os.remove(output_bam_path)
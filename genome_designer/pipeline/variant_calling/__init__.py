@@ -10,6 +10,7 @@ from main.models import AlignmentGroup
 from main.models import Dataset
 from main.models import ensure_exists_0775_dir
 from main.s3 import project_files_needed
+from main.telemetry import TelemetrySpan
 from pipeline.variant_effects import run_snpeff
 from pipeline.variant_calling.common import add_vcf_dataset
 from pipeline.variant_calling.common import get_common_tool_params
@@ -59,7 +60,9 @@ VARIANT_TOOL_PARAMS_MAP = {
 ###############################################################################
 
 @task
-@project_files_needed
+@project_files_needed(paths=lambda alignment_group, variant_params_dict: [
+        alignment_group.get_model_data_dir(),
+        alignment_group.reference_genome.get_model_data_dir()])
 def find_variants_with_tool(alignment_group, variant_params_dict):
     """Applies a variant caller to the alignment data contained within
     alignment_group.
@@ -111,11 +114,16 @@ def find_variants_with_tool(alignment_group, variant_params_dict):
 
     # Run the tool
     common_params.update(tool_kwargs)
+    span_extra = {}
+    if is_parallel_tool:
+        span_extra['region_num'] = tool_kwargs['region_num']
     try:
-        tool_succeeded = tool_function(
-                vcf_output_dir=tool_dir,
-                vcf_output_filename=vcf_output_filename,
-                **common_params)
+        with TelemetrySpan('variant_caller.' + tool_name,
+                alignment_group=alignment_group, **span_extra):
+            tool_succeeded = tool_function(
+                    vcf_output_dir=tool_dir,
+                    vcf_output_filename=vcf_output_filename,
+                    **common_params)
     except Exception as exc:
         alignment_group = AlignmentGroup.objects.get(id=alignment_group.id)
         alignment_group.status = AlignmentGroup.STATUS.FAILED
@@ -143,7 +151,9 @@ def find_variants_with_tool(alignment_group, variant_params_dict):
     # then update the vcf_output_filename and vcf_dataset_type.
     if (tool_name == TOOL_FREEBAYES and
             alignment_group.reference_genome.is_annotated()):
-        vcf_output_filename = run_snpeff(alignment_group, TOOL_FREEBAYES)
+        with TelemetrySpan('snpeff.' + tool_name,
+                alignment_group=alignment_group):
+            vcf_output_filename = run_snpeff(alignment_group, TOOL_FREEBAYES)
         vcf_dataset_type = Dataset.TYPE.VCF_FREEBAYES_SNPEFF
         add_vcf_dataset(alignment_group, vcf_dataset_type, vcf_output_filename)
 
@@ -9,6 +9,7 @@ from uuid import uuid4
 import vcf
 
 from utils.jbrowse_util import add_vcf_track
+from main.dataset_registry import preload_entity_datasets
 from main.models import Dataset
 from main.models import ensure_exists_0775_dir
 from main.model_utils import clean_filesystem_location
@@ -173,6 +174,7 @@ def _find_valid_sample_alignments(alignment_group, alignment_type):
         skipping those that failed. """
     sample_alignment_list = (
             alignment_group.experimentsampletoalignment_set.all())
+    preload_entity_datasets(sample_alignment_list)
 
     # Filter out mis-aligned files.
     # TODO: Should we show in the UI that some alignments failed and are
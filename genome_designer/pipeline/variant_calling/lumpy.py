@@ -16,14 +16,22 @@ from pipeline.variant_calling.constants import TOOL_LUMPY
 from pipeline.read_alignment import get_discordant_read_pairs
 from pipeline.read_alignment import get_split_reads
 from pipeline.variant_calling.common import process_vcf_dataset
+from pipeline.variant_calling.sv_regions import extract_region_evidence_bam
+from pipeline.variant_calling.sv_regions import filter_vcf_to_region_core
+from pipeline.variant_calling.sv_regions import get_sv_caller_preexec_fn
 from pipeline.variant_effects import run_snpeff
 from utils import uppercase_underscore
 
 
 def run_lumpy(
         fasta_ref, sample_alignments, vcf_output_dir, vcf_output_filename,
-        alignment_type, **kwargs):
+        alignment_type, sv_region=None, **kwargs):
     """Runs lumpy.
+
+    If sv_region is given, lumpy only sees the discordant pairs and split
+    reads with a part in that region, and the calls in its core are kept. The
+    full bam is still passed so that the insert size distribution is
+    estimated over the whole sample. See pipeline/variant_calling/sv_regions.py.
     """
     print 'RUNNING LUMPY...'
 
@@ -45,11 +53,27 @@ def run_lumpy(
 
         # Get or create discordant reads.
         bam_disc_dataset = get_discordant_read_pairs(sa)
-        bam_disc_file_list.append(bam_disc_dataset.get_absolute_location())
+        bam_disc_file = bam_disc_dataset.get_absolute_location()
 
         # Get or create split reads.
         bam_sr_dataset = get_split_reads(sa)
-        bam_sr_file_list.append(bam_sr_dataset.get_absolute_location())
+        bam_sr_file = bam_sr_dataset.get_absolute_location()
+
+        # Restrict the evidence to the region.
+        if sv_region is not None:
+            region_root = vcf_output_filename[:-4]
+            region_bam_disc_file = region_root + '.discordant.bam'
+            extract_region_evidence_bam(bam_disc_file, sv_region,
+                    region_bam_disc_file)
+            bam_disc_file = region_bam_disc_file
+
+            region_bam_sr_file = region_root + '.split.bam'
+            extract_region_evidence_bam(bam_sr_file, sv_region,
+                    region_bam_sr_file)
+            bam_sr_file = region_bam_sr_file
+
+        bam_disc_file_list.append(bam_disc_file)
+        bam_sr_file_list.append(bam_sr_file)
 
     lumpy_cmd = [
         settings.LUMPY_EXPRESS_BINARY,
@@ -65,7 +89,12 @@ def run_lumpy(
     # Run Lumpy Express.
     lumpy_error_output = vcf_output_filename + '.error'
     with open(lumpy_error_output, 'w') as error_output_fh:
-        subprocess.check_call(lumpy_cmd, stderr=error_output_fh)
+        subprocess.check_call(lumpy_cmd, stderr=error_output_fh,
+                preexec_fn=get_sv_caller_preexec_fn())
+
+    # Calls in the margins are kept by the neighboring regions.
+    if sv_region is not None and os.path.exists(vcf_output_filename):
+        filter_vcf_to_region_core(vcf_output_filename, sv_region)
 
     return True  # success
 
@@ -11,19 +11,26 @@ import vcf
 
 from main.model_utils import get_dataset_with_type
 from main.models import Dataset
-from pipeline.read_alignment import get_insert_size_mean_and_stdev
+from pipeline.read_alignment import get_alignment_metrics
 from pipeline.variant_calling.common import add_vcf_dataset
 from pipeline.variant_calling.common import common_postprocess_vcf
 from pipeline.variant_calling.common import get_common_tool_params
 from pipeline.variant_calling.common import process_vcf_dataset
 from pipeline.variant_calling.constants import TOOL_PINDEL
+from pipeline.variant_calling.sv_regions import get_samtools_region_string
+from pipeline.variant_calling.sv_regions import get_sv_caller_preexec_fn
+from pipeline.variant_calling.sv_regions import is_in_region_core
 from pipeline.variant_effects import run_snpeff
 from utils import uppercase_underscore
 
 
 def run_pindel(fasta_ref, sample_alignments, vcf_output_dir,
-        vcf_output_filename, alignment_type, **kwargs):
-    """Run pindel to find SVs."""
+        vcf_output_filename, alignment_type, sv_region=None, **kwargs):
+    """Run pindel to find SVs.
+
+    If sv_region is given, only looks in that region, and keeps the calls in
+    its core. See pipeline/variant_calling/sv_regions.py.
+    """
     if not os.path.isdir('%s/pindel' % settings.TOOLS_DIR):
         raise Exception('Pindel is not installed. Aborting.')
 
@@ -32,7 +39,7 @@ def run_pindel(fasta_ref, sample_alignments, vcf_output_dir,
             for sa in sample_alignments]
 
     samples = [sa.experiment_sample for sa in sample_alignments]
-    insert_sizes = [get_insert_size_mean_and_stdev(sa) for sa in
+    insert_sizes = [get_alignment_metrics(sa)['insert_size_mean'] for sa in
             sample_alignments]
 
     assert len(bam_files) == len(insert_sizes)
@@ -45,10 +52,9 @@ def run_pindel(fasta_ref, sample_alignments, vcf_output_dir,
                 bam_files, samples, insert_sizes):
 
             # Skip bad alignments.
-            mean, stdev = insert_size
-            if mean == -1:
+            if insert_size == -1:
                 continue
-            fh.write('%s %s %s\n' % (bam_file, mean, sample.uid))
+            fh.write('%s %s %s\n' % (bam_file, insert_size, sample.uid))
             at_least_one_config_line_written = True
 
     if not at_least_one_config_line_written:
@@ -57,12 +63,16 @@ def run_pindel(fasta_ref, sample_alignments, vcf_output_dir,
 
     # Build the full pindel command.
     pindel_root = vcf_output_filename[:-4]  # get rid of .vcf extension
+    if sv_region is not None:
+        chromosome_arg = get_samtools_region_string(sv_region)
+    else:
+        chromosome_arg = 'ALL'
     subprocess.check_call(['%s/pindel/pindel' % settings.TOOLS_DIR,
         '-f', fasta_ref,
         '-i', pindel_config,
-        '-c', 'ALL',
+        '-c', chromosome_arg,
         '-o', pindel_root
-    ])
+    ], preexec_fn=get_sv_caller_preexec_fn())
 
     # convert all different structural variant types to vcf
     subprocess.check_call(['%s/pindel/pindel2vcf' % settings.TOOLS_DIR,
@@ -73,12 +83,12 @@ def run_pindel(fasta_ref, sample_alignments, vcf_output_dir,
         '-mc', '1',  # just need one read to show 1/1 in vcf
     ])
 
-    postprocess_pindel_vcf(vcf_output_filename)
+    postprocess_pindel_vcf(vcf_output_filename, sv_region=sv_region)
 
     return True # success
 
 
-def postprocess_pindel_vcf(vcf_file):
+def postprocess_pindel_vcf(vcf_file, sv_region=None):
     """Process vcfs output by Pindel, so that the information is
     customized to whatever is needed in Millstone, and the format is
     the same as that of Freebayes.
@@ -86,6 +96,8 @@ def postprocess_pindel_vcf(vcf_file):
     Args:
         vcf_file: This is typically the output of pindel2vcf. This file is
             over-written by this function.
+        sv_region: If Pindel was run over a region, the region. Calls outside
+            of its core are dropped.
     """
     # First create a backup file.
     shutil.copyfile(vcf_file, vcf_file + '.prepostprocess')
@@ -104,6 +116,11 @@ def postprocess_pindel_vcf(vcf_file):
         with open(temp_vcf_filename, 'w') as output_fh:
             vcf_writer = vcf.Writer(output_fh, vcf_reader)
             for record in vcf_reader:
+                # Calls in the margins are kept by the neighboring regions.
+                if sv_region is not None and not is_in_region_core(
+                        sv_region, record.CHROM, record.POS):
+                    continue
+
                 # At least one sample must have gt_type > 0.
                 # TODO(gleb): I'm not sure if gt_type is properly set. Debug by
                 # inspecting the backup file created above.
@@ -0,0 +1,165 @@
+"""
+Splitting structural variant calling into regions.
+
+Pindel and Lumpy are run as one task per sample per region of the genome
+(see sv_caller_regions()). Each region has a core, and the caller is run
+over the core extended on both sides by a margin sized from the sample's
+insert size distribution, so that discordant pairs and split reads
+supporting breakpoints near the edge of the core are seen. A call is kept
+only by the region whose core contains its breakpoint (the VCF POS), so that
+calls in the overlap of neighboring regions aren't reported twice.
+
+Regions are dicts with keys chrom, start, end, core_start and core_end, with
+0-based, half-open coordinates.
+"""
+
+import resource
+import shutil
+
+from django.conf import settings
+import pysam
+
+from main.models import Dataset
+from main.model_utils import get_dataset_with_type
+from pipeline.read_alignment import get_alignment_metrics
+from pipeline.read_alignment_util import ensure_bwa_index
+
+
+def _get_chrom_lengths(ref_genome):
+    """Returns a list of (chrom, length) pairs read from the fasta index.
+    """
+    ref_genome_fasta = get_dataset_with_type(ref_genome,
+            Dataset.TYPE.REFERENCE_GENOME_FASTA).get_absolute_location()
+    ensure_bwa_index(ref_genome_fasta)
+
+    chrom_lengths = []
+    with open(ref_genome_fasta + '.fai') as faidx_fh:
+        for line in faidx_fh:
+            fields = line.strip().split('\t')
+            chrom_lengths.append((fields[0], int(fields[1])))
+    return chrom_lengths
+
+
+def get_sv_region_margin(sample_alignment):
+    """Returns the number of bases each region's core is extended by for the
+    sample.
+    """
+    metrics = get_alignment_metrics(sample_alignment)
+    if metrics['insert_size_mean'] == -1:
+        return settings.SV_CALLER_MIN_REGION_MARGIN
+    return max(settings.SV_CALLER_MIN_REGION_MARGIN,
+            metrics['insert_size_mean'] +
+                    settings.SV_CALLER_REGION_MARGIN_STDEVS *
+                            metrics['insert_size_stdev'])
+
+
+def sv_caller_regions(ref_genome, sample_alignment, region_size=None):
+    """Returns the list of regions to run an SV caller over for the sample.
+
+    The cores are region_size bases long, settings.SV_CALLER_REGION_SIZE by
+    default, except for the last one of each chromosome.
+    """
+    if region_size is None:
+        region_size = settings.SV_CALLER_REGION_SIZE
+    margin = get_sv_region_margin(sample_alignment)
+
+    regions = []
+    for chrom, chrom_len in _get_chrom_lengths(ref_genome):
+        for core_start in range(0, chrom_len, region_size):
+            core_end = min(core_start + region_size, chrom_len)
+            regions.append({
+                'chrom': chrom,
+                'start': max(core_start - margin, 0),
+                'end': min(core_end + margin, chrom_len),
+                'core_start': core_start,
+                'core_end': core_end
+            })
+    return regions
+
+
+def get_samtools_region_string(region):
+    """Returns the region as chrom:start-end, 1-based and inclusive, as taken
+    by samtools and pindel.
+    """
+    return '%s:%d-%d' % (region['chrom'], region['start'] + 1, region['end'])
+
+
+def is_in_region_core(region, chrom, pos):
+    """Returns whether the 1-based position is in the core of the region.
+    """
+    return (chrom == region['chrom'] and
+            region['core_start'] < pos <= region['core_end'])
+
+
+def filter_vcf_to_region_core(vcf_path, region):
+    """Rewrites the vcf keeping only records positioned in the region's core.
+    """
+    temp_vcf_path = vcf_path + '.tmp'
+    with open(vcf_path) as input_fh, open(temp_vcf_path, 'w') as output_fh:
+        for line in input_fh:
+            if not line.startswith('#'):
+                fields = line.split('\t', 2)
+                if not is_in_region_core(region, fields[0], int(fields[1])):
+                    continue
+            output_fh.write(line)
+    shutil.move(temp_vcf_path, vcf_path)
+
+
+def _get_read_positions(read, references):
+    """Returns a list of (chrom, 0-based position) for the read, its mate,
+    and the other parts of a split alignment.
+    """
+    positions = []
+    if not read.is_unmapped:
+        positions.append(
+                (references[read.reference_id], read.reference_start))
+    if read.is_paired and not read.mate_is_unmapped:
+        positions.append(
+                (references[read.next_reference_id], read.next_reference_start))
+    if read.has_tag('SA'):
+        # Semicolon-terminated list of rname,pos,strand,CIGAR,mapQ,NM;
+        for alignment in read.get_tag('SA').split(';'):
+            if alignment:
+                chrom, pos = alignment.split(',')[:2]
+                positions.append((chrom, int(pos) - 1))
+    return positions
+
+
+def extract_region_evidence_bam(bam_path, region, output_bam_path):
+    """Writes the reads in the bam for which the read, its mate or another
+    part of its split alignment lies in the region.
+
+    Meant for the discordant pair and split read bams, which hold a small
+    fraction of the reads, so the whole bam is scanned rather than fetching
+    by region, which would miss mates that lie outside of the region.
+    """
+    input_bam = pysam.AlignmentFile(bam_path, 'rb')
+    try:
+        references = input_bam.references
+        output_bam = pysam.AlignmentFile(output_bam_path, 'wb',
+                template=input_bam)
+        try:
+            for read in input_bam.fetch(until_eof=True):
+                for chrom, pos in _get_read_positions(read, references):
+                    if (chrom == region['chrom'] and
+                            region['start'] <= pos < region['end']):
+                        output_bam.write(read)
+                        break
+        finally:
+            output_bam.close()
+    finally:
+        input_bam.close()
+
+
+def get_sv_caller_preexec_fn():
+    """Returns a function that applies settings.SV_CALLER_MEMORY_LIMIT_MB to
+    a child process, for use as subprocess preexec_fn, or None if there's no
+    limit.
+    """
+    if settings.SV_CALLER_MEMORY_LIMIT_MB is None:
+        return None
+    limit_bytes = settings.SV_CALLER_MEMORY_LIMIT_MB * 1024 * 1024
+
+    def _set_memory_limit():
+        resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+    return _set_memory_limit
@@ -43,6 +43,8 @@ urlpatterns = patterns('',
             'main.views.alignment_view'),
     url(r'^projects/([\w-]+)/alignments/([\w-]+)/error$',
             'main.views.alignment_error_log'),
+    url(r'^projects/([\w-]+)/alignments/([\w-]+)/telemetry$',
+            'main.views.alignment_telemetry_view'),
     url(r'^projects/([\w-]+)/alignments/([\w-]+)/samplealign/([\w-]+)/error$',
             'main.views.sample_alignment_error_view'),
 
@@ -124,6 +126,9 @@ urlpatterns = patterns('',
     url(r'^_/alignmentgroups/delete$',
             'main.xhr_handlers.alignment_groups_delete'),
 
+    url(r'^_/status_events$',
+            'main.xhr_handlers.get_status_events'),
+
     url(r'^_/alignments/generate_contigs$',
             'main.xhr_handlers.generate_contigs'),
     url(r'^_/alignments/download_bam$',
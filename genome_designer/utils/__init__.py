@@ -2,6 +2,7 @@
 Miscellaneous utility functions.
 """
 import collections
+import hashlib
 import os
 import re
 import shutil
@@ -41,6 +42,14 @@ def make_temp_file(label, extension):
     return temp_file_path
 
 
+def calc_file_md5(filepath):
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(128 * md5.block_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
 def internet_on():
     """Check whether we're connected to the Internet.
     """
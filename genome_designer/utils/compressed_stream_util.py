@@ -0,0 +1,442 @@
+"""
+Read-only file-like objects over the decompressed contents of compressed
+files, so that Python code can consume compressed datasets directly rather
+than decompressing them to temporary files first. See Dataset.stream().
+
+gzip files are decompressed in process. BGZF files (written by bgzip, which
+are also valid gzip files) are made of independent blocks, so they can be
+decompressed by several threads at once, and can be seeked to the virtual
+file offsets that bai and tabix indexes use. Other formats are decompressed
+by a subprocess whose output is read through a pipe.
+"""
+
+import bz2
+import struct
+import subprocess
+import tempfile
+import zlib
+
+from multiprocessing.pool import ThreadPool
+
+
+# Size of the reads from compressed files and subprocess pipes.
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Each thread decompresses this many BGZF blocks at a time. Blocks hold at
+# most 64KB of data.
+BGZF_BLOCKS_PER_THREAD = 16
+
+GZIP_MAGIC = '\x1f\x8b'
+
+# ID1, ID2, CM, FLG, MTIME, XFL, OS, XLEN.
+GZIP_HEADER_STRUCT = struct.Struct('<BBBBIBBH')
+
+GZIP_FLAG_EXTRA = 4
+
+# BGZF blocks carry their size in a 'BC' subfield of the gzip extra field.
+BGZF_SUBFIELD_ID = 'BC'
+
+# Lines of a tabix region read are returned this many at a time.
+TABIX_REGION_LINES_PER_CHUNK = 1000
+
+
+class GzipStreamDecompressor(object):
+    """Incrementally decompresses gzip data, including files made of several
+    concatenated gzip members such as those written by bgzip.
+    """
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, chunk):
+        output = []
+        while chunk:
+            output.append(self._decompressor.decompress(chunk))
+            # Anything left over belongs to the next member.
+            chunk = self._decompressor.unused_data
+            if chunk:
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return ''.join(output)
+
+
+class Bz2StreamDecompressor(object):
+    """Incrementally decompresses bzip2 data, including files made of several
+    concatenated streams such as those written by pbzip2.
+    """
+
+    def __init__(self):
+        self._decompressor = bz2.BZ2Decompressor()
+
+    def decompress(self, chunk):
+        output = []
+        while chunk:
+            try:
+                output.append(self._decompressor.decompress(chunk))
+            except EOFError:
+                # The previous stream ended exactly at the end of the last
+                # chunk.
+                self._decompressor = bz2.BZ2Decompressor()
+                continue
+            # Anything left over belongs to the next stream.
+            chunk = self._decompressor.unused_data
+            if chunk:
+                self._decompressor = bz2.BZ2Decompressor()
+        return ''.join(output)
+
+
+def _get_bgzf_block_size(header, extra):
+    """Returns the size of the BGZF block with the given gzip header and
+    extra field, or None if they aren't those of a BGZF block.
+    """
+    id1, id2, method, flags, _, _, _, _ = GZIP_HEADER_STRUCT.unpack(header)
+    if ((chr(id1) + chr(id2)) != GZIP_MAGIC or method != 8 or
+            not flags & GZIP_FLAG_EXTRA):
+        return None
+    position = 0
+    while position + 4 <= len(extra):
+        subfield_id = extra[position:position + 2]
+        subfield_length = struct.unpack('<H',
+                extra[position + 2:position + 4])[0]
+        if subfield_id == BGZF_SUBFIELD_ID and subfield_length == 2:
+            block_size = struct.unpack('<H',
+                    extra[position + 4:position + 6])[0]
+            return block_size + 1
+        position += 4 + subfield_length
+    return None
+
+
+def is_bgzf(path):
+    """Returns whether the file at path is BGZF compressed.
+    """
+    with open(path, 'rb') as fh:
+        header = fh.read(GZIP_HEADER_STRUCT.size)
+        if len(header) < GZIP_HEADER_STRUCT.size:
+            return False
+        extra_length = GZIP_HEADER_STRUCT.unpack(header)[-1]
+        return _get_bgzf_block_size(header, fh.read(extra_length)) is not None
+
+
+def _inflate_bgzf_block(block):
+    """Returns the decompressed data of the raw BGZF block.
+    """
+    extra_length = GZIP_HEADER_STRUCT.unpack(
+            block[:GZIP_HEADER_STRUCT.size])[-1]
+    crc, data_size = struct.unpack('<II', block[-8:])
+    data = zlib.decompress(block[12 + extra_length:-8], -zlib.MAX_WBITS)
+    if len(data) != data_size or zlib.crc32(data) & 0xFFFFFFFF != crc:
+        raise IOError('Corrupt BGZF block')
+    return data
+
+
+class DecompressedReader(object):
+    """Base class for the read-only file-like objects, supporting read(),
+    readline(), iteration and use as a context manager.
+
+    Subclasses implement _read_chunk() which returns the next chunk of
+    decompressed data, or an empty string at the end of the data.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._buffer_position = 0
+        self._at_eof = False
+        self.closed = False
+
+    def _read_chunk(self):
+        raise NotImplementedError
+
+    def _fill_buffer(self):
+        """Replaces the buffer with the next chunk. Returns False at the end
+        of the data.
+        """
+        if self._at_eof:
+            return False
+        self._buffer = self._read_chunk()
+        self._buffer_position = 0
+        if not self._buffer:
+            self._at_eof = True
+        return not self._at_eof
+
+    def _is_buffer_exhausted(self):
+        return self._buffer_position >= len(self._buffer)
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        piece_list = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self._is_buffer_exhausted() and not self._fill_buffer():
+                break
+            end = len(self._buffer)
+            if size >= 0:
+                end = min(end, self._buffer_position + remaining)
+            piece = self._buffer[self._buffer_position:end]
+            self._buffer_position = end
+            piece_list.append(piece)
+            remaining -= len(piece)
+        return ''.join(piece_list)
+
+    def readline(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        piece_list = []
+        while True:
+            if self._is_buffer_exhausted() and not self._fill_buffer():
+                break
+            newline_position = self._buffer.find('\n', self._buffer_position)
+            if newline_position >= 0:
+                end = newline_position + 1
+            else:
+                end = len(self._buffer)
+            piece_list.append(self._buffer[self._buffer_position:end])
+            self._buffer_position = end
+            if newline_position >= 0:
+                break
+        return ''.join(piece_list)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class GzipReader(DecompressedReader):
+    """Reads a gzip file, which may have several members.
+    """
+
+    def __init__(self, path):
+        super(GzipReader, self).__init__()
+        self._fh = open(path, 'rb')
+        self._decompressor = GzipStreamDecompressor()
+
+    def _read_chunk(self):
+        while True:
+            chunk = self._fh.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return ''
+            data = self._decompressor.decompress(chunk)
+            if data:
+                return data
+
+    def close(self):
+        self._fh.close()
+        super(GzipReader, self).close()
+
+
+class BgzfReader(DecompressedReader):
+    """Reads a BGZF file, optionally decompressing blocks with several
+    threads, and supports seeking to virtual file offsets.
+
+    Each chunk of the underlying reader is the data of a single block, so
+    the virtual offset is (offset of the current block << 16) | position in
+    the block's data.
+    """
+
+    def __init__(self, path, num_threads=1):
+        super(BgzfReader, self).__init__()
+        self._fh = open(path, 'rb')
+        self._pool = None
+        if num_threads > 1:
+            self._pool = ThreadPool(num_threads)
+        self._num_blocks_per_batch = max(num_threads, 1) * (
+                BGZF_BLOCKS_PER_THREAD)
+
+        # Decompressed blocks read ahead, as (block offset, data) pairs.
+        self._pending_block_list = []
+
+        # Offset in the file of the block in the buffer.
+        self._block_offset = 0
+
+    def _read_raw_block(self):
+        """Returns the next (block offset, raw block) pair, or None at the
+        end of the file.
+        """
+        block_offset = self._fh.tell()
+        header = self._fh.read(GZIP_HEADER_STRUCT.size)
+        if not header:
+            return None
+        if len(header) < GZIP_HEADER_STRUCT.size:
+            raise IOError('Truncated BGZF block at %d' % block_offset)
+        extra = self._fh.read(GZIP_HEADER_STRUCT.unpack(header)[-1])
+        block_size = _get_bgzf_block_size(header, extra)
+        if block_size is None:
+            raise IOError('Invalid BGZF block at %d' % block_offset)
+        remainder = self._fh.read(block_size - len(header) - len(extra))
+        if len(header) + len(extra) + len(remainder) != block_size:
+            raise IOError('Truncated BGZF block at %d' % block_offset)
+        return (block_offset, header + extra + remainder)
+
+    def _read_blocks(self):
+        """Decompresses the next batch of blocks into the pending list.
+        """
+        raw_block_list = []
+        while len(raw_block_list) < self._num_blocks_per_batch:
+            raw_block = self._read_raw_block()
+            if raw_block is None:
+                break
+            raw_block_list.append(raw_block)
+        raw_data_list = [block for _, block in raw_block_list]
+        if self._pool is not None:
+            data_list = self._pool.map(_inflate_bgzf_block, raw_data_list,
+                    BGZF_BLOCKS_PER_THREAD)
+        else:
+            data_list = [_inflate_bgzf_block(block) for block in raw_data_list]
+        self._pending_block_list = [
+                (block_offset, data) for (block_offset, _), data
+                in zip(raw_block_list, data_list)]
+        self._pending_block_list.reverse()
+
+    def _read_chunk(self):
+        while True:
+            if not self._pending_block_list:
+                self._read_blocks()
+                if not self._pending_block_list:
+                    return ''
+            self._block_offset, data = self._pending_block_list.pop()
+            # Skip empty blocks, like the one marking the end of the file.
+            if data:
+                return data
+
+    def seek_virtual_offset(self, virtual_offset):
+        """Seeks to a virtual file offset, as found in bai and tabix indexes.
+        """
+        block_offset = virtual_offset >> 16
+        position_in_block = virtual_offset & 0xFFFF
+        self._fh.seek(block_offset)
+        self._pending_block_list = []
+        self._at_eof = False
+        self._buffer = ''
+        self._buffer_position = 0
+        if self._fill_buffer() and position_in_block:
+            if self._block_offset != block_offset:
+                raise IOError('No BGZF data at offset %d' % block_offset)
+            if position_in_block > len(self._buffer):
+                raise IOError('Virtual offset %d is past the end of its block'
+                        % virtual_offset)
+            self._buffer_position = position_in_block
+
+    def tell_virtual_offset(self):
+        """Returns the virtual file offset of the next byte to be read.
+        """
+        if self._is_buffer_exhausted():
+            if self._pending_block_list:
+                return self._pending_block_list[-1][0] << 16
+            return self._fh.tell() << 16
+        return (self._block_offset << 16) | self._buffer_position
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self._fh.close()
+        super(BgzfReader, self).close()
+
+
+class ProcessReader(DecompressedReader):
+    """Reads the output of a decompression command, e.g. ('bzcat', path).
+    """
+
+    def __init__(self, command):
+        super(ProcessReader, self).__init__()
+        self._command = command
+        self._stderr_fh = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                stderr=self._stderr_fh)
+
+    def _read_chunk(self):
+        chunk = self._process.stdout.read(READ_CHUNK_SIZE)
+        if not chunk:
+            returncode = self._process.wait()
+            if returncode:
+                self._stderr_fh.seek(0)
+                raise subprocess.CalledProcessError(returncode,
+                        ' '.join(self._command), self._stderr_fh.read())
+        return chunk
+
+    def close(self):
+        # The command is still running if not all of the data was read.
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+        self._stderr_fh.close()
+        super(ProcessReader, self).close()
+
+
+class TabixRegionReader(DecompressedReader):
+    """Reads the header lines of a bgzipped, tabix-indexed file, followed by
+    the lines overlapping a region, like `tabix -h`.
+    """
+
+    def __init__(self, path, chromosome, start, end):
+        # Imported here so that pysam is only needed for region reads.
+        import pysam
+
+        super(TabixRegionReader, self).__init__()
+        self._tabix_file = pysam.Tabixfile(path)
+        header_line_list = list(self._tabix_file.header)
+        if chromosome in self._tabix_file.contigs:
+            region_line_iter = self._tabix_file.fetch(chromosome, start, end)
+        else:
+            region_line_iter = iter([])
+        self._line_iter = iter(header_line_list)
+        self._region_line_iter = region_line_iter
+
+    def _read_chunk(self):
+        line_list = []
+        for line in self._line_iter:
+            line_list.append(line)
+            if len(line_list) == TABIX_REGION_LINES_PER_CHUNK:
+                break
+        if not line_list and self._region_line_iter is not None:
+            self._line_iter = self._region_line_iter
+            self._region_line_iter = None
+            return self._read_chunk()
+        return ''.join(line + '\n' for line in line_list)
+
+    def close(self):
+        self._tabix_file.close()
+        super(TabixRegionReader, self).close()
+
+
+def open_decompressed(path, num_threads=1, region=None,
+        decompress_command=None):
+    """Returns a read-only file-like object over the decompressed contents of
+    the file at path.
+
+    Args:
+        path: Path to the file. Files ending in .gz or .bgz are decompressed
+            in process.
+        num_threads: Number of threads to decompress with, which only helps
+            for BGZF files.
+        region: Optional (chromosome, start, end) tuple, 0-based and
+            half-open. If given, the file must be bgzipped and indexed with
+            tabix, and only the header and the lines overlapping the region
+            are read.
+        decompress_command: Command to decompress other formats, to which
+            path is appended, e.g. ('bzcat',). If None, and the file isn't
+            gzipped, the file is opened as is.
+    """
+    if region is not None:
+        return TabixRegionReader(path, *region)
+    if path.endswith(('.gz', '.bgz')):
+        if is_bgzf(path):
+            return BgzfReader(path, num_threads=num_threads)
+        return GzipReader(path)
+    if decompress_command is not None:
+        return ProcessReader(tuple(decompress_command) + (path,))
+    return open(path, 'rb')
@@ -7,17 +7,21 @@ import copy
 import csv
 from datetime import datetime
 import os
-import re
 import StringIO
-import zipfile
+import subprocess
 
 from Bio import SeqIO
 from django.conf import settings
 import vcf
 
 from main.model_utils import get_dataset_with_type
+from main.model_utils import iter_query_rows
 from main.models import Dataset
+from main.models import VariantAlternate
+from main.s3_sync import MANIFEST_FILENAME
 from utils import lowercase_underscore
+from utils.jbrowse_util import TABIX_BINARY
+from utils.zip_stream_util import generate_zip_stream
 # from variant_calling.common import common_postprocess_vcf
 from variants.dynamic_snp_filter_key_map import update_filter_key_map
 from variants.materialized_variant_filter import get_variants_that_pass_filter
@@ -50,7 +54,7 @@ def export_melted_variant_view(
         ref_genome = alignment_group.reference_genome
 
     mvm = MeltedVariantMaterializedViewManager(ref_genome)
-    mvm.create_if_not_exists_or_invalid()
+    mvm.create_if_not_exists_or_invalid(alignment_group=alignment_group)
 
     # We'll perform a query, using any filter_string provided.
     query_args = {}
@@ -285,10 +289,9 @@ def export_contig_list_as_vcf(contig_list, vcf_dest_path_or_filehandle):
         contig_left, contig_right = contig.contig_insertion_endpoints
 
         # Get Seqrecord
-        contig_fasta = get_dataset_with_type(
-                contig,
-                Dataset.TYPE.REFERENCE_GENOME_FASTA).get_absolute_location()
-        with open(contig_fasta) as fh:
+        contig_fasta_dataset = get_dataset_with_type(
+                contig, Dataset.TYPE.REFERENCE_GENOME_FASTA)
+        with contig_fasta_dataset.stream() as fh:
                 contig_seqrecord = SeqIO.parse(fh, 'fasta').next()
 
         # Determine whether contig is reverse complement relative to reference
@@ -307,11 +310,10 @@ def export_contig_list_as_vcf(contig_list, vcf_dest_path_or_filehandle):
 
         if ref_left > ref_right:
             bases_to_peel_back = ref_left - ref_right
-            ref_genome_fasta = get_dataset_with_type(
+            ref_genome_fasta_dataset = get_dataset_with_type(
                     contig.parent_reference_genome,
-                    Dataset.TYPE.REFERENCE_GENOME_FASTA
-                            ).get_absolute_location()
-            with open(ref_genome_fasta) as fh:
+                    Dataset.TYPE.REFERENCE_GENOME_FASTA)
+            with ref_genome_fasta_dataset.stream() as fh:
                 ref_seqrecord_iter = SeqIO.parse(fh, 'fasta')
                 ref_seqrecord = None
                 for seqrecord in ref_seqrecord_iter:
@@ -328,11 +330,10 @@ def export_contig_list_as_vcf(contig_list, vcf_dest_path_or_filehandle):
             alt_value = peel_back_sequence + cassette_sequence
 
         elif ref_right > ref_left:
-            ref_genome_fasta = get_dataset_with_type(
+            ref_genome_fasta_dataset = get_dataset_with_type(
                     contig.parent_reference_genome,
-                    Dataset.TYPE.REFERENCE_GENOME_FASTA
-                            ).get_absolute_location()
-            with open(ref_genome_fasta) as fh:
+                    Dataset.TYPE.REFERENCE_GENOME_FASTA)
+            with ref_genome_fasta_dataset.stream() as fh:
                 ref_seqrecord_iter = SeqIO.parse(fh, 'fasta')
                 ref_seqrecord = None
                 for seqrecord in ref_seqrecord_iter:
@@ -382,76 +383,190 @@ def export_contig_list_as_vcf(contig_list, vcf_dest_path_or_filehandle):
     update_filter_key_map(contig_0.parent_reference_genome, vcf_filename)
 
 
-def export_variant_set_as_vcf(variant_set, vcf_dest_path_or_filehandle):
+# Query for the rows of a VariantSet vcf, one per VariantAlternate, sorted
+# the way tabix requires.
+VARIANT_SET_VCF_ROWS_SQL = (
+    'SELECT main_variant.id, main_chromosome.seqrecord_id, '
+            'main_variant.position, main_variant.uid, main_variant.ref_value, '
+            'main_variantalternate.alt_value '
+        'FROM main_varianttovariantset '
+            'INNER JOIN main_variant ON '
+                    'main_variant.id = main_varianttovariantset.variant_id '
+            'INNER JOIN main_chromosome ON '
+                    'main_chromosome.id = main_variant.chromosome_id '
+            'LEFT JOIN main_variantalternate ON '
+                    'main_variantalternate.variant_id = main_variant.id '
+        'WHERE main_varianttovariantset.variant_set_id = %s '
+        'ORDER BY main_chromosome.id, main_variant.position, main_variant.id'
+)
+
+# Columns after ALT, which are the same for every exported Variant. The single
+# placeholder sample is homozygous for the alt.
+VARIANT_SET_VCF_ROW_SUFFIX = '\t'.join([
+    '1', # QUAL
+    'PASS', # FILTER
+    '.', # INFO
+    'GT', # FORMAT
+    '1/1', # PLACEHOLDER_SAMPLE_NAME
+]) + '\n'
+
+
+def _read_vcf_template_header():
+    """Returns the header lines of the vcf template, including the #CHROM
+    line.
+    """
+    with open(VCF_TEMPLATE_PATH) as template_fh:
+        return ''.join(line for line in template_fh if line.startswith('#'))
+
+
+def _iter_variant_set_vcf_lines(variant_set):
+    """Generator over the data lines of the vcf for the VariantSet.
+
+    The Variants, their Chromosomes and VariantAlternates are read with a
+    single query through a server-side cursor.
+    """
+    ref_genome = variant_set.reference_genome
+
+    def _format_line(row, alt_value):
+        (_, seqrecord_id, position, uid, ref_value, _) = row
+        return '\t'.join([seqrecord_id, str(position), uid, ref_value,
+                VariantAlternate.resolve_alt_value(ref_genome, alt_value),
+                VARIANT_SET_VCF_ROW_SUFFIX])
+
+    # Rows for the same Variant are adjacent, so we only need to look at the
+    # next row to check that each Variant has exactly one alt.
+    prev_row = None
+    for row in iter_query_rows(VARIANT_SET_VCF_ROWS_SQL, (variant_set.id,)):
+        assert row[5] is not None, (
+                "Only support variants with exactly one alt.")
+        if prev_row is not None:
+            assert row[0] != prev_row[0], (
+                    "Only support variants with exactly one alt.")
+            yield _format_line(prev_row, prev_row[5])
+        prev_row = row
+    if prev_row is not None:
+        yield _format_line(prev_row, prev_row[5])
+
+
+def export_variant_set_as_vcf(variant_set, vcf_dest_path_or_filehandle,
+        bgzip=False):
     """Exports a VariantSet as a vcf.
+
+    Args:
+        variant_set: The VariantSet to export.
+        vcf_dest_path_or_filehandle: Path or open filehandle to write to.
+        bgzip: If True, vcf_dest_path_or_filehandle must be a path. The vcf
+            is compressed with bgzip as it is written and indexed with tabix,
+            creating <path>.tbi.
     """
+    if bgzip:
+        assert isinstance(vcf_dest_path_or_filehandle, str), (
+                "bgzip output requires a destination path.")
+        with open(vcf_dest_path_or_filehandle, 'w') as out_fh:
+            bgzip_proc = subprocess.Popen([settings.BGZIP_BINARY, '-c'],
+                    stdin=subprocess.PIPE, stdout=out_fh)
+            try:
+                _write_variant_set_vcf(variant_set, bgzip_proc.stdin)
+            finally:
+                bgzip_proc.stdin.close()
+                bgzip_returncode = bgzip_proc.wait()
+        if bgzip_returncode:
+            raise subprocess.CalledProcessError(bgzip_returncode,
+                    settings.BGZIP_BINARY)
+        subprocess.check_call([TABIX_BINARY, '-f', '-p', 'vcf',
+                vcf_dest_path_or_filehandle])
+        return
+
     # Allow dest input as path or filehandle.
     if isinstance(vcf_dest_path_or_filehandle, str):
-        out_vcf_fh = open(vcf_dest_path_or_filehandle, 'w')
+        with open(vcf_dest_path_or_filehandle, 'w') as out_vcf_fh:
+            _write_variant_set_vcf(variant_set, out_vcf_fh)
     else:
-        out_vcf_fh = vcf_dest_path_or_filehandle
+        _write_variant_set_vcf(variant_set, vcf_dest_path_or_filehandle)
 
-    # The vcf.Writer() requires a template vcf in order to structure itself.
-    # We read in a generic template to satisfy this.
-    with open(VCF_TEMPLATE_PATH) as template_fh:
-        vcf_template = vcf.Reader(template_fh)
 
-    vcf_writer = vcf.Writer(out_vcf_fh, vcf_template)
-    for variant in variant_set.variants.all():
-        alts = variant.get_alternates()
-        assert len(alts) == 1, "Only support variants with exactly one alt."
-        alt_value = alts[0]
+def _write_variant_set_vcf(variant_set, out_vcf_fh):
+    # The header is that of the generic template vcf, which declares the
+    # placeholder sample.
+    out_vcf_fh.write(_read_vcf_template_header())
+    for line in _iter_variant_set_vcf_lines(variant_set):
+        out_vcf_fh.write(line)
 
-        record = vcf.model._Record(
-                variant.chromosome.seqrecord_id,
-                variant.position,
-                variant.uid,
-                variant.ref_value,
-                (alt_value,),
-                1, # QUAL
-                [], # FILTER
-                {}, # INFO
-                'GT:DP:RO:QR:AO:QA:GL', # FORMAT
-                {PLACEHOLDER_SAMPLE_NAME: 0}, # sample_indexes
-        )
-        # Add a placeholder sample.
-        calldata_type = vcf.model.make_calldata_tuple(['GT'])
-        placeholder_sample_data = calldata_type(GT='1/1')
-        record.samples = [vcf.model._Call(
-                record, PLACEHOLDER_SAMPLE_NAME, placeholder_sample_data)]
-        vcf_writer.write_record(record)
+
+# Extensions of files that are already compressed, which are stored in
+# project exports rather than compressed again.
+PROJECT_EXPORT_STORED_EXTENSIONS = set([
+    '.bam', '.bgz', '.bz2', '.gz', '.jpg', '.png', '.tbi', '.zip',
+])
+
+# Extensions of files that the app regenerates from the rest of the project
+# data, such as indexes, which can be left out of project exports.
+PROJECT_EXPORT_REGENERABLE_EXTENSIONS = set([
+    # Bam and fasta indexes.
+    '.bai', '.fai',
+    # Bwa index.
+    '.amb', '.ann', '.bwt', '.pac', '.sa',
+])
+
+# Bookkeeping files that are never exported.
+PROJECT_EXPORT_IGNORED_FILENAMES = set([
+    MANIFEST_FILENAME,
+])
 
 
-def export_project_as_zip(project):
-    """Compresses project and generates link for download.
+def get_project_export_filename(project):
+    return '{common_root}_{proj_title}_{timestamp}.zip'.format(
+            common_root='millstone_export',
+            proj_title=lowercase_underscore(project.title[:20]),
+            timestamp=datetime.now().strftime('%Y_%m_%d_%H%M'))
+
+
+def iter_project_export_files(project, exclude_regenerable=False):
+    """Yields (path, archive_path, compress) for each file in the project
+    export.
+
+    Archive paths start at the project uid. If exclude_regenerable is True,
+    indexes and JBrowse data are left out.
+    """
+    project_root_dir = project.get_model_data_dir()
+    archive_root = os.path.dirname(project_root_dir)
+
+    regenerable_dir_set = set()
+    if exclude_regenerable:
+        regenerable_dir_set = set(ref_genome.get_jbrowse_directory_path()
+                for ref_genome in project.referencegenome_set.all())
+
+    for root, dirs, files in os.walk(project_root_dir):
+        # Pruning dirs in place keeps os.walk from descending into them.
+        dirs[:] = sorted(d for d in dirs
+                if os.path.join(root, d) not in regenerable_dir_set)
+        for filename in sorted(files):
+            if filename in PROJECT_EXPORT_IGNORED_FILENAMES:
+                continue
+            extension = os.path.splitext(filename)[1].lower()
+            if (exclude_regenerable and
+                    extension in PROJECT_EXPORT_REGENERABLE_EXTENSIONS):
+                continue
+            full_path = os.path.join(root, filename)
+            yield (full_path, os.path.relpath(full_path, archive_root),
+                    extension not in PROJECT_EXPORT_STORED_EXTENSIONS)
+
+
+def export_project_as_zip(project, exclude_regenerable=False,
+        num_threads=None):
+    """Generator that yields the project data as a zip archive, so it can be
+    streamed in a download response without writing the archive to disk.
+
+    Files that are already compressed, like bams and bgzipped vcfs, are stored
+    as they are. The rest are compressed using num_threads threads, which
+    defaults to settings.PROJECT_EXPORT_COMPRESSION_THREADS.
     """
-    # Common root for exported zip file.
-    COMMON_EXPORT_ROOT = 'millstone_export'
-
-    # Delete previous export files to avoid overwhelming space.
-    for f in os.listdir(settings.TEMP_FILE_ROOT):
-        if re.match(COMMON_EXPORT_ROOT, f):
-            os.remove(os.path.join(settings.TEMP_FILE_ROOT, f))
-
-    project_export_zip_name = (
-            '{common_root}_{proj_title}_{timestamp}.zip'.format(
-                    common_root=COMMON_EXPORT_ROOT,
-                    proj_title=lowercase_underscore(project.title[:20]),
-                    timestamp=datetime.now().strftime('%Y_%m_%d_%H%M')))
-    project_zip_dest = os.path.join(
-            settings.TEMP_FILE_ROOT, project_export_zip_name)
-    with zipfile.ZipFile(project_zip_dest, 'w', allowZip64=True) as ziph:
-        project_root_dir = project.get_model_data_dir()
-        for root, dirs, files in os.walk(project_root_dir):
-            for file in files:
-                full_path = os.path.join(root, file)
-                # Write to destination in archive that omits part of path
-                # before project uid.
-                archive_target_path = (
-                        re.search(project.uid + '.*', full_path).group())
-                ziph.write(full_path, archive_target_path)
-
-    return os.path.join('/tmp', project_export_zip_name)
+    if num_threads is None:
+        num_threads = settings.PROJECT_EXPORT_COMPRESSION_THREADS
+    return generate_zip_stream(
+            iter_project_export_files(project,
+                    exclude_regenerable=exclude_regenerable),
+            num_threads=num_threads)
 
 
 CONTIG_CSV_FIELD_NAMES = [
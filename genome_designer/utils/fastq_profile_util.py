@@ -0,0 +1,306 @@
+"""
+Streaming profile of the reads in a fastq file.
+
+The profile is computed natively from chunks of the file as they're read, so
+it can be computed in the same pass that copies the file during sample
+import. It replaces FastQC on the critical path: the phred encoding it
+determines is what get_clipped_reads_smart() needs, and the rest is a summary
+of read quality similar to FastQC's, stored as JSON with the
+ExperimentSample. FastQC html reports remain available as an optional
+background task.
+
+Quality and base composition statistics are accumulated as per-position
+histograms with numpy, so the only per-read Python work is splitting lines.
+"""
+
+import hashlib
+import itertools
+import os
+
+import numpy as np
+
+from main.models import Dataset
+from utils.compressed_stream_util import Bz2StreamDecompressor
+from utils.compressed_stream_util import GzipStreamDecompressor
+
+
+# Phred encodings, named as FastQC names them since that's where they used to
+# come from.
+PHRED_ENCODING__SANGER = 'Sanger / Illumina 1.9'
+PHRED_ENCODING__ILLUMINA_1_3 = 'Illumina 1.3'
+PHRED_ENCODING__ILLUMINA_1_5 = 'Illumina 1.5'
+
+PHRED_ENCODING_TO_OFFSET = {
+    PHRED_ENCODING__SANGER: 33,
+    PHRED_ENCODING__ILLUMINA_1_3: 64,
+    PHRED_ENCODING__ILLUMINA_1_5: 64,
+}
+
+# Quantiles of quality reported for each position in the reads.
+PROFILE_QUALITY_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# The duplicate level is estimated from this many reads at the start of the
+# file, comparing only the first bases of each read, as FastQC does.
+DUPLICATE_SAMPLE_NUM_READS = 100000
+DUPLICATE_SAMPLE_PREFIX_LENGTH = 50
+
+# Quality characters are ascii.
+NUM_QUALITY_CHARS = 128
+
+
+def determine_phred_encoding(lowest_quality_char):
+    """Returns the phred encoding given the ordinal of the lowest quality
+    character in a fastq, or None if it doesn't match a known encoding.
+
+    Uses the same rule as FastQC.
+    """
+    if lowest_quality_char is None or lowest_quality_char < 33:
+        return None
+    elif lowest_quality_char < 64:
+        return PHRED_ENCODING__SANGER
+    elif lowest_quality_char == 65:
+        return PHRED_ENCODING__ILLUMINA_1_3
+    elif lowest_quality_char <= 126:
+        return PHRED_ENCODING__ILLUMINA_1_5
+    return None
+
+
+def _add_counts(counts, new_counts):
+    """Returns the sum of the count arrays, padding the first axis of the
+    shorter one with zeros.
+    """
+    if counts is None:
+        return new_counts
+    if len(new_counts) > len(counts):
+        counts, new_counts = new_counts, counts
+    counts = counts.copy()
+    counts[:len(new_counts)] += new_counts
+    return counts
+
+
+def _get_positions_in_reads(length_array):
+    """Returns the position within its read of each character of the reads
+    concatenated, given the array of read lengths.
+    """
+    read_start_array = np.cumsum(length_array) - length_array
+    return (np.arange(length_array.sum()) -
+            np.repeat(read_start_array, length_array))
+
+
+class FastqProfiler(object):
+    """Accumulates the profile of the reads in a fastq from successive chunks
+    of its decompressed text.
+    """
+
+    def __init__(self):
+        self.num_reads = 0
+
+        # Indexed by position in read, then quality character.
+        self._quality_counts = None
+        # Indexed by position in read.
+        self._base_counts = None
+        self._n_counts = None
+        # Indexed by read length.
+        self._read_length_counts = None
+
+        self._duplicate_sample_set = set()
+        self._num_duplicate_sample_reads = 0
+
+        self._partial_data = ''
+
+    def update(self, data):
+        if '\r' in data:
+            data = data.replace('\r', '')
+        line_list = (self._partial_data + data).split('\n')
+
+        # Keep incomplete records for the next chunk.
+        num_complete_lines = len(line_list) - 1
+        num_complete_lines -= num_complete_lines % 4
+        self._partial_data = '\n'.join(line_list[num_complete_lines:])
+        self._add_records(line_list[:num_complete_lines])
+
+    def finish(self):
+        """Adds the last record, which may not end in a newline.
+        """
+        line_list = self._partial_data.split('\n')
+        self._partial_data = ''
+        self._add_records(line_list[:len(line_list) - len(line_list) % 4])
+
+    def _add_records(self, line_list):
+        seq_list = line_list[1::4]
+        quality_list = line_list[3::4]
+        if not quality_list:
+            return
+        self.num_reads += len(quality_list)
+
+        quality_length_array = np.fromiter(
+                itertools.imap(len, quality_list), dtype=np.int64,
+                count=len(quality_list))
+        quality_array = np.frombuffer(''.join(quality_list), dtype=np.uint8)
+        quality_position_array = _get_positions_in_reads(quality_length_array)
+        if len(quality_array):
+            max_length = quality_position_array.max() + 1
+            self._quality_counts = _add_counts(self._quality_counts,
+                    np.bincount(
+                            quality_position_array * NUM_QUALITY_CHARS +
+                                    np.minimum(quality_array,
+                                            NUM_QUALITY_CHARS - 1),
+                            minlength=max_length * NUM_QUALITY_CHARS
+                    ).reshape((max_length, NUM_QUALITY_CHARS)))
+        self._read_length_counts = _add_counts(self._read_length_counts,
+                np.bincount(quality_length_array))
+
+        seq_length_array = np.fromiter(
+                itertools.imap(len, seq_list), dtype=np.int64,
+                count=len(seq_list))
+        seq_array = np.frombuffer(''.join(seq_list), dtype=np.uint8)
+        seq_position_array = _get_positions_in_reads(seq_length_array)
+        self._base_counts = _add_counts(self._base_counts,
+                np.bincount(seq_position_array))
+        self._n_counts = _add_counts(self._n_counts,
+                np.bincount(seq_position_array[seq_array == ord('N')],
+                        minlength=len(self._base_counts)))
+
+        if self._num_duplicate_sample_reads < DUPLICATE_SAMPLE_NUM_READS:
+            sample_list = seq_list[:DUPLICATE_SAMPLE_NUM_READS -
+                    self._num_duplicate_sample_reads]
+            self._duplicate_sample_set.update(
+                    seq[:DUPLICATE_SAMPLE_PREFIX_LENGTH]
+                    for seq in sample_list)
+            self._num_duplicate_sample_reads += len(sample_list)
+
+    def get_lowest_quality_char(self):
+        if self._quality_counts is None:
+            return None
+        seen_char_array = np.nonzero(self._quality_counts.sum(axis=0))[0]
+        if not len(seen_char_array):
+            return None
+        return int(seen_char_array[0])
+
+    def get_phred_encoding(self):
+        return determine_phred_encoding(self.get_lowest_quality_char())
+
+    def get_profile(self):
+        """Returns the profile as a json-serializable dictionary with keys:
+            * num_reads, num_bases
+            * phred_encoding: None if it couldn't be determined, in which
+                  case qualities assume an offset of 33.
+            * read_length_distribution: Dictionary from length to count.
+            * per_position_quality: Dictionary with keys quantiles, mean and
+                  one key per quantile, each a list by position in read.
+            * n_fraction, per_position_n_fraction: Fraction of bases that
+                  are N, overall and by position in read.
+            * duplicate_fraction_estimate, duplicate_sample_size: Fraction of
+                  the reads at the start of the file that duplicate another
+                  read there, and the number of reads sampled.
+        """
+        self.finish()
+
+        phred_encoding = self.get_phred_encoding()
+        profile = {
+            'num_reads': self.num_reads,
+            'num_bases': 0,
+            'phred_encoding': phred_encoding,
+            'read_length_distribution': {},
+            'per_position_quality': {},
+            'n_fraction': None,
+            'per_position_n_fraction': [],
+            'duplicate_fraction_estimate': None,
+            'duplicate_sample_size': self._num_duplicate_sample_reads,
+        }
+
+        if self._read_length_counts is not None:
+            profile['read_length_distribution'] = dict(
+                    (int(length), int(count)) for length, count in
+                    enumerate(self._read_length_counts) if count)
+
+        if self._quality_counts is not None:
+            offset = PHRED_ENCODING_TO_OFFSET.get(phred_encoding, 33)
+            quality_values = np.arange(NUM_QUALITY_CHARS) - offset
+            cumulative_counts = self._quality_counts.cumsum(axis=1)
+            position_totals = cumulative_counts[:, -1]
+            per_position_quality = {
+                'quantiles': PROFILE_QUALITY_QUANTILES,
+                'mean': np.round(
+                        self._quality_counts.dot(quality_values) /
+                                np.maximum(position_totals, 1).astype(float),
+                        2).tolist(),
+            }
+            for quantile in PROFILE_QUALITY_QUANTILES:
+                # Index of the first quality char reaching the quantile.
+                char_idx_array = (cumulative_counts <
+                        quantile * position_totals[:, np.newaxis]).sum(axis=1)
+                per_position_quality[str(quantile)] = (
+                        quality_values[char_idx_array].tolist())
+            profile['per_position_quality'] = per_position_quality
+
+        if self._base_counts is not None:
+            num_bases = int(self._base_counts.sum())
+            profile['num_bases'] = num_bases
+            if num_bases:
+                profile['n_fraction'] = round(
+                        float(self._n_counts.sum()) / num_bases, 6)
+            profile['per_position_n_fraction'] = np.round(
+                    self._n_counts /
+                            np.maximum(self._base_counts, 1).astype(float),
+                    6).tolist()
+
+        if self._num_duplicate_sample_reads:
+            profile['duplicate_fraction_estimate'] = round(1 - (
+                    float(len(self._duplicate_sample_set)) /
+                    self._num_duplicate_sample_reads), 6)
+
+        return profile
+
+
+def _get_incremental_decompress_fn(path):
+    """Returns a function that takes successive chunks of the file at path and
+    returns the decompressed data in them, or None if the file is compressed
+    in a format we can't decompress incrementally.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in Dataset.COMPRESSION_TYPES:
+        return lambda chunk: chunk
+    elif extension in ('.gz', '.bgz'):
+        return GzipStreamDecompressor().decompress
+    elif extension == '.bz2':
+        return Bz2StreamDecompressor().decompress
+    return None
+
+
+class FastqStats(object):
+    """Computes stats for a fastq file from the chunks of the file as they're
+    read, so that they can be computed in the same pass that copies the file.
+
+    Computes the md5 of the file as stored, and the FastqProfiler profile of
+    the decompressed reads.
+    """
+
+    def __init__(self, path):
+        self._md5 = hashlib.md5()
+        self._decompress = _get_incremental_decompress_fn(path)
+        self._profiler = FastqProfiler()
+
+    def update(self, chunk):
+        self._md5.update(chunk)
+        if self._decompress is not None:
+            self._profiler.update(self._decompress(chunk))
+
+    def get_stats(self):
+        """Returns a dictionary with keys md5, num_reads, phred_encoding and
+        profile.
+
+        All but md5 are None if the file couldn't be decompressed.
+        """
+        stats = {
+            'md5': self._md5.hexdigest(),
+            'num_reads': None,
+            'phred_encoding': None,
+            'profile': None,
+        }
+        if self._decompress is not None:
+            profile = self._profiler.get_profile()
+            stats['num_reads'] = profile['num_reads']
+            stats['phred_encoding'] = profile['phred_encoding']
+            stats['profile'] = profile
+        return stats
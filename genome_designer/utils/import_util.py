@@ -4,6 +4,7 @@ Methods related to importing data.
 
 import copy
 import csv
+import json
 import os
 import shutil
 import re
@@ -11,6 +12,8 @@ import subprocess
 from tempfile import mkdtemp
 from tempfile import mkstemp
 from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile
+import zipfile
 
 from BCBio import GFF
 from Bio import Entrez
@@ -30,11 +33,13 @@ from main.models import VariantSet
 from main.models import VariantToVariantSet
 from main.model_utils import clean_filesystem_location
 from main.model_utils import get_dataset_with_type
+from main.s3 import no_project_files
 from main.s3 import project_files_needed
 from pipeline.read_alignment_util import ensure_bwa_index
 from pipeline.variant_effects import build_snpeff
 from utils import generate_safe_filename_prefix_from_label
 from utils import uppercase_underscore
+from utils.fastq_profile_util import FastqStats
 from utils.genbank_util import generate_gbk_feature_index
 from utils.jbrowse_util import prepare_jbrowse_ref_sequence
 from utils.jbrowse_util import add_genbank_file_track
@@ -79,6 +84,22 @@ PRE_DEFINED_SAMPLE_UPLOAD_THROUGH_BROWSER_PARTS = (
 
 REQUIRED_VCF_HEADER_PART = ['CHROM', 'POS', 'ID', 'REF', 'ALT']
 
+# Size of the reads used when copying fastq files. Large reads keep the disks
+# streaming rather than seeking back and forth between source and dest.
+FASTQ_COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Prefix of the ExperimentSample.data keys holding the md5 and number of reads
+# of each fastq, computed while it's copied.
+FASTQ_DATASET_TYPE_TO_DATA_KEY_PREFIX = {
+    Dataset.TYPE.FASTQ1: 'fastq1',
+    Dataset.TYPE.FASTQ2: 'fastq2',
+}
+
+FASTQ_DATASET_TYPE_TO_PROFILE_DATASET_TYPE = {
+    Dataset.TYPE.FASTQ1: Dataset.TYPE.FASTQ1_PROFILE,
+    Dataset.TYPE.FASTQ2: Dataset.TYPE.FASTQ2_PROFILE,
+}
+
 
 if settings.S3_ENABLED:
     from main.s3 import s3_temp_get, s3_get
@@ -88,7 +109,7 @@ if settings.S3_ENABLED:
             return import_reference_genome_from_local_file(
                     project, label, f, import_format)
 
-    @project_files_needed
+    @project_files_needed(paths=no_project_files)
     def import_samples_from_s3(project, targets_file_rows, s3files):
         tmp_dir = mkdtemp()
         local_s3files_map = {}
@@ -124,7 +145,7 @@ class DataImportError(Exception):
         return 'DataImportError: ' + str(self.msg)
 
 
-@project_files_needed
+@project_files_needed(paths=no_project_files)
 def import_reference_genome_from_local_file(project, label, file_location,
         import_format, move=False):
     """Creates a ReferenceGenome associated with the given Project.
@@ -386,7 +407,7 @@ def _assert_sample_targets_file_size(targets_file):
                 "Targets file is too large: %d" % targets_file.size)
 
 
-@project_files_needed
+@project_files_needed(paths=no_project_files)
 def import_samples_from_targets_file(project, targets_file, options={}):
     """Uses the uploaded targets file to add a set of samples to the project.
     We need to check each line of the targets file for consistency before we
@@ -507,26 +528,107 @@ def _create_fastq_dataset(experiment_sample, fastq_source, dataset_type,
     return reads_dataset
 
 
+def copy_fastq_with_stats(source, dest, move=False):
+    """Copies the fastq file at source to dest, computing its FastqStats in
+    the same pass over the data.
+
+    If move is True, the file is moved instead, which is a rename when source
+    and dest are on the same filesystem, and the stats are computed from a
+    read of dest.
+
+    Returns:
+        Dictionary of stats as returned by FastqStats.get_stats().
+    """
+    fastq_stats = FastqStats(source)
+
+    if source == dest or move:
+        if source != dest:
+            shutil.move(source, dest)
+        with open(dest, 'rb') as dest_fh:
+            for chunk in iter(lambda: dest_fh.read(FASTQ_COPY_BUFFER_SIZE), ''):
+                fastq_stats.update(chunk)
+    else:
+        with open(source, 'rb') as source_fh, open(dest, 'wb') as dest_fh:
+            for chunk in iter(
+                    lambda: source_fh.read(FASTQ_COPY_BUFFER_SIZE), ''):
+                fastq_stats.update(chunk)
+                dest_fh.write(chunk)
+        # Match shutil.copy(), which this replaces.
+        shutil.copymode(source, dest)
+
+    return fastq_stats.get_stats()
+
+
+def update_experiment_sample_fastq_stats(experiment_sample, dataset_type,
+        fastq_stats):
+    """Stores the md5 and number of reads of the fastq in the ExperimentSample
+    data, as well as the phred encoding if not already known, and saves the
+    full profile of the reads as a json Dataset.
+    """
+    data_key_prefix = FASTQ_DATASET_TYPE_TO_DATA_KEY_PREFIX[dataset_type]
+    experiment_sample.data[data_key_prefix + '_md5'] = fastq_stats['md5']
+    experiment_sample.data[data_key_prefix + '_num_reads'] = (
+            fastq_stats['num_reads'])
+    if (fastq_stats['phred_encoding'] is not None and
+            not experiment_sample.data.get('phred_encoding')):
+        experiment_sample.data['phred_encoding'] = (
+                fastq_stats['phred_encoding'])
+    experiment_sample.save(update_fields=['data'])
+
+    if fastq_stats['profile'] is not None:
+        _save_fastq_profile(experiment_sample, dataset_type,
+                fastq_stats['profile'])
+
+
+def _save_fastq_profile(experiment_sample, dataset_type, profile):
+    """Writes the profile of the fastq reads to a json file and adds the
+    Dataset pointing to it, unless it already exists.
+    """
+    profile_path = os.path.join(experiment_sample.get_model_data_dir(),
+            FASTQ_DATASET_TYPE_TO_DATA_KEY_PREFIX[dataset_type] +
+                    '_profile.json')
+    with open(profile_path, 'w') as profile_fh:
+        json.dump(profile, profile_fh)
+
+    profile_dataset_type = FASTQ_DATASET_TYPE_TO_PROFILE_DATASET_TYPE[
+            dataset_type]
+    if get_dataset_with_type(experiment_sample, profile_dataset_type) is None:
+        add_dataset_to_entity(experiment_sample, profile_dataset_type,
+                profile_dataset_type, profile_path)
+
+
 def _copy_dataset_data(experiment_sample, fastq_source, dataset_type,
             move=False, set_status=Dataset.STATUS.VERIFYING):
     """Helper to copy data and set status.
+
+    Stats computed while copying are stored with the ExperimentSample, so
+    that alignment doesn't need to wait for FastQC for the phred encoding.
     """
     dataset = experiment_sample.dataset_set.get(type=dataset_type)
     dataset.status = Dataset.STATUS.COPYING
     dataset.save()
-    copy_dataset_to_entity_data_dir(experiment_sample, fastq_source, move=move)
+
+    dest = _get_copy_target_path(experiment_sample, fastq_source)
+    fastq_stats = copy_fastq_with_stats(fastq_source, dest, move=move)
+    update_experiment_sample_fastq_stats(experiment_sample, dataset_type,
+            fastq_stats)
+
     dataset.status = set_status
     dataset.save()
     return dataset
 
 
 @task
-@project_files_needed
+@project_files_needed(paths=no_project_files)
 def copy_experiment_sample_data(
         project, experiment_sample, data, move=False,
         options={'skip_fastqc': False}):
     """Celery task that wraps the process of copying the data for an
     ExperimentSample.
+
+    The reads are profiled while they're copied, so the Datasets are ready
+    for alignment as soon as they are copied. FastQC reports, unless
+    skipped, are generated by a separate background task.
     """
 
     # Copy read1.
@@ -547,37 +649,25 @@ def copy_experiment_sample_data(
                 read2_dataset.filesystem_location):
             # Make sure the files are not the same.
             read1_dataset.status = Dataset.STATUS.FAILED
+            read1_dataset.save()
             read2_dataset.status = Dataset.STATUS.FAILED
+            read2_dataset.save()
 
             # TODO: Provide way for user to get an error message, similar to
             # how make an error link for alignments.
-        else:
-            read1_dataset.status = Dataset.STATUS.READY
-            read1_dataset.save()
-            read2_dataset.status = Dataset.STATUS.READY
-            read2_dataset.save()
-
+            return
+        fastq_dataset_list = [read1_dataset, read2_dataset]
     else:
         # Unpaired.
-        read1_dataset.status = Dataset.STATUS.READY
-        read1_dataset.save()
+        fastq_dataset_list = [read1_dataset]
 
-    # Quality Control via FASTQC and save.
-    read1_dataset.status = Dataset.STATUS.QC
-    read1_dataset.save()
-    if not options.get('skip_fastqc', False):
-        run_fastqc_on_sample_fastq(experiment_sample, read1_dataset)
-    read1_dataset.status = Dataset.STATUS.READY
-    read1_dataset.save()
+    for fastq_dataset in fastq_dataset_list:
+        fastq_dataset.status = Dataset.STATUS.READY
+        fastq_dataset.save()
 
-    if read2_dataset is not None:
-        read2_dataset.status = Dataset.STATUS.QC
-        read1_dataset.save()
-        if not options.get('skip_fastqc', False):
-            run_fastqc_on_sample_fastq(experiment_sample, read2_dataset,
-                    rev=True)
-        read2_dataset.status = Dataset.STATUS.READY
-        read2_dataset.save()
+    # Optional FastQC html reports.
+    if settings.RUN_FASTQC_ON_IMPORT and not options.get('skip_fastqc', False):
+        run_fastqc_on_sample_fastqs.delay(experiment_sample, fastq_dataset_list)
 
 
 @task
@@ -596,29 +686,91 @@ def run_fastqc_on_sample_fastq(
     Returns:
         New Dataset pointing to html file of FastQC results.
     """
-    fastq_filename = source_fastq_dataset.get_absolute_location()
+    fastqc_process = _start_fastqc(experiment_sample, source_fastq_dataset)
+    return _finish_fastqc(experiment_sample, source_fastq_dataset,
+            fastqc_process, rev=rev,
+            source_dataset_status_on_success=source_dataset_status_on_success)
 
-    # There's no option to pass the output filename to FastQC so we just
-    # create the name that matches what FastQC outputs.
-    fastqc_filename = _get_fastqc_path(source_fastq_dataset)
 
-    if rev:
-        dataset_type = Dataset.TYPE.FASTQC2_HTML
-    else:
-        dataset_type = Dataset.TYPE.FASTQC1_HTML
+@task
+def run_fastqc_on_sample_fastqs(experiment_sample, fastq_dataset_list,
+        source_dataset_status_on_success=None):
+    """Runs FASTQC on the fastq Datasets of a sample concurrently, with at
+    most settings.FASTQC_MAX_CONCURRENT_PER_WORKER processes at a time.
+
+    Returns:
+        List of the new Datasets pointing to the html FastQC results, in the
+        same order as fastq_dataset_list.
+    """
+    max_concurrent = max(1, settings.FASTQC_MAX_CONCURRENT_PER_WORKER)
+
+    fastqc_dataset_list = []
+    for batch_start in range(0, len(fastq_dataset_list), max_concurrent):
+        batch = fastq_dataset_list[batch_start:batch_start + max_concurrent]
+        running_list = [
+                (fastq_dataset, _start_fastqc(experiment_sample, fastq_dataset))
+                for fastq_dataset in batch]
+        for fastq_dataset, fastqc_process in running_list:
+            fastqc_dataset_list.append(_finish_fastqc(
+                    experiment_sample, fastq_dataset, fastqc_process,
+                    rev=fastq_dataset.type == Dataset.TYPE.FASTQ2,
+                    source_dataset_status_on_success=(
+                            source_dataset_status_on_success)))
+    return fastqc_dataset_list
 
+
+def _start_fastqc(experiment_sample, source_fastq_dataset):
+    """Starts FastQC on the fastq Dataset without waiting for it.
+
+    FastQC output goes to a temporary file rather than a pipe so that
+    concurrent runs can't block on a full pipe.
+
+    Returns:
+        The Popen object, with the command and output file handle attached.
+    """
     # create the tmp dir if it doesn't exist
     if not os.path.exists(settings.TEMP_FILE_ROOT):
         os.mkdir(settings.TEMP_FILE_ROOT)
 
     command = [
             settings.FASTQC_BINARY,
-            fastq_filename,
+            source_fastq_dataset.get_absolute_location(),
             '-o', experiment_sample.get_model_data_dir(),
             '-d', settings.TEMP_FILE_ROOT]
 
-    fastqc_output = subprocess.check_output(
-            command, stderr=subprocess.STDOUT)
+    output_fh = TemporaryFile(dir=settings.TEMP_FILE_ROOT)
+    fastqc_process = subprocess.Popen(command, stdout=output_fh,
+            stderr=subprocess.STDOUT)
+    fastqc_process.command = command
+    fastqc_process.output_fh = output_fh
+    return fastqc_process
+
+
+def _finish_fastqc(experiment_sample, source_fastq_dataset, fastqc_process,
+        rev=False, source_dataset_status_on_success=None):
+    """Waits for FastQC started by _start_fastqc() and adds its results.
+
+    Raises:
+        subprocess.CalledProcessError if FastQC failed.
+    """
+    fastqc_process.wait()
+    fastqc_process.output_fh.seek(0)
+    fastqc_output = fastqc_process.output_fh.read()
+    fastqc_process.output_fh.close()
+    if fastqc_process.returncode != 0:
+        raise subprocess.CalledProcessError(fastqc_process.returncode,
+                fastqc_process.command, fastqc_output)
+
+    fastq_filename = source_fastq_dataset.get_absolute_location()
+
+    # There's no option to pass the output filename to FastQC so we just
+    # create the name that matches what FastQC outputs.
+    fastqc_filename = _get_fastqc_path(source_fastq_dataset)
+
+    if rev:
+        dataset_type = Dataset.TYPE.FASTQC2_HTML
+    else:
+        dataset_type = Dataset.TYPE.FASTQC1_HTML
 
     # Check that fastqc file has been made
     # TODO: We need proper error checking and logging probably, so that this
@@ -627,7 +779,9 @@ def run_fastqc_on_sample_fastq(
         print 'FastQC Failed for {}:\n{}'.format(
                     fastq_filename, fastqc_output)
 
-    set_phred_encoding(fastqc_filename, experiment_sample)
+    # Usually already determined from the reads when they were copied.
+    if not experiment_sample.data.get('phred_encoding'):
+        set_phred_encoding(fastqc_filename, experiment_sample)
 
     fastqc_dataset = add_dataset_to_entity(experiment_sample,
             dataset_type, dataset_type, fastqc_filename)
@@ -661,27 +815,24 @@ def _get_fastqc_path(fastq_dataset):
 
 
 def set_phred_encoding(fastqc_filename, experiment_sample):
+    """Sets the phred encoding of the ExperimentSample from the FastQC
+    results.
+    """
     fastqc_filename_base = os.path.splitext(fastqc_filename)[0]
     fastqc_data_zip_path = fastqc_filename_base + '.zip'
     zip_archive_text_file = (fastqc_filename_base.split('/')[-1] +
             '/fastqc_data.txt')
 
-    if not os.path.exists(fastqc_data_zip_path):
-        experiment_sample.data['phred_encoding'] = None
-    else:
-        unzip_process = subprocess.Popen([
-                'unzip', '-ca',
-                fastqc_data_zip_path,
-                zip_archive_text_file],
-                stdout=subprocess.PIPE)
-
-        output = subprocess.check_output(
-                ['grep', '-m', '1', 'Encoding'],
-                stdin=unzip_process.stdout)
-
-        encoding = output.strip().split('\t')[1]
+    encoding = None
+    if os.path.exists(fastqc_data_zip_path):
+        with zipfile.ZipFile(fastqc_data_zip_path) as fastqc_zip:
+            with fastqc_zip.open(zip_archive_text_file) as fastqc_data_fh:
+                for line in fastqc_data_fh:
+                    if line.startswith('Encoding'):
+                        encoding = line.strip().split('\t')[1]
+                        break
 
-        experiment_sample.data['phred_encoding'] = encoding
+    experiment_sample.data['phred_encoding'] = encoding
     experiment_sample.save()
 
 
@@ -999,7 +1150,7 @@ def _read_variant_set_file(variant_set_file, ref_genome, dataset,
             # Get or create the Variant for this record. This step
             # also generates the alternate objects and assigns their
             # data fields as well.
-            variant, alt_list = get_or_create_variant(reference_genome,
+            variant, alt_list, _ = get_or_create_variant(reference_genome,
                     record, dataset)
 
             # Create a link between the Variant and the VariantSet if
@@ -1063,7 +1214,7 @@ def _read_variant_set_file_as_csv(variant_set_file, reference_genome,
 
             # Get or create the Variant for this record.
             # NOTE: No samples so query_cache is not necessary.
-            variant, alts = get_or_create_variant(
+            variant, alts, _ = get_or_create_variant(
                     reference_genome, record, dataset, query_cache=None)
 
             # Create a link between the Variant and the VariantSet if
@@ -21,11 +21,19 @@ json tracklist. It also needs to symlink various track subdirectories into the
 main directory. It assumes that there won't be anything to overwrite (like two
 {trackname}/seq dirs).
 
+Each individual tracklist written is also appended to an append-only
+manifest, `jbrowse/indiv_tracks/manifest.jsonl`, along with the subdirs that
+need to be symlinked into the root. compile_tracklist_json() regenerates the
+main tracklist in one pass over the manifest rather than rescanning every
+track, and does nothing if no tracks were added since the last compile.
+
 We perform this compile_tracklist_json() every time a link is asked for.
 
 """
 
+from collections import OrderedDict
 from distutils.dir_util import mkpath
+import fcntl
 import glob
 import json
 import os
@@ -34,6 +42,7 @@ import subprocess
 
 from main.model_utils import get_dataset_with_type
 from main.models import Dataset
+from main.reference_genome_metadata_cache import invalidate_reference_genome_metadata
 from utils import merge_nested_dictionaries
 from settings import JBROWSE_BIN_PATH
 from settings import JBROWSE_DATA_URL_ROOT
@@ -43,6 +52,13 @@ from settings import TOOLS_DIR
 
 TABIX_BINARY = '%s/tabix/tabix' % TOOLS_DIR
 
+# Append-only JSON-lines file in indiv_tracks registering each individual
+# tracklist, so that compiling doesn't need to rescan every track.
+TRACK_MANIFEST_FILENAME = 'manifest.jsonl'
+
+# Records the manifest state the main trackList.json was compiled from.
+COMPILED_TRACK_MANIFEST_SIGNATURE_FILENAME = '.compiled_track_manifest'
+
 # TODO: Figure out better place to put this.
 # JBrowse requires the symlink path to exist. See settings.py
 # comments for more info.
@@ -96,15 +112,166 @@ def write_tracklist_json(reference_genome, dictionary, concurrent_id=None):
     with open(json_track_fn, 'w') as json_track_fh:
         json_track_fh.write(json.dumps(dictionary))
 
+    # Register the individual tracklist so that compile_tracklist_json()
+    # doesn't need to rescan the indiv_tracks dir.
+    if concurrent_id:
+        _append_to_track_manifest(reference_genome, concurrent_id, dictionary)
+
+    # Track names shown with Variants may have changed.
+    invalidate_reference_genome_metadata(reference_genome)
+
+
+def _get_track_manifest_path(reference_genome):
+    return os.path.join(reference_genome.get_jbrowse_directory_path(),
+            'indiv_tracks', TRACK_MANIFEST_FILENAME)
+
+
+def _make_track_manifest_entry(track_dir, concurrent_id, dictionary):
+    """Returns the manifest entry for an individual tracklist, including the
+    subdirs (seq, tracks, etc.) that need to be linked into the root.
+    """
+    subdirs = [subdir for subdir in sorted(os.listdir(track_dir))
+            if os.path.isdir(os.path.join(track_dir, subdir))]
+    return {
+        'id': concurrent_id,
+        'tracklist': dictionary,
+        'subdirs': subdirs,
+    }
+
+
+def _append_to_track_manifest(reference_genome, concurrent_id, dictionary):
+    """Appends an entry for the individual tracklist to the manifest.
+
+    Entries are never rewritten. A later entry for the same concurrent_id
+    replaces any earlier ones when the manifest is read.
+    """
+    manifest_path = _get_track_manifest_path(reference_genome)
+
+    # Tracks added before the manifest existed need to be registered first.
+    # The scan picks up the tracklist that was just written.
+    if not os.path.exists(manifest_path):
+        if _build_track_manifest_from_indiv_tracks(reference_genome):
+            return
+
+    track_dir = os.path.join(os.path.dirname(manifest_path), concurrent_id)
+    entry = _make_track_manifest_entry(track_dir, concurrent_id, dictionary)
+    with open(manifest_path, 'a') as manifest_fh:
+        # Several workers may be adding tracks at the same time.
+        fcntl.flock(manifest_fh, fcntl.LOCK_EX)
+        try:
+            manifest_fh.write(json.dumps(entry) + '\n')
+        finally:
+            fcntl.flock(manifest_fh, fcntl.LOCK_UN)
+
+
+def remove_indiv_tracks(reference_genome, concurrent_id_list):
+    """Deletes individual tracks and removes them from the manifest, so that
+    they are dropped the next time the tracklist is compiled.
+    """
+    indiv_tracks_path = os.path.join(
+            reference_genome.get_jbrowse_directory_path(), 'indiv_tracks')
+    removed_id_list = []
+    for concurrent_id in concurrent_id_list:
+        track_dir = os.path.join(indiv_tracks_path, concurrent_id)
+        if os.path.exists(track_dir):
+            shutil.rmtree(track_dir)
+            removed_id_list.append(concurrent_id)
+
+    manifest_path = _get_track_manifest_path(reference_genome)
+    if not removed_id_list or not os.path.exists(manifest_path):
+        return
+    with open(manifest_path, 'a') as manifest_fh:
+        fcntl.flock(manifest_fh, fcntl.LOCK_EX)
+        try:
+            for concurrent_id in removed_id_list:
+                manifest_fh.write(json.dumps(
+                        {'id': concurrent_id, 'removed': True}) + '\n')
+        finally:
+            fcntl.flock(manifest_fh, fcntl.LOCK_UN)
+
+
+def _build_track_manifest_from_indiv_tracks(reference_genome):
+    """Creates the manifest by scanning indiv_tracks. Only needed for
+    tracks added before the manifest existed.
+
+    Returns True if the manifest was created by this call.
+    """
+    manifest_path = _get_track_manifest_path(reference_genome)
+    indiv_tracks_path = os.path.dirname(manifest_path)
+    track_files = glob.glob(
+            os.path.join(indiv_tracks_path, '*', 'trackList.json'))
+    if not track_files:
+        return False
+    with open(manifest_path, 'a') as manifest_fh:
+        fcntl.flock(manifest_fh, fcntl.LOCK_EX)
+        try:
+            # Another worker may have built it while we were waiting.
+            if os.fstat(manifest_fh.fileno()).st_size:
+                return False
+            for track_fn in track_files:
+                track_dir = os.path.dirname(track_fn)
+                with open(track_fn) as track_fh:
+                    entry = _make_track_manifest_entry(track_dir,
+                            os.path.basename(track_dir),
+                            json.loads(track_fh.read()))
+                manifest_fh.write(json.dumps(entry) + '\n')
+        finally:
+            fcntl.flock(manifest_fh, fcntl.LOCK_UN)
+    return True
+
+
+def _read_track_manifest(manifest_path):
+    """Returns an OrderedDict from concurrent_id to the latest manifest entry
+    for it.
+    """
+    entries = OrderedDict()
+    with open(manifest_path) as manifest_fh:
+        fcntl.flock(manifest_fh, fcntl.LOCK_SH)
+        try:
+            for line in manifest_fh:
+                entry = json.loads(line)
+                if entry.get('removed'):
+                    entries.pop(entry['id'], None)
+                else:
+                    entries[entry['id']] = entry
+        finally:
+            fcntl.flock(manifest_fh, fcntl.LOCK_UN)
+    return entries
+
+
+def _get_track_manifest_signature(manifest_path):
+    """The manifest is append-only, so its size and mtime change whenever a
+    track is added.
+    """
+    manifest_stat = os.stat(manifest_path)
+    return '%d:%f' % (manifest_stat.st_size, manifest_stat.st_mtime)
+
+
 def compile_tracklist_json(reference_genome):
     """
-    Gathers all the individual tracks in the ./indiv_tracks
-    directory and creates a new 'tracks' listing, keeping
-    each track label unique.
+    Creates a new 'tracks' listing from all the individual tracks
+    registered in the indiv_tracks manifest, keeping each track label
+    unique, and symlinks their subdirs into the root.
+
+    The main trackList.json is left untouched if no tracks have been added
+    since it was last compiled, so that its ETag stays valid and clients
+    can keep using their cached copy.
     """
     jbrowse_path = reference_genome.get_jbrowse_directory_path()
-    indiv_tracks_path = os.path.join(jbrowse_path,'indiv_tracks')
-    track_files = glob.glob(os.path.join(indiv_tracks_path,'*','trackList.json'))
+    manifest_path = _get_track_manifest_path(reference_genome)
+    if not os.path.exists(manifest_path):
+        _build_track_manifest_from_indiv_tracks(reference_genome)
+    if not os.path.exists(manifest_path):
+        return
+
+    manifest_signature = _get_track_manifest_signature(manifest_path)
+    compiled_signature_fn = os.path.join(jbrowse_path,
+            COMPILED_TRACK_MANIFEST_SIGNATURE_FILENAME)
+    if (os.path.exists(compiled_signature_fn) and
+            os.path.exists(os.path.join(jbrowse_path, 'trackList.json'))):
+        with open(compiled_signature_fn) as signature_fh:
+            if signature_fh.read() == manifest_signature:
+                return
 
     # a dictionary of tracks by label. We assume here that all
     # tracks are unique by 'label' (which should really be called
@@ -112,9 +279,8 @@ def compile_tracklist_json(reference_genome):
     track_dict = {}
     consolidated_track_list = {}
 
-    for track_fn in track_files:
-
-        this_track_list = json.loads(open(track_fn).read())
+    for entry in _read_track_manifest(manifest_path).itervalues():
+        this_track_list = entry['tracklist']
 
         # First, pop out off 'tracks' list from the json, and
         # add them to the track_dict by label
@@ -130,24 +296,14 @@ def compile_tracklist_json(reference_genome):
                 track['urlTemplate'] = os.path.join(
                     'indiv_tracks',track_key, track['urlTemplate'])
 
-
-        # Finally, symlink any subdirs (seq, etc) into the root.
-        track_dir = os.path.dirname(track_fn)
-
-        for subdir in os.listdir(track_dir):
-            abs_subdir = os.path.join(track_dir, subdir)
-            if not os.path.isdir(abs_subdir): continue
-
-            try:
-                shutil.copytree(
-                    src= abs_subdir,
-                    dst= os.path.join(jbrowse_path,subdir),
-                    symlinks=True
-                )
-            except Exception as e:
-                print e
-                print 'Skipping dir {:s} because it already exists.'.format(
-                        subdir)
+        # Symlink any subdirs (seq, etc) into the root. The first track to
+        # claim a subdir keeps it.
+        for subdir in entry['subdirs']:
+            link_path = os.path.join(jbrowse_path, subdir)
+            if os.path.lexists(link_path):
+                continue
+            os.symlink(os.path.join('indiv_tracks', entry['id'], subdir),
+                    link_path)
 
         # (We're assuming here that any overwriting that individual
         # files do of these fields is not important. The only field
@@ -163,6 +319,9 @@ def compile_tracklist_json(reference_genome):
 
     write_tracklist_json(reference_genome, consolidated_track_list)
 
+    with open(compiled_signature_fn, 'w') as signature_fh:
+        signature_fh.write(manifest_signature)
+
 def prepare_jbrowse_ref_sequence(reference_genome, **kwargs):
     """Prepare the reference sequence and place it in the ref_genome dir.
 
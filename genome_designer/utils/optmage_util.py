@@ -82,6 +82,7 @@ def print_mage_oligos(variant_set, output_filehandle, target_id_prefix,
 
     oligo_target_list = []
     for variant in passing_variants:
+        # Prefetched by _validate_variant_set_for_printing_mage_oligos().
         alt_value = variant.variantalternate_set.all()[0].alt_value
 
         # Configure the oligo for this variant.
@@ -125,24 +126,27 @@ def _validate_variant_set_for_printing_mage_oligos(variant_set):
         ValidationException
     """
     passing_variants = []
-    for variant in variant_set.variants.all():
+    for variant in variant_set.variants.prefetch_related(
+            'variantalternate_set'):
         # Don't support SV types.
         if variant.type in SV_TYPES.values():
             raise ValidationException("SVs Not supported")
 
+        alts = variant.variantalternate_set.all()
+
         # No alt, silently skip.
-        if variant.variantalternate_set.count() == 0:
+        if len(alts) == 0:
             continue
 
         # Don't support case of multiple alts.
-        if variant.variantalternate_set.count() > 1:
+        if len(alts) > 1:
             raise ValidationException(
                     "All Variants must have exactly one alt. " +
                     "Variant with uid " + variant.uid + " has " +
-                    str(variant.variantalternate_set.count()))
+                    str(len(alts)))
 
         ref_value = variant.ref_value
-        alt_value = variant.variantalternate_set.all()[0]
+        alt_value = alts[0].alt_value
 
         if ref_value == alt_value:
             raise ValidationException("Nothing to do.")
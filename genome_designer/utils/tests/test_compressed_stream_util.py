@@ -0,0 +1,70 @@
+"""
+Tests for compressed_stream_util.py.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase
+
+from utils.compressed_stream_util import is_bgzf
+from utils.compressed_stream_util import open_decompressed
+
+
+class TestOpenDecompressed(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+        # Enough lines to span several BGZF blocks.
+        self.line_list = ['line_%d\t%s\n' % (i, 'ACGT' * (i % 20))
+                for i in range(20000)]
+        self.text_path = os.path.join(self.temp_dir, 'lines.txt')
+        with open(self.text_path, 'w') as fh:
+            fh.writelines(self.line_list)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _compress(self, command, extension):
+        compressed_path = self.text_path + extension
+        with open(self.text_path) as input_fh:
+            with open(compressed_path, 'w') as output_fh:
+                subprocess.check_call(command, stdin=input_fh,
+                        stdout=output_fh)
+        return compressed_path
+
+    def test_gzip(self):
+        gzip_path = self._compress(['gzip', '-c'], '.gz')
+        self.assertFalse(is_bgzf(gzip_path))
+        with open_decompressed(gzip_path) as fh:
+            self.assertEqual(self.line_list, list(fh))
+
+    def test_bgzf(self):
+        bgzf_path = self._compress([settings.BGZIP_BINARY, '-c'], '.gz')
+        self.assertTrue(is_bgzf(bgzf_path))
+        for num_threads in [1, 3]:
+            with open_decompressed(bgzf_path, num_threads=num_threads) as fh:
+                self.assertEqual(''.join(self.line_list), fh.read())
+
+    def test_bgzf_seek_virtual_offset(self):
+        bgzf_path = self._compress([settings.BGZIP_BINARY, '-c'], '.gz')
+        with open_decompressed(bgzf_path, num_threads=2) as fh:
+            virtual_offset_list = []
+            for line in self.line_list:
+                virtual_offset_list.append(fh.tell_virtual_offset())
+                self.assertEqual(line, fh.readline())
+
+            for line_idx in [15000, 3, 10000]:
+                fh.seek_virtual_offset(virtual_offset_list[line_idx])
+                self.assertEqual(self.line_list[line_idx], fh.readline())
+
+    def test_decompress_command(self):
+        bz2_path = self._compress(['bzip2', '-c'], '.bz2')
+        with open_decompressed(bz2_path,
+                decompress_command=('bzcat',)) as fh:
+            self.assertEqual(self.line_list[0], fh.readline())
+            self.assertEqual(self.line_list[1:], list(fh))
@@ -1,7 +1,10 @@
 """Tests for data_export_util.py.
 """
 
+import gzip
+import os
 import StringIO
+import zipfile
 
 from django.test import TestCase
 import vcf
@@ -12,6 +15,7 @@ from main.models import VariantAlternate
 from main.models import VariantSet
 from main.models import VariantToVariantSet
 from main.testing_util import create_common_entities
+from utils.data_export_util import export_project_as_zip
 from utils.data_export_util import export_variant_set_as_vcf
 
 
@@ -22,12 +26,13 @@ class TestExportVariantSetAsVcf(TestCase):
         """
         self.common_entities = create_common_entities()
 
-    def test_basic(self):
+    def _create_variant_set(self):
         variant_set = VariantSet.objects.create(
                 reference_genome=self.common_entities['reference_genome'],
                 label='vs1')
 
-        for position in range(1, 11):
+        # Created out of order to check the export is sorted.
+        for position in reversed(range(1, 11)):
             var = Variant.objects.create(
                     type=Variant.TYPE.TRANSITION,
                     reference_genome=self.common_entities['reference_genome'],
@@ -41,6 +46,11 @@ class TestExportVariantSetAsVcf(TestCase):
             VariantToVariantSet.objects.create(
                     variant=var, variant_set=variant_set)
 
+        return variant_set
+
+    def test_basic(self):
+        variant_set = self._create_variant_set()
+
         output_fh = StringIO.StringIO()
 
         export_variant_set_as_vcf(variant_set, output_fh)
@@ -48,9 +58,78 @@ class TestExportVariantSetAsVcf(TestCase):
         output_fh.seek(0)
 
         reader = vcf.Reader(output_fh)
-        row_count = 0
+        position_list = []
         for record in reader:
             self.assertEqual('G', record.ALT[0])
-            row_count += 1
+            position_list.append(record.POS)
+
+        self.assertEqual(range(1, 11), position_list)
+
+    def test_bgzip(self):
+        variant_set = self._create_variant_set()
+        variant_set.ensure_model_data_dir_exists()
+        vcf_path = os.path.join(variant_set.get_model_data_dir(), 'vs1.vcf.gz')
+
+        export_variant_set_as_vcf(variant_set, vcf_path, bgzip=True)
+
+        self.assertTrue(os.path.exists(vcf_path + '.tbi'))
+        with gzip.open(vcf_path) as fh:
+            reader = vcf.Reader(fh)
+            self.assertEqual(10, len(list(reader)))
+
+
+class TestExportProjectAsZip(TestCase):
+
+    def setUp(self):
+        """Override.
+        """
+        self.common_entities = create_common_entities()
+        project = self.common_entities['project']
+        sample_dir = self.common_entities['sample_1'].get_model_data_dir()
+        ref_genome = self.common_entities['reference_genome']
+
+        self.file_contents = {
+            os.path.join(sample_dir, 'reads.fq'): '@r1\nACGT\n+\nIIII\n' * 100,
+            os.path.join(sample_dir, 'align.bam'): 'not really a bam',
+            os.path.join(sample_dir, 'align.bam.bai'): 'bam index',
+            os.path.join(ref_genome.get_jbrowse_directory_path(),
+                    'trackList.json'): '{}',
+        }
+        for path, content in self.file_contents.iteritems():
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fh:
+                fh.write(content)
+
+        self.archive_root = os.path.dirname(project.get_model_data_dir())
+
+    def _export(self, **kwargs):
+        zip_data = ''.join(export_project_as_zip(
+                self.common_entities['project'], **kwargs))
+        return zipfile.ZipFile(StringIO.StringIO(zip_data))
+
+    def _get_archive_path(self, path):
+        return os.path.relpath(path, self.archive_root)
+
+    def test_export(self):
+        for num_threads in [1, 2]:
+            export_zip = self._export(num_threads=num_threads)
+            self.assertEqual(None, export_zip.testzip())
+            for path, content in self.file_contents.iteritems():
+                archive_path = self._get_archive_path(path)
+                self.assertTrue(archive_path.startswith(
+                        self.common_entities['project'].uid))
+                self.assertEqual(content, export_zip.read(archive_path))
+
+            # Already compressed formats aren't compressed again.
+            bam_info = export_zip.getinfo(self._get_archive_path(
+                    [p for p in self.file_contents if p.endswith('.bam')][0]))
+            self.assertEqual(zipfile.ZIP_STORED, bam_info.compress_type)
 
-        self.assertEqual(10, row_count)
+    def test_export_exclude_regenerable(self):
+        export_zip = self._export(exclude_regenerable=True)
+        archive_path_set = set(export_zip.namelist())
+        for path in self.file_contents:
+            self.assertEqual(
+                    path.endswith('reads.fq') or path.endswith('.bam'),
+                    self._get_archive_path(path) in archive_path_set)
@@ -0,0 +1,72 @@
+"""
+Tests for fastq_profile_util.py.
+"""
+
+import bz2
+
+from django.test import TestCase
+
+from utils.fastq_profile_util import determine_phred_encoding
+from utils.fastq_profile_util import FastqProfiler
+from utils.fastq_profile_util import FastqStats
+from utils.fastq_profile_util import PHRED_ENCODING__ILLUMINA_1_5
+from utils.fastq_profile_util import PHRED_ENCODING__SANGER
+
+
+FASTQ_DATA = '\n'.join([
+    '@read_1', 'ACGN', '+', 'II#I',
+    '@read_2', 'ACG', '+', 'II5',
+    '@read_3', 'ACGT', '+', 'IIII',
+])
+
+
+class TestFastqProfiler(TestCase):
+
+    def test_profile(self):
+        profiler = FastqProfiler()
+        # Chunks that split records, without a newline at the end.
+        for chunk_start in range(0, len(FASTQ_DATA), 5):
+            profiler.update(FASTQ_DATA[chunk_start:chunk_start + 5])
+        profile = profiler.get_profile()
+
+        self.assertEqual(3, profile['num_reads'])
+        self.assertEqual(11, profile['num_bases'])
+        self.assertEqual(PHRED_ENCODING__SANGER, profile['phred_encoding'])
+        self.assertEqual({3: 1, 4: 2}, profile['read_length_distribution'])
+
+        quality = profile['per_position_quality']
+        self.assertEqual([40, 40, 20, 40], quality['0.5'])
+        self.assertEqual([40, 40, 2, 40], quality['0.1'])
+
+        self.assertEqual([0.0, 0.0, 0.0, 0.5],
+                profile['per_position_n_fraction'])
+
+        # The first 3 bases of each read are the same, but not the reads.
+        self.assertEqual(0.0, profile['duplicate_fraction_estimate'])
+
+    def test_determine_phred_encoding(self):
+        self.assertEqual(PHRED_ENCODING__SANGER,
+                determine_phred_encoding(ord('#')))
+        self.assertEqual(PHRED_ENCODING__ILLUMINA_1_5,
+                determine_phred_encoding(ord('B')))
+        self.assertEqual(None, determine_phred_encoding(None))
+
+
+class TestFastqStats(TestCase):
+
+    def test_multi_stream_bz2(self):
+        # Like pbzip2 output, the reads are split across two bzip2 streams.
+        split_position = FASTQ_DATA.index('@read_3')
+        first_stream = bz2.compress(FASTQ_DATA[:split_position])
+        second_stream = bz2.compress(FASTQ_DATA[split_position:])
+        data = first_stream + second_stream
+
+        for chunk_list in [
+                [data],
+                # Boundary between streams at the end of a chunk.
+                [first_stream, second_stream],
+                [data[i:i + 7] for i in range(0, len(data), 7)]]:
+            stats = FastqStats('reads.fq.bz2')
+            for chunk in chunk_list:
+                stats.update(chunk)
+            self.assertEqual(3, stats.get_stats()['num_reads'])
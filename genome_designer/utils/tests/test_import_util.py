@@ -2,6 +2,7 @@
 Tests for import_util.py.
 """
 
+import hashlib
 import os
 
 from django.conf import settings
@@ -23,6 +24,7 @@ from main.upload_template_views import TEMPLATE__SAMPLES_BATCH_IMPORT_FROM_SERVE
 from utils.import_util import _get_fastqc_path
 from utils.import_util import DataImportError
 from utils.import_util import copy_and_add_dataset_source
+from utils.import_util import copy_fastq_with_stats
 from utils.import_util import create_sample_models_for_eventual_upload
 from utils.import_util import import_reference_genome_from_local_file
 from utils.import_util import import_samples_from_targets_file
@@ -30,6 +32,7 @@ from utils.import_util import import_variant_set_from_vcf
 from utils.import_util import import_reference_genome_from_ncbi
 from utils.import_util import run_fastqc_on_sample_fastq
 from utils import internet_on
+from utils.fastq_profile_util import PHRED_ENCODING__SANGER
 
 TEST_USERNAME = 'gmcdev'
 TEST_PASSWORD = 'g3n3d3z'
@@ -536,3 +539,33 @@ class TestFastQC(TestCase):
 
         EXPECTED_FASTQC_FILENAME = 'R2_001_fastqc.html'
         self.assertEqual(EXPECTED_FASTQC_FILENAME, actual_fastqc_filename)
+
+
+class TestCopyFastqWithStats(TestCase):
+    """Tests for copying fastqs while computing their stats.
+    """
+
+    def setUp(self):
+        self.common_entities = create_common_entities()
+        self.dest_dir = self.common_entities['sample_1'].get_model_data_dir()
+
+    def _assert_copy_with_stats(self, source):
+        dest = os.path.join(self.dest_dir, os.path.split(source)[1])
+        stats = copy_fastq_with_stats(source, dest)
+
+        with open(source, 'rb') as source_fh:
+            source_data = source_fh.read()
+        with open(dest, 'rb') as dest_fh:
+            self.assertEqual(source_data, dest_fh.read())
+
+        self.assertEqual(hashlib.md5(source_data).hexdigest(), stats['md5'])
+        # Both test fastqs have 12 reads.
+        self.assertEqual(12, stats['num_reads'])
+        self.assertEqual(PHRED_ENCODING__SANGER, stats['phred_encoding'])
+        self.assertEqual(12, stats['profile']['num_reads'])
+
+    def test_copy(self):
+        self._assert_copy_with_stats(TEST_FASTQ1)
+
+    def test_copy_gzipped(self):
+        self._assert_copy_with_stats(TEST_FASTQ_GZ_1)
@@ -0,0 +1,87 @@
+"""
+Tests for jbrowse_util.py.
+"""
+
+import json
+import os
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.models import Project
+from main.models import ReferenceGenome
+from utils.jbrowse_util import compile_tracklist_json
+from utils.jbrowse_util import remove_indiv_tracks
+from utils.jbrowse_util import write_tracklist_json
+
+
+TEST_USERNAME = 'testuser'
+TEST_PASSWORD = 'password'
+TEST_EMAIL = 'test@example.com'
+
+
+class TestCompileTracklistJson(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(TEST_USERNAME, password=TEST_PASSWORD,
+                email=TEST_EMAIL)
+        project = Project.objects.create(owner=user.get_profile(),
+                title='Test Project')
+        self.reference_genome = ReferenceGenome.objects.create(
+                project=project, label='refgenome')
+        self.jbrowse_path = self.reference_genome.get_jbrowse_directory_path()
+
+    def _read_compiled_track_labels(self):
+        with open(os.path.join(self.jbrowse_path, 'trackList.json')) as fh:
+            return set(track['label']
+                    for track in json.loads(fh.read())['tracks'])
+
+    def _make_tracklist(self, label):
+        return {
+            'formatVersion': 1,
+            'tracks': [{'label': label, 'urlTemplate': 'seq/{refseq}.txt'}]
+        }
+
+    def test_compile_from_manifest(self):
+        write_tracklist_json(self.reference_genome,
+                self._make_tracklist('DNA'), 'DNA')
+        os.mkdir(os.path.join(self.jbrowse_path, 'indiv_tracks', 'DNA', 'seq'))
+        write_tracklist_json(self.reference_genome,
+                self._make_tracklist('DNA'), 'DNA')
+        write_tracklist_json(self.reference_genome,
+                self._make_tracklist('bam_1'), 'bam_1')
+
+        compile_tracklist_json(self.reference_genome)
+        self.assertEqual(set(['DNA', 'bam_1']),
+                self._read_compiled_track_labels())
+
+        # Subdirs are symlinked rather than copied.
+        seq_path = os.path.join(self.jbrowse_path, 'seq')
+        self.assertTrue(os.path.islink(seq_path))
+        self.assertEqual(os.path.realpath(os.path.join(
+                        self.jbrowse_path, 'indiv_tracks', 'DNA', 'seq')),
+                os.path.realpath(seq_path))
+
+        # Compiling again without changes leaves the tracklist alone.
+        tracklist_path = os.path.join(self.jbrowse_path, 'trackList.json')
+        os.utime(tracklist_path, (0, 0))
+        compile_tracklist_json(self.reference_genome)
+        self.assertEqual(0, os.stat(tracklist_path).st_mtime)
+
+        # Removed tracks are dropped.
+        remove_indiv_tracks(self.reference_genome, ['bam_1'])
+        compile_tracklist_json(self.reference_genome)
+        self.assertEqual(set(['DNA']), self._read_compiled_track_labels())
+
+    def test_compile_without_manifest(self):
+        """Tracks written before the manifest existed should be picked up.
+        """
+        for label in ['DNA', 'bam_1']:
+            track_dir = os.path.join(self.jbrowse_path, 'indiv_tracks', label)
+            os.makedirs(track_dir)
+            with open(os.path.join(track_dir, 'trackList.json'), 'w') as fh:
+                fh.write(json.dumps(self._make_tracklist(label)))
+
+        compile_tracklist_json(self.reference_genome)
+        self.assertEqual(set(['DNA', 'bam_1']),
+                self._read_compiled_track_labels())
@@ -0,0 +1,266 @@
+"""
+Writes zip archives as a stream of bytes, so that an archive can be sent in
+an HTTP response as it's generated, without writing it to disk first.
+
+The zipfile module needs to seek back to each local header to fill in the crc
+and sizes once an entry has been written. Instead, entries here are followed
+by a data descriptor holding those (general purpose flag bit 3), and all
+entries carry Zip64 sizes so that there's no limit on their size or on the
+size of the archive. The result reads with zipfile, unzip and the usual
+archive tools.
+"""
+
+import os
+import struct
+import time
+import zlib
+
+from multiprocessing.pool import ThreadPool
+
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Size of the chunks files are read, compressed and yielded in.
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Compressing in parallel, each thread compresses a chunk at a time, and this
+# many chunks per thread are read ahead.
+PARALLEL_CHUNKS_PER_THREAD = 2
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# Zip64 extensions need version 4.5. The high byte of version made by says the
+# external attributes hold unix permissions.
+ZIP_VERSION = 45
+ZIP_VERSION_MADE_BY = (3 << 8) | ZIP_VERSION
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+ZIP64_EXTRA_HEADER_ID = 0x0001
+
+LOCAL_FILE_HEADER_STRUCT = struct.Struct('<4sHHHHHLLLHH')
+LOCAL_FILE_HEADER_SIGNATURE = 'PK\x03\x04'
+
+DATA_DESCRIPTOR_STRUCT = struct.Struct('<4sLQQ')
+DATA_DESCRIPTOR_SIGNATURE = 'PK\x07\x08'
+
+CENTRAL_DIRECTORY_HEADER_STRUCT = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+CENTRAL_DIRECTORY_HEADER_SIGNATURE = 'PK\x01\x02'
+
+ZIP64_END_RECORD_STRUCT = struct.Struct('<4sQHHLLQQQQ')
+ZIP64_END_RECORD_SIGNATURE = 'PK\x06\x06'
+
+ZIP64_END_LOCATOR_STRUCT = struct.Struct('<4sLQL')
+ZIP64_END_LOCATOR_SIGNATURE = 'PK\x06\x07'
+
+END_RECORD_STRUCT = struct.Struct('<4sHHHHLLH')
+END_RECORD_SIGNATURE = 'PK\x05\x06'
+
+
+def _get_dos_date_time(mtime):
+    """Returns the (date, time) pair zip headers use for the given timestamp.
+    """
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return ((0 << 9) | (1 << 5) | 1, 0)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return (dos_date, dos_time)
+
+
+def _compress_chunk(chunk, compress_level):
+    """Returns the chunk as raw deflate data that ends on a byte boundary, so
+    that the results for consecutive chunks can be concatenated.
+    """
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED,
+            -zlib.MAX_WBITS)
+    return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class ZipStreamWriter(object):
+    """Generates a zip archive entry by entry, yielding its bytes.
+
+    Usage:
+        writer = ZipStreamWriter()
+        for data in writer.iter_file_entry(path, 'dir/file.txt'):
+            ...
+        for data in writer.iter_end():
+            ...
+        writer.close()
+
+    With num_threads > 1, deflated entries are compressed in parallel, as
+    pigz does: chunks are compressed independently and concatenated, which
+    costs a little in compression ratio.
+    """
+
+    def __init__(self, compress_level=6, num_threads=1):
+        self.compress_level = compress_level
+        self.num_threads = num_threads
+        self._pool = None
+        self._offset = 0
+        self._central_directory_headers = []
+
+    def _emit(self, data):
+        self._offset += len(data)
+        return data
+
+    def iter_file_entry(self, path, archive_path, compress=True):
+        """Yields the entry for the file at path, stored at archive_path.
+        """
+        if isinstance(archive_path, unicode):
+            archive_path = archive_path.encode('utf-8')
+        flags = FLAG_DATA_DESCRIPTOR
+        if any(ord(c) > 127 for c in archive_path):
+            flags |= FLAG_UTF8
+        method = ZIP_DEFLATED if compress else ZIP_STORED
+
+        stat = os.stat(path)
+        dos_date, dos_time = _get_dos_date_time(stat.st_mtime)
+        header_offset = self._offset
+
+        # Sizes aren't known yet, and come in the data descriptor. The Zip64
+        # extra field tells readers that the descriptor has 8-byte sizes.
+        local_extra = struct.pack('<HHQQ', ZIP64_EXTRA_HEADER_ID, 16, 0, 0)
+        yield self._emit(LOCAL_FILE_HEADER_STRUCT.pack(
+                LOCAL_FILE_HEADER_SIGNATURE, ZIP_VERSION, flags, method,
+                dos_time, dos_date, 0, ZIP64_LIMIT, ZIP64_LIMIT,
+                len(archive_path), len(local_extra)) +
+                archive_path + local_extra)
+
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        with open(path, 'rb') as fh:
+            for chunk, data in self._iter_file_data(fh, method):
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+                if data:
+                    compress_size += len(data)
+                    yield self._emit(data)
+        crc &= 0xFFFFFFFF
+
+        yield self._emit(DATA_DESCRIPTOR_STRUCT.pack(
+                DATA_DESCRIPTOR_SIGNATURE, crc, compress_size, file_size))
+
+        self._central_directory_headers.append(
+                self._get_central_directory_header(archive_path, flags,
+                        method, dos_date, dos_time, crc, compress_size,
+                        file_size, header_offset,
+                        (stat.st_mode & 0xFFFF) << 16))
+
+    def _iter_file_data(self, fh, method):
+        """Yields pairs of (chunk read, data to write) for the file, where
+        either may be empty.
+        """
+        read_chunk = lambda: fh.read(ZIP_STREAM_CHUNK_SIZE)
+
+        if method == ZIP_STORED:
+            for chunk in iter(read_chunk, ''):
+                yield chunk, chunk
+            return
+
+        if self.num_threads <= 1:
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                    -zlib.MAX_WBITS)
+            for chunk in iter(read_chunk, ''):
+                yield chunk, compressor.compress(chunk)
+            yield '', compressor.flush()
+            return
+
+        if self._pool is None:
+            self._pool = ThreadPool(self.num_threads)
+        batch_size = self.num_threads * PARALLEL_CHUNKS_PER_THREAD
+        while True:
+            batch = []
+            for chunk in iter(read_chunk, ''):
+                batch.append(chunk)
+                if len(batch) == batch_size:
+                    break
+            if not batch:
+                break
+            compressed_batch = self._pool.map(
+                    lambda chunk: _compress_chunk(chunk, self.compress_level),
+                    batch)
+            for chunk, data in zip(batch, compressed_batch):
+                yield chunk, data
+            if len(batch) < batch_size:
+                break
+        # Every chunk ended with a non-final block, so end with an empty
+        # final block.
+        yield '', zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                -zlib.MAX_WBITS).flush(zlib.Z_FINISH)
+
+    def _get_central_directory_header(self, archive_path, flags, method,
+            dos_date, dos_time, crc, compress_size, file_size, header_offset,
+            external_attr):
+        extra = ''
+        if max(file_size, compress_size, header_offset) >= ZIP64_LIMIT:
+            extra = struct.pack('<HHQQQ', ZIP64_EXTRA_HEADER_ID, 24,
+                    file_size, compress_size, header_offset)
+            file_size = compress_size = header_offset = ZIP64_LIMIT
+        return CENTRAL_DIRECTORY_HEADER_STRUCT.pack(
+                CENTRAL_DIRECTORY_HEADER_SIGNATURE, ZIP_VERSION_MADE_BY,
+                ZIP_VERSION, flags, method, dos_time, dos_date, crc,
+                compress_size, file_size, len(archive_path), len(extra), 0, 0,
+                0, external_attr, header_offset) + archive_path + extra
+
+    def iter_end(self):
+        """Yields the central directory and end records, which finish the
+        archive.
+        """
+        central_directory_offset = self._offset
+        for header in self._central_directory_headers:
+            yield self._emit(header)
+        central_directory_size = self._offset - central_directory_offset
+        num_entries = len(self._central_directory_headers)
+
+        if (num_entries >= ZIP64_COUNT_LIMIT or
+                central_directory_offset >= ZIP64_LIMIT or
+                central_directory_size >= ZIP64_LIMIT):
+            zip64_end_record_offset = self._offset
+            yield self._emit(ZIP64_END_RECORD_STRUCT.pack(
+                    ZIP64_END_RECORD_SIGNATURE,
+                    ZIP64_END_RECORD_STRUCT.size - 12, ZIP_VERSION_MADE_BY,
+                    ZIP_VERSION, 0, 0, num_entries, num_entries,
+                    central_directory_size, central_directory_offset))
+            yield self._emit(ZIP64_END_LOCATOR_STRUCT.pack(
+                    ZIP64_END_LOCATOR_SIGNATURE, 0, zip64_end_record_offset,
+                    1))
+            num_entries = min(num_entries, ZIP64_COUNT_LIMIT)
+            central_directory_offset = min(central_directory_offset,
+                    ZIP64_LIMIT)
+            central_directory_size = min(central_directory_size, ZIP64_LIMIT)
+
+        yield self._emit(END_RECORD_STRUCT.pack(END_RECORD_SIGNATURE, 0, 0,
+                num_entries, num_entries, central_directory_size,
+                central_directory_offset, 0))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+def generate_zip_stream(file_list, compress_level=6, num_threads=1):
+    """Generator that yields a zip archive of the files in file_list.
+
+    Args:
+        file_list: Iterable of (path, archive_path, compress) tuples.
+        compress_level: zlib compression level for compressed entries.
+        num_threads: Number of threads to compress each entry with.
+    """
+    writer = ZipStreamWriter(compress_level=compress_level,
+            num_threads=num_threads)
+    try:
+        for path, archive_path, compress in file_list:
+            for data in writer.iter_file_entry(path, archive_path,
+                    compress=compress):
+                yield data
+        for data in writer.iter_end():
+            yield data
+    finally:
+        # Also runs if the client goes away and the generator is closed.
+        writer.close()
@@ -3,9 +3,18 @@ Helpers and utils for working with Variants.
 """
 
 from collections import OrderedDict
+import json
 import re
 
+from django.conf import settings
+from django.db import connection
+from django.db import transaction
+
+from main.model_utils import advisory_lock
+from main.model_utils import ADVISORY_LOCK_NAMESPACE__PARENT_CHILD_FIELDS
+from main.models import ExperimentSampleRelation
 from main.models import VariantCallerCommonData
+from main.models import VariantEvidence
 
 from materialized_view_manager import MATERIALIZED_TABLE_QUERYABLE_FIELDS_MAP
 from variants.filter_key_map_constants import MAP_KEY__VARIANT
@@ -13,6 +22,10 @@ from variants.filter_key_map_constants import MAP_KEY__COMMON_DATA
 from variants.filter_key_map_constants import MAP_KEY__ALTERNATE
 from variants.filter_key_map_constants import MAP_KEY__EVIDENCE
 from variants.filter_key_map_constants import MAP_KEY__EXPERIMENT_SAMPLE
+from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__BOOLEAN
+from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__FLOAT
+from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__INTEGER
+from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__STRING
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__ES_LABEL
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__VS_LABEL
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__VS_UID
@@ -198,10 +211,11 @@ def convert_delim_key_value_triple_to_expr(triple):
     # Grab the parts for convenience.
     (delim, key, value) = triple
 
-    # HACK: Special handling for variant set keys.
+    # HACK: Special handling for variant set keys. Containment rather than
+    # ANY() so that the GIN index on the array column can be used.
     if key in [MELTED_SCHEMA_KEY__VS_LABEL, MELTED_SCHEMA_KEY__VS_UID]:
         assert delim in ['==', '=']
-        return ('%s = ANY (' + key + ')', value)
+        return (key + ' @> ARRAY[%s]::varchar[]', value)
 
     # Make '==' SQL-friendly.
     if delim == '==':
@@ -333,6 +347,44 @@ def generate_key_to_materialized_view_parent_col(reference_genome):
     return key_to_parent_map
 
 
+# Casts applied to json values in materialized view queries, by key type.
+# Strings are compared as is.
+VARIANT_KEY_MAP_TYPE_TO_SQL_CAST = {
+    VARIANT_KEY_MAP_TYPE__INTEGER: '::Integer',
+    VARIANT_KEY_MAP_TYPE__FLOAT: '::Float',
+    VARIANT_KEY_MAP_TYPE__BOOLEAN: '::Boolean',
+    VARIANT_KEY_MAP_TYPE__STRING: '',
+}
+
+
+def get_json_key_sql_expression(reference_genome, key):
+    """Returns the SQL expression that selects the key from the json column
+    of the materialized view that holds it, cast to the key's type, e.g.
+    "(ve_data->>'INFO_AO')::Integer".
+
+    Returns None if the key isn't held in a json column or its type isn't
+    supported. Filters and the indexes built for them use the same
+    expression, which is what lets Postgres use the indexes.
+    """
+    json_field = generate_key_to_materialized_view_parent_col(
+            reference_genome).get(key, None)
+    json_field_expanded = {
+            'vccd_data': MAP_KEY__COMMON_DATA,
+            'va_data': MAP_KEY__ALTERNATE,
+            'es_data': MAP_KEY__EXPERIMENT_SAMPLE,
+            've_data': MAP_KEY__EVIDENCE}.get(json_field, None)
+    if json_field_expanded is None:
+        return None
+
+    # Get the type of the field from the original variant_key_map.
+    field_type = reference_genome.variant_key_map[
+            json_field_expanded][key]['type']
+    sql_cast = VARIANT_KEY_MAP_TYPE_TO_SQL_CAST.get(field_type, None)
+    if sql_cast is None:
+        return None
+    return "(%s->>'%s')%s" % (json_field, key, sql_cast)
+
+
 def determine_visible_field_names(hard_coded_keys, filter_string,
         ref_genome):
     """Determine which fields to show, combining hard-coded keys and
@@ -355,11 +407,112 @@ def update_parent_child_variant_fields(alignment_group):
 
     Ideally this is done before making the materialized view.
 
+    The values are computed in SQL unless
+    settings.FLAG__PARENT_CHILD_FIELDS_IN_SQL is False, in which case we fall
+    back to iterating over each VariantCallerCommonData in Python.
+
     Note: This should only be run ONCE, right after all variants are done but
-    before the materialized view is made. Also, it should NEVER be run by
-    a task such that multiple are run in parallel, since that hoses the DB.
+    before the materialized view is made. Concurrent calls for the same
+    AlignmentGroup are serialized with an advisory lock.
     """
+    # VCFs from different variant callers are parsed in parallel, and each
+    # ends by calling this, so make sure they take turns.
+    with advisory_lock(ADVISORY_LOCK_NAMESPACE__PARENT_CHILD_FIELDS,
+            alignment_group.id):
+        if settings.FLAG__PARENT_CHILD_FIELDS_IN_SQL:
+            _update_parent_child_variant_fields_sql(alignment_group)
+        else:
+            _update_parent_child_variant_fields_python(alignment_group)
+
+
+# Number of VariantEvidence rows written per UPDATE statement.
+PARENT_CHILD_UPDATE_BATCH_SIZE = 1000
+
+# Computes IN_PARENTS and IN_CHILDREN for every VariantEvidence in an
+# AlignmentGroup. Parents and children are only considered if they have
+# VariantEvidence for the same VariantCallerCommonData. IN_PARENTS is NULL
+# when the sample has no parent with evidence, in which case the key is left
+# untouched. A NULL GT_TYPE counts as 0.
+PARENT_CHILD_FIELDS_SQL = """
+    SELECT ve.id, ve.data,
+        (SELECT MAX(CASE WHEN
+                    COALESCE((parent_ve.data->>'GT_TYPE')::integer, 0) > 0
+                    THEN 1 ELSE 0 END)
+            FROM {relation_table} rel
+            JOIN {ve_table} parent_ve
+                ON parent_ve.experiment_sample_id = rel.parent_id
+                AND parent_ve.variant_caller_common_data_id =
+                        ve.variant_caller_common_data_id
+            WHERE rel.child_id = ve.experiment_sample_id) AS in_parents,
+        (SELECT COALESCE(SUM(CASE WHEN
+                    COALESCE((child_ve.data->>'GT_TYPE')::integer, 0) > 0
+                    THEN 1 ELSE 0 END), 0)
+            FROM {relation_table} rel
+            JOIN {ve_table} child_ve
+                ON child_ve.experiment_sample_id = rel.child_id
+                AND child_ve.variant_caller_common_data_id =
+                        ve.variant_caller_common_data_id
+            WHERE rel.parent_id = ve.experiment_sample_id) AS in_children
+    FROM {ve_table} ve
+    JOIN {vccd_table} vccd ON ve.variant_caller_common_data_id = vccd.id
+    WHERE vccd.alignment_group_id = %s
+"""
+
 
+def _update_parent_child_variant_fields_sql(alignment_group):
+    """Set-based implementation of update_parent_child_variant_fields().
+
+    Postgres 9.3 can't modify keys inside a json column, so the values are
+    computed in one query and the updated json is written back with batched
+    UPDATE ... FROM (VALUES ...) statements, rather than one save() per row.
+
+    NOTE: Unlike the Python implementation, where the last parent visited
+    wins, IN_PARENTS is 1 if the variant is called in any parent.
+    """
+    cursor = connection.cursor()
+    cursor.execute(PARENT_CHILD_FIELDS_SQL.format(
+                    relation_table=ExperimentSampleRelation._meta.db_table,
+                    ve_table=VariantEvidence._meta.db_table,
+                    vccd_table=VariantCallerCommonData._meta.db_table),
+            [alignment_group.id])
+
+    update_sql_template = (
+            'UPDATE {ve_table} AS ve SET data = v.data::json '
+            'FROM (VALUES {values}) AS v(id, data) '
+            'WHERE ve.id = v.id')
+    id_data_batch = []
+
+    def _flush_batch():
+        if not id_data_batch:
+            return
+        update_sql = update_sql_template.format(
+                ve_table=VariantEvidence._meta.db_table,
+                values=', '.join(['(%s, %s)'] * len(id_data_batch)))
+        params = []
+        for ve_id, data in id_data_batch:
+            params.extend([ve_id, json.dumps(data)])
+        connection.cursor().execute(update_sql, params)
+        del id_data_batch[:]
+
+    for ve_id, data, in_parents, in_children in cursor.fetchall():
+        if not isinstance(data, dict):
+            data = json.loads(data) if data else {}
+        if in_parents is not None:
+            data['IN_PARENTS'] = in_parents
+        data['IN_CHILDREN'] = in_children
+        id_data_batch.append((ve_id, data))
+        if len(id_data_batch) >= PARENT_CHILD_UPDATE_BATCH_SIZE:
+            _flush_batch()
+    _flush_batch()
+
+    transaction.commit_unless_managed()
+
+
+def _update_parent_child_variant_fields_python(alignment_group):
+    """Python implementation of update_parent_child_variant_fields().
+
+    Kept as a fallback for the SQL implementation.
+    """
     #1. Get parent-children uid relationships for all experiment_samples
     # in alignment_group.
     samples = alignment_group.get_samples()
@@ -22,11 +22,15 @@ The maps defined here specify:
 """
 
 import copy
+from functools import wraps
 
 import vcf
 
 from main.exceptions import InputError
+from main.model_utils import advisory_lock
+from main.model_utils import ADVISORY_LOCK_NAMESPACE__VARIANT_KEY_MAP
 from main.models import ReferenceGenome
+from main.reference_genome_metadata_cache import invalidate_reference_genome_metadata
 from variants.filter_key_map_constants import EXPERIMENT_SAMPLE_HARD_CODED
 from variants.filter_key_map_constants import MAP_KEY__ALTERNATE
 from variants.filter_key_map_constants import MAP_KEY__COMMON_DATA
@@ -60,6 +64,22 @@ def initialize_filter_key_map():
     return variant_key_map
 
 
+def _serialize_key_map_updates(func):
+    """Decorator that holds a lock on the ReferenceGenome's key map while
+    func reads, updates and saves it, so that concurrent updates (e.g. from
+    VCFs of different variant callers) don't overwrite each other.
+
+    The ReferenceGenome must be the first arg of func.
+    """
+    @wraps(func)
+    def wrapper(ref_genome, *args, **kwargs):
+        with advisory_lock(ADVISORY_LOCK_NAMESPACE__VARIANT_KEY_MAP,
+                ref_genome.id):
+            return func(ref_genome, *args, **kwargs)
+    return wrapper
+
+
+@_serialize_key_map_updates
 def update_sample_filter_key_map(ref_genome, experiment_sample):
     """
     Updates a reference genome's variant key map dictionary with
@@ -114,8 +134,10 @@ def update_sample_filter_key_map(ref_genome, experiment_sample):
 
     _assert_unique_keys(ref_genome.variant_key_map)
     ref_genome.save(update_fields=['variant_key_map'])
+    invalidate_reference_genome_metadata(ref_genome)
 
 
+@_serialize_key_map_updates
 def update_filter_key_map(ref_genome, source_vcf):
     """Updates a reference genome's variant key map dictionary with
     (potentially) new fields from a new VCF.
@@ -197,6 +219,7 @@ def update_filter_key_map(ref_genome, source_vcf):
     _assert_unique_keys(ref_genome.variant_key_map)
 
     ref_genome.save(update_fields=['variant_key_map'])
+    invalidate_reference_genome_metadata(ref_genome)
 
 
 def _assert_unique_keys(variant_key_map):
@@ -19,7 +19,8 @@ def lookup_genes(alignment_group):
 	# Perform the query against the melted variant view.
 	materialized_view_manager = MeltedVariantMaterializedViewManager(
 		alignment_group.reference_genome)
-	materialized_view_manager.create_if_not_exists_or_invalid()
+	materialized_view_manager.create_if_not_exists_or_invalid(
+			alignment_group=alignment_group)
 
 	# Build up the sql statement in parts.
 
@@ -28,19 +29,15 @@ def lookup_genes(alignment_group):
 		"va_data->>'INFO_EFF_GENE' AS gene, "
 		"COUNT(DISTINCT position) AS num_variants ")
 
-	# Start building the sql statement.
+	# Start building the sql statement. Only the partitions for the
+	# AlignmentGroup are read.
 	sql_statement = 'SELECT %s FROM %s ' % (select_clause,
-		materialized_view_manager.get_table_name())
+		materialized_view_manager.get_table_expression(
+				alignment_group=alignment_group))
 
 	# Add the where clause.
 	where_clause_gene_part = "((va_data->>'INFO_EFF_GENE'::text) IS NOT NULL) "
-	where_clause_alignment_group_part = (
-			'AG_ID = {ag_id} OR AG_ID IS NULL'.format(
-					ag_id=alignment_group.id))
-	where_clause = '({ag_part}) AND ({gene_part})'.format(
-			ag_part=where_clause_alignment_group_part,
-			gene_part=where_clause_gene_part)
-	sql_statement += 'WHERE (' + where_clause + ') '
+	sql_statement += 'WHERE (' + where_clause_gene_part + ') '
 
 	# Finally group by gene.
 	sql_statement += 'GROUP BY gene '
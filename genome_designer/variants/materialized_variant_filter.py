@@ -7,6 +7,7 @@ from scratch.
 """
 
 import re
+import time
 
 from django.db import connection
 from sympy.logic import boolalg
@@ -19,13 +20,13 @@ from variants.common import convert_delim_key_value_triple_to_expr
 from variants.common import generate_key_to_materialized_view_parent_col
 from variants.common import get_all_key_map
 from variants.common import get_delim_key_value_triple
+from variants.common import get_json_key_sql_expression
 from variants.common import SymbolGenerator
-from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__BOOLEAN
-from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__FLOAT
-from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__INTEGER
-from variants.filter_key_map_constants import VARIANT_KEY_MAP_TYPE__STRING
 from variants.materialized_view_manager import MATERIALIZED_TABLE_QUERY_SELECT_CLAUSE_COMPONENTS
 from variants.materialized_view_manager import MeltedVariantMaterializedViewManager
+from variants.materialized_view_manager import record_variant_filter_query
+from variants.melted_variant_result import iter_melted_variant_rows
+from variants.melted_variant_result import MeltedVariantResult
 from variants.melted_variant_schema import CAST_SCHEMA_KEY__TOTAL_SAMPLE_COUNT
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__POSITION
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__UID
@@ -68,7 +69,8 @@ class VariantFilterEvaluator(object):
 
         self.materialized_view_manager = MeltedVariantMaterializedViewManager(
                 ref_genome)
-        self.materialized_view_manager.create_if_not_exists_or_invalid()
+        self.materialized_view_manager.create_if_not_exists_or_invalid(
+                alignment_group=alignment_group)
 
         # Validation.
         if scope is not None:
@@ -98,6 +100,12 @@ class VariantFilterEvaluator(object):
         # Generator object that provides symbols in alphabetical order.
         self.symbol_maker = SymbolGenerator()
 
+        # Keys in json columns that the filter uses.
+        self.json_filter_keys = set()
+
+        # Seconds evaluate() spent executing the query.
+        self.query_time = 0.0
+
         # Catch trivial, no filter case.
         if self.filter_string == '':
             self.sympy_representation = ''
@@ -181,9 +189,12 @@ class VariantFilterEvaluator(object):
         # we use something called window functions.
         select_clause += ', count(*) OVER() AS full_count '
 
-        # Minimal sql_statement has select clause.
+        # Minimal sql_statement has select clause. If there's an
+        # AlignmentGroup, only its partition and the one with AG_ID NULL are
+        # read, so that's the only filtering by AlignmentGroup needed.
         sql_statement = 'SELECT %s FROM %s ' % (select_clause,
-                self.materialized_view_manager.get_table_name())
+                self.materialized_view_manager.get_table_expression(
+                        alignment_group=self.alignment_group))
 
         # Maybe construct WHERE clause.
         if self.sympy_representation:
@@ -204,22 +215,6 @@ class VariantFilterEvaluator(object):
             else:
                 where_clause = opt_uid_part
 
-        # Maybe add AlignmentGroup filter.
-        where_clause_alignment_group_part = None
-        if self.alignment_group:
-            where_clause_alignment_group_part = (
-                    'AG_ID = {ag_id} OR AG_ID IS NULL'.format(
-                            ag_id=self.alignment_group.id,
-                    ))
-        if where_clause:
-            if where_clause_alignment_group_part:
-                where_clause = '({ag_part}) AND ({where_clause})'.format(
-                        ag_part=where_clause_alignment_group_part,
-                        where_clause=where_clause
-                )
-        else:
-            where_clause = where_clause_alignment_group_part
-
         # Add WHERE clause to SQL statement.
         if where_clause:
             sql_statement += 'WHERE (' + where_clause + ') '
@@ -249,21 +244,19 @@ class VariantFilterEvaluator(object):
         # so that they can be combined through boolean operators with other
         # evaluations.
         cursor = connection.cursor()
+        query_start_time = time.time()
         cursor.execute(sql_statement, where_clause_args)
+        self.query_time = time.time() - query_start_time
 
         # Column header data.
         col_descriptions = [col[0].upper() for col in cursor.description]
 
-        # Either act as a generator, or return all results.
+        # Either act as a generator, or return all results. Rows are kept as
+        # tuples that share a column index rather than as one dict per row.
         if self.act_as_generator:
-            def as_generator():
-              next_row = cursor.fetchone()
-              while next_row:
-                  yield dict(zip(col_descriptions, next_row))
-                  next_row = cursor.fetchone()
-            return as_generator()
+            return iter_melted_variant_rows(cursor, col_descriptions)
         else:
-            return [dict(zip(col_descriptions, row)) for row in cursor.fetchall()]
+            return MeltedVariantResult(col_descriptions, cursor.fetchall())
 
     def _select_clause(self):
         """Determines the SELECT clause for the materialized view.
@@ -433,31 +426,12 @@ class VariantFilterEvaluator(object):
         # Check if arg is a special json field, and rewrite if so, using the appropriate type cast
         # For example, if arg = 'INFO_AO', which is an integer field under snp_alternate_data (ve_data)
         #   then this function will return "(ve_data->>INFO_AO)::Integer"
-
-        json_field = generate_key_to_materialized_view_parent_col(
-                self.ref_genome).get(arg, None)
-        json_field_expanded = {
-                'vccd_data': 'snp_caller_common_data',
-                'va_data': 'snp_alternate_data',
-                'es_data': 'experiment_sample_data',
-                've_data': 'snp_evidence_data'}.get(json_field, None)
-
-        if json_field_expanded:
-            # Get the type of the field from the original variant_key_map
-            field_type = self.ref_genome.variant_key_map[
-                    json_field_expanded][arg]['type']
-
-            # support these data types
-            # string doesn't need to be cast
-            field_type_expanded = {
-                    VARIANT_KEY_MAP_TYPE__INTEGER: '::Integer',
-                    VARIANT_KEY_MAP_TYPE__FLOAT: '::Float',
-                    VARIANT_KEY_MAP_TYPE__BOOLEAN: '::Boolean',
-                    VARIANT_KEY_MAP_TYPE__STRING: ''}.get(field_type, None)
-
-            if field_type_expanded is not None:
-                return "(%s->>'%s')%s" % (
-                    json_field, arg, field_type_expanded)
+        json_key_expression = get_json_key_sql_expression(self.ref_genome, arg)
+        if json_key_expression is not None:
+            # Recorded with the query timing, which determines the json keys
+            # that get indexes in the materialized view.
+            self.json_filter_keys.add(arg)
+            return json_key_expression
 
         # default to returning arg exactly as is
         return arg
@@ -471,7 +445,8 @@ class LookupVariantsResult(object):
     """Result of a call to lookup_variants.
 
     Attributes:
-        result_list: List of cast or melted Variant objects.
+        result_list: MeltedVariantResult (or empty list) of cast or melted
+            Variant rows.
         num_total_variants: Total number of variants that match query.
             For pagination.
     """
@@ -504,12 +479,20 @@ def lookup_variants(query_args, reference_genome, alignment_group=None):
     # If melted, set num_total_variants after full data call.
     num_total_variants = None
 
+    # Both calls are recorded as a single query for the json key index
+    # stats, see record_variant_filter_query().
+    json_filter_keys = set()
+    query_time = 0.0
+
     if not query_args.get('is_melted', True):
         query_args['get_uids_only'] = True
-        uid_only_results = get_variants_that_pass_filter(
-                query_args, reference_genome, alignment_group=alignment_group)
-        query_args['optimization_uid_list'] = [
-                r['UID'] for r in uid_only_results]
+        evaluator = VariantFilterEvaluator(query_args, reference_genome,
+                alignment_group=alignment_group)
+        uid_only_results = evaluator.evaluate()
+        json_filter_keys |= evaluator.json_filter_keys
+        query_time += evaluator.query_time
+        query_args['optimization_uid_list'] = uid_only_results.get_column(
+                'UID')
         if len(uid_only_results):
             num_total_variants = uid_only_results[0]['FULL_COUNT']
         else:
@@ -520,8 +503,11 @@ def lookup_variants(query_args, reference_genome, alignment_group=None):
     if num_total_variants is None or num_total_variants > 0:
         # Query full data.
         query_args['get_uids_only'] = False
-        page_results = get_variants_that_pass_filter(query_args, reference_genome,
+        evaluator = VariantFilterEvaluator(query_args, reference_genome,
                 alignment_group=alignment_group)
+        page_results = evaluator.evaluate()
+        json_filter_keys |= evaluator.json_filter_keys
+        query_time += evaluator.query_time
 
         # Figure out number of total variants by parsing one of the above results,
         # Only if not set in 1st call. This code should only run for melted results.
@@ -533,6 +519,9 @@ def lookup_variants(query_args, reference_genome, alignment_group=None):
     else:
         page_results = []
 
+    record_variant_filter_query(reference_genome, json_filter_keys,
+            query_time)
+
     return LookupVariantsResult(page_results, num_total_variants)
 
 
@@ -560,9 +549,13 @@ def get_variants_that_pass_filter(query_args, ref_genome, alignment_group=None):
             called in this AlignmentGroup.
 
     Returns:
-        List of dictionary objects representing melted Variants.
+        MeltedVariantResult whose rows behave like dictionaries representing
+        melted Variants, or a generator of rows if act_as_generator is set.
         See materialized_view_manager.py.
     """
     evaluator = VariantFilterEvaluator(query_args, ref_genome,
             alignment_group=alignment_group)
-    return evaluator.evaluate()
+    result = evaluator.evaluate()
+    record_variant_filter_query(ref_genome, evaluator.json_filter_keys,
+            evaluator.query_time)
+    return result
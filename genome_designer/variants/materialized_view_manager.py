@@ -1,14 +1,83 @@
 """
 Manages the Materialized view of the Variant data for filtering.
+
+The data is materialized in partitions, one per AlignmentGroup plus one for
+Variants in VariantSets, under a plain view that unions them.
+
+Partitions are indexed after each build. Besides B-tree indexes on the core
+columns and GIN indexes on the variant set arrays, json keys get expression
+indexes if they're used by the project owner's saved filters or by the
+filter queries that took the most time recently. The time of each filter
+lookup is added to per-day totals for the json keys it filtered by (see
+record_variant_filter_query()), which is where recent usage comes from, so
+indexes on keys that stop being queried are dropped.
 """
 
+from collections import defaultdict
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+from celery import task
+from django.conf import settings
 from django.db import connection
+from django.db import DatabaseError
 from django.db import transaction
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
 from main.consistency import ensure_all_ref_genome_variant_set_consistency
+from main.telemetry import TelemetrySpan
 from melted_variant_schema import *
 
 
+# Per-day totals of filter query time by json key, in the ReferenceGenome's
+# data dir.
+JSON_KEY_QUERY_STATS_FILENAME = 'json_key_query_stats.json'
+
+SECONDS_PER_DAY = 24 * 3600
+
+# Columns of the melted view that get B-tree indexes.
+MELTED_VIEW_BTREE_INDEX_COLUMNS = [
+    MELTED_SCHEMA_KEY__UID,
+    MELTED_SCHEMA_KEY__POSITION,
+    MELTED_SCHEMA_KEY__CHROMOSOME,
+    MELTED_SCHEMA_KEY__REF,
+    MELTED_SCHEMA_KEY__ALT,
+    MELTED_SCHEMA_KEY__ALIGNMENT_GROUP_ID,
+    MELTED_SCHEMA_KEY__ES_ID,
+    MELTED_SCHEMA_KEY__ES_UID,
+    MELTED_SCHEMA_KEY__ES_LABEL,
+    MELTED_SCHEMA_KEY__VA_ID,
+]
+
+# Array columns of the melted view, which get GIN indexes.
+MELTED_VIEW_GIN_INDEX_COLUMNS = [
+    MELTED_SCHEMA_KEY__VS_UID,
+    MELTED_SCHEMA_KEY__VS_LABEL,
+]
+
+
+@contextmanager
+def _autocommit():
+    """Puts the database connection in autocommit mode, which CREATE INDEX
+    CONCURRENTLY requires.
+    """
+    transaction.commit_unless_managed()
+    connection.cursor()
+    pg_connection = connection.connection
+    isolation_level = pg_connection.isolation_level
+    pg_connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        yield
+    finally:
+        pg_connection.set_isolation_level(isolation_level)
+
+
 class AbstractMaterializedViewManager(object):
     """Base class for object acting as wrapper for a Postgresql materialized
     view (available starting Postgresql 9.3)
@@ -30,20 +99,34 @@ class AbstractMaterializedViewManager(object):
 
     def create(self):
         """Creates the materialized view in the Postgresql DB.
+
+        The view is built under a temporary name and then swapped in, so
+        that the previous view remains queryable while the new one builds.
         """
-        # Drop the existing table.
-        self.drop()
+        build_table_name = '%s_%s' % (self.view_table_name,
+                uuid.uuid4().hex[:8])
 
         # Delegate to child class.
-        self.create_internal()
+        self.create_internal(build_table_name)
 
-    def create_internal(self):
-        """Creates the materialized view in the Postgresql DB.
+        self.swap_in(build_table_name)
+
+    def create_internal(self, table_name):
+        """Creates the materialized view in the Postgresql DB, with the
+        given name.
 
         Child classes should implement.
         """
         raise NotImplementedError("Child classes must implement.")
 
+    def swap_in(self, build_table_name):
+        """Replaces the view with the one built as build_table_name.
+        """
+        self.drop(commit=False)
+        self.cursor.execute('ALTER MATERIALIZED VIEW %s RENAME TO %s' % (
+                build_table_name, self.view_table_name))
+        transaction.commit_unless_managed()
+
     def refresh(self):
         """Refreshes the view.
         """
@@ -53,15 +136,22 @@ class AbstractMaterializedViewManager(object):
                 self.view_table_name)
         self.cursor.execute(refresh_statement)
 
-    def drop(self):
+    def drop(self, commit=True, cascade=False):
         """Drops the materialized view in the Postgresql DB.
+
+        Args:
+            commit: Whether to commit the transaction after dropping.
+            cascade: Whether to also drop views that depend on this one.
         """
         assert self.view_table_name
         assert self.cursor
         drop_sql_statement = "DROP MATERIALIZED VIEW IF EXISTS %s" % (
                 self.view_table_name,)
+        if cascade:
+            drop_sql_statement += ' CASCADE'
         self.cursor.execute(drop_sql_statement)
-        transaction.commit_unless_managed()
+        if commit:
+            transaction.commit_unless_managed()
 
     def create_if_not_exists_or_invalid(self):
         """Creates the table if it doesn't exist or is not valid.
@@ -98,116 +188,572 @@ class AbstractMaterializedViewManager(object):
         self.cursor.execute(raw_sql, ('m', self.view_table_name))
         return bool(self.cursor.fetchone())
 
+    def get_index_definitions(self):
+        """Returns a dictionary from index name to the part of the CREATE
+        INDEX statement after the table name, for the indexes the view
+        should have.
+
+        Child classes may override.
+        """
+        return {}
 
-class MeltedVariantMaterializedViewManager(AbstractMaterializedViewManager):
-    """Interface for objects providing a wrapper for a Postgresql materialized
-    view.
+    def get_index_name_prefix(self):
+        """Prefix of the names of the indexes that maintain_indexes() manages.
+        """
+        raise NotImplementedError("Child classes must implement.")
+
+    def get_index_names(self):
+        """Returns the names of the existing indexes on the view.
+        """
+        self.cursor.execute(
+                'SELECT indexname FROM pg_indexes WHERE tablename = %s',
+                (self.view_table_name,))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def maintain_indexes(self):
+        """Creates the indexes from get_index_definitions() that don't exist
+        yet, and drops the managed indexes that are no longer wanted.
+
+        Indexes are built concurrently so that queries aren't blocked while
+        they build. Inside a managed transaction, where that isn't possible,
+        they're built in savepoints instead. An index that fails to build,
+        e.g. because a json value doesn't match its key's type, is skipped.
+        """
+        if not self.check_table_exists():
+            return
+
+        index_definitions = self.get_index_definitions()
+        existing_index_names = set(self.get_index_names())
+        drop_index_names = [name for name in existing_index_names
+                if name.startswith(self.get_index_name_prefix()) and
+                        name not in index_definitions]
+        create_index_names = [name for name in sorted(index_definitions)
+                if name not in existing_index_names]
+
+        if transaction.is_managed():
+            for name in drop_index_names:
+                self._execute_in_savepoint('DROP INDEX IF EXISTS %s' % name)
+            for name in create_index_names:
+                self._execute_in_savepoint('CREATE INDEX %s ON %s %s' % (
+                        name, self.view_table_name, index_definitions[name]))
+            return
+
+        with _autocommit():
+            for name in drop_index_names:
+                self._execute_autocommit(
+                        'DROP INDEX CONCURRENTLY IF EXISTS %s' % name)
+            for name in create_index_names:
+                created = self._execute_autocommit(
+                        'CREATE INDEX CONCURRENTLY %s ON %s %s' % (
+                                name, self.view_table_name,
+                                index_definitions[name]))
+                if not created:
+                    # A failed concurrent build leaves an invalid index.
+                    self._execute_autocommit(
+                            'DROP INDEX IF EXISTS %s' % name)
+
+    def _execute_in_savepoint(self, sql_statement):
+        savepoint_id = transaction.savepoint()
+        try:
+            self.cursor.execute(sql_statement)
+        except DatabaseError as e:
+            transaction.savepoint_rollback(savepoint_id)
+            print 'WARNING: %s failed: %s' % (sql_statement, str(e))
+            return False
+        transaction.savepoint_commit(savepoint_id)
+        return True
+
+    def _execute_autocommit(self, sql_statement):
+        try:
+            connection.cursor().execute(sql_statement)
+        except DatabaseError as e:
+            print 'WARNING: %s failed: %s' % (sql_statement, str(e))
+            return False
+        return True
+
+
+class MeltedVariantPartitionManager(AbstractMaterializedViewManager):
+    """Wrapper for the materialized view holding one partition of the melted
+    variant data of a ReferenceGenome.
+
+    Each AlignmentGroup has a partition with the rows for its
+    VariantCallerCommonData. The partition without an AlignmentGroup holds
+    the rows for Variants in VariantSets, which have AG_ID NULL.
     """
 
-    def __init__(self, reference_genome):
+    def __init__(self, reference_genome, alignment_group=None,
+            json_index_keys=None):
         self.reference_genome = reference_genome
+        self.alignment_group = alignment_group
+        self.json_index_keys = json_index_keys
         self.view_table_name = self.get_table_name()
         self.cursor = connection.cursor()
 
+    def get_partition_label(self):
+        if self.alignment_group is None:
+            return 'sets'
+        return self.alignment_group.uid
+
     def get_table_name(self):
         """Override.
         """
-        return 'materialized_melted_variant_' + self.reference_genome.uid
+        return '%s_%s' % (
+                get_melted_variant_view_name(self.reference_genome),
+                self.get_partition_label())
 
     def is_valid(self):
         """Override.
         """
+        if self.alignment_group is not None:
+            return self.alignment_group.is_materialized_variant_view_valid
         return self.reference_genome.is_materialized_variant_view_valid
 
-    def create_internal(self):
+    def create(self):
+        """Override to record how long building the partition takes, and to
+        set the valid bit.
+        """
+        with TelemetrySpan('build_materialized_view',
+                reference_genome=self.reference_genome,
+                partition=self.get_partition_label()):
+            super(MeltedVariantPartitionManager, self).create()
+
+        # Set the valid bit.
+        if self.alignment_group is not None:
+            valid_bit_owner = self.alignment_group
+        else:
+            valid_bit_owner = self.reference_genome
+        valid_bit_owner.is_materialized_variant_view_valid = True
+        valid_bit_owner.save(update_fields=[
+                'is_materialized_variant_view_valid'])
+
+    def swap_in(self, build_table_name):
+        """Override to update the view over all partitions in the same
+        transaction, since it depends on the partition being replaced.
+        """
+        self.drop(commit=False, cascade=True)
+        self.cursor.execute('ALTER MATERIALIZED VIEW %s RENAME TO %s' % (
+                build_table_name, self.view_table_name))
+        MeltedVariantMaterializedViewManager(
+                self.reference_genome).create_union_view()
+        transaction.commit_unless_managed()
+
+    def get_index_name_prefix(self):
         """Override.
         """
-        ensure_all_ref_genome_variant_set_consistency(self.reference_genome)
+        return 'mmv_%s_%s_' % (self.reference_genome.uid,
+                self.get_partition_label())
+
+    def get_index_definitions(self):
+        """Override.
+        """
+        # Imported here since variants.common imports this module.
+        from variants.common import get_json_key_sql_expression
+
+        if self.json_index_keys is None:
+            self.json_index_keys = get_json_index_keys(self.reference_genome)
+
+        prefix = self.get_index_name_prefix()
+        index_definitions = {}
+        for column in MELTED_VIEW_BTREE_INDEX_COLUMNS:
+            index_definitions[prefix + column.lower()] = '(%s)' % column
+        for column in MELTED_VIEW_GIN_INDEX_COLUMNS:
+            index_definitions[prefix + column.lower() + '_gin'] = (
+                    'USING GIN (%s)' % column)
+        for key in self.json_index_keys:
+            expression = get_json_key_sql_expression(self.reference_genome,
+                    key)
+            index_name = prefix + 'json_' + hashlib.md5(
+                    expression).hexdigest()[:12]
+            index_definitions[index_name] = '((%s))' % expression
+        return index_definitions
+
+    def create_internal(self, table_name):
+        """Override.
+        """
+        if self.alignment_group is not None:
+            melted_variant_data_sql = (
+                'SELECT %s FROM main_variant '
+                    'INNER JOIN main_variantcallercommondata ON (main_variant.id = main_variantcallercommondata.variant_id) '
+                    'INNER JOIN main_variantevidence ON (main_variantcallercommondata.id = main_variantevidence.variant_caller_common_data_id) '
+                    'INNER JOIN main_experimentsample ON (main_variantevidence.experiment_sample_id = main_experimentsample.id) '
+
+                    # VariantSets
+                    # We do an inner select which only gets rows associated with an ExperimentSample.
+                    # Then LEFT JOIN on whatever weot.
+                    'INNER JOIN main_chromosome ON (main_variant.chromosome_id = main_chromosome.id) '
+
+                    'LEFT JOIN '
+                        '(SELECT main_varianttovariantset.variant_id, '
+                                'main_variantset.uid, '
+                                'main_variantset.label, '
+                                'main_varianttovariantset.variant_set_id, '
+                                'main_varianttovariantset_sample_variant_set_association.experimentsample_id '
+                            'FROM '
+                                'main_variantset '
+                                'INNER JOIN main_varianttovariantset ON main_varianttovariantset.variant_set_id = main_variantset.id '
+                                'INNER JOIN main_varianttovariantset_sample_variant_set_association ON ('
+                                        'main_varianttovariantset_sample_variant_set_association.varianttovariantset_id = main_varianttovariantset.id) '
+                        ') AS main_variantset ON (' # HACK: Re-use name main_variantset to match outer-most select.
+                                'main_variantset.variant_id = main_variant.id AND '
+                                'main_experimentsample.id = main_variantset.experimentsample_id) '
+
+                    # VariantAlternate
+                    'LEFT JOIN main_variantevidence_variantalternate_set ON ('
+                            'main_variantevidence.id = main_variantevidence_variantalternate_set.variantevidence_id) '
+                    'LEFT JOIN main_variantalternate ON main_variantevidence_variantalternate_set.variantalternate_id = main_variantalternate.id '
+                'WHERE (main_variant.reference_genome_id = %d AND '
+                        'main_variantcallercommondata.alignment_group_id = %d) '
+                'GROUP BY %s'
+                % (
+                        MATERIALIZED_TABLE_SELECT_CLAUSE,
+                        self.reference_genome.id,
+                        self.alignment_group.id,
+                        MATERIALIZED_TABLE_GROUP_BY_CLAUSE)
+            )
+        else:
+            # Variants in VariantSets, which are yielded whether or not they
+            # are associated with any ExperimentSample.
+            melted_variant_data_sql = (
+                'SELECT %s FROM main_variant '
+                    'INNER JOIN main_variantalternate ON main_variantalternate.variant_id = main_variant.id '
+                    'INNER JOIN main_varianttovariantset ON main_variant.id = main_varianttovariantset.variant_id '
+                    'INNER JOIN main_variantset ON main_varianttovariantset.variant_set_id = main_variantset.id '
+                    'INNER JOIN main_chromosome ON (main_variant.chromosome_id = main_chromosome.id) '
+                'WHERE (main_variant.reference_genome_id = %d) '
+                'GROUP BY %s'
+                % (
+                        MATERIALIZED_TABLE_VTVS_SELECT_CLAUSE,
+                        self.reference_genome.id,
+                        MATERIALIZED_TABLE_VTVS_GROUP_BY_CLAUSE)
+            )
 
         # Query all columns except the catch-all key value fields first,
-        # then join with the key-value columns.
+        # then join with the key-value columns. These are joined directly
+        # rather than through CTEs, which Postgres would materialize in full
+        # for every partition.
         create_sql_statement = (
             'CREATE MATERIALIZED VIEW %s AS ('
                 'WITH melted_variant_data AS ('
-                    '('
-                        'SELECT %s FROM main_variant '
-                            'INNER JOIN main_variantcallercommondata ON (main_variant.id = main_variantcallercommondata.variant_id) '
-                            'INNER JOIN main_variantevidence ON (main_variantcallercommondata.id = main_variantevidence.variant_caller_common_data_id) '
-                            'INNER JOIN main_experimentsample ON (main_variantevidence.experiment_sample_id = main_experimentsample.id) '
-
-                            # VariantSets
-                            # We do an inner select which only gets rows associated with an ExperimentSample.
-                            # Then LEFT JOIN on whatever weot.
-                            'INNER JOIN main_chromosome ON (main_variant.chromosome_id = main_chromosome.id) '
-
-                            'LEFT JOIN '
-                                '(SELECT main_varianttovariantset.variant_id, '
-                                        'main_variantset.uid, '
-                                        'main_variantset.label, '
-                                        'main_varianttovariantset.variant_set_id, '
-                                        'main_varianttovariantset_sample_variant_set_association.experimentsample_id '
-                                    'FROM '
-                                        'main_variantset '
-                                        'INNER JOIN main_varianttovariantset ON main_varianttovariantset.variant_set_id = main_variantset.id '
-                                        'INNER JOIN main_varianttovariantset_sample_variant_set_association ON ('
-                                                'main_varianttovariantset_sample_variant_set_association.varianttovariantset_id = main_varianttovariantset.id) '
-                                ') AS main_variantset ON (' # HACK: Re-use name main_variantset to match outer-most select.
-                                        'main_variantset.variant_id = main_variant.id AND '
-                                        'main_experimentsample.id = main_variantset.experimentsample_id) '
-
-                            # VariantAlternate
-                            'LEFT JOIN main_variantevidence_variantalternate_set ON ('
-                                    'main_variantevidence.id = main_variantevidence_variantalternate_set.variantevidence_id) '
-                            'LEFT JOIN main_variantalternate ON main_variantevidence_variantalternate_set.variantalternate_id = main_variantalternate.id '
-                        'WHERE (main_variant.reference_genome_id = %d) '
-                        'GROUP BY %s'
-                    ') '
-                    'UNION '
-                    '('
-                        'SELECT %s FROM main_variant '
-                            'INNER JOIN main_variantalternate ON main_variantalternate.variant_id = main_variant.id '
-                            'INNER JOIN main_varianttovariantset ON main_variant.id = main_varianttovariantset.variant_id '
-                            'INNER JOIN main_variantset ON main_varianttovariantset.variant_set_id = main_variantset.id '
-                            'INNER JOIN main_chromosome ON (main_variant.chromosome_id = main_chromosome.id) '
-                        'WHERE (main_variant.reference_genome_id = %d) '
-                        'GROUP BY %s'
-                    ') '
+                    '%s '
                     'ORDER BY POSITION, EXPERIMENT_SAMPLE_UID DESC '
                 ') ' # melted_variant_data
-                ', va_data_table AS ('
-                    'SELECT id, data AS va_data from main_variantalternate'
-                ') ' # va_data_table
-                ', es_data_table AS ('
-                    'SELECT id, data AS es_data from main_experimentsample'
-                ') ' # es_data_table
-                ', vccd_data_table AS ('
-                    'SELECT id, data AS vccd_data from main_variantcallercommondata'
-                ') ' # vccd_data_table
-                ', ve_data_table AS ('
-                    'SELECT id, data AS ve_data from main_variantevidence'
-                ') ' # ve_data_table
-                'SELECT melted_variant_data.*, va_data, vccd_data, ve_data, es_data '
+                'SELECT melted_variant_data.*, '
+                        'va_data_table.data AS va_data, '
+                        'vccd_data_table.data AS vccd_data, '
+                        've_data_table.data AS ve_data, '
+                        'es_data_table.data AS es_data '
                     'FROM melted_variant_data '
-                        'LEFT JOIN va_data_table ON va_data_table.id = melted_variant_data.va_id '
-                        'LEFT JOIN es_data_table ON es_data_table.id = melted_variant_data.es_id '
-                        'LEFT JOIN ve_data_table ON ve_data_table.id = melted_variant_data.ve_id '
-                        'LEFT JOIN vccd_data_table ON vccd_data_table.id = melted_variant_data.vccd_id'
+                        'LEFT JOIN main_variantalternate AS va_data_table ON va_data_table.id = melted_variant_data.va_id '
+                        'LEFT JOIN main_experimentsample AS es_data_table ON es_data_table.id = melted_variant_data.es_id '
+                        'LEFT JOIN main_variantevidence AS ve_data_table ON ve_data_table.id = melted_variant_data.ve_id '
+                        'LEFT JOIN main_variantcallercommondata AS vccd_data_table ON vccd_data_table.id = melted_variant_data.vccd_id'
             ')'
-            % (
-                    self.view_table_name,
-
-                    MATERIALIZED_TABLE_SELECT_CLAUSE,
-                    self.reference_genome.id,
-                    MATERIALIZED_TABLE_GROUP_BY_CLAUSE,
-
-                    MATERIALIZED_TABLE_VTVS_SELECT_CLAUSE,
-                    self.reference_genome.id,
-                    MATERIALIZED_TABLE_VTVS_GROUP_BY_CLAUSE)
+            % (table_name, melted_variant_data_sql)
             )
 
         self.cursor.execute(create_sql_statement)
         transaction.commit_unless_managed()
 
-        # Set the valid bit.
-        self.reference_genome.is_materialized_variant_view_valid = True
-        self.reference_genome.save()
+
+class MeltedVariantMaterializedViewManager(object):
+    """Interface for objects providing a wrapper for the Postgresql view of
+    the melted variant data of a ReferenceGenome.
+
+    The data is materialized in partitions, one per AlignmentGroup plus one
+    for Variants that are only in VariantSets (see
+    MeltedVariantPartitionManager). The view named by get_table_name() is a
+    plain view over all of them. Partitions are rebuilt independently, and
+    queries for a single AlignmentGroup only read the partitions it needs
+    (see get_table_expression()).
+    """
+
+    def __init__(self, reference_genome):
+        self.reference_genome = reference_genome
+        self.view_table_name = self.get_table_name()
+        self.cursor = connection.cursor()
+
+    def get_table_name(self):
+        """Get the name of the view over all partitions.
+        """
+        return get_melted_variant_view_name(self.reference_genome)
+
+    def get_table_expression(self, alignment_group=None):
+        """Returns the table to SELECT FROM to query the melted variant data.
+
+        Args:
+            alignment_group: If provided, the table only has the rows for this
+                AlignmentGroup and those with AG_ID NULL.
+        """
+        if alignment_group is None:
+            return self.view_table_name
+        return '(SELECT * FROM %s UNION ALL SELECT * FROM %s) AS %s' % (
+                self.get_partition_manager(alignment_group).get_table_name(),
+                self.get_partition_manager().get_table_name(),
+                self.view_table_name)
+
+    def get_partition_manager(self, alignment_group=None,
+            json_index_keys=None):
+        return MeltedVariantPartitionManager(self.reference_genome,
+                alignment_group=alignment_group,
+                json_index_keys=json_index_keys)
+
+    def get_partition_managers(self, alignment_group=None,
+            json_index_keys=None):
+        """Returns managers for every partition, or with alignment_group,
+        for the partitions that queries for it read.
+        """
+        if alignment_group is not None:
+            alignment_group_list = [alignment_group]
+        else:
+            alignment_group_list = (
+                    self.reference_genome.alignmentgroup_set.order_by('id'))
+        return [self.get_partition_manager(json_index_keys=json_index_keys)] + [
+                self.get_partition_manager(ag, json_index_keys=json_index_keys)
+                for ag in alignment_group_list]
+
+    def create(self):
+        """Rebuilds every partition.
+        """
+        ensure_all_ref_genome_variant_set_consistency(self.reference_genome)
+        self._create_partitions(self.get_partition_managers())
+
+    def create_if_not_exists_or_invalid(self, alignment_group=None):
+        """Rebuilds the partitions that don't exist or are not valid.
+
+        Args:
+            alignment_group: If provided, only the partitions that queries for
+                this AlignmentGroup read are checked.
+        """
+        if (not self._get_stale_partition_managers(alignment_group) and
+                self.check_table_exists()):
+            return
+
+        # Fixing sample associations may invalidate more partitions.
+        ensure_all_ref_genome_variant_set_consistency(self.reference_genome)
+        self._create_partitions(
+                self._get_stale_partition_managers(alignment_group))
+
+    def _get_stale_partition_managers(self, alignment_group):
+        return [partition_manager for partition_manager in
+                self.get_partition_managers(alignment_group=alignment_group)
+                if not partition_manager.check_table_exists() or
+                        not partition_manager.is_valid()]
+
+    def _create_partitions(self, partition_manager_list):
+        for partition_manager in partition_manager_list:
+            partition_manager.create()
+        if not self.check_table_exists():
+            self.create_union_view()
+            transaction.commit_unless_managed()
+
+        # The partitions are usable while their indexes build.
+        maintain_materialized_view_indexes.delay(self.reference_genome)
+
+    def is_valid(self):
+        """Whether every partition is up to date.
+        """
+        return all(partition_manager.is_valid() for partition_manager in
+                self.get_partition_managers())
+
+    def check_table_exists(self):
+        """Check if the view over all partitions exists.
+        """
+        return self._check_relation_exists('v')
+
+    def _check_relation_exists(self, relkind):
+        self.cursor.execute(
+                'SELECT c.relname FROM pg_catalog.pg_class c '
+                'WHERE c.relkind=%s AND c.relname=%s',
+                (relkind, self.view_table_name))
+        return bool(self.cursor.fetchone())
+
+    def create_union_view(self):
+        """Creates the view over all partitions that exist, replacing any
+        previous one. Doesn't commit.
+        """
+        if self._check_relation_exists('m'):
+            # Materialized in full, from before it was partitioned.
+            self.cursor.execute('DROP MATERIALIZED VIEW %s' %
+                    self.view_table_name)
+        self.cursor.execute('DROP VIEW IF EXISTS %s' % self.view_table_name)
+
+        partition_table_names = [partition_manager.get_table_name()
+                for partition_manager in self.get_partition_managers()
+                if partition_manager.check_table_exists()]
+        if not partition_table_names:
+            return
+        self.cursor.execute('CREATE VIEW %s AS %s' % (self.view_table_name,
+                ' UNION ALL '.join(['SELECT * FROM %s' % table_name
+                        for table_name in partition_table_names])))
+
+    def drop(self):
+        """Drops the view and every partition, including those of
+        AlignmentGroups that no longer exist.
+        """
+        self.cursor.execute(
+                'SELECT c.relname FROM pg_catalog.pg_class c '
+                'WHERE c.relkind=%s AND c.relname ~ %s',
+                ('m', '^%s(_|$)' % self.view_table_name))
+        partition_table_names = [row[0] for row in self.cursor.fetchall()]
+
+        # Dropping the partitions drops the view over them.
+        for table_name in partition_table_names:
+            self.cursor.execute('DROP MATERIALIZED VIEW IF EXISTS %s CASCADE'
+                    % table_name)
+        if self.check_table_exists():
+            self.cursor.execute('DROP VIEW %s' % self.view_table_name)
+        transaction.commit_unless_managed()
+
+    def drop_partition(self, alignment_group):
+        """Drops the partition of the AlignmentGroup, leaving the others in
+        place.
+        """
+        self.get_partition_manager(alignment_group).drop(commit=False,
+                cascade=True)
+        self.create_union_view()
+        transaction.commit_unless_managed()
+
+    def maintain_indexes(self):
+        """Maintains the indexes of every partition.
+        """
+        json_index_keys = get_json_index_keys(self.reference_genome)
+        for partition_manager in self.get_partition_managers(
+                json_index_keys=json_index_keys):
+            partition_manager.maintain_indexes()
+
+
+def get_melted_variant_view_name(reference_genome):
+    return 'materialized_melted_variant_' + reference_genome.uid
+
+
+def get_json_index_keys(reference_genome):
+    """Returns the json keys to create expression indexes for.
+
+    These are the keys used by the project owner's saved filters, then the
+    keys used by the most filter query time over the last
+    MATERIALIZED_VIEW_INDEX_QUERY_WINDOW_DAYS, up to
+    MATERIALIZED_VIEW_MAX_JSON_KEY_INDEXES keys in total.
+    """
+    # Imported here since variants.common imports this module.
+    from variants.common import extract_filter_keys
+    from variants.common import get_json_key_sql_expression
+    from variants.common import ParseError
+
+    def _is_indexable(key):
+        # Keys are interpolated into DDL, so only allow plain names.
+        return (re.match(r'^\w+$', key) is not None and
+                get_json_key_sql_expression(reference_genome, key) is not None)
+
+    key_list = []
+    saved_filter_queries = (
+            reference_genome.project.owner.savedvariantfilterquery_set.all())
+    for saved_filter_query in saved_filter_queries:
+        try:
+            filter_keys = extract_filter_keys(saved_filter_query.text,
+                    reference_genome)
+        except ParseError:
+            # Saved for a different ReferenceGenome.
+            continue
+        for key in filter_keys:
+            if key not in key_list and _is_indexable(key):
+                key_list.append(key)
+
+    min_day = _get_min_query_stats_day()
+    key_to_query_time = defaultdict(float)
+    for key, day_to_totals in _read_json_key_query_stats(
+            reference_genome).iteritems():
+        for day, (_, query_time) in day_to_totals.iteritems():
+            if int(day) >= min_day:
+                key_to_query_time[key] += query_time
+    for key in sorted(key_to_query_time, key=key_to_query_time.get,
+            reverse=True):
+        if key not in key_list and _is_indexable(key):
+            key_list.append(key)
+
+    return key_list[:settings.MATERIALIZED_VIEW_MAX_JSON_KEY_INDEXES]
+
+
+def _get_json_key_query_stats_path(reference_genome):
+    return os.path.join(reference_genome.get_model_data_dir(),
+            JSON_KEY_QUERY_STATS_FILENAME)
+
+
+def _get_min_query_stats_day():
+    """Returns the first day, in days since the epoch, within
+    MATERIALIZED_VIEW_INDEX_QUERY_WINDOW_DAYS.
+    """
+    return (int(time.time() // SECONDS_PER_DAY) -
+            settings.MATERIALIZED_VIEW_INDEX_QUERY_WINDOW_DAYS)
+
+
+def _parse_json_key_query_stats(content):
+    try:
+        return json.loads(content) if content else {}
+    except ValueError:
+        return {}
+
+
+def _read_json_key_query_stats(reference_genome):
+    """Returns a dict from json key to a dict from day, in days since the
+    epoch, to the [count, total time] of filter queries on the key that day.
+    """
+    stats_path = _get_json_key_query_stats_path(reference_genome)
+    if not os.path.exists(stats_path):
+        return {}
+    with open(stats_path) as fh:
+        return _parse_json_key_query_stats(fh.read())
+
+
+def record_variant_filter_query(reference_genome, json_filter_keys,
+        query_time):
+    """Adds a filter query that took query_time seconds to today's totals for
+    each of the json keys it filtered by, and drops days that are out of the
+    MATERIALIZED_VIEW_INDEX_QUERY_WINDOW_DAYS window, so the stats stay
+    small.
+
+    Best effort, so failing to write the stats is logged rather than failing
+    the query.
+    """
+    if not json_filter_keys:
+        return
+
+    today = str(int(time.time() // SECONDS_PER_DAY))
+    min_day = _get_min_query_stats_day()
+    try:
+        reference_genome.ensure_model_data_dir_exists()
+        fd = os.open(_get_json_key_query_stats_path(reference_genome),
+                os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, 'r+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                stats = _parse_json_key_query_stats(fh.read())
+                for key in json_filter_keys:
+                    totals = stats.setdefault(key, {}).setdefault(
+                            today, [0, 0.0])
+                    totals[0] += 1
+                    totals[1] += query_time
+
+                pruned_stats = {}
+                for key, day_to_totals in stats.iteritems():
+                    recent_day_to_totals = dict(
+                            (day, totals) for day, totals
+                            in day_to_totals.iteritems()
+                            if int(day) >= min_day)
+                    if recent_day_to_totals:
+                        pruned_stats[key] = recent_day_to_totals
+
+                fh.seek(0)
+                fh.truncate()
+                fh.write(json.dumps(pruned_stats))
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+    except (IOError, OSError) as e:
+        print 'WARNING: Could not record variant filter query: %s' % str(e)
+
+
+@task
+def maintain_materialized_view_indexes(reference_genome):
+    """Brings the indexes of the ReferenceGenome's materialized view
+    partitions in line with how they're being queried.
+    """
+    MeltedVariantMaterializedViewManager(reference_genome).maintain_indexes()
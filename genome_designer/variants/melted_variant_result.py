@@ -0,0 +1,148 @@
+"""
+Compact representation of the rows returned by querying the materialized
+melted variant view.
+
+Rather than building a dictionary for every row, the rows are kept as the
+tuples returned by the database cursor and share a single map from column
+name to tuple index. Each row still behaves like a read-only dictionary so
+existing clients that do row['UID'] or row.get('VA_DATA') keep working.
+"""
+
+
+class MeltedVariantRow(object):
+    """Dictionary-like view of a single row.
+
+    Keys that are not columns of the query (e.g. those added while adapting
+    rows for the frontend) are stored in a small per-row dictionary that is
+    only created when needed.
+    """
+
+    __slots__ = ('_values', '_column_index', '_extra')
+
+    def __init__(self, values, column_index):
+        self._values = values
+        self._column_index = column_index
+        self._extra = None
+
+    def __getitem__(self, key):
+        idx = self._column_index.get(key)
+        if idx is not None:
+            return self._values[idx]
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._column_index:
+            # Row values are the tuples returned by the cursor.
+            raise TypeError('Column %s is read-only.' % key)
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __contains__(self, key):
+        return (key in self._column_index or
+                (self._extra is not None and key in self._extra))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        return self.to_dict() == dict(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Mutable, so not hashable.
+    __hash__ = None
+
+    def __repr__(self):
+        return 'MeltedVariantRow(%r)' % self.to_dict()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = list(self._column_index.iterkeys())
+        if self._extra is not None:
+            keys.extend(self._extra.iterkeys())
+        return keys
+
+    def iteritems(self):
+        for key, idx in self._column_index.iteritems():
+            yield (key, self._values[idx])
+        if self._extra is not None:
+            for item in self._extra.iteritems():
+                yield item
+
+    def items(self):
+        return list(self.iteritems())
+
+    def to_dict(self):
+        return dict(self.iteritems())
+
+
+class MeltedVariantResult(object):
+    """List-like container of MeltedVariantRow objects backed by the raw row
+    tuples and a shared column index.
+
+    Attributes:
+        column_names: List of upper-cased column names, in query order.
+        column_index: Map from column name to index in each row tuple.
+        rows: List of row tuples as returned by the cursor.
+    """
+
+    __slots__ = ('column_names', 'column_index', 'rows', '_row_objs')
+
+    def __init__(self, column_names, rows):
+        self.column_names = column_names
+        self.column_index = dict(
+                (name, idx) for idx, name in enumerate(column_names))
+        self.rows = rows
+
+        # Row objects are created lazily and cached so that mutations made
+        # through __setitem__ are preserved across iterations.
+        self._row_objs = None
+
+    def _get_row_objs(self):
+        if self._row_objs is None:
+            column_index = self.column_index
+            self._row_objs = [MeltedVariantRow(values, column_index)
+                    for values in self.rows]
+        return self._row_objs
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self._get_row_objs())
+
+    def __getitem__(self, idx):
+        return self._get_row_objs()[idx]
+
+    def __nonzero__(self):
+        return bool(self.rows)
+
+    def get_column(self, key):
+        """Returns a list with the value of the column for every row, without
+        creating per-row objects.
+        """
+        idx = self.column_index[key]
+        return [values[idx] for values in self.rows]
+
+
+def iter_melted_variant_rows(cursor, column_names):
+    """Generator over the remaining rows of a cursor, yielding
+    MeltedVariantRow objects that share one column index.
+    """
+    column_index = dict((name, idx) for idx, name in enumerate(column_names))
+    next_row = cursor.fetchone()
+    while next_row:
+        yield MeltedVariantRow(next_row, column_index)
+        next_row = cursor.fetchone()
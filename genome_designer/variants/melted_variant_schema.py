@@ -157,11 +157,19 @@ MATERIALIZED_TABLE_GROUP_BY_CLAUSE = ', '.join(
 # Generate the SELECT clause for the Variant to VariantSet.label view.
 # We perform a UNION with this table to ensure that we yield Variants that
 # are in a VariantSet without an association with any ExperimentSample.
+# These rows are materialized separately from the rest, so the NULL columns
+# are cast to the types they have in the other rows.
 MATERIALIZED_TABLE_VTVS_SELECT_CLAUSE_COMPONENTS = []
 for schema_obj in MELTED_VARIANT_SCHEMA:
     if schema_obj['is_null_in_variant_to_set_label']:
+        if (schema_obj['query_schema'] and
+                schema_obj['query_schema']['type'] == 'String'):
+            null_type = 'varchar'
+        else:
+            null_type = 'integer'
         MATERIALIZED_TABLE_VTVS_SELECT_CLAUSE_COMPONENTS.append(
-                'NULL' + ' AS ' + schema_obj['joined_table_col_name'])
+                'NULL::' + null_type + ' AS ' +
+                schema_obj['joined_table_col_name'])
     elif (schema_obj['source_col_name'] in [
             'main_variantset.uid',
             'main_variantset.label']):
@@ -12,6 +12,7 @@ from main.models import Project
 from main.models import ReferenceGenome
 from main.models import Variant
 from main.models import VariantAlternate
+from main.models import VariantEvidence
 from main.testing_util import create_common_entities_w_variants
 from variants.dynamic_snp_filter_key_map import update_filter_key_map
 from settings import PWD as GD_ROOT
@@ -100,6 +101,45 @@ class TestCommon(TestCase):
         self.assertEqual(ve_sample_3.data['GT_TYPE'],2)
         self.assertEqual(ve_sample_2.data['IN_CHILDREN'],1)
 
+    def test_update_parent_child_variant_fields__sql_matches_python(self):
+        """The SQL implementation should produce the same keys as the Python
+        fallback.
+        """
+        self.common_entities = create_common_entities_w_variants()
+        samples = self.common_entities['samples']
+        samples[0].add_child(samples[1])
+        samples[0].add_child(samples[2])
+        samples[2].add_child(samples[3])
+        samples[4].add_child(samples[5])
+        samples[5].add_child(samples[6])
+        alignment_group = self.common_entities['alignment_group']
+
+        def _get_parent_child_values():
+            return dict([
+                    (ve.id, (ve.data.get('IN_PARENTS'),
+                            ve.data.get('IN_CHILDREN')))
+                    for ve in VariantEvidence.objects.filter(
+                            variant_caller_common_data__alignment_group=
+                                    alignment_group)])
+
+        with self.settings(FLAG__PARENT_CHILD_FIELDS_IN_SQL=False):
+            update_parent_child_variant_fields(alignment_group)
+        python_values = _get_parent_child_values()
+
+        # Clear the keys so the SQL path has to recompute them.
+        for ve in VariantEvidence.objects.filter(
+                variant_caller_common_data__alignment_group=alignment_group):
+            ve.data.pop('IN_PARENTS', None)
+            ve.data.pop('IN_CHILDREN', None)
+            ve.save(update_fields=['data'])
+
+        with self.settings(FLAG__PARENT_CHILD_FIELDS_IN_SQL=True):
+            update_parent_child_variant_fields(alignment_group)
+        sql_values = _get_parent_child_values()
+
+        self.assertTrue(len(python_values) > 0)
+        self.assertEqual(python_values, sql_values)
+
 
 class TestSymbolGenerator(TestCase):
     """Tests the symbol generator used for symbolic manipulation.
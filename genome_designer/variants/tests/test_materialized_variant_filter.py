@@ -28,7 +28,9 @@ from settings import PWD as GD_ROOT
 from variants.common import determine_visible_field_names
 from variants.common import ParseError
 from variants.materialized_variant_filter import get_variants_that_pass_filter
+from variants.materialized_variant_filter import lookup_variants
 from variants.materialized_variant_filter import VariantFilterEvaluator
+from variants.materialized_view_manager import _read_json_key_query_stats
 from variants.materialized_view_manager import MeltedVariantMaterializedViewManager
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__CHROMOSOME
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__POSITION
@@ -505,6 +507,21 @@ class TestVariantFilter(BaseTestVariantFilterTestCase):
                 self.ref_genome)
         self.assertEqual(1, len(passing_variants))
 
+        def _count_recorded_queries():
+            day_to_totals = _read_json_key_query_stats(self.ref_genome).get(
+                    'INFO_EFF_GENE', {})
+            return sum(totals[0] for totals in day_to_totals.itervalues())
+        self.assertEqual(1, _count_recorded_queries())
+
+        # The uids-only and full queries of a cast lookup count once.
+        lookup_variants({
+            'filter_string': 'INFO_EFF_GENE = tolC',
+            'is_melted': False,
+            'visible_key_names': determine_visible_field_names(
+                    [], 'INFO_EFF_GENE = tolC', self.ref_genome)
+        }, self.ref_genome)
+        self.assertEqual(2, _count_recorded_queries())
+
 
     def test_case_insensitive(self):
         """Filter keys should not be case sensitive.
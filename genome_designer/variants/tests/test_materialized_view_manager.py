@@ -2,11 +2,16 @@
 Tests for materialized_view_manager.py.
 """
 
+import json
+import os
+
 from django.db import connection
 from django.test import TestCase
 
+from main.models import AlignmentGroup
 from main.models import Chromosome
 from main.models import Dataset
+from main.models import SavedVariantFilterQuery
 from main.models import Variant
 from main.models import VariantAlternate
 from main.models import VariantCallerCommonData
@@ -16,7 +21,10 @@ from main.models import VariantToVariantSet
 from main.testing_util import create_common_entities
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__VS_LABEL
 from variants.melted_variant_schema import MELTED_SCHEMA_KEY__VS_UID
+from variants.materialized_view_manager import get_json_index_keys
+from variants.materialized_view_manager import JSON_KEY_QUERY_STATS_FILENAME
 from variants.materialized_view_manager import MeltedVariantMaterializedViewManager
+from variants.materialized_view_manager import record_variant_filter_query
 
 
 class TestMaterializedViewManager(TestCase):
@@ -146,3 +154,117 @@ class TestMaterializedViewManager(TestCase):
             if data_row[MELTED_SCHEMA_KEY__VS_UID][0] is not None:
                 observed_rows_with_variant_set_data += 1
         self.assertEqual(1, observed_rows_with_variant_set_data)
+
+    def test_indexes(self):
+        SavedVariantFilterQuery.objects.create(
+                owner=self.common_entities['project'].owner,
+                text='GT_TYPE = 2')
+
+        mvm = MeltedVariantMaterializedViewManager(
+                self.common_entities['reference_genome'])
+        mvm.create()
+
+        partition_manager = mvm.get_partition_manager()
+        prefix = partition_manager.get_index_name_prefix()
+        index_names = set(partition_manager.get_index_names())
+        self.assertTrue(prefix + 'position' in index_names)
+        self.assertTrue(prefix + 'variant_set_uid_gin' in index_names)
+        json_index_names = [name for name in index_names
+                if name.startswith(prefix + 'json_')]
+        self.assertEqual(1, len(json_index_names))
+
+        # The index for the key is dropped once nothing uses it.
+        SavedVariantFilterQuery.objects.all().delete()
+        mvm.maintain_indexes()
+        index_names = set(partition_manager.get_index_names())
+        self.assertTrue(prefix + 'position' in index_names)
+        self.assertFalse(json_index_names[0] in index_names)
+
+    def test_json_index_keys_from_recent_queries(self):
+        reference_genome = self.common_entities['reference_genome']
+        reference_genome.ensure_model_data_dir_exists()
+        stats_path = os.path.join(reference_genome.get_model_data_dir(),
+                JSON_KEY_QUERY_STATS_FILENAME)
+
+        # Queries on a day long out of the window don't count.
+        with open(stats_path, 'w') as fh:
+            json.dump({'GT_TYPE': {'1': [1, 5.0]}}, fh)
+        self.assertEqual([], get_json_index_keys(reference_genome))
+
+        # Recording a query drops the old day.
+        record_variant_filter_query(reference_genome, ['GT_TYPE'], 1.0)
+        self.assertEqual(['GT_TYPE'], get_json_index_keys(reference_genome))
+        with open(stats_path) as fh:
+            day_to_totals = json.load(fh)['GT_TYPE']
+        self.assertEqual([[1, 1.0]], day_to_totals.values())
+
+    def _count_rows(self, table_expression):
+        self.cursor.execute('SELECT * FROM %s' % table_expression)
+        return len(self.cursor.fetchall())
+
+    def _get_relation_oid(self, table_name):
+        self.cursor.execute('SELECT oid FROM pg_class WHERE relname = %s',
+                (table_name,))
+        return self.cursor.fetchone()[0]
+
+    def test_partitions(self):
+        ref_genome = self.common_entities['reference_genome']
+        alignment_group_1 = self.common_entities['alignment_group_1']
+        alignment_group_2 = AlignmentGroup.objects.create(
+                label='Alignment 2',
+                reference_genome=ref_genome,
+                aligner=AlignmentGroup.ALIGNER.BWA)
+
+        vcf_source_dataset = Dataset.objects.create(
+            type=Dataset.TYPE.VCF_FREEBAYES,
+            label='fake_source_dataset')
+
+        # One Variant called in each AlignmentGroup.
+        for position, alignment_group in [
+                (2, alignment_group_1), (3, alignment_group_2)]:
+            variant = Variant.objects.create(
+                    type=Variant.TYPE.TRANSITION,
+                    reference_genome=ref_genome,
+                    chromosome=self.common_entities['chromosome'],
+                    position=position,
+                    ref_value='A')
+            VariantAlternate.objects.create(
+                    variant=variant,
+                    alt_value='T')
+            common_data_obj = VariantCallerCommonData.objects.create(
+                    alignment_group=alignment_group,
+                    variant=variant,
+                    source_dataset=vcf_source_dataset)
+            VariantEvidence.objects.create(
+                    experiment_sample=self.common_entities['sample_1'],
+                    variant_caller_common_data=common_data_obj)
+
+        mvm = MeltedVariantMaterializedViewManager(ref_genome)
+        mvm.create()
+        self.assertEqual(2, self._count_rows(mvm.get_table_name()))
+        self.assertEqual(1, self._count_rows(mvm.get_table_expression(
+                alignment_group=alignment_group_1)))
+
+        sets_table_name = mvm.get_partition_manager().get_table_name()
+        ag_1_table_name = mvm.get_partition_manager(
+                alignment_group_1).get_table_name()
+        ag_2_table_name = mvm.get_partition_manager(
+                alignment_group_2).get_table_name()
+        sets_oid = self._get_relation_oid(sets_table_name)
+        ag_1_oid = self._get_relation_oid(ag_1_table_name)
+        ag_2_oid = self._get_relation_oid(ag_2_table_name)
+
+        # Only the invalidated partition is rebuilt.
+        alignment_group_2.invalidate_materialized_view()
+        mvm.create_if_not_exists_or_invalid()
+        self.assertEqual(sets_oid, self._get_relation_oid(sets_table_name))
+        self.assertEqual(ag_1_oid, self._get_relation_oid(ag_1_table_name))
+        self.assertNotEqual(ag_2_oid,
+                self._get_relation_oid(ag_2_table_name))
+        self.assertTrue(mvm.is_valid())
+
+        # Deleting an AlignmentGroup only drops its partition.
+        alignment_group_2.delete()
+        self.assertEqual(1, self._count_rows(mvm.get_table_name()))
+        self.assertEqual(ag_1_oid, self._get_relation_oid(ag_1_table_name))
+        self.assertTrue(mvm.is_valid())
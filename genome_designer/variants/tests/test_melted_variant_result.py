@@ -0,0 +1,62 @@
+"""
+Tests for melted_variant_result.py.
+"""
+
+from django.test import TestCase
+
+from main.model_views import _modify_obj_list_for_variant_set_display
+from main.model_views import ALL_VS_LABEL_KEY
+from variants.melted_variant_result import MeltedVariantResult
+from variants.melted_variant_schema import MELTED_SCHEMA_KEY__VS_LABEL
+
+
+COLUMN_NAMES = ['UID', 'VA_ID', 'EXPERIMENT_SAMPLE_UID', 'VARIANT_SET_LABEL',
+        'VARIANT_SET_UID', 'POSITION']
+
+
+class TestMeltedVariantResult(TestCase):
+
+    def setUp(self):
+        self.result = MeltedVariantResult(COLUMN_NAMES, [
+                (u'7ad36beb', 146, None, ['green'], ['88349a95'], 10),
+                (u'7ad36beb', 146, 'es1_uid', [], [], 10),
+                (u'9be1f00d', 150, 'es1_uid', [], [], 20),
+        ])
+
+    def test_rows_behave_like_dicts(self):
+        self.assertEqual(3, len(self.result))
+        first = self.result[0]
+        self.assertEqual(u'7ad36beb', first['UID'])
+        self.assertEqual(10, first.get('POSITION'))
+        self.assertEqual('default', first.get('NOT_A_COLUMN', 'default'))
+        self.assertTrue('VA_ID' in first)
+        self.assertFalse('NOT_A_COLUMN' in first)
+        self.assertEqual(set(COLUMN_NAMES), set(first.keys()))
+        self.assertEqual(dict(zip(COLUMN_NAMES, self.result.rows[0])),
+                first.to_dict())
+        self.assertRaises(KeyError, lambda: first['NOT_A_COLUMN'])
+
+    def test_get_column(self):
+        self.assertEqual([10, 10, 20], self.result.get_column('POSITION'))
+
+    def test_extra_keys(self):
+        """Keys added after the query are stored per row and preserved
+        across iterations.
+        """
+        for row in self.result:
+            row['EXTRA'] = row['POSITION'] + 1
+        self.assertEqual([11, 11, 21], [row['EXTRA'] for row in self.result])
+
+        def _overwrite_column():
+            self.result[0]['UID'] = 'other'
+        self.assertRaises(TypeError, _overwrite_column)
+
+    def test_modify_obj_list_for_variant_set_display(self):
+        """The model_views helper works on rows as it does on dicts.
+        """
+        modified_obj_list = _modify_obj_list_for_variant_set_display(
+                self.result)
+        self.assertEqual(2, len(modified_obj_list))
+        self.assertEqual(['green'], modified_obj_list[0][ALL_VS_LABEL_KEY])
+        self.assertEqual([], modified_obj_list[0][MELTED_SCHEMA_KEY__VS_LABEL])
+        self.assertEqual([], modified_obj_list[1][ALL_VS_LABEL_KEY])
@@ -14,6 +14,7 @@ from main.models import Chromosome
 from main.models import Dataset
 from main.models import ExperimentSample
 from main.models import ExperimentSampleToAlignment
+from main.models import ReferenceGenome
 from main.models import Variant
 from main.models import VariantAlternate
 from main.models import VariantCallerCommonData
@@ -334,6 +335,64 @@ class TestAddAndRemoveVariantsFromSet(TestCase):
             else:
                 self.assertEqual(0, vtvs.sample_variant_set_association.count())
 
+    def test_remove__sample_association(self):
+        """Tests removing a sample association keeps the Variant in the set
+        until it is removed without a sample.
+        """
+        variant_obj_list = Variant.objects.filter(
+                reference_genome=self.ref_genome_1,
+                position__lte=10,
+                chromosome=self.chromosome)
+        data_str_list = [obj.uid + ',' + self.sample_1.uid
+                for obj in variant_obj_list]
+
+        # Adding twice should not create duplicate rows.
+        for i in range(2):
+            response = update_variant_in_set_memberships(
+                    self.ref_genome_1,
+                    data_str_list,
+                    MODIFY_VARIANT_SET_MEMBERSHIP__ADD,
+                    self.var_set1.uid)
+            self.assertEqual(response['alert_type'], 'info', str(response))
+        all_vtvs = VariantToVariantSet.objects.filter(
+                variant_set=self.var_set1)
+        self.assertEqual(10, all_vtvs.count())
+        for vtvs in all_vtvs:
+            self.assertEqual(1, vtvs.sample_variant_set_association.count())
+
+        # Removing without a sample is a no-op while associations remain.
+        response = update_variant_in_set_memberships(
+                self.ref_genome_1,
+                [obj.uid for obj in variant_obj_list],
+                MODIFY_VARIANT_SET_MEMBERSHIP__REMOVE,
+                self.var_set1.uid)
+        self.assertEqual(response['alert_type'], 'info', str(response))
+        self.assertEqual(10, self.var_set1.variants.all().count())
+
+        # Remove the sample association, then the variant itself.
+        response = update_variant_in_set_memberships(
+                self.ref_genome_1,
+                data_str_list,
+                MODIFY_VARIANT_SET_MEMBERSHIP__REMOVE,
+                self.var_set1.uid)
+        self.assertEqual(response['alert_type'], 'info', str(response))
+        self.assertEqual(10, self.var_set1.variants.all().count())
+        for vtvs in VariantToVariantSet.objects.filter(
+                variant_set=self.var_set1):
+            self.assertEqual(0, vtvs.sample_variant_set_association.count())
+
+        response = update_variant_in_set_memberships(
+                self.ref_genome_1,
+                [obj.uid for obj in variant_obj_list],
+                MODIFY_VARIANT_SET_MEMBERSHIP__REMOVE,
+                self.var_set1.uid)
+        self.assertEqual(response['alert_type'], 'info', str(response))
+        self.assertEqual(0, self.var_set1.variants.all().count())
+
+        # The view is invalidated by the membership change.
+        self.assertFalse(ReferenceGenome.objects.get(
+                id=self.ref_genome_1.id).is_materialized_variant_view_valid)
+
     def test_all_matching_filter__all__cast(self):
         """Test adding all matching '' filter, cast.
         """
@@ -6,6 +6,8 @@ from collections import defaultdict
 import re
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.db import transaction
 import pyinter
 
 from main.constants import UNDEFINED_STRING
@@ -25,6 +27,9 @@ VALID_ACTIONS = set([
     MODIFY_VARIANT_SET_MEMBERSHIP__REMOVE
 ])
 
+# Max number of rows written per bulk INSERT / DELETE statement.
+BULK_BATCH_SIZE = 5000
+
 # Lenient regex that matches uids.
 UID_REGEX = re.compile('\w+')
 
@@ -85,9 +90,6 @@ def update_variant_in_set_memberships(ref_genome, uid_data_str_list,
         _perform_remove(grouped_uid_dict_list, variant_set,
                 variant_uid_to_obj_map, sample_uid_to_obj_map)
 
-    # These actions invalidate the materialized view.
-    ref_genome.invalidate_materialized_view()
-
     # Return success response if we got here.
     return {
         'alert_type': 'info',
@@ -289,9 +291,12 @@ def _get_cached_uid_to_object_maps(ref_genome, grouped_uid_dict_list):
 
 def _perform_add(grouped_uid_dict_list, variant_set, variant_uid_to_obj_map,
         sample_uid_to_obj_map):
-    """
-    TODO: Instead of looping through variants individually,
-    create them in one fell swoop, which will be faster.
+    """Adds the variants (and optional sample associations) to the set.
+
+    Existing VariantToVariantSet and association rows are looked up in one
+    query each, and only the missing rows are inserted using bulk_create().
+    bulk_create() does not fire post_save, so the materialized view is
+    invalidated once at the end rather than once per row.
 
     Args:
         grouped_uid_dict_list:
@@ -309,56 +314,123 @@ def _perform_add(grouped_uid_dict_list, variant_set, variant_uid_to_obj_map,
             { <SOME_SAMPLE_UID>: <ExperimentSample object>, ...}
 
     """
-
+    # Variant ids that should end up in the set, and the (variant id,
+    # sample id) associations that should exist.
+    variant_id_set = set()
+    variant_sample_id_pair_set = set()
     for group in grouped_uid_dict_list:
-        variant = variant_uid_to_obj_map[group['variant_uid']]
-        vtvs, created = VariantToVariantSet.objects.get_or_create(
-                variant=variant,
-                variant_set=variant_set)
-        # Maybe add sample association.
+        variant_id = variant_uid_to_obj_map[group['variant_uid']].id
+        variant_id_set.add(variant_id)
         sample_uid = group['sample_uid']
         if sample_uid == UNDEFINED_STRING:
             continue
-        vtvs.sample_variant_set_association.add(
-                sample_uid_to_obj_map[sample_uid])
+        variant_sample_id_pair_set.add(
+                (variant_id, sample_uid_to_obj_map[sample_uid].id))
+
+    # Insert VariantToVariantSet rows for variants not yet in the set.
+    existing_variant_id_set = set(_get_variant_id_to_vtvs_id_map(
+            variant_set).keys())
+    VariantToVariantSet.objects.bulk_create([
+            VariantToVariantSet(variant_id=new_variant_id,
+                    variant_set=variant_set)
+            for new_variant_id in variant_id_set - existing_variant_id_set],
+            batch_size=BULK_BATCH_SIZE)
+
+    # Insert missing sample associations.
+    if variant_sample_id_pair_set:
+        variant_id_to_vtvs_id_map = _get_variant_id_to_vtvs_id_map(
+                variant_set)
+        existing_vtvs_sample_id_pair_set = set(
+                _get_vtvs_sample_association_queryset(variant_set)
+                        .values_list('varianttovariantset', 'experimentsample'))
+        Through = VariantToVariantSet.sample_variant_set_association.through
+        new_association_list = []
+        for variant_id, sample_id in variant_sample_id_pair_set:
+            vtvs_id = variant_id_to_vtvs_id_map[variant_id]
+            if (vtvs_id, sample_id) in existing_vtvs_sample_id_pair_set:
+                continue
+            new_association_list.append(Through(
+                    varianttovariantset_id=vtvs_id,
+                    experimentsample_id=sample_id))
+        Through.objects.bulk_create(new_association_list,
+                batch_size=BULK_BATCH_SIZE)
+
+    variant_set.reference_genome.invalidate_materialized_view()
 
 
 def _perform_remove(grouped_uid_dict_list, variant_set,
         variant_uid_to_obj_map, sample_uid_to_obj_map):
-    for group in grouped_uid_dict_list:
-        variant = variant_uid_to_obj_map[group['variant_uid']]
-        try:
-            vtvs = VariantToVariantSet.objects.get(
-                    variant=variant,
-                    variant_set=variant_set)
-        except ObjectDoesNotExist:
-            # It's possible this relation was removed on an earlier
-            # iteration.
-            # TODO(gleb): Think about what could go wrong here and add
-            # tests.
-            continue
-        sample_uid = group['sample_uid']
-        if sample_uid == UNDEFINED_STRING:
-            # See next for loop.
-            continue
-        vtvs.sample_variant_set_association.remove(
-                sample_uid_to_obj_map[sample_uid])
+    """Removes the variants (or just their sample associations) from the set.
 
-    # Iterate again and destroy any VariantToVariantSet that
-    # should be completely removed.
+    Entries with a sample only remove that sample association. Entries
+    without a sample remove the VariantToVariantSet, provided no sample
+    associations remain for it after the first step.
+    """
+    variant_id_to_vtvs_id_map = _get_variant_id_to_vtvs_id_map(variant_set)
+
+    # Group the sample associations to remove by sample so that each sample
+    # costs a single DELETE.
+    sample_id_to_vtvs_id_set = defaultdict(set)
+    maybe_remove_vtvs_id_set = set()
     for group in grouped_uid_dict_list:
-        variant = variant_uid_to_obj_map[group['variant_uid']]
-        try:
-            vtvs = VariantToVariantSet.objects.get(
-                    variant=variant,
-                    variant_set=variant_set)
-        except ObjectDoesNotExist:
-            # It's possible this relation was removed on an earlier
-            # iteration.
-            # TODO(gleb): Think about what could go wrong here and add
-            # tests.
+        variant_id = variant_uid_to_obj_map[group['variant_uid']].id
+        if not variant_id in variant_id_to_vtvs_id_map:
+            # Not a member of the set, nothing to do.
             continue
+        vtvs_id = variant_id_to_vtvs_id_map[variant_id]
         sample_uid = group['sample_uid']
         if sample_uid == UNDEFINED_STRING:
-            if vtvs.sample_variant_set_association.count() == 0:
-                vtvs.delete()
+            maybe_remove_vtvs_id_set.add(vtvs_id)
+        else:
+            sample_id_to_vtvs_id_set[
+                    sample_uid_to_obj_map[sample_uid].id].add(vtvs_id)
+
+    association_queryset = _get_vtvs_sample_association_queryset(variant_set)
+    for sample_id, vtvs_id_set in sample_id_to_vtvs_id_set.iteritems():
+        association_queryset.filter(
+                experimentsample=sample_id,
+                varianttovariantset__in=list(vtvs_id_set)).delete()
+
+    # Only remove VariantToVariantSets that have no remaining sample
+    # associations.
+    if maybe_remove_vtvs_id_set:
+        vtvs_ids_with_association = set(association_queryset.values_list(
+                'varianttovariantset', flat=True).distinct())
+        _bulk_delete_vtvs(maybe_remove_vtvs_id_set - vtvs_ids_with_association)
+
+    variant_set.reference_genome.invalidate_materialized_view()
+
+
+def _get_variant_id_to_vtvs_id_map(variant_set):
+    """Returns map from Variant id to VariantToVariantSet id for all members
+    of the VariantSet, using a single query.
+    """
+    return dict(VariantToVariantSet.objects.filter(
+            variant_set=variant_set).values_list('variant', 'id'))
+
+
+def _get_vtvs_sample_association_queryset(variant_set):
+    """Returns QuerySet over the auto-created through table rows linking
+    the VariantSet's VariantToVariantSets to ExperimentSamples.
+    """
+    Through = VariantToVariantSet.sample_variant_set_association.through
+    return Through.objects.filter(varianttovariantset__variant_set=variant_set)
+
+
+def _bulk_delete_vtvs(vtvs_id_set):
+    """Deletes the VariantToVariantSet rows with the given ids.
+
+    QuerySet.delete() loads every object and sends pre_delete for each of
+    them, which would invalidate the materialized view once per row, so the
+    rows are deleted directly. Callers must ensure no sample associations
+    reference these rows and must invalidate the materialized view.
+    """
+    vtvs_id_list = list(vtvs_id_set)
+    if not vtvs_id_list:
+        return
+    cursor = connection.cursor()
+    sql = 'DELETE FROM %s WHERE id = ANY(%%s)' % (
+            VariantToVariantSet._meta.db_table)
+    for i in xrange(0, len(vtvs_id_list), BULK_BATCH_SIZE):
+        cursor.execute(sql, [vtvs_id_list[i:i + BULK_BATCH_SIZE]])
+    transaction.commit_unless_managed()
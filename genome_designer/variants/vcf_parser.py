@@ -8,6 +8,8 @@ from django.db import reset_queries
 
 import vcf
 
+from main.model_utils import advisory_lock
+from main.model_utils import ADVISORY_LOCK_NAMESPACE__VARIANT
 from main.model_utils import get_dataset_with_type
 from main.models import Chromosome
 from main.models import ExperimentSample
@@ -16,6 +18,7 @@ from main.models import Variant
 from main.models import VariantCallerCommonData
 from main.models import VariantAlternate
 from main.models import VariantEvidence
+from main.telemetry import TelemetrySpan
 from variants.common import update_parent_child_variant_fields
 from variants.dynamic_snp_filter_key_map import update_filter_key_map
 
@@ -75,7 +78,7 @@ def parse_vcf(vcf_dataset, alignment_group,
 
     # First count the number of records to give helpful status debug output.
     record_count = 0
-    with open(vcf_dataset.get_absolute_location()) as fh:
+    with vcf_dataset.stream() as fh:
         vcf_reader = vcf.Reader(fh)
         for record in vcf_reader:
             record_count += 1
@@ -84,7 +87,16 @@ def parse_vcf(vcf_dataset, alignment_group,
     # NOTE: Do not save handles to the Variants, else suffer the wrath of a
     # memory leak when parsing a large vcf file.
     variant_list = []
-    with open(vcf_dataset.get_absolute_location()) as fh:
+
+    # Whether any Variant this VCF adds data to was created by something
+    # else, e.g. another AlignmentGroup parsing concurrently. Those can show
+    # up in any partition of the materialized view.
+    updated_existing_variant = False
+    created_variant_ids = set()
+
+    parse_span = TelemetrySpan('parse_vcf', alignment_group=alignment_group,
+            dataset_type=vcf_dataset.type, record_count=record_count)
+    with parse_span, vcf_dataset.stream() as fh:
         vcf_reader = vcf.Reader(fh)
 
         # First, update the reference_genome's key list with any new
@@ -118,9 +130,13 @@ def parse_vcf(vcf_dataset, alignment_group,
             # Get or create the Variant for this record. This step
             # also generates the alternate objects and assigns their
             # data fields as well.
-            variant, _ = get_or_create_variant(reference_genome,
+            variant, _, created = get_or_create_variant(reference_genome,
                     record, vcf_dataset, alignment_group, query_cache)
             variant_list.append(variant)
+            if created:
+                created_variant_ids.add(variant.id)
+            elif variant.id not in created_variant_ids:
+                updated_existing_variant = True
 
             # For large VCFs, the cached SQL object references can exhaust memory
             # so we explicitly clear them here. Our efficiency doesn't really suffer.
@@ -132,10 +148,16 @@ def parse_vcf(vcf_dataset, alignment_group,
     # and independently, and we can't be sure that they will be called the same in
     # different samples.
     if should_update_parent_child_relationships:
-        update_parent_child_variant_fields(alignment_group)
+        with TelemetrySpan('update_parent_child_variant_fields',
+                alignment_group=alignment_group):
+            update_parent_child_variant_fields(alignment_group)
 
-    # Force invalidate materialized view here.
-    reference_genome.invalidate_materialized_view()
+    # Force invalidate materialized view here. Only this AlignmentGroup's
+    # partition changes, unless existing Variants were updated.
+    if updated_existing_variant:
+        reference_genome.invalidate_materialized_view()
+    else:
+        alignment_group.invalidate_materialized_view()
 
     return variant_list
 
@@ -198,7 +220,8 @@ def get_or_create_variant(reference_genome, vcf_record, vcf_dataset,
         query_cache: QueryCache helper object for making queries.
 
     Returns:
-        Tuple (Variant, List<VariantAlt>)
+        Tuple (Variant, List<VariantAlt>, created), where created is whether
+        the Variant was created by this call.
     """
     # Build a dictionary of data for this record.
     raw_data_dict = extract_raw_data_dict(vcf_record)
@@ -235,54 +258,60 @@ def get_or_create_variant(reference_genome, vcf_record, vcf_dataset,
                 ' are: ' + str([str(chrom.seqrecord_id) for chrom in
                         Chromosome.objects.filter(reference_genome=reference_genome)]).strip('[]')))
 
-    # Try to find an existing Variant, or create it.
-    variant, created = Variant.objects.get_or_create(
-            reference_genome=reference_genome,
-            chromosome=Chromosome.objects.filter(
+    # Variant callers may be parsed concurrently, so make sure only one of
+    # them creates a given Variant and its alts.
+    variant_lock_key = '%d:%s:%d:%s' % (
+            reference_genome.id, chromosome_label, position, ref_value)
+    with advisory_lock(ADVISORY_LOCK_NAMESPACE__VARIANT, variant_lock_key):
+        # Try to find an existing Variant, or create it.
+        variant, created = Variant.objects.get_or_create(
                 reference_genome=reference_genome,
-                seqrecord_id=chromosome_label)[0],
-            position=position,
-            ref_value=ref_value
-    )
+                chromosome=Chromosome.objects.filter(
+                    reference_genome=reference_genome,
+                    seqrecord_id=chromosome_label)[0],
+                position=position,
+                ref_value=ref_value
+        )
 
-    # We don't want to search by type above, but we do want to save
-    # the type here. There are weird cases where we might be overwriting
-    # the type (i.e. two SNVs with identical ref/alt but different types),
-    # but I think this is OK for now.
-    if type:
-        variant.type = type
-        variant.save()
+        # We don't want to search by type above, but we do want to save
+        # the type here. There are weird cases where we might be overwriting
+        # the type (i.e. two SNVs with identical ref/alt but different types),
+        # but I think this is OK for now.
+        if type:
+            variant.type = type
+            variant.save()
 
-    # Whether or not this is an (structural variant) SV is determined in
-    # VariantAlternate data. Still, we want to expose this on the Variant
-    # level, so we check whether this is SV internally.
-    is_sv = False
+        # Whether or not this is an (structural variant) SV is determined in
+        # VariantAlternate data. Still, we want to expose this on the Variant
+        # level, so we check whether this is SV internally.
+        is_sv = False
 
-    alts = []
-    all_alt_keys = reference_genome.get_variant_alternate_map().keys()
-    raw_alt_keys = [k for k in raw_data_dict.keys() if k in all_alt_keys]
+        alts = []
+        all_alt_keys = reference_genome.get_variant_alternate_map().keys()
+        raw_alt_keys = [k for k in raw_data_dict.keys() if k in all_alt_keys]
 
-    for alt_idx, alt_value in enumerate(alt_values):
+        for alt_idx, alt_value in enumerate(alt_values):
 
-        # Grab the alt data for this alt index.
-        alt_data = dict([(k, raw_data_dict[k][alt_idx]) for k in raw_alt_keys])
+            # Grab the alt data for this alt index.
+            alt_data = dict([(k, raw_data_dict[k][alt_idx])
+                    for k in raw_alt_keys])
 
-        var_alt, var_created = VariantAlternate.objects.get_or_create(
-                variant=variant,
-                alt_value=alt_value)
+            var_alt, var_created = VariantAlternate.objects.get_or_create(
+                    variant=variant,
+                    alt_value=alt_value)
 
-        # If this is a new alternate, initialize the data dictionary
-        if var_created:
-            var_alt.data = {}
+            # If this is a new alternate, initialize the data dictionary
+            if var_created:
+                var_alt.data = {}
 
-        # TODO: We are overwriting keys here. Is this desired?
-        var_alt.data.update(alt_data)
-        var_alt.save()
+            # TODO: We are overwriting keys here. Is this desired?
+            var_alt.data.update(alt_data)
+            var_alt.save()
 
-        if 'INFO_SVTYPE' in alt_data:
-            is_sv = True
+            if 'INFO_SVTYPE' in alt_data:
+                is_sv = True
 
-        alts.append(var_alt)
+            alts.append(var_alt)
 
     # Remove all per-alt keys from raw_data_dict before passing to VCC create.
     [raw_data_dict.pop(k, None) for k in raw_alt_keys]
@@ -325,7 +354,7 @@ def get_or_create_variant(reference_genome, vcf_record, vcf_dataset,
                     variant_caller_common_data=common_data_obj,
                     data=sample_data_dict)
 
-    return (variant, alts)
+    return (variant, alts, created)
 
 
 def extract_sample_data_dict(s):